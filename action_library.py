@@ -0,0 +1,199 @@
+"""诊疗动作库内存索引
+
+动作库常驻内存，按文件 mtime 判断是否需要重新加载：
+- 有序字典保存动作，成员判断为 O(1)
+- 字符 n-gram 倒排索引，用于挑选与诊疗方案最相关的前 K 个动作写入提示词；
+  首次检索（或启动预热）时才建立，保存和成员判断不必等待
+- 新动作先合并进内存，再由一个线程统一写回文件（组提交），并发保存不会逐个全量重写
+- 写回时持有进程间文件锁并先合并文件中其他进程新增的动作，多进程部署时不会互相覆盖
+"""
+import os
+import math
+import threading
+from typing import List, Dict, Set, Iterable
+from collections import defaultdict
+
+from storage import ACTION_LIBRARY_FILE, load_action_library, save_action_library, file_lock
+
+NGRAM_SIZE = 2
+PROMPT_LIBRARY_TOP_K = 60
+# 出现在超过该比例动作中的 n-gram 区分度太低，检索时跳过
+COMMON_NGRAM_RATIO = 0.05
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> Set[str]:
+    """提取字符 n-gram，短于 n 的文本整体作为一个 gram"""
+    text = "".join(text.split())
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+class ActionLibrary:
+    """线程安全的动作库服务"""
+
+    def __init__(self, path: str = ACTION_LIBRARY_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.actions: Dict[str, int] = {}  # 动作 -> 在库中的位置
+        self.index: Dict[str, Set[str]] = defaultdict(set)
+        self.gram_counts: Dict[str, int] = {}
+        self.indexed = False  # n-gram 索引是否已建立
+        self.mtime = None
+        self.write_lock = threading.Lock()  # 同一时间只有一个线程写文件
+        self.generation = 0  # 内存中动作库的版本，每次新增动作递增
+        self.flushed = 0  # 已写入文件的版本
+        self.stats = {"adds": 0, "writes": 0}
+
+    def _file_mtime(self):
+        """文件的版本标记：原子替换每次都产生新文件，带上 inode 和大小，
+        不同进程在同一时钟刻度内的两次写入也能区分"""
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        """文件被外部修改或尚未加载时重新建立索引"""
+        if self.generation != self.flushed:
+            return  # 还有未写入文件的新动作，以内存为准
+        mtime = self._file_mtime()
+        if self.mtime is not None and mtime == self.mtime:
+            return
+        # 先取版本标记再读取：读取期间其他进程写入时标记已过期，下次会重新加载
+        actions = load_action_library(self.path)
+        self.actions = {}
+        self.index = defaultdict(set)
+        self.gram_counts = {}
+        self.indexed = False
+        for action in actions:
+            self._index_action(action)
+        self.mtime = mtime
+
+    def _index_action(self, action: str):
+        if action in self.actions:
+            return
+        self.actions[action] = len(self.actions)
+        if self.indexed:
+            self._index_grams(action)
+
+    def _ensure_indexed(self):
+        """首次检索时为全部动作建立 n-gram 索引"""
+        if not self.indexed:
+            for action in self.actions:
+                self._index_grams(action)
+            self.indexed = True
+
+    def _index_grams(self, action: str):
+        grams = char_ngrams(action)
+        self.gram_counts[action] = len(grams)
+        for gram in grams:
+            self.index[gram].add(action)
+
+    def __contains__(self, action: str) -> bool:
+        with self.lock:
+            self._refresh()
+            return action in self.actions
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._refresh()
+            return len(self.actions)
+
+    def all_actions(self) -> List[str]:
+        """按入库顺序返回全部动作"""
+        with self.lock:
+            self._refresh()
+            return list(self.actions)
+
+    def version(self):
+        """动作库内容的版本标识，内容变化（新增或文件被外部修改）后改变"""
+        with self.lock:
+            self._refresh()
+            return (self.mtime, self.generation)
+
+    def add_actions(self, actions: Iterable[str]) -> List[str]:
+        """将新动作合并到动作库并写回文件，返回新增的动作（返回时已写入文件）"""
+        with self.lock:
+            self._refresh()
+            added = []
+            for action in actions:
+                if action and action not in self.actions:
+                    self._index_action(action)
+                    added.append(action)
+            if not added:
+                return added
+            self.generation += 1
+            self.stats["adds"] += 1
+            target = self.generation
+        self._flush(target)
+        return added
+
+    def _flush(self, target: int):
+        """写回文件直到版本 target；排队期间其他线程的新增会被同一次写入一并带上"""
+        with self.write_lock, file_lock(self.path):
+            with self.lock:
+                if self.flushed >= target:
+                    return
+            try:
+                # 其他进程可能已写入新动作：以文件中的顺序为准，追加本进程的新增
+                on_disk = load_action_library(self.path) if self._file_mtime() != self.mtime else None
+                with self.lock:
+                    generation = self.generation
+                    snapshot = list(self.actions)
+                    if on_disk is not None:
+                        known = set(on_disk)
+                        snapshot = on_disk + [action for action in snapshot if action not in known]
+                        for action in on_disk:
+                            self._index_action(action)
+                save_action_library(snapshot, self.path)
+            except Exception:
+                with self.lock:
+                    # 写入失败时丢弃未持久化的新增，下次访问从文件重新加载
+                    self.generation = self.flushed
+                    self.mtime = None
+                raise
+            with self.lock:
+                if on_disk is not None:
+                    # 与文件保持相同顺序（写入期间的新增排在最后），各进程的提示词一致
+                    written = set(snapshot)
+                    order = snapshot + [action for action in self.actions if action not in written]
+                    self.actions = {action: position for position, action in enumerate(order)}
+                self.flushed = generation
+                self.mtime = self._file_mtime()
+                self.stats["writes"] += 1
+
+    def relevant_actions(self, text: str, top_k: int = PROMPT_LIBRARY_TOP_K) -> List[str]:
+        """返回与文本最相关的前 top_k 个动作（按库中顺序排列，保持提示词稳定）"""
+        with self.lock:
+            self._refresh()
+            total = len(self.actions)
+            if total <= top_k:
+                return list(self.actions)
+            self._ensure_indexed()
+
+            scores: Dict[str, float] = defaultdict(float)
+            common_limit = max(1000, total * COMMON_NGRAM_RATIO)
+            for gram in char_ngrams(text):
+                postings = self.index.get(gram)
+                if not postings or len(postings) > common_limit:
+                    continue
+                weight = math.log(1 + total / len(postings))
+                for action in postings:
+                    scores[action] += weight
+
+            ranked = sorted(scores, key=lambda a: (-scores[a] / math.sqrt(self.gram_counts[a]), self.actions[a]))
+            return sorted(ranked[:top_k], key=self.actions.get)
+
+    def warm(self):
+        """加载动作库并建立 n-gram 索引（启动预热）"""
+        with self.lock:
+            self._refresh()
+            self._ensure_indexed()
+
+    def get_stats(self) -> Dict[str, int]:
+        """新增批次数与实际写文件次数"""
+        with self.lock:
+            return {**self.stats, "actions": len(self.actions)}
+
+# 全局共享的动作库索引
+library_index = ActionLibrary()
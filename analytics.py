@@ -0,0 +1,515 @@
+"""标注统计分析：问题 → 诊疗动作共现矩阵
+
+遍历一次全部标注，建立"问题 × 标准化动作"的稀疏计数矩阵（行：问题名称，列：动作文本），
+按患者计数：某患者把动作 a 关联到问题 p 记 1 次。查询时在该问题的行上向量化计算：
+- count：关联次数
+- confidence：有该问题的已标注患者中关联了该动作的比例 P(a|p)
+- lift：confidence / P(a)，P(a) 为已标注患者中关联了该动作的比例
+- pmi：log2(lift)
+其中"已标注患者"指至少有一个关联的患者。
+
+矩阵缓存在 data/analytics/cooccurrence.npz 中，启动时加载后只重新计算修改过的患者；
+本进程保存标注时通过 patient_index 的回调增量更新（变化先记在增量表中，累积到一定数量
+再合并进压缩矩阵），其他进程的修改按标注存储的变更标记定期同步。
+
+同一矩阵也用于关联建议（suggest_links）：打开患者时，对其每个问题取出该行，
+与患者已有动作求交，按置信度给出尚未建立的关联。
+
+依赖 numpy 和 scipy（可选，首次使用时才导入，未安装时统计接口返回安装提示）。
+"""
+import os
+import io
+import json
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+import config
+from storage import DATA_DIR
+from annotation_store import annotation_store
+from patient_index import patient_index
+
+# numpy 和 scipy 导入较慢，首次使用时由 load_dependencies() 导入
+np = sparse = None
+DEPENDENCIES_AVAILABLE = None  # None 表示尚未尝试导入
+
+ANALYTICS_DIR = os.path.join(DATA_DIR, "analytics")
+ANALYTICS_CACHE_FILE = os.path.join(ANALYTICS_DIR, "cooccurrence.npz")
+# 多久检查一次其他进程的标注修改（秒）
+ANALYTICS_SYNC_SECONDS = getattr(config, "ANALYTICS_SYNC_SECONDS", 10)
+# 增量表超过该条目数时合并进压缩矩阵
+ANALYTICS_DELTA_LIMIT = 50000
+# 缓存文件的最短写入间隔（秒）
+ANALYTICS_SAVE_SECONDS = 60
+# 关联建议：至少在多少名患者中出现过、置信度 P(动作|问题) 的下限、每名患者最多返回的条数
+SUGGEST_MIN_COUNT = getattr(config, "SUGGEST_MIN_COUNT", 3)
+SUGGEST_MIN_CONFIDENCE = getattr(config, "SUGGEST_MIN_CONFIDENCE", 0.1)
+SUGGEST_LIMIT = getattr(config, "SUGGEST_LIMIT", 50)
+METRICS = ("count", "confidence", "lift", "pmi")
+MISSING_DEPENDENCY = "统计分析需要 numpy 和 scipy，请安装: pip install numpy scipy"
+
+def load_dependencies() -> bool:
+    """导入 numpy 和 scipy，未安装时返回 False"""
+    global np, sparse, DEPENDENCIES_AVAILABLE
+    if DEPENDENCIES_AVAILABLE is None:
+        try:
+            import numpy
+            from scipy import sparse as scipy_sparse
+        except ImportError:  # 可选依赖
+            DEPENDENCIES_AVAILABLE = False
+        else:
+            np, sparse = numpy, scipy_sparse
+            DEPENDENCIES_AVAILABLE = True
+    return DEPENDENCIES_AVAILABLE
+
+def problem_key(problem: Dict[str, Any]) -> str:
+    """问题的统计键：问题名称（牙齿类问题不区分牙位，使用问题描述）"""
+    label = problem.get("label", "")
+    if problem.get("type") == "牙齿":
+        text = problem.get("text") or ""
+        return "牙齿" + text[len(label):].strip()
+    return label
+
+def patient_pairs(parsed: Dict[str, Any], annotation_data: Optional[Dict[str, Any]]):
+    """返回 (患者的问题键集合, 关联的动作集合, (问题键, 动作) 关联集合)"""
+    if not annotation_data:
+        return set(), set(), set()
+    problems = {problem["id"]: problem_key(problem) for problem in parsed["problems"]}
+    texts = {solution["id"]: solution.get("text", "").strip() for solution in annotation_data.get("solutions", [])}
+    pairs = set()
+    for action_id, problem_ids in (annotation_data.get("annotations") or {}).items():
+        text = texts.get(action_id)
+        if not text:
+            continue
+        for problem_id in problem_ids:
+            if problems.get(problem_id):
+                pairs.add((problems[problem_id], text))
+    if not pairs:
+        return set(), set(), set()
+    return {key for key in problems.values() if key}, {text for _, text in pairs}, pairs
+
+class CooccurrenceIndex:
+    """线程安全的共现矩阵，支持按患者增量更新"""
+
+    def __init__(self, store=annotation_store, index=patient_index, cache_file: str = ANALYTICS_CACHE_FILE):
+        self.store = store
+        self.index = index
+        self.cache_file = cache_file
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.problems: List[str] = []
+        self.problem_ids: Dict[str, int] = {}
+        self.actions: List[str] = []
+        self.action_ids: Dict[str, int] = {}
+        self.base = None   # 压缩后的计数矩阵（CSR）
+        self.delta: Dict[int, Dict[int, int]] = {}  # 行 -> {列: 计数变化}，尚未合并
+        self.delta_size = 0
+        self.problem_counts = None  # 有该问题的已标注患者数
+        self.action_counts = None   # 关联了该动作的已标注患者数
+        self.total = 0              # 已标注患者数
+        # 患者ID -> (标注修改时间, 问题行, 动作列, 关联的 (行, 列))，用于撤销旧的贡献
+        self.contributions: Dict[str, Tuple[Any, tuple, tuple, tuple]] = {}
+        self.token = None
+        self.sync_lock = threading.Lock()  # 同一时间只有一个线程扫描标注存储
+        self.warming = False
+        self.synced = 0.0
+        self.saved = 0.0
+        self.dirty = False
+        self.stats = {"builds": 0, "loaded_from_cache": False, "updates": 0, "synced_patients": 0,
+                      "compactions": 0, "build_seconds": 0.0}
+
+    # ---- 词表与计数 ----
+
+    def _problem_id(self, key: str) -> int:
+        row = self.problem_ids.get(key)
+        if row is None:
+            row = self.problem_ids[key] = len(self.problems)
+            self.problems.append(key)
+            self.problem_counts = self._grow(self.problem_counts, len(self.problems))
+        return row
+
+    def _action_id(self, text: str) -> int:
+        col = self.action_ids.get(text)
+        if col is None:
+            col = self.action_ids[text] = len(self.actions)
+            self.actions.append(text)
+            self.action_counts = self._grow(self.action_counts, len(self.actions))
+        return col
+
+    @staticmethod
+    def _grow(array, size: int):
+        """按倍数扩容的计数数组"""
+        if len(array) >= size:
+            return array
+        grown = np.zeros(max(size, len(array) * 2, 64), dtype=np.int64)
+        grown[:len(array)] = array
+        return grown
+
+    def _contribution(self, patient_id: str, annotation_data: Optional[Dict[str, Any]], mtime):
+        parsed = self.index.get_parsed(patient_id) if annotation_data else None
+        if parsed is None:
+            return (mtime, (), (), ())
+        problems, actions, pairs = patient_pairs(parsed, annotation_data)
+        return (mtime,
+                tuple(self._problem_id(key) for key in problems),
+                tuple(self._action_id(text) for text in actions),
+                tuple((self._problem_id(key), self._action_id(text)) for key, text in pairs))
+
+    def _add(self, contribution, sign: int):
+        _, rows, cols, pairs = contribution
+        if not pairs:
+            return
+        self.total += sign
+        self.problem_counts[list(rows)] += sign
+        self.action_counts[list(cols)] += sign
+        for row, col in pairs:
+            cells = self.delta.setdefault(row, {})
+            value = cells.get(col, 0) + sign
+            if value:
+                if col not in cells:
+                    self.delta_size += 1
+                cells[col] = value
+            elif col in cells:
+                del cells[col]
+                self.delta_size -= 1
+        self.dirty = True
+
+    def _apply(self, patient_id: str, contribution):
+        """用新的贡献替换该患者旧的贡献，contribution 为 None 表示标注已删除"""
+        old = self.contributions.pop(patient_id, None)
+        if old is not None:
+            self._add(old, -1)
+        if contribution is not None:
+            self.contributions[patient_id] = contribution
+            self._add(contribution, 1)
+        if self.delta_size > ANALYTICS_DELTA_LIMIT:
+            self._compact()
+
+    def _compact(self):
+        """把增量表合并进压缩矩阵"""
+        shape = (len(self.problems), len(self.actions))
+        base = self.base.tocoo()
+        rows = [base.row]
+        cols = [base.col]
+        data = [base.data]
+        for row, cells in self.delta.items():
+            if cells:
+                rows.append(np.full(len(cells), row, dtype=np.int32))
+                cols.append(np.fromiter(cells.keys(), dtype=np.int32, count=len(cells)))
+                data.append(np.fromiter(cells.values(), dtype=np.int64, count=len(cells)))
+        matrix = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                   shape=shape, dtype=np.int64)
+        matrix.eliminate_zeros()
+        self.base = matrix
+        self.delta = {}
+        self.delta_size = 0
+        self.stats["compactions"] += 1
+
+    # ---- 构建、同步与缓存 ----
+
+    def _reset(self):
+        self.problems, self.problem_ids, self.actions, self.action_ids = [], {}, [], {}
+        self.base = sparse.csr_matrix((0, 0), dtype=np.int64)
+        self.delta, self.delta_size = {}, 0
+        self.problem_counts = np.zeros(0, dtype=np.int64)
+        self.action_counts = np.zeros(0, dtype=np.int64)
+        self.total = 0
+        self.contributions = {}
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        if not load_dependencies():
+            raise RuntimeError(MISSING_DEPENDENCY)
+        start = time.perf_counter()
+        self._reset()
+        try:
+            self._load_cache()
+            self.stats["loaded_from_cache"] = True
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"统计缓存无法读取，重新构建: {e}")
+            self._reset()
+        self.loaded = True
+        self._apply_scan(self._scan(force=True))
+        self.stats["builds"] += 1
+        self.stats["build_seconds"] = time.perf_counter() - start
+
+    def _scan(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """到期且标注存储有变化时返回 {患者ID: 修改时间}，否则返回 None"""
+        with self.sync_lock:
+            now = time.time()
+            if not force and now - self.synced < ANALYTICS_SYNC_SECONDS:
+                return None
+            self.synced = now
+            token = self.store.change_token()
+            if not force and token == self.token:
+                return None
+            self.token = token
+            return self.store.scan()
+
+    def _apply_scan(self, mtimes: Dict[str, Any]):
+        """重新计算修改时间变化的患者（调用方持有锁）"""
+        for patient_id in [pid for pid in self.contributions if pid not in mtimes]:
+            self._apply(patient_id, None)
+        changed = 0
+        for patient_id, mtime in mtimes.items():
+            known = self.contributions.get(patient_id)
+            if known is not None and known[0] == mtime:
+                continue
+            self._apply(patient_id, self._contribution(patient_id, self.store.load(patient_id), mtime))
+            changed += 1
+        self.stats["synced_patients"] += changed
+        if self.dirty and (changed > 1000 or time.time() - self.saved > ANALYTICS_SAVE_SECONDS):
+            self._save_cache()
+
+    def sync(self, force: bool = False):
+        """同步其他进程的修改；扫描标注存储时不持有锁，不阻塞查询"""
+        mtimes = self._scan(force)
+        if mtimes is not None:
+            with self.lock:
+                self._apply_scan(mtimes)
+
+    def _prepare(self):
+        with self.lock:
+            self._ensure_loaded()
+        self.sync()
+
+    def warm(self):
+        """在后台加载矩阵（不阻塞调用方）"""
+        with self.lock:
+            if self.loaded or self.warming:
+                return
+            self.warming = True
+        threading.Thread(target=self._warm, name="analytics-warm", daemon=True).start()
+
+    def _warm(self):
+        try:
+            if load_dependencies():
+                self._prepare()
+        except Exception as e:
+            logging.error(f"统计矩阵加载失败: {e}")
+        finally:
+            self.warming = False
+
+    def _sync_later(self):
+        """到期时在后台同步其他进程的修改（正在同步时跳过）"""
+        if time.time() - self.synced < ANALYTICS_SYNC_SECONDS or self.sync_lock.locked():
+            return
+        threading.Thread(target=self.sync, name="analytics-sync", daemon=True).start()
+
+    def _save_cache(self):
+        self._compact()
+        meta = {
+            "problems": self.problems,
+            "actions": self.actions,
+            "total": self.total,
+            "contributions": {pid: [c[0], c[1], c[2], [x for pair in c[3] for x in pair]]
+                              for pid, c in self.contributions.items()},
+        }
+        buffer = io.BytesIO()
+        np.savez(buffer, data=self.base.data, indices=self.base.indices, indptr=self.base.indptr,
+                 shape=np.array(self.base.shape), problem_counts=self.problem_counts[:len(self.problems)],
+                 action_counts=self.action_counts[:len(self.actions)],
+                 meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8))
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, self.cache_file)
+        self.saved = time.time()
+        self.dirty = False
+
+    def _load_cache(self):
+        with np.load(self.cache_file, allow_pickle=False) as cache:
+            meta = json.loads(cache["meta"].tobytes().decode("utf-8"))
+            self.base = sparse.csr_matrix((cache["data"], cache["indices"], cache["indptr"]),
+                                          shape=tuple(cache["shape"]))
+            self.problem_counts = cache["problem_counts"].astype(np.int64)
+            self.action_counts = cache["action_counts"].astype(np.int64)
+        self.problems = meta["problems"]
+        self.problem_ids = {key: i for i, key in enumerate(self.problems)}
+        self.actions = meta["actions"]
+        self.action_ids = {text: i for i, text in enumerate(self.actions)}
+        self.total = meta["total"]
+        self.contributions = {
+            pid: (c[0], tuple(c[1]), tuple(c[2]), tuple(zip(c[3][::2], c[3][1::2])))
+            for pid, c in meta["contributions"].items()
+        }
+
+    def update(self, patient_id: str, annotation_data: Optional[Dict[str, Any]]):
+        """本进程保存标注后的增量更新（patient_index 回调）"""
+        with self.lock:
+            if not self.loaded:
+                return  # 首次查询时会整体构建（未安装依赖时不会构建）
+            mtime = self.store.mtime(patient_id)
+            contribution = self._contribution(patient_id, annotation_data, mtime) if mtime is not None else None
+            self._apply(patient_id, contribution)
+            self.stats["updates"] += 1
+
+    def refresh(self):
+        """立即同步全部修改并写入缓存"""
+        with self.lock:
+            self._ensure_loaded()
+        self.sync(force=True)
+        with self.lock:
+            if self.dirty:
+                self._save_cache()
+
+    # ---- 查询 ----
+
+    def _row(self, row: int):
+        """某一行的 (列, 计数)，合并压缩矩阵与增量表"""
+        if row < self.base.shape[0]:
+            start, end = self.base.indptr[row], self.base.indptr[row + 1]
+            cols, counts = self.base.indices[start:end], self.base.data[start:end]
+        else:
+            cols, counts = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        cells = self.delta.get(row)
+        if cells:
+            cols = np.concatenate([cols, np.fromiter(cells.keys(), dtype=np.int32, count=len(cells))])
+            counts = np.concatenate([counts, np.fromiter(cells.values(), dtype=np.int64, count=len(cells))])
+            cols, inverse = np.unique(cols, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        keep = counts > 0
+        return cols[keep], counts[keep]
+
+    def _metrics(self, counts, problem_counts, action_counts) -> Dict[str, Any]:
+        confidence = counts / np.maximum(problem_counts, 1)
+        action_rate = action_counts / max(self.total, 1)
+        lift = np.divide(confidence, action_rate, out=np.zeros_like(confidence), where=action_rate > 0)
+        pmi = np.log2(lift, out=np.zeros_like(lift), where=lift > 0)
+        return {"count": counts, "confidence": confidence, "lift": lift, "pmi": pmi}
+
+    def find_problems(self, text: str, limit: int = 10) -> List[str]:
+        """名称包含 text 的问题（按已标注患者数降序）"""
+        with self.lock:
+            self._ensure_loaded()
+            matches = [key for key in self.problems if text in key]
+            matches.sort(key=lambda key: -self.problem_counts[self.problem_ids[key]])
+            return matches[:limit]
+
+    def top_actions(self, problem: str, top: int = 10, metric: str = "lift",
+                    min_count: int = 1) -> Optional[Dict[str, Any]]:
+        """与问题共现最强的动作，问题不存在时返回 None"""
+        if metric not in METRICS:
+            raise ValueError(f"未知的指标: {metric}")
+        self._prepare()
+        with self.lock:
+            row = self.problem_ids.get(problem)
+            if row is None:
+                return None
+            cols, counts = self._row(row)
+            problem_count = int(self.problem_counts[row])
+            keep = counts >= min_count
+            cols, counts = cols[keep], counts[keep]
+            values = self._metrics(counts.astype(np.float64), problem_count, self.action_counts[cols])
+            # 指标相同时按关联次数排序
+            order = np.lexsort((-counts, -values[metric]))[:top]
+            return {
+                "problem": problem,
+                "patients": problem_count,
+                "annotated_patients": self.total,
+                "metric": metric,
+                "actions": [{
+                    "action": self.actions[cols[i]],
+                    "count": int(counts[i]),
+                    "confidence": float(values["confidence"][i]),
+                    "lift": float(values["lift"][i]),
+                    "pmi": float(values["pmi"][i]),
+                } for i in order],
+            }
+
+    def top_pairs(self, top: int = 20, metric: str = "lift", min_count: int = 5) -> Dict[str, Any]:
+        """全库共现最强的 (问题, 动作) 组合"""
+        if metric not in METRICS:
+            raise ValueError(f"未知的指标: {metric}")
+        self._prepare()
+        with self.lock:
+            if self.delta_size:
+                self._compact()
+            matrix = self.base.tocoo()
+            keep = matrix.data >= min_count
+            rows, cols, counts = matrix.row[keep], matrix.col[keep], matrix.data[keep]
+            values = self._metrics(counts.astype(np.float64), self.problem_counts[rows], self.action_counts[cols])
+            order = np.lexsort((-counts, -values[metric]))[:top]
+            return {
+                "metric": metric,
+                "annotated_patients": self.total,
+                "pairs": [{
+                    "problem": self.problems[rows[i]],
+                    "action": self.actions[cols[i]],
+                    "count": int(counts[i]),
+                    "confidence": float(values["confidence"][i]),
+                    "lift": float(values["lift"][i]),
+                    "pmi": float(values["pmi"][i]),
+                } for i in order],
+            }
+
+    def suggest_links(self, parsed: Dict[str, Any], annotation_data: Optional[Dict[str, Any]],
+                      limit: int = SUGGEST_LIMIT) -> List[Dict[str, Any]]:
+        """根据历史标注为患者推荐尚未建立的 (动作, 问题) 关联，按置信度降序
+
+        只在内存中查询，不等待加载或同步：矩阵尚未加载时触发后台加载并返回空列表。
+        """
+        if DEPENDENCIES_AVAILABLE is False or not annotation_data or not annotation_data.get("solutions"):
+            return []
+        if not self.loaded:
+            self.warm()
+            return []
+        self._sync_later()
+        existing = annotation_data.get("annotations") or {}
+        with self.lock:
+            # 患者的动作 -> 矩阵列（同一文本的多个动作取第一个）
+            columns: Dict[int, str] = {}
+            for solution in annotation_data["solutions"]:
+                col = self.action_ids.get(solution.get("text", "").strip())
+                if col is not None and col not in columns:
+                    columns[col] = solution["id"]
+            if not columns:
+                return []
+            patient_cols = np.fromiter(columns.keys(), dtype=np.int32, count=len(columns))
+            suggestions = []
+            for problem in parsed["problems"]:
+                row = self.problem_ids.get(problem_key(problem))
+                if row is None:
+                    continue
+                cols, counts = self._row(row)
+                keep = np.isin(cols, patient_cols) & (counts >= SUGGEST_MIN_COUNT)
+                if not keep.any():
+                    continue
+                cols, counts = cols[keep], counts[keep]
+                values = self._metrics(counts.astype(np.float64), self.problem_counts[row], self.action_counts[cols])
+                for i in np.nonzero(values["confidence"] >= SUGGEST_MIN_CONFIDENCE)[0]:
+                    action_id = columns[int(cols[i])]
+                    if problem["id"] in existing.get(action_id, ()):
+                        continue
+                    suggestions.append({
+                        "action_id": action_id,
+                        "problem_id": problem["id"],
+                        "count": int(counts[i]),
+                        "confidence": float(values["confidence"][i]),
+                        "lift": float(values["lift"][i]),
+                    })
+        suggestions.sort(key=lambda item: (-item["confidence"], -item["count"]))
+        return suggestions[:limit]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                **self.stats,
+                "available": load_dependencies(),
+                "loaded": self.loaded,
+                "problems": len(self.problems),
+                "actions": len(self.actions),
+                "nonzero": int(self.base.nnz) if self.base is not None else 0,
+                "pending_delta": self.delta_size,
+                "annotated_patients": self.total,
+                "patients": len(self.contributions),
+            }
+
+# 全局共享的共现矩阵
+cooccurrence = CooccurrenceIndex()
+patient_index.add_listener(cooccurrence.update)
@@ -0,0 +1,421 @@
+"""标注数据存储后端
+
+- JsonAnnotationStore：每个患者一个 JSON 文件，覆盖前在 data/backups 保存 .bak 副本（见 backups.py，适合小规模使用）
+- SqliteAnnotationStore：单文件 SQLite（WAL 模式），包含 patients / solutions / links 表
+  以及只追加的 revisions 表，历史以紧凑的差异记录而不是完整副本
+
+通过 config.py 中的 STORAGE_BACKEND（或环境变量 ANNOTATION_STORAGE）选择 "json" 或 "sqlite"。
+从 JSON 迁移: python app.py migrate-sqlite
+修复重复的动作ID: python app.py repair-ids [--dry-run]
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+
+import config
+from metrics import IO_SECONDS
+from storage import DATA_DIR, ANNOTATIONS_DIR, BACKUP_DIR, write_json_atomic, file_lock, repair_action_ids
+from backups import create_backup, list_backups, read_backup
+
+SQLITE_DB_FILE = os.path.join(DATA_DIR, "annotations.db")
+STORAGE_BACKEND = os.environ.get("ANNOTATION_STORAGE", getattr(config, "STORAGE_BACKEND", "json"))
+
+# 标注文档中单独建表的字段，其余字段存入 patients.extra
+STRUCTURED_FIELDS = ("patient_id", "annotations", "solutions", "revision")
+
+# ---- 差异 ----
+
+def make_diff(old: Any, new: Any) -> Optional[Dict[str, Any]]:
+    """计算两个 JSON 值的差异，相同时返回 None
+
+    字典逐键递归比较，其他类型（包括列表）变化时整体替换：
+    {"set": {键: 新值}, "del": [键], "sub": {键: 子差异}} 或 {"value": 新值}
+    """
+    if old == new:
+        return None
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return {"value": new}
+    diff = {}
+    changed = {k: v for k, v in new.items() if k not in old}
+    deleted = [k for k in old if k not in new]
+    nested = {}
+    for key in old.keys() & new.keys():
+        sub = make_diff(old[key], new[key])
+        if sub is None:
+            continue
+        if "value" in sub:
+            changed[key] = sub["value"]
+        else:
+            nested[key] = sub
+    if changed:
+        diff["set"] = changed
+    if deleted:
+        diff["del"] = deleted
+    if nested:
+        diff["sub"] = nested
+    return diff
+
+def apply_diff(old: Any, diff: Optional[Dict[str, Any]]) -> Any:
+    """将 make_diff 的结果应用到旧值上"""
+    if diff is None:
+        return old
+    if "value" in diff:
+        return diff["value"]
+    result = dict(old) if isinstance(old, dict) else {}
+    for key in diff.get("del", []):
+        result.pop(key, None)
+    for key, sub in diff.get("sub", {}).items():
+        result[key] = apply_diff(result.get(key), sub)
+    result.update(diff.get("set", {}))
+    return result
+
+# ---- 本进程写入记录 ----
+
+class LocalWrites:
+    """记录本进程写入前后的 change_token，患者索引据此区分自己的写入与外部修改"""
+
+    def __init__(self, limit: int = 256):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.transitions: "OrderedDict[Any, Any]" = OrderedDict()  # 写入前标记 -> 写入后标记
+
+    def record(self, before, after):
+        if before is None or before == after:
+            return
+        with self.lock:
+            self.transitions[before] = after
+            while len(self.transitions) > self.limit:
+                self.transitions.popitem(last=False)
+
+    def follow(self, token):
+        """从 token 开始沿本进程的写入前进，返回最后到达的标记"""
+        seen = set()
+        with self.lock:
+            while token in self.transitions and token not in seen:
+                seen.add(token)
+                token = self.transitions[token]
+        return token
+
+# ---- JSON 文件后端 ----
+
+class JsonAnnotationStore:
+    """每个患者一个 JSON 文件"""
+
+    name = "json"
+
+    def __init__(self, annotations_dir: str = ANNOTATIONS_DIR):
+        self.annotations_dir = annotations_dir
+        self.local_writes = LocalWrites()
+        os.makedirs(annotations_dir, exist_ok=True)
+
+    def _path(self, patient_id: str) -> str:
+        return os.path.join(self.annotations_dir, f"{patient_id}.json")
+
+    def lock(self, patient_id: str) -> threading.RLock:
+        """患者标注的读-改-写锁"""
+        return file_lock(self._path(patient_id))
+
+    def load(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """读取标注数据，不存在时返回 None"""
+        try:
+            with IO_SECONDS.time(op="json_load"), open(self._path(patient_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, patient_id: str, data: Dict[str, Any], backup: bool = True, source: str = "save") -> int:
+        """写入标注数据，backup 为 True 时先备份旧文件，返回新修订号"""
+        path = self._path(patient_id)
+        with file_lock(path):
+            old_data = self.load(patient_id)
+            if backup and old_data is not None:
+                # 恢复历史版本前的状态总是备份（不受合并窗口限制），恢复本身也可撤销
+                create_backup(path, old_data, force=source == "restore")
+            revision = (old_data or {}).get("revision", 0) + 1
+            before = self.change_token()
+            write_json_atomic(path, {**data, "revision": revision})
+            self.local_writes.record(before, self.change_token())
+            return revision
+
+    def mtime(self, patient_id: str) -> Optional[int]:
+        try:
+            return os.stat(self._path(patient_id)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def change_token(self):
+        """新增或删除标注文件时变化的标记（目录 mtime）"""
+        try:
+            return os.stat(self.annotations_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def scan(self) -> Dict[str, int]:
+        """返回 {患者ID: 修改时间(ns)}"""
+        result = {}
+        if not os.path.exists(self.annotations_dir):
+            return result
+        for entry in os.scandir(self.annotations_dir):
+            if entry.name.endswith('.json'):
+                try:
+                    result[entry.name[:-5]] = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+        return result
+
+# ---- SQLite 后端 ----
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL DEFAULT 0,
+    updated_at INTEGER NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS solutions (
+    patient_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    action_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (patient_id, position)
+);
+CREATE TABLE IF NOT EXISTS links (
+    patient_id TEXT NOT NULL,
+    action_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    problem_id TEXT NOT NULL,
+    PRIMARY KEY (patient_id, action_id, position)
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    diff TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_revisions_patient ON revisions (patient_id, revision);
+"""
+
+class SqliteAnnotationStore:
+    """单文件 SQLite 存储，每个线程使用独立连接"""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str = SQLITE_DB_FILE):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.local_writes = LocalWrites()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _load(self, conn: sqlite3.Connection, patient_id: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute("SELECT extra, revision FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
+        if row is None:
+            return None
+        revision = row[1]
+        data = {"patient_id": patient_id, "annotations": {}, "solutions": []}
+        for action_id, text, extra in conn.execute(
+                "SELECT action_id, text, extra FROM solutions WHERE patient_id = ? ORDER BY position",
+                (patient_id,)):
+            solution = {"id": action_id, "text": text}
+            if extra:
+                solution.update(json.loads(extra))
+            data["solutions"].append(solution)
+        for action_id, problem_id in conn.execute(
+                "SELECT action_id, problem_id FROM links WHERE patient_id = ? ORDER BY rowid",
+                (patient_id,)):
+            data["annotations"].setdefault(action_id, []).append(problem_id)
+        data.update(json.loads(row[0]))
+        data["revision"] = revision
+        return data
+
+    def lock(self, patient_id: str) -> threading.RLock:
+        """患者标注的读-改-写锁（写入本身由 SQLite 事务保证原子性）"""
+        return file_lock(f"{self.db_path}#{patient_id}")
+
+    def load(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """读取标注数据，不存在时返回 None"""
+        with IO_SECONDS.time(op="sqlite_load"):
+            return self._load(self._connect(), patient_id)
+
+    def save(self, patient_id: str, data: Dict[str, Any], backup: bool = True,
+             source: str = "save", created_at: Optional[float] = None) -> int:
+        """写入标注数据并追加一条差异修订，返回保存后的修订号（内容未变化时不写入）"""
+        conn = self._connect()
+        with IO_SECONDS.time(op="sqlite_save"), conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old = self._load(conn, patient_id) or {"revision": 0}
+            data = {k: v for k, v in data.items() if k != "revision"}
+            diff = make_diff({k: v for k, v in old.items() if k != "revision"}, data)
+            if diff is None:
+                return old["revision"]
+            revision = old["revision"] + 1
+            created_at = created_at or time.time()
+            extra = {k: v for k, v in data.items() if k not in STRUCTURED_FIELDS}
+            conn.execute(
+                "INSERT INTO patients (patient_id, revision, updated_at, extra) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(patient_id) DO UPDATE SET revision = excluded.revision, "
+                "updated_at = excluded.updated_at, extra = excluded.extra",
+                (patient_id, revision, int(created_at * 1e9), json.dumps(extra, ensure_ascii=False)))
+            conn.execute("DELETE FROM solutions WHERE patient_id = ?", (patient_id,))
+            conn.executemany(
+                "INSERT INTO solutions (patient_id, position, action_id, text, extra) VALUES (?, ?, ?, ?, ?)",
+                [(patient_id, i, s.get("id"), s.get("text", ""),
+                  json.dumps({k: v for k, v in s.items() if k not in ("id", "text")}, ensure_ascii=False)
+                  if len(s) > 2 else None)
+                 for i, s in enumerate(data.get("solutions", []))])
+            conn.execute("DELETE FROM links WHERE patient_id = ?", (patient_id,))
+            conn.executemany(
+                "INSERT INTO links (patient_id, action_id, position, problem_id) VALUES (?, ?, ?, ?)",
+                [(patient_id, action_id, i, problem_id)
+                 for action_id, problem_ids in data.get("annotations", {}).items()
+                 for i, problem_id in enumerate(problem_ids)])
+            # BEGIN IMMEDIATE 持有写锁，其他进程不会在这两个修订ID之间写入
+            before = conn.execute("SELECT COALESCE(MAX(id), 0) FROM revisions").fetchone()[0]
+            after = conn.execute(
+                "INSERT INTO revisions (patient_id, revision, created_at, source, diff) VALUES (?, ?, ?, ?, ?)",
+                (patient_id, revision, created_at, source,
+                 json.dumps(diff, ensure_ascii=False, separators=(',', ':')))).lastrowid
+        # 提交后才记录：回滚的修订ID可能被其他进程重新使用
+        self.local_writes.record(before, after)
+        return revision
+
+    def mtime(self, patient_id: str) -> Optional[int]:
+        row = self._connect().execute(
+            "SELECT updated_at FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
+        return row[0] if row else None
+
+    def change_token(self):
+        """最新修订的ID，任何写入后都会变化"""
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM revisions").fetchone()[0]
+
+    def scan(self) -> Dict[str, int]:
+        """返回 {患者ID: 修改时间(ns)}"""
+        return dict(self._connect().execute("SELECT patient_id, updated_at FROM patients"))
+
+    def history(self, patient_id: str) -> List[Dict[str, Any]]:
+        """列出患者的修订记录"""
+        return [{"revision": revision, "created_at": created_at, "source": source}
+                for revision, created_at, source in self._connect().execute(
+                    "SELECT revision, created_at, source FROM revisions WHERE patient_id = ? ORDER BY revision",
+                    (patient_id,))]
+
+    def load_revision(self, patient_id: str, revision: int) -> Optional[Dict[str, Any]]:
+        """依次应用差异，还原指定修订时的标注数据"""
+        data = None
+        found = False
+        for rev, diff in self._connect().execute(
+                "SELECT revision, diff FROM revisions WHERE patient_id = ? AND revision <= ? ORDER BY revision",
+                (patient_id, revision)):
+            data = apply_diff(data or {}, json.loads(diff))
+            found = rev == revision
+        if not found:
+            return None
+        data["revision"] = revision
+        return data
+
+# ---- 后端选择与迁移 ----
+
+def create_store(backend: str = STORAGE_BACKEND):
+    """按名称创建存储后端"""
+    if backend == "sqlite":
+        return SqliteAnnotationStore()
+    if backend == "json":
+        return JsonAnnotationStore()
+    raise ValueError(f"未知的存储后端: {backend}")
+
+def migrate_json_to_sqlite(target: SqliteAnnotationStore, annotations_dir: str = ANNOTATIONS_DIR,
+                           backup_dir: str = BACKUP_DIR) -> Dict[str, int]:
+    """将 JSON 标注及其 .bak 备份按时间顺序导入 SQLite，相同内容的备份不会产生修订"""
+    backups = {name: [(entry["time"], entry["path"]) for entry in entries]
+               for name, entries in list_backups(backup_dir).items()}
+
+    stats = {"patients": 0, "revisions": 0, "skipped_backups": 0}
+    for name in sorted(os.listdir(annotations_dir)):
+        if not name.endswith('.json'):
+            continue
+        patient_id = name[:-5]
+        path = os.path.join(annotations_dir, name)
+        history = sorted(backups.get(name, []))
+        revision = 0
+        history.append((os.path.getmtime(path), path))
+        for created_at, file_path in history:
+            try:
+                data = read_backup(file_path)
+            except (OSError, ValueError) as e:
+                logging.warning(f"跳过无法读取的文件 {file_path}: {e}")
+                continue
+            source = "migrate" if file_path == path else "migrate-backup"
+            new_revision = target.save(patient_id, data, source=source, created_at=created_at)
+            if new_revision == revision:
+                stats["skipped_backups"] += 1
+            else:
+                stats["revisions"] += 1
+            revision = new_revision
+        stats["patients"] += 1
+    return stats
+
+def main(argv=None):
+    """命令行入口: python app.py migrate-sqlite [--db data/annotations.db]"""
+    parser = argparse.ArgumentParser(prog="app.py migrate-sqlite", description="将JSON标注和备份迁移到SQLite")
+    parser.add_argument("--db", default=SQLITE_DB_FILE, help="SQLite数据库文件")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        print(f"数据库已存在: {args.db}，请先备份并删除后再迁移")
+        return 1
+    stats = migrate_json_to_sqlite(SqliteAnnotationStore(args.db))
+    print(f"迁移完成: {stats['patients']} 个患者, {stats['revisions']} 条修订, "
+          f"跳过 {stats['skipped_backups']} 个重复备份")
+    print("在 config.py 中设置 STORAGE_BACKEND = \"sqlite\" 以启用")
+    return 0
+
+def repair_store_action_ids(store, dry_run: bool = False) -> Dict[str, List[tuple]]:
+    """修复所有标注中重复的动作ID并补上 next_action_id 计数器，返回 {患者ID: [(原ID, 新ID)]}"""
+    repaired = {}
+    for patient_id in sorted(store.scan()):
+        with store.lock(patient_id):
+            data = store.load(patient_id)
+            if data is None:
+                continue
+            had_counter = isinstance(data.get("next_action_id"), int)
+            renamed = repair_action_ids(data)
+            if renamed:
+                repaired[patient_id] = renamed
+            if not dry_run and (renamed or not had_counter):
+                store.save(patient_id, data, backup=bool(renamed), source="repair-ids")
+    return repaired
+
+def repair_main(argv=None):
+    """命令行入口: python app.py repair-ids [--dry-run]"""
+    parser = argparse.ArgumentParser(prog="app.py repair-ids", description="修复重复的动作ID")
+    parser.add_argument("--dry-run", action="store_true", help="只列出需要修复的动作，不写入")
+    args = parser.parse_args(argv)
+
+    repaired = repair_store_action_ids(annotation_store, dry_run=args.dry_run)
+    for patient_id, renamed in repaired.items():
+        for old_id, new_id in renamed:
+            print(f"{patient_id}: {old_id or '(空)'} -> {new_id}")
+    print(f"共 {len(repaired)} 个患者存在重复ID" + ("（未写入）" if args.dry_run else "，已修复"))
+    return 0
+
+# 全局共享的存储实例
+annotation_store = create_store()
@@ -1,10 +1,13 @@
 from flask import Flask, render_template, request, jsonify, Response
 import os
+import sys
 import json
-import re
 import time
+import shutil
+import tarfile
+import zipfile
 import logging
-from typing import List, Dict, Any
+import tempfile
 from datetime import datetime
 
 # 配置日志
@@ -20,275 +23,144 @@ logging.basicConfig(
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 # 查看 config.py 是否存在
-if os.path.exists(r'config.py'):
-    from config import OPENAI_API_KEY, OPENAI_BASE_URL, MODEL
-else:
+if not os.path.exists(r'config.py'):
     print("请添加配置文件 config.py")
     exit(1)
 
 app = Flask(__name__)
-zh_en_dict = {
-    "Symptom":"主诉",
-    "Dental":"牙性",
-    "Tooth":"牙齿",
-    "Skeletal":"骨性",
-    "Softtissue":"软组织",
-    "Functional":"功能",
-    "Growth":"生长发育",
-    "UnhealthyHabits":"不良习惯",
-    "Functional":"功能",
-    "TreatmentPlan":"诊疗方案"
-}
-
-
-# 配置数据目录
-DATA_DIR = "data"
-PATIENTS_DIR = os.path.join(DATA_DIR, "patients")
-ANNOTATIONS_DIR = os.path.join(DATA_DIR, "annotations")
-ACTION_LIBRARY_FILE = os.path.join(DATA_DIR, "action_library.json")
+
+from storage import (PATIENTS_DIR, ANNOTATIONS_DIR, BACKUP_DIR, validate_patient_data,
+                     apply_annotation_ops, allocate_action_id, next_action_number)
+from action_library import library_index
+from patient_index import patient_index, STATUS_UNANNOTATED, STATUS_AUTO_GENERATED, STATUS_ANNOTATED
+from standardizer import LLM_FANOUT
+from llm_cache import llm_cache
+from llm_client import llm_client
+from rule_standardizer import rule_standardizer, RULE_STANDARDIZER
+from prefetch import prefetcher
+from jobs import job_queue
+from analytics import cooccurrence, MISSING_DEPENDENCY, load_dependencies as load_analytics_dependencies
+from annotation_store import annotation_store
+import export
+import importer
+import metrics
+import backups
+from warmup import warmup, STARTUP_WARMUP
 
 # 确保数据目录存在
 os.makedirs(PATIENTS_DIR, exist_ok=True)
 os.makedirs(ANNOTATIONS_DIR, exist_ok=True)
-
-# 创建备份目录
-BACKUP_DIR = os.path.join(DATA_DIR, "backups")
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
-def create_backup(file_path, content):
-    """创建文件备份"""
-    try:
-        backup_name = f"{os.path.basename(file_path)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.bak"
-        backup_path = os.path.join(BACKUP_DIR, backup_name)
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            if isinstance(content, dict):
-                json.dump(content, f, ensure_ascii=False, indent=2)
-            else:
-                f.write(content)
-        logging.info(f"创建备份: {backup_path}")
-    except Exception as e:
-        logging.error(f"创建备份失败: {e}")
-
-def validate_patient_data(data):
-    """验证患者数据"""
-    required_fields = ['patient_id', 'annotations', 'solutions']
-    for field in required_fields:
-        if field not in data:
-            raise ValueError(f"缺少必要字段: {field}")
-    
-    if not isinstance(data['solutions'], list):
-        raise ValueError("solutions 必须是列表")
-    
-    if not isinstance(data['annotations'], dict):
-        raise ValueError("annotations 必须是字典")
-    
-    return True
-
-def load_action_library() -> List[str]:
-    """加载诊疗动作库"""
-    if os.path.exists(ACTION_LIBRARY_FILE):
-        with open(ACTION_LIBRARY_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    else:
-        # 初始默认动作库
-        default_actions = [
-            "排齐牙列",
-            "解除拥挤",
-            "纠正中线",
-            "调整磨牙关系",
-            "内收前牙",
-            "压低前牙",
-            "片切",
-            "拔除智齿",
-            "正畸保持",
-            "纠正扭转牙",
-            "排齐上颌牙列",
-            "排齐下颌牙列"
-        ]
-        save_action_library(default_actions)
-        return default_actions
-
-def save_action_library(actions: List[str]):
-    """保存诊疗动作库"""
-    with open(ACTION_LIBRARY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(actions, f, ensure_ascii=False, indent=2)
-
-def parse_patient_file(content: str) -> Dict[str, Any]:
-    """解析病历文件内容"""
-    result = {
-        "problems": [],
-        "treatment_plan": ""
-    }
-
-    # 诊疗方案拆分
-    parts = content.split("TreatmentPlan<sep>")
-    infos = parts[0]
-    treatment_plan = parts[1] if len(parts) > 1 else ""
-    treatment_plan = '\n'.join(treatment_plan.split('<sep>')).strip() if treatment_plan else ""
-    lines = infos.strip().split('\n')
-    current_section = None
-    
-    for line in lines:
-        line = line.strip()
-        if not line:  continue
-
-        if line.startswith("Patient"): continue
-        problem_type = line.split("<sep>")[0].strip()
-        problems = line.split("<sep>")[1:]
-        problem = [''.join(problems).strip()]
-        current_section = zh_en_dict.get(problem_type, None)
-
-        result["problems"].append({
-            "id": f"problem-{len(result['problems'])}",
-            "text": problem,
-            "type": current_section
-        })
-
-    # 处理诊疗方案
-    result["treatment_plan"] = treatment_plan
-    
-    return result
-
-from openai import OpenAI
-
-def call_llm(prompt: str, test_mode: bool=False) -> str:
-    """调用LLM并返回响应（模拟实现）"""
-    if test_mode:
-        print(f"Calling LLM with prompt: {prompt}")
-        return "LLM response 1 \nLLM response 2"
-
-    try:
-        client = OpenAI(
-            api_key=OPENAI_API_KEY, 
-            base_url=OPENAI_BASE_URL
-        )
-
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
-            stream=False
-        )
-
-        result = response.choices[0].message.content
-        if result:
-            return result.strip()
-        else:
-            return "LLM返回空内容"
-    except Exception as e:
-        print(f"LLM调用错误: {e}")
-        # 返回测试模式的结果，确保系统能正常运行
-        return "LLM调用失败，返回默认结果"
-
-def call_llm_stream(prompt: str):
-    """流式调用LLM并返回生成器"""
-    try:
-        client = OpenAI(
-            api_key=OPENAI_API_KEY, 
-            base_url=OPENAI_BASE_URL
-        )
-
-        stream = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
-            stream=True
-        )
-
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
-    except Exception as e:
-        print(f"LLM流式调用错误: {e}")
-        yield "LLM调用失败"
-
-
-standardize_actions_prompt = """
-你是一位专业的正畸医生助手，需要将口语化、描述性的正畸治疗计划拆分为标准化的诊疗动作。
-
-任务要求：
-1. 将输入的治疗计划文本拆分为具体的、可执行的诊疗动作
-2. 每个动作应该是原子化的，即一个动作只描述一个具体的治疗手段
-3. 使用标准的正畸医学术语
-4. 去除费用、时间、风险提示等非治疗动作的内容
-5. 每行输出一个诊疗动作，不要添加序号或其他格式
-6. 尽可能保存所有动词以及包含的医学术语，因为这些都属于重要的手段信息
-7. 方向前后也尽可能保留，位置信息和方向都属于重要的定位信息，比如"右移"、"左移"、"向后移动"等等
-8. 如果一小句中有多个动作，每个动作都要单独输出，不要合并
-9. 如果有多颗牙同时进行拆开，也要依次拆分
-10. "适度""尝试"等程度词不做保存，保证动作的标准化特性
-
-
-标准诊疗动作库：
-[这里是标准诊疗动作库]
-
-转换规则：
-- "上下唇倾排齐，解除拥挤及扭转" → "排齐上颌牙列"、"排齐下颌牙列"、"解除拥挤"、"纠正扭转牙"
-- "后牙锁合先利用矫治器纠正" → "纠正后牙锁合"
-- "维持磨牙关系" → "维持磨牙关系"
-- "上颌排齐整平后，拉17向近中，右侧直立27并拉向近中" → "排齐上颌牙列"、"整平上颌牙列"、"拉17向近中"、"右侧直立27"、"拉27向近中"
-- "下颌右侧推磨牙向后开辟间隙" → "下颌右侧推磨牙向后"、"开辟间隙"
-- "上颌前牙整体右移调整中线" → "前牙整体移动"、"纠正中线"
-- "智齿酌情" → "拔除智齿"
-- "正畸保持" → "正畸保持"
-- "下颌左侧直立磨牙" → "下颌左侧直立磨牙"
-- "必要时下前牙配合片切解决三角间隙" → "片切解决三角间隙"
-- "13、46、47全冠修复" → "13全冠修复"、"46全冠修复"、"47全冠修复"
-- "利用拔牙间隙排齐牙列，上前牙适度内收" → "排齐上颌牙列"、"排齐下颌牙列"、"内收上前牙"
-- "双颌扩弓，前牙原地排齐（考虑到患者鼻唇角较小），末端回弯。" → "双颌扩弓"、"排齐上颌牙列"、"末端回弯"
-- "左侧III类牵引配合推磨牙（考虑到下颌中线右偏），纠正左侧磨牙近中关系。" → "左侧III类牵引"、"推磨牙"、"纠正左侧磨牙近中关系"
-- "压低上前牙纠正深覆合（考虑到ahead牙位置较上唇较高）" → "压低ahead牙"、"纠正深覆合"
-- "斜行牵引纠正中线" → "斜行牵引"、"纠正中线"
-- "下颌推磨牙向后纠正磨牙关系，配合扩弓排齐牙列" → "下颌推磨牙向后"、"纠正磨牙关系"、"配合扩弓"、"排齐牙列"
-- "压低下前牙，尝试改善下颌角" → "压低下前牙"、"尝试改善下颌角"
-- "利用现有间隙内收上下牙列关闭现有间隙" → "内收上下牙列"、"关闭现有间隙"
-- "建立后牙稳定咬合关系及正常符合覆盖" → "建立后牙稳定咬合关系"
-- "上颌少量扩弓，改善宽度不调" → "上颌扩弓"、"改善宽度不调"
-- "下颌少量片切解除拥挤" → "下颌片切"、"解除拥挤"
-- "压低下前牙整平牙列打开咬合" → "压低下前牙"、"整平牙列"、"打开咬合"
-- "推双侧磨牙向远中" → "推双侧磨牙向远中"
-- "利用上述间隙排齐牙齿，压低并内收上下前牙" → "排齐牙齿"、"压低ahead牙"、"压低下前牙"、"内收ahead牙"、"内收下前牙"
-- "右侧适度推磨牙向后改善磨牙与尖牙关系" → "右侧推磨牙向后"、"改善磨牙关系"、"改善尖牙关系"
-- "交互牵引解除右侧后牙正锁合" → "交互牵引"、"解除右侧后牙正锁合"
-- "36酌情树脂或全冠修复" → "36全冠修复"、"36树脂修复"
-
-请将以下治疗计划拆分为标准化的诊疗动作：
-[这里是诊疗方案]
-"""
-def standardize_actions_with_llm(treatment_plan: str, action_library: List[str]) -> List[str]:
-    """使用LLM标准化诊疗动作（模拟实现）"""
-    # 这里是一个简化的实现，实际项目中应该调用真实的LLM API
-    standardized = []
-    action_library_text = "\n".join(action_library)
-    prompt = standardize_actions_prompt
-    prompt  = prompt.replace("[这里是标准诊疗动作库]", action_library_text)
-    prompt = prompt.replace("[这里是诊疗方案]", treatment_plan)
-    standardized.extend(call_llm(prompt, test_mode=False).split('\n'))
-
-    # 去重并保持顺序
-    seen = set()
-    result = []
-    for action in standardized:
-        if action not in seen:
-            seen.add(action)
-            result.append(action)
-    
-    return result
+# ---- 请求指标与追踪 ----
+
+metrics.register_collector("llm", llm_client.get_stats)
+metrics.register_collector("llm_cache", llm_cache.get_stats)
+metrics.register_collector("patient_index", patient_index.get_stats)
+metrics.register_collector("library", library_index.get_stats)
+metrics.register_collector("prefetch", prefetcher.get_stats)
+metrics.register_collector("jobs", job_queue.get_stats)
+metrics.register_collector("backups", backups.backup_manager.get_stats)
+metrics.register_collector("warmup", warmup.get_stats)
+# 各患者的规则命中报告不作为指标
+metrics.register_collector("rules", lambda: {k: v for k, v in rule_standardizer.get_stats().items() if k != "recent"})
+
+@app.before_request
+def start_request_metrics():
+    """开始计时，开启追踪时以请求头 X-Trace-Id（没有则新生成）开始根 span"""
+    metrics.start_writer()
+    request.metrics_start = time.perf_counter()
+    request.trace_span = metrics.span("http_request", trace_id=request.headers.get("X-Trace-Id"),
+                                      method=request.method, path=request.path).__enter__()
+
+@app.after_request
+def record_request_metrics(response):
+    """响应发送完毕（含流式响应）后记录耗时并结束根 span"""
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    method, status, start = request.method, response.status_code, request.metrics_start
+    trace = request.trace_span
+    trace.detach()
+    if hasattr(trace, "span_id"):
+        response.headers["X-Trace-Id"] = trace.trace_id
+
+    def finish():
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=method, route=route, status=status)
+        if hasattr(trace, "span_id"):
+            trace.finish(route=route, status=status)
+
+    response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def detach_request_span(error=None):
+    trace = getattr(request, "trace_span", None)
+    if trace is not None:
+        trace.detach()
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 文本格式的指标（多进程部署时合并各进程）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def get_ready():
+    """就绪检查：患者索引和动作库可用时返回 200，后台预热尚未完成时返回 503"""
+    status = warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+def start_warmup():
+    """启动服务前在后台预热索引（STARTUP_WARMUP = "lazy" 时由第一个请求建立）"""
+    if STARTUP_WARMUP == "background":
+        warmup.start()
 
 @app.route('/')
 def index():
     """主页面"""
     return render_template('index.html')
 
+PATIENT_QUERY_PARAMS = ('limit', 'cursor', 'start', 'before', 'status', 'has_links', 'modified_since', 'prefix')
+PATIENT_STATUSES = (STATUS_UNANNOTATED, STATUS_AUTO_GENERATED, STATUS_ANNOTATED)
+
+def parse_timestamp(value: str) -> float:
+    """解析秒级时间戳或ISO格式时间"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
 @app.route('/api/patients')
 def get_patients():
-    """获取所有患者ID列表"""
+    """获取患者ID列表
+
+    不带参数时返回全部ID；带 limit/cursor/status 等参数时分页返回，并附带各状态数量。
+    """
     try:
-        patient_files = [f for f in os.listdir(PATIENTS_DIR) if f.endswith('.txt')]
-        patient_ids = [os.path.splitext(f)[0] for f in patient_files]
-        return jsonify({"patients": sorted(patient_ids)})
+        if not any(param in request.args for param in PATIENT_QUERY_PARAMS):
+            return jsonify({"patients": patient_index.patient_ids()})
+        
+        status = request.args.get('status') or None
+        if status and status not in PATIENT_STATUSES:
+            raise ValueError(f"未知的标注状态: {status}")
+        has_links = request.args.get('has_links')
+        if has_links is not None:
+            has_links = has_links.lower() == 'true'
+        modified_since = request.args.get('modified_since')
+        if modified_since:
+            modified_since = parse_timestamp(modified_since)
+        
+        result = patient_index.query(
+            status=status,
+            has_links=has_links,
+            modified_since=modified_since or None,
+            prefix=request.args.get('prefix') or None,
+            cursor=request.args.get('cursor') or None,
+            start=request.args.get('start') or None,
+            before=request.args.get('before') or None,
+            limit=int(request.args.get('limit', 100))
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": f"参数错误: {str(e)}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -296,30 +168,9 @@ def get_patients():
 def get_last_edited_patient():
     """获取最近编辑的患者ID"""
     try:
-        # 查找最近修改的标注文件
-        if not os.path.exists(ANNOTATIONS_DIR):
-            return jsonify({"patient_id": None})
-        
-        annotation_files = [f for f in os.listdir(ANNOTATIONS_DIR) if f.endswith('.json')]
-        if not annotation_files:
-            return jsonify({"patient_id": None})
-        
-        # 按修改时间排序，获取最近修改的文件
-        annotation_files_with_time = []
-        for f in annotation_files:
-            file_path = os.path.join(ANNOTATIONS_DIR, f)
-            mtime = os.path.getmtime(file_path)
-            patient_id = os.path.splitext(f)[0]
-            annotation_files_with_time.append((patient_id, mtime))
-        
-        # 按修改时间降序排序
-        annotation_files_with_time.sort(key=lambda x: x[1], reverse=True)
-        
-        # 返回最近修改的患者ID
-        latest_patient_id = annotation_files_with_time[0][0]
-        return jsonify({"patient_id": latest_patient_id})
-        
-    except Exception as e:
+        # 由患者索引直接给出最近修改标注的患者
+        return jsonify({"patient_id": patient_index.last_edited()})
+    except Exception:
         return jsonify({"patient_id": None})
 
 @app.route('/api/patient/<patient_id>')
@@ -329,31 +180,24 @@ def get_patient_data(patient_id):
         # 检查是否强制重新生成
         force_regenerate = request.args.get('force_regenerate', 'false').lower() == 'true'
         
-        # 读取病历文件
-        patient_file = os.path.join(PATIENTS_DIR, f"{patient_id}.txt")
-        if not os.path.exists(patient_file):
+        # 读取并解析病历（带缓存）
+        parsed_data = patient_index.get_parsed(patient_id)
+        if parsed_data is None:
             return jsonify({"error": "患者文件不存在"}), 404
         
-        with open(patient_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 解析病历
-        parsed_data = parse_patient_file(content)
-        
-        # 检查是否存在已保存的标注文件
-        annotation_file = os.path.join(ANNOTATIONS_DIR, f"{patient_id}.json")
+        # 检查是否存在已保存的标注（强制重新生成时也需要当前修订号）
+        annotation_data = annotation_store.load(patient_id)
+        revision = annotation_data.get("revision", 0) if annotation_data else 0
+        next_action_id = next_action_number(annotation_data) if annotation_data else 0
         annotations = {}
         solutions = []
         has_saved_data = False
         
-        # 如果不是强制重新生成，且存在标注文件，直接使用其中的数据
-        if not force_regenerate and os.path.exists(annotation_file):
-            # 如果存在标注文件，直接使用其中的数据
-            with open(annotation_file, 'r', encoding='utf-8') as f:
-                annotation_data = json.load(f)
-                annotations = annotation_data.get("annotations", {})
-                solutions = annotation_data.get("solutions", [])
-                has_saved_data = True
+        # 如果不是强制重新生成，且存在标注，直接使用其中的数据
+        if annotation_data is not None and not force_regenerate:
+            annotations = annotation_data.get("annotations", {})
+            solutions = annotation_data.get("solutions", [])
+            has_saved_data = True
                 
             print(f"加载已保存的患者数据: {patient_id}, 包含 {len(solutions)} 个诊疗动作")
         elif force_regenerate:
@@ -366,7 +210,12 @@ def get_patient_data(patient_id):
             "solutions": solutions,
             "annotations": annotations,
             "original_treatment_plan": parsed_data["treatment_plan"],
-            "has_saved_data": has_saved_data  # 标识是否有已保存的数据
+            "has_saved_data": has_saved_data,  # 标识是否有已保存的数据
+            "revision": revision,  # 增量保存时作为 base_revision
+            "next_action_id": next_action_id,  # 客户端新建动作时从该编号开始分配ID
+            "active_job": job_queue.active_job(patient_id),  # 进行中的生成任务，页面刷新后据此重新订阅
+            # 根据历史标注推荐的关联（强制重新生成时动作会被替换，不推荐）
+            "suggestions": cooccurrence.suggest_links(parsed_data, annotation_data) if has_saved_data else []
         })
         
     except Exception as e:
@@ -393,39 +242,22 @@ def save_annotations(patient_id):
         # 验证数据
         validate_patient_data(annotation_data)
         
-        # 保存标注文件
-        annotation_file = os.path.join(ANNOTATIONS_DIR, f"{patient_id}.json")
-        
-        # 如果文件已存在，创建备份
-        if os.path.exists(annotation_file):
-            with open(annotation_file, 'r', encoding='utf-8') as f:
-                old_data = json.load(f)
-            create_backup(annotation_file, old_data)
-        
-        # 保存新数据
-        with open(annotation_file, 'w', encoding='utf-8') as f:
-            json.dump(annotation_data, f, ensure_ascii=False, indent=2)
+        # 保存新数据（JSON后端先备份旧文件，SQLite后端记录差异修订）
+        revision = annotation_store.save(patient_id, annotation_data)
+        patient_index.update_annotation(patient_id, annotation_data)
+        prefetcher.discard(patient_id)
         
         # 更新动作库
-        action_library = load_action_library()
         new_actions = [sol["text"] for sol in data.get("solutions", [])]
-        
-        # 合并新动作到库中
-        updated = False
-        for action in new_actions:
-            if action not in action_library:
-                action_library.append(action)
-                updated = True
-        
-        if updated:
-            save_action_library(action_library)
+        library_index.add_actions(new_actions)
         
         logging.info(f"保存患者 {patient_id} 标注成功，包含 {len(annotation_data['solutions'])} 个动作")
         
         return jsonify({
             "success": True, 
             "message": "标注保存成功",
-            "saved_actions": len(annotation_data['solutions'])
+            "saved_actions": len(annotation_data['solutions']),
+            "revision": revision
         })
         
     except ValueError as e:
@@ -435,6 +267,59 @@ def save_annotations(patient_id):
         logging.error(f"保存标注失败: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/patient/<patient_id>/annotations', methods=['PATCH'])
+def patch_annotations(patient_id):
+    """按操作列表增量修改标注，base_revision 与当前修订不一致时返回 409"""
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get("ops"), list):
+            return jsonify({"error": "缺少操作列表 ops"}), 400
+        base_revision = data.get("base_revision")
+        
+        with annotation_store.lock(patient_id):
+            annotation_data = annotation_store.load(patient_id) or {
+                "patient_id": patient_id,
+                "annotations": {},
+                "solutions": []
+            }
+            current_revision = annotation_data.get("revision", 0)
+            if base_revision is not None and base_revision != current_revision:
+                # 由客户端基于最新数据重放操作后重试
+                return jsonify({
+                    "error": "标注已被其他人修改",
+                    "revision": current_revision,
+                    "annotations": annotation_data.get("annotations", {}),
+                    "solutions": annotation_data.get("solutions", []),
+                    "next_action_id": next_action_number(annotation_data)
+                }), 409
+            
+            new_texts, id_map = apply_annotation_ops(annotation_data, data["ops"])
+            annotation_data.pop("auto_generated", None)  # 已经过人工修改
+            annotation_data["last_modified"] = datetime.now().isoformat()
+            validate_patient_data(annotation_data)
+            
+            revision = annotation_store.save(patient_id, annotation_data, source="patch")
+            patient_index.update_annotation(patient_id, annotation_data)
+            prefetcher.discard(patient_id)
+        
+        # 只把新增或改名的动作合并进动作库
+        library_index.add_actions(new_texts)
+        
+        return jsonify({
+            "success": True,
+            "revision": revision,
+            "applied_ops": len(data["ops"]),
+            "id_map": id_map,  # 与他人冲突而重新分配的动作ID
+            "next_action_id": next_action_number(annotation_data)
+        })
+        
+    except ValueError as e:
+        logging.error(f"增量保存失败: {e}")
+        return jsonify({"error": f"数据验证失败: {str(e)}"}), 400
+    except Exception as e:
+        logging.error(f"增量保存失败: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/action/add/<patient_id>', methods=['POST'])
 def add_new_action(patient_id):
     """为指定患者添加新的诊疗动作"""
@@ -445,36 +330,33 @@ def add_new_action(patient_id):
         if not action_text:
             return jsonify({"error": "动作文本不能为空"}), 400
         
-        # 加载现有标注文件
-        annotation_file = os.path.join(ANNOTATIONS_DIR, f"{patient_id}.json")
-        if os.path.exists(annotation_file):
-            with open(annotation_file, 'r', encoding='utf-8') as f:
-                annotation_data = json.load(f)
-        else:
-            annotation_data = {
-                "patient_id": patient_id,
-                "annotations": {},
-                "solutions": []
-            }
+        # 持有该患者的锁完成读-改-写，避免并发添加互相覆盖
+        with annotation_store.lock(patient_id):
+            # 加载现有标注
+            annotation_data = annotation_store.load(patient_id)
+            if annotation_data is None:
+                annotation_data = {
+                    "patient_id": patient_id,
+                    "annotations": {},
+                    "solutions": []
+                }
         
-        # 添加新动作
-        new_action_id = f"action-{len(annotation_data['solutions'])}"
-        new_action = {
-            "id": new_action_id,
-            "text": action_text
-        }
+            # 添加新动作
+            new_action_id = allocate_action_id(annotation_data)
+            new_action = {
+                "id": new_action_id,
+                "text": action_text
+            }
         
-        annotation_data['solutions'].append(new_action)
+            annotation_data['solutions'].append(new_action)
         
-        # 保存文件
-        with open(annotation_file, 'w', encoding='utf-8') as f:
-            json.dump(annotation_data, f, ensure_ascii=False, indent=2)
+            # 保存
+            annotation_store.save(patient_id, annotation_data, source="add")
+            patient_index.update_annotation(patient_id, annotation_data)
+            prefetcher.discard(patient_id)
         
         # 更新动作库
-        action_library = load_action_library()
-        if action_text not in action_library:
-            action_library.append(action_text)
-            save_action_library(action_library)
+        library_index.add_actions([action_text])
         
         return jsonify({
             "success": True,
@@ -489,28 +371,19 @@ def add_new_action(patient_id):
 def delete_action(patient_id, action_id):
     """删除指定患者的诊疗动作"""
     try:
-        # 加载现有标注文件
-        annotation_file = os.path.join(ANNOTATIONS_DIR, f"{patient_id}.json")
-        if not os.path.exists(annotation_file):
-            return jsonify({"error": "标注文件不存在"}), 404
-            
-        with open(annotation_file, 'r', encoding='utf-8') as f:
-            annotation_data = json.load(f)
-        
-        # 删除solutions中的动作
-        solutions = annotation_data.get("solutions", [])
-        solutions = [s for s in solutions if s["id"] != action_id]
-        annotation_data["solutions"] = solutions
+        with annotation_store.lock(patient_id):
+            # 加载现有标注
+            annotation_data = annotation_store.load(patient_id)
+            if annotation_data is None:
+                return jsonify({"error": "标注文件不存在"}), 404
         
-        # 删除相关的标注链接
-        annotations = annotation_data.get("annotations", {})
-        if action_id in annotations:
-            del annotations[action_id]
-        annotation_data["annotations"] = annotations
+            # 删除动作及相关的标注链接
+            apply_annotation_ops(annotation_data, [{"op": "delete_action", "action_id": action_id}])
         
-        # 保存文件
-        with open(annotation_file, 'w', encoding='utf-8') as f:
-            json.dump(annotation_data, f, ensure_ascii=False, indent=2)
+            # 保存
+            annotation_store.save(patient_id, annotation_data, source="delete")
+            patient_index.update_annotation(patient_id, annotation_data)
+            prefetcher.discard(patient_id)
         
         return jsonify({
             "success": True,
@@ -520,124 +393,328 @@ def delete_action(patient_id, action_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/patient/<patient_id>/backups')
+def list_patient_backups(patient_id):
+    """列出患者保留的历史版本（JSON 后端为备份文件，SQLite 后端为差异修订），从新到旧"""
+    try:
+        return jsonify({
+            "patient_id": patient_id,
+            "backend": annotation_store.name,
+            "versions": backups.list_versions(annotation_store, patient_id)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patient/<patient_id>/backups/<version_id>')
+def get_patient_backup(patient_id, version_id):
+    """查看某个历史版本的标注数据"""
+    try:
+        data = backups.load_version(annotation_store, patient_id, version_id)
+        if data is None:
+            return jsonify({"error": "版本不存在"}), 404
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patient/<patient_id>/backups/<version_id>/restore', methods=['POST'])
+def restore_patient_backup(patient_id, version_id):
+    """恢复到某个历史版本（当前内容先备份，恢复也可撤销）"""
+    try:
+        with annotation_store.lock(patient_id):
+            data = backups.load_version(annotation_store, patient_id, version_id)
+            if data is None:
+                return jsonify({"error": "版本不存在"}), 404
+            annotation_data = {k: v for k, v in data.items() if k != "revision"}
+            annotation_data["patient_id"] = patient_id
+            annotation_data["last_modified"] = datetime.now().isoformat()
+            validate_patient_data(annotation_data)
+            revision = annotation_store.save(patient_id, annotation_data, source="restore")
+            patient_index.update_annotation(patient_id, annotation_data)
+            prefetcher.discard(patient_id)
+        
+        library_index.add_actions([sol["text"] for sol in annotation_data.get("solutions", [])])
+        logging.info(f"患者 {patient_id} 恢复到版本 {version_id}")
+        
+        return jsonify({
+            "success": True,
+            "restored": version_id,
+            "revision": revision
+        })
+    except ValueError as e:
+        return jsonify({"error": f"数据验证失败: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/patient/<patient_id>/stream-actions')
 def stream_actions(patient_id):
     """流式生成诊疗动作"""
+    # 显式跳过LLM响应缓存
+    bypass_cache = request.args.get('bypass_cache', 'false').lower() == 'true'
+    # 按分句并行生成（默认取 config.LLM_FANOUT）
+    fanout = request.args.get('fanout', str(LLM_FANOUT)).lower() == 'true'
+    # 先用规则匹配能确定的行，只把剩余部分交给LLM（默认取 config.RULE_STANDARDIZER）
+    use_rules = request.args.get('rules', str(RULE_STANDARDIZER)).lower() == 'true'
+    
+    # 读取并解析病历（带缓存）
+    parsed_data = patient_index.get_parsed(patient_id)
+    if parsed_data is None:
+        error = {'error': '患者文件不存在'}
+    elif not parsed_data["treatment_plan"].strip():
+        error = {'error': '没有找到诊疗方案'}
+    else:
+        error = None
+    
+    after = resume_position()
+    
     def generate():
+        if error:
+            yield f"data: {json.dumps(error)}\n\n"
+            return
         try:
-            # 读取病历文件
-            patient_file = os.path.join(PATIENTS_DIR, f"{patient_id}.txt")
-            if not os.path.exists(patient_file):
-                yield f"data: {json.dumps({'error': '患者文件不存在'})}\n\n"
-                return
-            
-            with open(patient_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 解析病历
-            parsed_data = parse_patient_file(content)
-            raw_actions = parsed_data["treatment_plan"]
-            
-            if not raw_actions.strip():
-                yield f"data: {json.dumps({'error': '没有找到诊疗方案'})}\n\n"
-                return
-            
-            # 准备LLM提示
-            action_library = load_action_library()
-            action_library_text = "\n".join(action_library)
-            prompt = standardize_actions_prompt
-            prompt = prompt.replace("[这里是标准诊疗动作库]", action_library_text)
-            prompt = prompt.replace("[这里是诊疗方案]", raw_actions)
-            
-            # 首先发送开始信号
-            yield f"data: {json.dumps({'type': 'start', 'original_plan': raw_actions})}\n\n"
-            time.sleep(0.3)
-            
-            # 获取完整的LLM响应
-            try:
-                full_response = call_llm(prompt)
-                lines = full_response.split('\n')
-                
-                # 过滤和标准化动作
-                actions = []
-                for line in lines:
-                    line = line.strip()
-                    # 过滤掉空行、标题行、说明行等
-                    if (line and 
-                        not line.startswith('**') and 
-                        not line.startswith('##') and 
-                        not line.startswith('-') and
-                        not line.startswith('以下') and
-                        not line.startswith('标准') and
-                        not line.startswith('请') and
-                        len(line) > 2 and
-                        len(line) < 100):  # 合理的长度范围
-                        actions.append(line)
-                
-                # 流式发送每个动作
-                for i, action in enumerate(actions):
-                    action_data = {
-                        'type': 'action',
-                        'text': action,
-                        'id': f"action-{i}"
-                    }
-                    yield f"data: {json.dumps(action_data)}\n\n"
-                    time.sleep(0.5)  # 控制动画速度
-                
-                # 自动保存生成的结果
-                solutions = [{"id": f"action-{i}", "text": action} for i, action in enumerate(actions)]
-                annotation_data = {
-                    "patient_id": patient_id,
-                    "annotations": {},
-                    "solutions": solutions,
-                    "auto_generated": True,
-                    "generated_time": time.time()
-                }
-                
-                annotation_file = os.path.join(ANNOTATIONS_DIR, f"{patient_id}.json")
-                with open(annotation_file, 'w', encoding='utf-8') as f:
-                    json.dump(annotation_data, f, ensure_ascii=False, indent=2)
-                
-                # 更新动作库
-                action_library = load_action_library()
-                for action in actions:
-                    if action not in action_library:
-                        action_library.append(action)
-                save_action_library(action_library)
-                
-                print(f"流式生成完成并自动保存: {patient_id}, {len(actions)} 个动作")
-                
-                # 发送完成信号
-                yield f"data: {json.dumps({'type': 'complete', 'actions': actions, 'auto_saved': True})}\n\n"
-                
-            except Exception as llm_error:
-                print(f"LLM处理错误: {llm_error}")
-                # 使用默认动作作为备用
-                default_actions = [
-                    "排齐牙列",
-                    "解除拥挤", 
-                    "调整咬合",
-                    "正畸保持"
-                ]
-                
-                for i, action in enumerate(default_actions):
-                    action_data = {
-                        'type': 'action',
-                        'text': action,
-                        'id': f"action-{i}"
-                    }
-                    yield f"data: {json.dumps(action_data)}\n\n"
-                    time.sleep(0.5)
-                
-                yield f"data: {json.dumps({'type': 'complete', 'actions': default_actions})}\n\n"
-            
+            # 生成在后台任务中进行，客户端断开后仍会完成并保存；同一患者进行中的任务直接复用
+            job_id = job_queue.submit(patient_id, bypass_cache=bypass_cache, fanout=fanout, use_rules=use_rules)
+            yield from relay_job_events(job_id, after)
         except Exception as e:
             print(f"流式处理错误: {e}")
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
     
-    return Response(generate(), mimetype='text/event-stream', 
+    return event_stream(generate())
+
+def event_stream(events):
+    """SSE 响应"""
+    # Connection 是逐跳头部，WSGI 应用不能设置（waitress 会拒绝）；由服务器负责保持连接
+    return Response(events, mimetype='text/event-stream', 
                    headers={'Cache-Control': 'no-cache',
-                           'Connection': 'keep-alive'})
+                           'X-Accel-Buffering': 'no'})
+
+def resume_position() -> int:
+    """断线重连时从哪个事件开始：Last-Event-ID 之后，或参数 after 指定的序号"""
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        return int(last_event_id) + 1
+    return max(request.args.get('after', 0, type=int), 0)
+
+def relay_job_events(job_id, after: int = 0):
+    """转发任务事件，带序号以便 EventSource 断线重连时从断点继续"""
+    for item in job_queue.follow(job_id, after=after):
+        if item is None:
+            # 心跳，避免代理在LLM响应较慢时断开连接
+            yield ": keepalive\n\n"
+        else:
+            index, event = item
+            yield f"id: {index}\ndata: {json.dumps(event)}\n\n"
+
+@app.route('/api/patient/<patient_id>/jobs', methods=['POST'])
+def submit_generation_job(patient_id):
+    """提交后台生成任务（该患者已有进行中的任务时返回该任务），返回任务ID"""
+    if patient_index.get_entry(patient_id) is None:
+        return jsonify({"error": "患者文件不存在"}), 404
+    bypass_cache = request.args.get('bypass_cache', 'false').lower() == 'true'
+    fanout = request.args.get('fanout', str(LLM_FANOUT)).lower() == 'true'
+    use_rules = request.args.get('rules', str(RULE_STANDARDIZER)).lower() == 'true'
+    job_id = job_queue.submit(patient_id, bypass_cache=bypass_cache, fanout=fanout, use_rules=use_rules)
+    job = job_queue.wait(job_id)
+    job.pop("events", None)
+    return jsonify(job), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """任务状态；带 after 时附带该序号之后的事件，带 wait 时长轮询最多 wait 秒"""
+    try:
+        after = request.args.get('after', type=int)
+        wait = min(request.args.get('wait', 0, type=float), 60)
+        job = job_queue.wait(job_id, after=after or 0, timeout=wait)
+        if job is None:
+            return jsonify({"error": "任务不存在"}), 404
+        if after is None:
+            job.pop("events", None)
+        return jsonify(job)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/events')
+def get_job_events(job_id):
+    """以 SSE 推送任务事件（从头重放或从 Last-Event-ID 之后继续）"""
+    if job_queue.load(job_id) is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return event_stream(relay_job_events(job_id, resume_position()))
+
+@app.route('/api/jobs/stats')
+def get_job_stats():
+    """获取后台生成任务的数量和状态"""
+    return jsonify(job_queue.get_stats())
+
+@app.route('/api/analytics/top-actions')
+def get_top_actions():
+    """与问题共现最强的诊疗动作：?problem=上牙列中度拥挤&metric=lift&top=10&min_count=1"""
+    if not load_analytics_dependencies():
+        return jsonify({"error": MISSING_DEPENDENCY}), 501
+    try:
+        problem = request.args.get('problem', '').strip()
+        if not problem:
+            raise ValueError("缺少参数 problem")
+        result = cooccurrence.top_actions(problem,
+                                          top=request.args.get('top', 10, type=int),
+                                          metric=request.args.get('metric', 'lift'),
+                                          min_count=request.args.get('min_count', 1, type=int))
+        if result is None:
+            return jsonify({"error": f"没有关联过的问题: {problem}",
+                            "suggestions": cooccurrence.find_problems(problem)}), 404
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": f"参数错误: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analytics/pairs')
+def get_top_pairs():
+    """全库共现最强的问题-动作组合：?metric=lift&top=20&min_count=5"""
+    if not load_analytics_dependencies():
+        return jsonify({"error": MISSING_DEPENDENCY}), 501
+    try:
+        return jsonify(cooccurrence.top_pairs(top=request.args.get('top', 20, type=int),
+                                              metric=request.args.get('metric', 'lift'),
+                                              min_count=request.args.get('min_count', 5, type=int)))
+    except ValueError as e:
+        return jsonify({"error": f"参数错误: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analytics/refresh', methods=['POST'])
+def refresh_analytics():
+    """立即同步全部标注修改并写入统计缓存"""
+    if not load_analytics_dependencies():
+        return jsonify({"error": MISSING_DEPENDENCY}), 501
+    cooccurrence.refresh()
+    return jsonify(cooccurrence.get_stats())
+
+@app.route('/api/analytics/stats')
+def get_analytics_stats():
+    """获取共现矩阵的规模、构建耗时和增量更新次数"""
+    return jsonify(cooccurrence.get_stats())
+
+@app.route('/api/export')
+def export_annotations():
+    """流式导出标注（训练数据），?since= 只导出该修改时间之后的患者，响应头 X-Export-Cursor 为下次的 since"""
+    try:
+        fmt = request.args.get('format', 'jsonl')
+        if fmt not in export.FORMATS:
+            raise ValueError(f"未知的导出格式: {fmt}")
+        since = request.args.get('since', type=int)
+        workers = min(request.args.get('workers', export.EXPORT_HTTP_WORKERS, type=int), export.EXPORT_WORKERS)
+    except ValueError as e:
+        return jsonify({"error": f"参数错误: {str(e)}"}), 400
+    if fmt == 'parquet' and not export.load_dependencies():
+        return jsonify({"error": export.MISSING_DEPENDENCY}), 501
+    items, cursor = export.select_patients(since)
+    mimetype = 'application/vnd.apache.parquet' if fmt == 'parquet' else 'application/x-ndjson'
+    return Response(export.stream_export(items, fmt, workers), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=annotations.{fmt}',
+        'X-Export-Cursor': str(cursor),
+        'X-Export-Patients': str(len(items)),
+    })
+
+@app.route('/api/import', methods=['POST'])
+def import_patients():
+    """批量导入病历：multipart 文件字段 file（可多个）或请求体（归档或多患者文本）
+
+    参数 replace、allow_errors、dry_run 同命令行；返回统计和前 IMPORT_MAX_ERRORS 条错误。
+    """
+    flag = lambda name: request.args.get(name, 'false').lower() == 'true'
+    patient_importer = importer.PatientImporter(replace=flag('replace'), allow_errors=flag('allow_errors'),
+                                                dry_run=flag('dry_run'))
+    try:
+        uploads = request.files.getlist('file')
+        if uploads:
+            for upload in uploads:
+                patient_importer.import_stream(upload.stream, upload.filename or 'upload')
+        else:
+            # zip 需要随机读取：请求体先写入临时文件（小文件留在内存中）
+            with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as body:
+                shutil.copyfileobj(request.stream, body)
+                body.seek(0)
+                patient_importer.import_stream(body, request.args.get('name', 'upload'))
+    except (OSError, zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        result = patient_importer.finish()
+        return jsonify({**result, "error": f"无法读取上传的文件: {e}"}), 400
+    result = patient_importer.finish()
+    print(f"批量导入病历: {result['records']} 名患者，新增 {result['created']}，更新 {result['updated']}，"
+          f"拒绝 {result['rejected']}")
+    return jsonify(result)
+
+@app.route('/api/llm/stats')
+def get_llm_stats():
+    """获取LLM客户端的调用、重试和熔断状态"""
+    return jsonify(llm_client.get_stats())
+
+@app.route('/api/prefetch/<patient_id>', methods=['POST'])
+def prefetch_next_patients(patient_id):
+    """打开患者后调用：在后台预取标注员列表（相同筛选条件）中的后续患者"""
+    try:
+        status = request.args.get('status') or None
+        if status and status not in PATIENT_STATUSES:
+            raise ValueError(f"未知的标注状态: {status}")
+        has_links = request.args.get('has_links')
+        if has_links is not None:
+            has_links = has_links.lower() == 'true'
+        scheduled = prefetcher.warm_after(patient_id, status=status, has_links=has_links)
+        return jsonify({"success": True, "scheduled": scheduled})
+    except ValueError as e:
+        return jsonify({"error": f"参数错误: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/prefetch/stats')
+def get_prefetch_stats():
+    """获取后台预取的数量和命中率"""
+    return jsonify(prefetcher.get_stats())
+
+@app.route('/api/rules/stats')
+def get_rule_stats():
+    """获取规则预标准化的命中率和估算节省的LLM耗时"""
+    return jsonify(rule_standardizer.get_stats())
+
+@app.route('/api/llm-cache/stats')
+def get_llm_cache_stats():
+    """获取LLM响应缓存的命中统计"""
+    return jsonify(llm_cache.get_stats())
+
+@app.route('/api/llm-cache/clear', methods=['POST'])
+def clear_llm_cache():
+    """清空LLM响应缓存"""
+    try:
+        llm_cache.clear()
+        return jsonify({"success": True, "message": "缓存已清空"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'precompute':
+        # 批量预生成模式: python app.py precompute [选项]
+        from precompute import main as precompute_main
+        sys.exit(precompute_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate-sqlite':
+        # 将JSON标注和备份迁移到SQLite: python app.py migrate-sqlite
+        from annotation_store import main as migrate_main
+        sys.exit(migrate_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'repair-ids':
+        # 修复重复的动作ID: python app.py repair-ids [--dry-run]
+        from annotation_store import repair_main
+        sys.exit(repair_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        # 导出训练数据: python app.py export --output out.jsonl [--incremental]
+        sys.exit(export.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        # 批量导入病历: python app.py import archive.zip [--replace] [--dry-run]
+        sys.exit(importer.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'backups':
+        # 整理或查看备份: python app.py backups compact [--dry-run] / backups list [患者ID]
+        sys.exit(backups.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        # 多进程生产服务器: python app.py serve [--workers N] [--threads N]
+        from server import main as serve_main
+        sys.exit(serve_main(sys.argv[2:]))
+    # 调试模式下重载器的父进程只负责监视文件，由子进程提供服务
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
     app.run(debug=True, host='127.0.0.1', port=5000)
@@ -0,0 +1,344 @@
+"""标注备份：去重、合并、分级保留与压缩
+
+JSON 存储后端覆盖标注前把旧内容写入 data/backups/<患者ID>.json_<时间>_<哈希>.bak，以下情况跳过：
+- 内容与该患者最近一份备份相同（忽略 revision、last_modified 等每次保存都会变化的字段）
+- 距最近一份备份不足 BACKUP_COALESCE_SECONDS 秒（一段连续编辑只保留编辑前的状态；恢复操作不受此限制）
+
+后台整理（每个进程首次备份后每 BACKUP_COMPACT_INTERVAL 秒一次，或 python app.py backups compact）：
+- 删除与前一份内容相同、或落在合并窗口内的备份（包括旧版本留下的重复备份）
+- 按 BACKUP_RETENTION 分级保留：默认最近 1 小时全部保留，1 天内每小时一份，30 天内每天一份，更早的删除；
+  每名患者至少保留最近的 BACKUP_KEEP_LATEST 份
+- 超过 BACKUP_COMPRESS_AFTER 秒的备份压缩为 .bak.gz
+
+GET /api/patient/<id>/backups 列出保留的版本，POST /api/patient/<id>/backups/<版本>/restore 恢复；
+SQLite 后端没有备份文件，列出和恢复的是差异修订。
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+
+import config
+from metrics import IO_SECONDS
+from storage import BACKUP_DIR, write_text_atomic, file_lock
+
+BACKUP_COALESCE_SECONDS = getattr(config, "BACKUP_COALESCE_SECONDS", 60)
+# [(最大年龄秒数, 保留间隔秒数)]，间隔为 0 表示全部保留；超过最后一级的删除
+BACKUP_RETENTION = getattr(config, "BACKUP_RETENTION", [(3600, 0), (86400, 3600), (30 * 86400, 86400)])
+BACKUP_KEEP_LATEST = getattr(config, "BACKUP_KEEP_LATEST", 1)
+BACKUP_COMPRESS_AFTER = getattr(config, "BACKUP_COMPRESS_AFTER", 86400)
+BACKUP_COMPACT_INTERVAL = getattr(config, "BACKUP_COMPACT_INTERVAL", 3600)
+# 计算内容哈希时忽略的字段（每次保存都会变化）
+VOLATILE_FIELDS = ("revision", "last_modified", "generated_time")
+
+# 旧版本的文件名没有微秒和哈希：00001.json_20250817_220133.bak
+BACKUP_NAME_PATTERN = re.compile(
+    r"^(?P<name>.+\.json)_(?P<stamp>\d{8}_\d{6}(?:_\d{6})?)(?:_(?P<hash>[0-9a-f]{12}))?\.bak(?P<gz>\.gz)?$")
+
+def content_hash(content: Any) -> str:
+    """备份内容的哈希（JSON 按键排序，忽略易变字段）"""
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except ValueError:
+            return hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    if isinstance(content, dict):
+        content = {k: v for k, v in content.items() if k not in VOLATILE_FIELDS}
+    text = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+def parse_backup_name(file_name: str) -> Optional[Dict[str, Any]]:
+    match = BACKUP_NAME_PATTERN.match(file_name)
+    if not match:
+        return None
+    stamp = match.group("stamp")
+    fmt = "%Y%m%d_%H%M%S_%f" if len(stamp) > 15 else "%Y%m%d_%H%M%S"
+    return {
+        "file": file_name,
+        "name": match.group("name"),
+        "id": stamp,
+        "time": datetime.strptime(stamp, fmt).timestamp(),
+        "hash": match.group("hash"),
+        "compressed": bool(match.group("gz")),
+    }
+
+def read_backup(path: str) -> Any:
+    """读取备份（.bak 或 .bak.gz）"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> Dict[str, List[Dict[str, Any]]]:
+    """{文件名: [备份，按时间排序]}"""
+    backups: Dict[str, List[Dict[str, Any]]] = {}
+    try:
+        names = os.listdir(backup_dir)
+    except FileNotFoundError:
+        return backups
+    for file_name in names:
+        entry = parse_backup_name(file_name)
+        if entry is not None:
+            entry["path"] = os.path.join(backup_dir, file_name)
+            backups.setdefault(entry["name"], []).append(entry)
+    for entries in backups.values():
+        entries.sort(key=lambda entry: entry["time"])
+    return backups
+
+def plan_retention(entries: List[Dict[str, Any]], now: float, coalesce: float = BACKUP_COALESCE_SECONDS,
+                   retention=BACKUP_RETENTION, keep_latest: int = BACKUP_KEEP_LATEST) -> Tuple[list, list]:
+    """把一名患者按时间排序、带哈希的备份分为 (保留, 删除)"""
+    # 最近的 keep_latest 份只在内容重复时删除，不受合并窗口和分级保留影响
+    latest = set(id(entry) for entry in entries[-keep_latest:]) if keep_latest > 0 else set()
+    # 去重与合并：与上一份保留的备份内容相同或间隔不足合并窗口的删除
+    survivors, removed = [], []
+    for entry in entries:
+        previous = survivors[-1] if survivors else None
+        if previous and (entry["hash"] == previous["hash"]
+                         or (entry["time"] - previous["time"] < coalesce and id(entry) not in latest)):
+            removed.append(entry)
+        else:
+            survivors.append(entry)
+
+    # 分级保留：每级每个间隔保留最早的一份（最近一份与前一份内容相同时，保留的是前一份）
+    latest = set(id(entry) for entry in survivors[-keep_latest:]) if keep_latest > 0 else set()
+    keep, buckets = [], set()
+    for entry in survivors:
+        age = now - entry["time"]
+        tier = next((index for index, (max_age, _) in enumerate(retention) if age < max_age), None)
+        if tier is None:
+            kept = False
+        elif retention[tier][1] <= 0:
+            kept = True
+        else:
+            bucket = (tier, int(entry["time"] // retention[tier][1]))
+            kept = bucket not in buckets
+            buckets.add(bucket)
+        if kept or id(entry) in latest:
+            keep.append(entry)
+        else:
+            removed.append(entry)
+    return keep, removed
+
+class BackupManager:
+    """创建备份并定期整理备份目录"""
+
+    def __init__(self, backup_dir: str = BACKUP_DIR):
+        self.backup_dir = backup_dir
+        self.lock = threading.Lock()
+        self.latest: Optional[Dict[str, Tuple[float, str]]] = None  # 文件名 -> (最近备份时间, 哈希)
+        self.started = False
+        self.stats = {"created": 0, "skipped_duplicate": 0, "skipped_coalesced": 0, "compactions": 0,
+                      "deleted": 0, "compressed": 0, "bytes_freed": 0}
+
+    def _count(self, key: str, amount: int = 1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def _latest(self, name: str) -> Optional[Tuple[float, str]]:
+        """该文件最近一份备份的 (时间, 哈希)；首次调用时扫描备份目录"""
+        with self.lock:
+            if self.latest is None:
+                latest = {}
+                for file_name, entries in list_backups(self.backup_dir).items():
+                    entry = entries[-1]
+                    latest[file_name] = (entry["time"], entry["hash"] or self._entry_hash(entry))
+                self.latest = latest
+            return self.latest.get(name)
+
+    @staticmethod
+    def _entry_hash(entry: Dict[str, Any]) -> str:
+        """文件名中没有哈希的旧备份读取内容计算"""
+        try:
+            return content_hash(read_backup(entry["path"]))
+        except (OSError, ValueError):
+            return ""
+
+    @IO_SECONDS.time(op="backup")
+    def create(self, file_path: str, content: Any, force: bool = False) -> Optional[str]:
+        """备份文件内容，返回备份路径；内容未变化或在合并窗口内（force 时不检查窗口）时跳过并返回 None"""
+        self._start()
+        name = os.path.basename(file_path)
+        digest = content_hash(content)
+        now = time.time()
+        latest = self._latest(name)
+        if latest is not None:
+            if latest[1] == digest:
+                self._count("skipped_duplicate")
+                return None
+            if not force and now - latest[0] < BACKUP_COALESCE_SECONDS:
+                self._count("skipped_coalesced")
+                return None
+        stamp = datetime.fromtimestamp(now).strftime("%Y%m%d_%H%M%S_%f")
+        backup_path = os.path.join(self.backup_dir, f"{name}_{stamp}_{digest}.bak")
+        try:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False, indent=2)
+            write_text_atomic(backup_path, text, fsync=False)
+        except Exception as e:
+            logging.error(f"创建备份失败: {e}")
+            return None
+        with self.lock:
+            self.latest[name] = (now, digest)
+            self.stats["created"] += 1
+        logging.info(f"创建备份: {backup_path}")
+        return backup_path
+
+    # ---- 整理 ----
+
+    def _start(self):
+        """首次创建备份时启动后台整理线程（每个进程一个）"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self._compact_loop, name="backup-compact", daemon=True).start()
+
+    def _compact_loop(self):
+        while True:
+            try:
+                self.compact()
+            except Exception as e:
+                logging.error(f"整理备份失败: {e}")
+            time.sleep(BACKUP_COMPACT_INTERVAL)
+
+    def compact(self, now: Optional[float] = None, dry_run: bool = False) -> Dict[str, int]:
+        """整理整个备份目录：删除重复和过期的备份，压缩较早的备份"""
+        now = now or time.time()
+        result = {"files": 0, "kept": 0, "deleted": 0, "compressed": 0, "bytes_freed": 0}
+        # 多个进程同时整理时依次进行，后进行的几乎没有需要处理的文件
+        with file_lock(os.path.join(self.backup_dir, ".compact")):
+            for name, entries in list_backups(self.backup_dir).items():
+                for entry in entries:
+                    entry["hash"] = entry["hash"] or self._entry_hash(entry)
+                keep, removed = plan_retention(entries, now)
+                result["files"] += len(entries)
+                result["kept"] += len(keep)
+                for entry in removed:
+                    result["bytes_freed"] += self._size(entry["path"])
+                    result["deleted"] += 1
+                    if not dry_run:
+                        self._remove(entry["path"])
+                for entry in keep:
+                    if not entry["compressed"] and now - entry["time"] >= BACKUP_COMPRESS_AFTER:
+                        result["compressed"] += 1
+                        if not dry_run:
+                            result["bytes_freed"] += self._compress(entry)
+                if not dry_run and keep:
+                    self._refresh_latest(name, keep[-1])
+        if not dry_run:
+            with self.lock:
+                self.stats["compactions"] += 1
+                for key in ("deleted", "compressed", "bytes_freed"):
+                    self.stats[key] += result[key]
+            if result["deleted"] or result["compressed"]:
+                logging.info(f"整理备份: 删除 {result['deleted']} 份, 压缩 {result['compressed']} 份, "
+                             f"释放 {result['bytes_freed'] / 1024:.0f} KB")
+        return result
+
+    def _refresh_latest(self, name: str, entry: Dict[str, Any]):
+        with self.lock:
+            if self.latest is not None and entry["time"] >= self.latest.get(name, (0, ""))[0]:
+                self.latest[name] = (entry["time"], entry["hash"])
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _compress(self, entry: Dict[str, Any]) -> int:
+        """压缩为 .bak.gz（文件名补上哈希），返回节省的字节数"""
+        path = entry["path"]
+        name = f"{entry['name']}_{entry['id']}_{entry['hash']}.bak.gz"
+        target = os.path.join(self.backup_dir, name)
+        tmp_path = f"{target}.tmp"
+        try:
+            with open(path, "rb") as source, gzip.open(tmp_path, "wb") as output:
+                output.write(source.read())
+            os.replace(tmp_path, target)
+        except FileNotFoundError:
+            return 0
+        saved = self._size(path) - self._size(target)
+        self._remove(path)
+        return saved
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.stats)
+
+# 全局共享的备份管理器
+backup_manager = BackupManager()
+
+def create_backup(file_path: str, content: Any, force: bool = False) -> Optional[str]:
+    """创建文件备份（去重、合并见 BackupManager.create）"""
+    return backup_manager.create(file_path, content, force)
+
+# ---- 版本列表与恢复 ----
+
+def list_versions(store, patient_id: str) -> List[Dict[str, Any]]:
+    """患者保留的历史版本，按时间从新到旧"""
+    if store.name == "sqlite":
+        return [{"id": str(item["revision"]), "time": item["created_at"], "source": item["source"]}
+                for item in reversed(store.history(patient_id))]
+    entries = list_backups(backup_manager.backup_dir).get(f"{patient_id}.json", [])
+    return [{"id": entry["id"], "time": entry["time"], "hash": entry["hash"],
+             "size": BackupManager._size(entry["path"]), "compressed": entry["compressed"]}
+            for entry in reversed(entries)]
+
+def load_version(store, patient_id: str, version_id: str) -> Optional[Dict[str, Any]]:
+    """读取指定版本的标注数据，不存在时返回 None"""
+    if store.name == "sqlite":
+        try:
+            return store.load_revision(patient_id, int(version_id))
+        except ValueError:
+            return None
+    for entry in list_backups(backup_manager.backup_dir).get(f"{patient_id}.json", []):
+        if entry["id"] == version_id:
+            try:
+                return read_backup(entry["path"])
+            except FileNotFoundError:
+                return None  # 刚被整理删除
+    return None
+
+def main(argv=None) -> int:
+    """命令行入口: python app.py backups compact|list [--dry-run] [患者ID]"""
+    parser = argparse.ArgumentParser(prog="python app.py backups", description="整理和查看标注备份")
+    parser.add_argument("command", choices=("compact", "list"))
+    parser.add_argument("patient_id", nargs="?", help="list 时查看的患者")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不删除或压缩")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        result = backup_manager.compact(dry_run=args.dry_run)
+        print(f"共 {result['files']} 份备份: 保留 {result['kept']}, 删除 {result['deleted']}, "
+              f"压缩 {result['compressed']}, 释放 {result['bytes_freed'] / 1024:.0f} KB"
+              + ("（未执行）" if args.dry_run else ""))
+        return 0
+    from annotation_store import annotation_store
+    if args.patient_id:
+        for version in list_versions(annotation_store, args.patient_id):
+            stamp = datetime.fromtimestamp(version["time"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{version['id']}\t{stamp}\t{version.get('hash') or version.get('source')}")
+        return 0
+    for name, entries in sorted(list_backups(backup_manager.backup_dir).items()):
+        print(f"{name[:-5]}\t{len(entries)} 份\t最近 {datetime.fromtimestamp(entries[-1]['time']):%Y-%m-%d %H:%M:%S}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""共现统计基准：合成大规模标注语料，测量构建、缓存加载、查询、增量更新和关联建议的耗时
+
+在临时数据目录中生成 --patients 个患者（问题取自样例病历，动作取自动作库），
+每个问题有几个偏好的动作，标注时大概率关联偏好动作，其余随机。关联建议在去掉关联的
+标注上计算（模拟刚生成完动作的患者），并统计建议覆盖了多少原有关联。结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_analytics.py [--patients 100000] [--queries 500] [--updates 1000]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+def sample_lines():
+    """样例病历中的问题行（不含患者信息和诊疗方案）"""
+    lines = set()
+    for path in glob.glob(os.path.join(ROOT_DIR, "data", "patients", "*.txt")):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f.read().split("TreatmentPlan<sep>")[0].splitlines():
+                if line.strip() and not line.startswith("Patient"):
+                    lines.add(line.strip())
+    return sorted(lines)
+
+def annotation_for(patient_id, problem_lines, preferred, actions, rng):
+    """为一个患者生成标注：每个问题以 70% 概率关联一个偏好动作"""
+    solutions = {}
+    links = {}
+    for index, line in enumerate(problem_lines):
+        if rng.random() < 0.3:
+            continue
+        if rng.random() < 0.7:
+            text = rng.choice(preferred[line])
+        else:
+            text = rng.choice(actions)
+        action_id = solutions.setdefault(text, f"action-{len(solutions)}")
+        links.setdefault(action_id, []).append(f"problem-{index}")
+    return {
+        "patient_id": patient_id,
+        "annotations": links,
+        "solutions": [{"id": action_id, "text": text} for text, action_id in solutions.items()],
+    }
+
+def generate(data_dir, patients, rng):
+    lines = sample_lines()
+    with open(os.path.join(ROOT_DIR, "data", "action_library.json"), "r", encoding="utf-8") as f:
+        actions = json.load(f)
+    preferred = {line: rng.sample(actions, 3) for line in lines}
+    os.makedirs(os.path.join(data_dir, "patients"))
+    os.makedirs(os.path.join(data_dir, "annotations"))
+    for i in range(patients):
+        patient_id = f"s{i:06d}"
+        problem_lines = rng.sample(lines, min(len(lines), rng.randint(10, 25)))
+        with open(os.path.join(data_dir, "patients", f"{patient_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Patient<sep>合成<sep>ID:{patient_id}\n" + "\n".join(problem_lines) + "\nTreatmentPlan<sep>无\n")
+        with open(os.path.join(data_dir, "annotations", f"{patient_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(annotation_for(patient_id, problem_lines, preferred, actions, rng), f, ensure_ascii=False)
+    return lines, preferred, actions
+
+def summary(values):
+    values = sorted(values)
+    return {"mean_ms": statistics.mean(values) * 1000,
+            "p50_ms": values[len(values) // 2] * 1000,
+            "p99_ms": values[min(len(values) - 1, int(len(values) * 0.99))] * 1000}
+
+def main():
+    parser = argparse.ArgumentParser(description="共现统计基准")
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--suggestions", type=int, default=500, help="计算关联建议的患者数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    data_dir = tempfile.mkdtemp(prefix="bench_analytics_")
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+    os.environ["ANNOTATION_STORAGE"] = "json"
+    try:
+        start = time.perf_counter()
+        lines, preferred, actions = generate(data_dir, args.patients, rng)
+        generate_seconds = time.perf_counter() - start
+
+        from analytics import CooccurrenceIndex, problem_key
+        from patient_parser import parse_patient_file
+        from patient_index import patient_index
+        from annotation_store import annotation_store
+        annotation_store_load = annotation_store.load
+
+        # 冷启动：遍历全部标注构建矩阵并写入缓存
+        cold = CooccurrenceIndex()
+        start = time.perf_counter()
+        cold.refresh()
+        build_seconds = time.perf_counter() - start
+
+        # 热启动：从缓存加载，只核对修改时间
+        warm = CooccurrenceIndex()
+        start = time.perf_counter()
+        warm.refresh()
+        load_seconds = time.perf_counter() - start
+
+        keys = sorted({problem_key(p) for line in lines for p in parse_patient_file(line)["problems"]})
+        query_times = []
+        for _ in range(args.queries):
+            key = rng.choice(keys)
+            start = time.perf_counter()
+            warm.top_actions(key, top=10)
+            query_times.append(time.perf_counter() - start)
+
+        # 增量更新：改写部分患者的标注，经 patient_index 回调更新矩阵
+        patient_index.add_listener(warm.update)
+        update_times = []
+        for _ in range(args.updates):
+            patient_id = f"s{rng.randrange(args.patients):06d}"
+            parsed = patient_index.get_parsed(patient_id)
+            problem_lines = [f"X<sep>{p['label']}" for p in parsed["problems"]]
+            data = annotation_for(patient_id, problem_lines, {line: rng.sample(actions, 3) for line in problem_lines},
+                                  actions, rng)
+            with open(os.path.join(data_dir, "annotations", f"{patient_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            start = time.perf_counter()
+            warm.update(patient_id, data)
+            update_times.append(time.perf_counter() - start)
+
+        query_after = []
+        for _ in range(args.queries):
+            key = rng.choice(keys)
+            start = time.perf_counter()
+            warm.top_actions(key, top=10)
+            query_after.append(time.perf_counter() - start)
+
+        # 关联建议：每名患者的耗时，以及建议覆盖原有关联的比例
+        suggest_times = []
+        suggested = recalled = expected = 0
+        for _ in range(args.suggestions):
+            patient_id = f"s{rng.randrange(args.patients):06d}"
+            parsed = patient_index.get_parsed(patient_id)
+            data = annotation_store_load(patient_id)
+            links = {(a, p) for a, problems in data["annotations"].items() for p in problems}
+            start = time.perf_counter()
+            result = warm.suggest_links(parsed, {**data, "annotations": {}})
+            suggest_times.append(time.perf_counter() - start)
+            suggested += len(result)
+            recalled += len(links & {(s["action_id"], s["problem_id"]) for s in result})
+            expected += len(links)
+
+        # 增量结果应与重新构建一致
+        rebuilt = CooccurrenceIndex(cache_file=os.path.join(data_dir, "rebuilt.npz"))
+        rebuilt.refresh()
+        sample_key = keys[0]
+        consistent = all(
+            warm.top_actions(key, top=20, metric="count") == rebuilt.top_actions(key, top=20, metric="count")
+            for key in keys[:50])
+        example = warm.top_actions(sample_key, top=5)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    result = {
+        "benchmark": "analytics",
+        "params": vars(args),
+        "generate_s": generate_seconds,
+        "cold_build_s": build_seconds,
+        "warm_load_s": load_seconds,
+        "query": summary(query_times),
+        "update": summary(update_times),
+        "query_after_updates": summary(query_after),
+        "suggest": {**summary(suggest_times), "per_patient": suggested / max(args.suggestions, 1),
+                    "recall": recalled / max(expected, 1), "precision": recalled / max(suggested, 1)},
+        "incremental_matches_rebuild": consistent,
+        "stats": warm.get_stats(),
+        "example": example,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
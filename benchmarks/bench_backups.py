@@ -0,0 +1,127 @@
+"""备份整理基准：模拟旧版本“每次保存都备份”留下的备份目录，比较整理前后的文件数和占用空间
+
+1. 在临时目录中为 --patients 名患者生成过去 --days 天的备份：每天若干段连续编辑，每段 --burst 次保存，
+   其中约三分之一的保存内容没有变化（旧版本同样会备份），文件名使用旧格式（无哈希）
+2. BackupManager.compact() 整理，记录删除、压缩的文件数、释放的空间和耗时，
+   并检查每名患者最新的备份被保留、所有保留的备份都可以读取
+3. 在整理后的目录上测量 create() 的耗时：内容不变（去重跳过）和内容变化（写入新备份）
+
+结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_backups.py [--patients 50] [--days 40] [--burst 8]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from backups import BackupManager, list_backups, read_backup, content_hash
+
+DAY = 86400
+
+def annotation(patient_id: str, actions: int) -> dict:
+    solutions = [{"id": f"action-{i}", "text": f"矫治动作{i}"} for i in range(actions)]
+    links = {s["id"]: [f"problem-{i % 20}"] for i, s in enumerate(solutions)}
+    return {"patient_id": patient_id, "annotations": links, "solutions": solutions, "version": "1.0"}
+
+def generate_history(backup_dir: str, patients: int, days: int, burst: int, now: float, rng: random.Random):
+    """按旧版本的行为生成备份文件"""
+    for p in range(patients):
+        patient_id = f"b{p:04d}"
+        actions = 4
+        for day in range(days, 0, -1):
+            for session in range(rng.randint(0, 3)):
+                start = now - day * DAY + rng.randint(8, 18) * 3600 + session * 600
+                for i in range(burst):
+                    if rng.random() > 0.33:
+                        actions = actions % 40 + 1
+                    stamp = datetime.fromtimestamp(start + i * rng.randint(2, 20)).strftime("%Y%m%d_%H%M%S")
+                    path = os.path.join(backup_dir, f"{patient_id}.json_{stamp}.bak")
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(annotation(patient_id, actions), f, ensure_ascii=False, indent=2)
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def main():
+    parser = argparse.ArgumentParser(description="备份整理基准")
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--days", type=int, default=40, help="模拟的历史天数")
+    parser.add_argument("--burst", type=int, default=8, help="每段连续编辑的保存次数")
+    parser.add_argument("--creates", type=int, default=500, help="测量 create() 的次数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    backup_dir = tempfile.mkdtemp(prefix="bench_backups_")
+    now = time.time()
+    try:
+        generate_history(backup_dir, args.patients, args.days, args.burst, now, rng)
+        # 同一秒内的备份文件名相同（旧版本的问题），以实际文件数为准
+        files = len(os.listdir(backup_dir))
+        size_before = directory_size(backup_dir)
+        latest_before = {name: content_hash(read_backup(entries[-1]["path"]))
+                         for name, entries in list_backups(backup_dir).items()}
+
+        manager = BackupManager(backup_dir)
+        start = time.perf_counter()
+        result = manager.compact(now=now)
+        compact_s = time.perf_counter() - start
+        # 再次整理应无事可做
+        second = manager.compact(now=now)
+
+        after = list_backups(backup_dir)
+        unreadable = 0
+        for entries in after.values():
+            for entry in entries:
+                try:
+                    read_backup(entry["path"])
+                except (OSError, ValueError):
+                    unreadable += 1
+        # 最新的内容必须保留（内容相同的备份只保留较早的一份，所以比较哈希）
+        latest_kept = sum(1 for name, digest in latest_before.items()
+                          if name in after and content_hash(read_backup(after[name][-1]["path"])) == digest)
+
+        # create()：内容不变时只计算哈希；内容变化时写入（合并窗口设为 0 以便每次都写）
+        import backups
+        backups.BACKUP_COALESCE_SECONDS = 0
+        manager.started = True  # 不启动后台整理线程
+        path = os.path.join(backup_dir, "b0000.json")
+        content = read_backup(after["b0000.json"][-1]["path"])
+        start = time.perf_counter()
+        for _ in range(args.creates):
+            manager.create(path, content)
+        duplicate_us = (time.perf_counter() - start) / args.creates * 1e6
+        start = time.perf_counter()
+        for i in range(args.creates):
+            manager.create(path, {**content, "next_action_id": i})
+        changed_us = (time.perf_counter() - start) / args.creates * 1e6
+    finally:
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+    print(json.dumps({
+        "benchmark": "backups",
+        "params": vars(args),
+        "before": {"files": files, "bytes": size_before},
+        "after": {"files": sum(len(entries) for entries in after.values()), "bytes": size_before - result["bytes_freed"]},
+        "compact": {**result, "elapsed_s": compact_s},
+        "second_compact": second,
+        "checks": {
+            "latest_kept": f"{latest_kept}/{len(latest_before)}",
+            "unreadable": unreadable,
+        },
+        "create": {"duplicate_us": duplicate_us, "changed_us": changed_us},
+    }, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
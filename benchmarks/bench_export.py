@@ -0,0 +1,92 @@
+"""导出基准：合成标注语料，比较单进程与多进程导出的吞吐量，并检查增量导出
+
+语料生成与 bench_analytics.py 相同。依次以 1 个和 --workers 个进程导出全部患者，
+记录耗时和主进程峰值内存；随后改写 --changed 名患者的标注，增量导出应恰好包含这些患者。
+结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_export.py [--patients 20000] [--workers 4] [--format jsonl|parquet]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_analytics import generate
+
+def count_rows(path: str, fmt: str) -> int:
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+def main():
+    parser = argparse.ArgumentParser(description="导出基准")
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--changed", type=int, default=100, help="增量导出前改写的患者数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    data_dir = tempfile.mkdtemp(prefix="bench_export_")
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+    os.environ["ANNOTATION_STORAGE"] = "json"
+    try:
+        generate(data_dir, args.patients, rng)
+        import export
+
+        runs = {}
+        for workers in sorted({1, args.workers}):
+            output = os.path.join(data_dir, f"out_{workers}.{args.format}")
+            result = export.run_export(output, args.format, workers)
+            runs[workers] = {
+                "elapsed_s": result["elapsed"],
+                "patients_per_s": result["patients"] / result["elapsed"],
+                "rows": count_rows(output, args.format),
+                "bytes": os.path.getsize(output),
+            }
+        cursor = result["cursor"]
+
+        # 增量导出：只应包含改写过的患者
+        time.sleep(0.01)
+        changed = sorted(rng.sample(range(args.patients), args.changed))
+        for i in changed:
+            path = os.path.join(data_dir, "annotations", f"s{i:06d}.json")
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            data["revision"] = data.get("revision", 0) + 1
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        output = os.path.join(data_dir, f"delta.{args.format}")
+        delta = export.run_export(output, args.format, args.workers, since=cursor)
+        # 峰值内存（KB，Linux）：主进程只持有在处理中的块
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    result = {
+        "benchmark": "export",
+        "params": vars(args),
+        "runs": runs,
+        "speedup": runs[1]["elapsed_s"] / runs[args.workers]["elapsed_s"],
+        "incremental": {"expected": args.changed, "exported": delta["patients"],
+                        "elapsed_s": delta["elapsed"]},
+        "peak_rss_mb": peak_rss_mb,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
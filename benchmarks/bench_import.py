@@ -0,0 +1,115 @@
+"""批量导入基准：生成多患者归档，测量导入吞吐量和峰值内存，并核对去重与错误统计
+
+在临时数据目录中生成一个 tar.gz（或首尾相接的文本文件），包含 --patients 名患者（问题取自样例病历），
+其中 --bad 比例的患者含格式错误的行、--dup 比例的患者重复出现。导入后检查新增、重复和拒绝的数量
+以及患者索引中的患者数。结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_import.py [--patients 100000] [--format tar.gz|txt] [--fsync]
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tarfile
+import argparse
+import resource
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_analytics import sample_lines
+
+def patient_text(index: int, lines, rng, bad: bool) -> str:
+    problems = rng.sample(lines, min(len(lines), rng.randint(10, 25)))
+    if bad:
+        problems.insert(rng.randrange(len(problems)), "格式错误的行")
+    return f"Patient<sep>合成<sep>ID:i{index:06d}\n" + "\n".join(problems) + "\nTreatmentPlan<sep>无\n"
+
+def generate(path: str, fmt: str, patients: int, bad_rate: float, dup_rate: float, rng):
+    """边生成边写入，返回预期的导入结果"""
+    lines = sample_lines()
+    expected = {"records": 0, "created": 0, "duplicates": 0, "rejected": 0}
+    if fmt == "txt":
+        output = open(path, "w", encoding="utf-8")
+        write = output.write
+    else:
+        output = tarfile.open(path, "w:gz")
+
+        def write(text):
+            data = text.encode("utf-8")
+            info = tarfile.TarInfo(f"patients/{expected['records']:06d}.txt")
+            info.size = len(data)
+            output.addfile(info, io.BytesIO(data))
+    with output:
+        for i in range(patients):
+            is_bad = rng.random() < bad_rate
+            text = patient_text(i, lines, rng, is_bad)
+            copies = 2 if rng.random() < dup_rate else 1
+            for _ in range(copies):
+                write(text)
+                expected["records"] += 1
+            # 含错误的患者每次出现都被拒绝，正确患者第二次出现计为重复
+            if is_bad:
+                expected["rejected"] += copies
+            else:
+                expected["created"] += 1
+                expected["duplicates"] += copies - 1
+    return expected
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入基准")
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--format", choices=("tar.gz", "txt"), default="tar.gz")
+    parser.add_argument("--bad", type=float, default=0.01, help="含格式错误的患者比例")
+    parser.add_argument("--dup", type=float, default=0.01, help="重复出现的患者比例")
+    parser.add_argument("--fsync", action="store_true", help="每个病历写入后刷盘")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    data_dir = tempfile.mkdtemp(prefix="bench_import_")
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+    os.environ["ANNOTATION_STORAGE"] = "json"
+    try:
+        archive = os.path.join(data_dir, f"input.{args.format}")
+        expected = generate(archive, args.format, args.patients, args.bad, args.dup, rng)
+        input_mb = os.path.getsize(archive) / 1024 / 1024
+        rss_before_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        from importer import PatientImporter
+        from patient_index import patient_index
+        importer = PatientImporter(fsync=args.fsync)
+        with open(archive, "rb") as f:
+            importer.import_stream(f, archive)
+        result = importer.finish()
+
+        start = time.perf_counter()
+        indexed = len(patient_index.patient_ids())
+        index_seconds = time.perf_counter() - start
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(json.dumps({
+        "benchmark": "import",
+        "params": vars(args),
+        "input_mb": input_mb,
+        "elapsed_s": result["elapsed"],
+        "records_per_s": result["records_per_second"],
+        "result": {key: result[key] for key in ("records", "created", "duplicates", "rejected", "errors")},
+        "expected": expected,
+        "indexed_patients": indexed,
+        "index_sync_after_import_s": index_seconds,
+        "peak_rss_mb": peak_rss_mb,
+        "rss_before_import_mb": rss_before_mb,
+    }, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
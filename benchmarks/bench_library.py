@@ -0,0 +1,115 @@
+"""动作库规模基准：提示词大小与保存耗时
+
+分别在 1k / 10k / 100k 条动作的合成动作库上比较：
+- 全量注入动作库与按相关性裁剪后的提示词长度（估算 token 数）
+- 旧实现（每次读文件 + 列表 in 判断）与内存索引的保存耗时
+- 相关动作检索耗时
+
+用法:
+    python benchmarks/bench_library.py [--sizes 1000 10000 100000] [--saves 20]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from action_library import ActionLibrary
+from storage import load_action_library, save_action_library
+from standardizer import build_standardize_prompt
+
+SAMPLE_PLAN = """隐形矫治、不拔牙矫治
+矫治步骤:1. 上下唇倾排齐，解除拥挤及扭转
+2. 后牙锁合先利用矫治器纠正，若无法完成则利用交互牵引纠正
+3. 维持磨牙关系
+5. 智齿酌情
+6. 正畸保持"""
+
+DIRECTIONS = ["", "上颌", "下颌", "左侧", "右侧", "双侧", "上颌左侧", "下颌右侧"]
+VERBS = ["排齐", "压低", "内收", "推", "直立", "拉", "纠正", "扩弓", "片切", "关闭", "改善", "维持"]
+OBJECTS = ["前牙", "磨牙", "牙列", "中线", "间隙", "尖牙关系", "深覆合", "锁合", "扭转牙", "宽度不调"]
+TEETH = [f"{q}{i}" for q in range(1, 5) for i in range(1, 9)]
+
+def synthetic_actions(count: int):
+    """生成 count 条互不相同的合成动作"""
+    bases = [f"{d}{v}{o}" for d, v, o in itertools.product(DIRECTIONS, VERBS, OBJECTS)]
+    generated = []
+    for variant in itertools.count():
+        for tooth in [""] + TEETH:
+            for base in bases:
+                suffix = f"（{variant}）" if variant else ""
+                generated.append(f"{tooth}{base}{suffix}")
+                if len(generated) >= count:
+                    return generated
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文字符按 1 个 token，其余字符按 4 个字符 1 个 token"""
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk) // 4
+
+def old_merge(path, actions):
+    """旧实现：每次保存都重新读取并线性查找"""
+    library = load_action_library(path)
+    updated = False
+    for action in actions:
+        if action not in library:
+            library.append(action)
+            updated = True
+    if updated:
+        save_action_library(library, path)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+def bench_size(size: int, saves: int):
+    work_dir = tempfile.mkdtemp(prefix="bench_library_")
+    path = os.path.join(work_dir, "action_library.json")
+    try:
+        base_actions = synthetic_actions(size)
+        save_action_library(base_actions, path)
+        # 每次保存提交 10 个动作，其中 1 个是新动作
+        batches = [base_actions[i * 9 % size:i * 9 % size + 9] + [f"新增动作{size}-{i}"] for i in range(saves)]
+
+        old_ms = [timed(old_merge, path, batch) for batch in batches]
+
+        save_action_library(base_actions, path)
+        library = ActionLibrary(path)
+        load_ms = timed(library.all_actions)
+        new_ms = [timed(library.add_actions, batch) for batch in batches]
+        lookup_ms = [timed(library.relevant_actions, SAMPLE_PLAN) for _ in range(saves)]
+
+        full_prompt = build_standardize_prompt(SAMPLE_PLAN, library.all_actions())
+        pruned_prompt = build_standardize_prompt(SAMPLE_PLAN, library.relevant_actions(SAMPLE_PLAN))
+        return {
+            "size": size,
+            "full_prompt_tokens": estimate_tokens(full_prompt),
+            "pruned_prompt_tokens": estimate_tokens(pruned_prompt),
+            "index_build_ms": load_ms,
+            "old_save_ms": statistics.median(old_ms),
+            "indexed_save_ms": statistics.median(new_ms),
+            "relevant_lookup_ms": statistics.median(lookup_ms),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="动作库规模基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--saves", type=int, default=20)
+    args = parser.parse_args()
+
+    results = [bench_size(size, args.saves) for size in args.sizes]
+    print(json.dumps({"benchmark": "action_library", "results": results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
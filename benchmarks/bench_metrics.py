@@ -0,0 +1,160 @@
+"""指标与追踪基准：测量埋点开销，并检查多进程服务器 /metrics 的合并结果
+
+1. 进程内：对样例病历比较 parse_patient_file 带计时与不带计时（__wrapped__）的耗时，
+   以及开启追踪（写 JSON 日志）时的耗时
+2. 服务器：在临时数据目录和桩LLM上以 --workers 个进程启动 python app.py serve，
+   发送 --requests 次患者请求和若干次流式生成，等待快照写入后多次读取 /metrics，
+   检查合并后的请求计数是否等于实际发送数、是否包含每个进程的 gauge，并记录 /metrics 本身的耗时
+
+结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_metrics.py [--workers 2] [--requests 200] [--streams 4]
+"""
+import os
+import re
+import sys
+import json
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_llm import start_stub_server
+from load_test import prepare_data_dir, free_port, request, wait_ready, percentile
+
+SAMPLE_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+def parse_metrics(text: str):
+    """解析 Prometheus 文本格式为 [(名称, {标签}, 值)]"""
+    samples = []
+    for line in text.splitlines():
+        match = SAMPLE_LINE.match(line)
+        if match:
+            labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2) or ""))
+            samples.append((match.group(1), labels, float(match.group(3))))
+    return samples
+
+def time_calls(func, contents, repeat: int) -> float:
+    """每次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for content in contents:
+            func(content)
+    return (time.perf_counter() - start) / (repeat * len(contents)) * 1e6
+
+def measure_overhead(repeat: int):
+    import metrics
+    from patient_parser import parse_patient_file
+    contents = []
+    for path in sorted(glob.glob(os.path.join(ROOT_DIR, "data", "patients", "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            contents.append(f.read())
+
+    raw_us = time_calls(parse_patient_file.__wrapped__, contents, repeat)
+    timed_us = time_calls(parse_patient_file, contents, repeat)
+    # 开启追踪：在一个根 span 内调用，每次解析写一行 JSON
+    trace_dir = tempfile.mkdtemp(prefix="bench_trace_")
+    metrics.TRACE_ENABLED = True
+    metrics.TRACE_LOG_FILE = os.path.join(trace_dir, "trace.log")
+    try:
+        with metrics.span("bench"):
+            traced_us = time_calls(parse_patient_file, contents, repeat)
+        with open(metrics.TRACE_LOG_FILE, "r", encoding="utf-8") as f:
+            spans = sum(1 for _ in f)
+    finally:
+        metrics.TRACE_ENABLED = False
+        shutil.rmtree(trace_dir, ignore_errors=True)
+
+    histogram = metrics.Histogram("bench_seconds", "基准", ("op",))
+    start = time.perf_counter()
+    for i in range(100000):
+        histogram.observe(0.001, op="x")
+    observe_us = (time.perf_counter() - start) / 100000 * 1e6
+    return {
+        "parse_us": raw_us,
+        "parse_timed_us": timed_us,
+        "parse_traced_us": traced_us,
+        "timer_overhead_us": timed_us - raw_us,
+        "trace_overhead_us": traced_us - raw_us,
+        "observe_us": observe_us,
+        "trace_spans": spans,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="指标与追踪基准")
+    parser.add_argument("--workers", type=int, default=2, help="服务器进程数")
+    parser.add_argument("--requests", type=int, default=200, help="患者数据请求数")
+    parser.add_argument("--streams", type=int, default=4, help="流式生成请求数")
+    parser.add_argument("--scrapes", type=int, default=10, help="读取 /metrics 的次数")
+    parser.add_argument("--repeat", type=int, default=200, help="进程内开销测量的重复次数")
+    args = parser.parse_args()
+
+    overhead = measure_overhead(args.repeat)
+
+    stub, llm_url = start_stub_server(latency=0.05, token_delay=0.005, echo_plan=True)
+    patient_ids = [f"m{i:03d}" for i in range(max(args.streams, 10))]
+    data_dir = prepare_data_dir(patient_ids)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, os.path.join(ROOT_DIR, "app.py"), "serve", "--port", str(port),
+               "--workers", str(args.workers)]
+    env = {**os.environ, "OPENAI_BASE_URL": llm_url, "ANNOTATION_DATA_DIR": data_dir}
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(base_url, process)
+        for i in range(args.requests):
+            request(base_url, f"/api/patient/{patient_ids[i % len(patient_ids)]}")
+        for patient_id in patient_ids[:args.streams]:
+            request(base_url, f"/api/patient/{patient_id}/stream-actions")
+        # 等待各进程写入快照
+        import metrics
+        time.sleep(metrics.METRICS_FLUSH_SECONDS * 1.5)
+
+        scrape_times = []
+        counts = []
+        pids = set()
+        for _ in range(args.scrapes):
+            start = time.perf_counter()
+            text = request(base_url, "/metrics").decode("utf-8")
+            scrape_times.append(time.perf_counter() - start)
+            samples = parse_metrics(text)
+            counts.append(sum(value for name, labels, value in samples
+                              if name == "annotation_http_request_seconds_count"
+                              and labels.get("route") == "/api/patient/<patient_id>"))
+            pids |= {labels["pid"] for name, labels, value in samples if name == "annotation_llm_requests"}
+        llm = {(labels.get("kind"), labels.get("outcome")): value for name, labels, value in samples
+               if name == "annotation_llm_request_seconds_count"}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        stub.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(json.dumps({
+        "benchmark": "metrics",
+        "params": vars(args),
+        "overhead": overhead,
+        "server": {
+            # 每次读取都应看到全部进程的请求（部分进程的数值来自快照）
+            "patient_requests_sent": args.requests,
+            "patient_requests_counted": {"min": min(counts), "max": max(counts)},
+            "processes_reported": len(pids),
+            "llm_requests": {f"{kind}/{outcome}": value for (kind, outcome), value in sorted(llm.items())},
+            "scrape_p50_s": percentile(scrape_times, 0.5),
+            "scrape_p99_s": percentile(scrape_times, 0.99),
+        },
+    }, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
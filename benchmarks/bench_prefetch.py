@@ -0,0 +1,95 @@
+"""预取基准：模拟标注员逐个"下一例"，比较开启和关闭预取时打开患者的耗时
+
+在临时数据目录（若干份样例病历）和本地桩LLM上，依次对每个患者执行前端的流程：
+通知服务器预取后续患者、获取患者数据、流式生成动作，然后停留 --think 秒（标注时间）。
+结果以 JSON 输出，包含每次打开的耗时和服务器的预取命中率。
+
+用法:
+    python benchmarks/bench_prefetch.py [--patients 8] [--think 1.0] [--latency 1.0] [--depth 3]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_llm import start_stub_server
+
+SAMPLE_PATIENT = os.path.join(ROOT_DIR, "data", "patients", "test_stream.txt")
+
+def prepare_data_dir(patients: int) -> str:
+    """创建包含若干尚无标注的样例患者的临时数据目录（诊疗方案各不相同，不会命中LLM缓存）"""
+    data_dir = tempfile.mkdtemp(prefix="bench_prefetch_")
+    os.makedirs(os.path.join(data_dir, "patients"))
+    with open(SAMPLE_PATIENT, "r", encoding="utf-8") as f:
+        content = f.read().rstrip()
+    for i in range(patients):
+        with open(os.path.join(data_dir, "patients", f"p{i:03d}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{content}\n第{i}次复诊时酌情调整\n")
+    return data_dir
+
+def walk(client, patient_ids, think: float, prefetch: bool):
+    """依次打开每个患者，返回每次打开（数据 + 动作生成完成）的耗时"""
+    timings = []
+    for patient_id in patient_ids:
+        start = time.perf_counter()
+        client.get(f"/api/patient/{patient_id}")
+        response = client.get(f"/api/patient/{patient_id}/stream-actions")
+        response.get_data()
+        timings.append(time.perf_counter() - start)
+        if prefetch:
+            client.post(f"/api/prefetch/{patient_id}")
+        time.sleep(think)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="预取基准")
+    parser.add_argument("--patients", type=int, default=8)
+    parser.add_argument("--think", type=float, default=1.0, help="每个患者的标注时间（秒）")
+    parser.add_argument("--latency", type=float, default=1.0, help="桩LLM首个token前的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="桩LLM每个片段的间隔（秒）")
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, token_delay=args.token_delay, echo_plan=True)
+    data_dir = prepare_data_dir(args.patients * 2)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+
+    import app
+    from prefetch import prefetcher
+
+    client = app.app.test_client()
+    ids = [f"p{i:03d}" for i in range(args.patients * 2)]
+    try:
+        without = walk(client, ids[:args.patients], args.think, prefetch=False)
+        prefetcher.depth = args.depth
+        before = prefetcher.get_stats()
+        with_prefetch = walk(client, ids[args.patients:], args.think, prefetch=True)
+        after = prefetcher.get_stats()
+    finally:
+        server.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    result = {
+        "benchmark": "prefetch",
+        "params": vars(args),
+        "without_prefetch": {"mean": statistics.mean(without), "max": max(without), "open_s": without},
+        "with_prefetch": {"mean": statistics.mean(with_prefetch), "max": max(with_prefetch),
+                          "open_s": with_prefetch},
+        "prefetch_hits": after["hits"] - before["hits"],
+        "prefetch_misses": after["misses"] - before["misses"],
+        "prefetch": after,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
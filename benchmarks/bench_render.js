@@ -0,0 +1,258 @@
+/**
+ * 前端渲染基准：在 jsdom 中加载 templates/index.html 和 static/js/script.js（不需要浏览器和服务器），
+ * 用合成患者测量切换患者和每次操作的耗时，以及每次操作产生的 DOM 变更数
+ *
+ * - load：loadPatientDirectly 渲染整个患者
+ * - toggle：点击问题词块建立/取消关联
+ * - select：切换选中的动作
+ * - stream：流式生成时逐个插入动作
+ * - add / delete：新建、删除动作
+ *
+ * 每次操作后检查 DOM 与数据一致（问题高亮、动作顺序和选中状态），不一致数记为 inconsistencies。
+ * jsdom 没有布局和 IntersectionObserver：默认所有块都创建；--viewport-blocks N 时每个列表只有前 N 个块
+ * 视为在视口内，用于观察虚拟化后创建的词块数。--baseline 用 git 中指定版本的 script.js 运行同样的操作对比。
+ * 结果以 JSON 输出。
+ *
+ * 用法:
+ *     npm install --prefix benchmarks    # 安装 jsdom
+ *     node benchmarks/bench_render.js [--sizes 40x15,300x80,2000x400] [--repeat 200] [--baseline HEAD~1] [--viewport-blocks 2]
+ */
+const fs = require('fs');
+const path = require('path');
+const { execFileSync } = require('child_process');
+
+const ROOT_DIR = path.dirname(__dirname);
+const PROBLEM_TYPES = ['主诉', '牙性', '牙齿', '骨性', '软组织', '功能', '生长发育', '不良习惯', '其他'];
+
+let JSDOM, VirtualConsole;
+try {
+    ({ JSDOM, VirtualConsole } = require('jsdom'));
+} catch (error) {
+    console.error('缺少依赖 jsdom，请先运行: npm install --prefix benchmarks');
+    process.exit(1);
+}
+
+function parseArgs(argv) {
+    const args = { sizes: '40x15,300x80,2000x400', repeat: 200, baseline: null, viewportBlocks: 0, seed: 1 };
+    for (let i = 0; i < argv.length; i += 2) {
+        const key = argv[i].replace(/^--/, '').replace(/-(\w)/g, (_, c) => c.toUpperCase());
+        if (!(key in args)) {
+            throw new Error(`未知参数: ${argv[i]}`);
+        }
+        args[key] = typeof args[key] === 'number' ? Number(argv[i + 1]) : argv[i + 1];
+    }
+    args.sizes = args.sizes.split(',').map(size => size.split('x').map(Number));
+    return args;
+}
+
+// 可复现的伪随机数
+function mulberry32(seed) {
+    return () => {
+        seed = (seed + 0x6D2B79F5) | 0;
+        let t = Math.imul(seed ^ (seed >>> 15), 1 | seed);
+        t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+        return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+    };
+}
+
+// 合成患者：问题分布在各类型中，每个动作关联 1~3 个问题，附带若干关联建议
+function syntheticPatient(problemCount, actionCount, random) {
+    const pick = (n) => Math.floor(random() * n);
+    const problems = Array.from({ length: problemCount }, (_, i) => ({
+        id: `problem-${i}`,
+        text: `问题${i} ${'牙列拥挤'.slice(0, 1 + pick(4))}`,
+        type: PROBLEM_TYPES[pick(PROBLEM_TYPES.length)]
+    }));
+    const solutions = Array.from({ length: actionCount }, (_, i) => ({ id: `action-${i}`, text: `诊疗动作${i}` }));
+    const annotations = {};
+    solutions.forEach(solution => {
+        annotations[solution.id] = Array.from(new Set(Array.from({ length: 1 + pick(3) }, () => `problem-${pick(problemCount)}`)));
+    });
+    const suggestions = Array.from({ length: Math.min(20, actionCount) }, () => ({
+        action_id: `action-${pick(actionCount)}`,
+        problem_id: `problem-${pick(problemCount)}`,
+        confidence: 0.8,
+        count: 5,
+        lift: 2
+    }));
+    return {
+        patient_id: 'bench', problems, solutions, annotations, suggestions,
+        revision: 1, next_action_id: actionCount, has_saved_data: true,
+        original_treatment_plan: 'TreatmentPlan'
+    };
+}
+
+// 只把前 N 个块视为在视口内的 IntersectionObserver（jsdom 没有布局）
+function viewportObserver(window, visibleBlocks) {
+    return class {
+        constructor(callback) {
+            this.callback = callback;
+            this.observed = 0;
+        }
+        observe(target) {
+            const isIntersecting = this.observed++ < visibleBlocks;
+            queueMicrotask(() => this.callback([{ target, isIntersecting }], this));
+        }
+        unobserve() {}
+        disconnect() {
+            this.observed = 0;
+        }
+    };
+}
+
+async function createPage(scriptSource, visibleBlocks) {
+    const html = fs.readFileSync(path.join(ROOT_DIR, 'templates', 'index.html'), 'utf-8')
+        .replace(/<script[^>]*><\/script>/g, '');
+    const dom = new JSDOM(html, { runScripts: 'outside-only', pretendToBeVisual: true, virtualConsole: new VirtualConsole() });
+    const { window } = dom;
+    if (window.document.readyState !== 'complete') {
+        await new Promise(resolve => window.addEventListener('load', resolve));
+    }
+    window.confirm = () => true;
+    window.Element.prototype.scrollIntoView = () => {};
+    window.fetch = async () => ({ ok: true, status: 200, json: async () => ({ revision: 1, solutions: [], annotations: {} }) });
+    if (visibleBlocks > 0) {
+        window.IntersectionObserver = viewportObserver(window, visibleBlocks);
+    }
+    // 页面已加载完成，DOMContentLoaded 中的初始化（请求患者列表）不会执行，只绑定事件
+    window.eval(scriptSource);
+    window.eval('setupEventListeners()');
+    return window;
+}
+
+function summary(values) {
+    const sorted = [...values].sort((a, b) => a - b);
+    const at = (q) => sorted[Math.min(sorted.length - 1, Math.floor(q * sorted.length))];
+    return {
+        count: values.length,
+        mean_ms: values.reduce((a, b) => a + b, 0) / values.length,
+        p50_ms: at(0.5),
+        p99_ms: at(0.99)
+    };
+}
+
+// 检查 DOM 与状态一致：问题高亮对应选中动作的关联，动作词块的顺序和选中状态与数据一致，返回不一致的数量
+function inconsistencies(window) {
+    const state = window.eval('({ selected: selectedSolutionId, links: annotationLinks, order: solutionsData.map(s => s.id) })');
+    const linked = new Set(state.selected === null ? [] : state.links[state.selected] || []);
+    let errors = 0;
+    window.document.querySelectorAll('.chip.problem').forEach(chip => {
+        if (chip.classList.contains('linked') !== linked.has(chip.dataset.id)) errors++;
+    });
+    const chips = Array.from(window.document.querySelectorAll('.chip.solution'));
+    chips.forEach(chip => {
+        if (chip.classList.contains('selected') !== (chip.dataset.id === state.selected)) errors++;
+    });
+    // 分块渲染时只有部分动作有词块，按数据中的相对顺序检查
+    const position = new Map(state.order.map((id, index) => [id, index]));
+    const positions = chips.map(chip => position.has(chip.dataset.id) ? position.get(chip.dataset.id) : -1);
+    positions.forEach((value, index) => {
+        if (value === -1 || (index > 0 && value < positions[index - 1])) errors++;
+    });
+    return errors;
+}
+
+async function measure(window, recorder, times, mutations, operation) {
+    recorder.takeRecords();
+    const start = performance.now();
+    await operation();
+    times.push(performance.now() - start);
+    // IntersectionObserver 回调和删除动作等异步部分完成后再统计变更
+    mutations.push(recorder.takeRecords().length);
+}
+
+async function runScenario(scriptSource, problemCount, actionCount, args) {
+    const window = await createPage(scriptSource, args.viewportBlocks);
+    const document = window.document;
+    const random = mulberry32(args.seed);
+    const data = () => syntheticPatient(problemCount, actionCount, mulberry32(args.seed));
+    const recorder = new window.MutationObserver(() => {});
+    recorder.observe(document.body, { subtree: true, childList: true, attributes: true, characterData: true });
+    const result = {};
+    let errors = 0;
+    // prepare 在计时之外取得操作的参数（如要点击的词块）
+    const record = async (name, count, operation, { check = true, prepare = (i) => i } = {}) => {
+        const times = [];
+        const mutations = [];
+        for (let i = 0; i < count; i++) {
+            const arg = prepare(i);
+            await measure(window, recorder, times, mutations, () => operation(arg));
+            if (check) {
+                errors += inconsistencies(window);
+            }
+        }
+        result[name] = { ...summary(times), mutations_mean: mutations.reduce((a, b) => a + b, 0) / mutations.length };
+    };
+
+    // 预热（JIT），先运行的脚本不吃亏
+    for (let i = 0; i < 3; i++) {
+        await window.loadPatientDirectly(data());
+    }
+    await record('load', Math.max(5, Math.floor(args.repeat / 20)), async () => {
+        await window.loadPatientDirectly(data());
+        await Promise.resolve();
+    });
+    result.load.problem_chips = document.querySelectorAll('.chip.problem').length;
+    result.load.solution_chips = document.querySelectorAll('.chip.solution').length;
+
+    await record('toggle', args.repeat, (chip) => {
+        chip.dispatchEvent(new window.MouseEvent('click', { bubbles: true }));
+    }, {
+        prepare: () => {
+            const chips = document.querySelectorAll('.chip.problem');
+            return chips[Math.floor(random() * chips.length)];
+        }
+    });
+    await record('select', args.repeat, () => {
+        window.handleSolutionClick(`action-${Math.floor(random() * actionCount)}`);
+    });
+
+    await window.loadPatientDirectly(data());
+    // 流式插入的动作只在 DOM 中（完成时才写入数据），不检查一致性
+    await record('stream', Math.min(args.repeat, 100), (i) => {
+        window.addActionToUI({ id: `action-stream-${i}`, text: `流式动作${i}` });
+    }, { check: false });
+
+    await window.loadPatientDirectly(data());
+    await record('add', Math.min(args.repeat, 50), () => window.addNewAction());
+    await record('delete', Math.min(args.repeat, 50, actionCount), async (i) => {
+        await window.deleteAction(`action-${i}`);
+    });
+
+    result.inconsistencies = errors;
+    window.eval('clearTimeout(opsTimer)');
+    window.close();
+    return result;
+}
+
+async function main() {
+    const args = parseArgs(process.argv.slice(2));
+    const current = fs.readFileSync(path.join(ROOT_DIR, 'static', 'js', 'script.js'), 'utf-8');
+    const baseline = args.baseline
+        ? execFileSync('git', ['show', `${args.baseline}:static/js/script.js`], { cwd: ROOT_DIR, encoding: 'utf-8' })
+        : null;
+
+    const results = {};
+    for (const [problemCount, actionCount] of args.sizes) {
+        const key = `${problemCount}x${actionCount}`;
+        results[key] = { current: await runScenario(current, problemCount, actionCount, args) };
+        if (baseline) {
+            results[key].baseline = await runScenario(baseline, problemCount, actionCount, args);
+            results[key].speedup = Object.fromEntries(Object.keys(results[key].current)
+                .filter(name => name !== 'inconsistencies')
+                .map(name => [name, results[key].baseline[name].mean_ms / results[key].current[name].mean_ms]));
+        }
+    }
+    console.log(JSON.stringify({
+        benchmark: 'render',
+        params: { ...args, sizes: args.sizes.map(size => size.join('x')) },
+        results
+    }, null, 2));
+    // 脚本中的定时器（提示消息、防抖保存）不影响结果
+    process.exit(0);
+}
+
+main().catch(error => {
+    console.error(error);
+    process.exit(1);
+});
@@ -0,0 +1,97 @@
+"""规则预标准化基准：统计每个患者的规则命中率和节省的LLM耗时
+
+对病历目录中的每个诊疗方案运行规则匹配，再在本地桩LLM上分别请求完整方案和
+规则未命中的剩余部分（跳过缓存），比较两者耗时。桩服务按方案行数输出动作，
+输出越短耗时越少，与真实LLM的趋势一致。结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_rules.py [--patients-dir data/patients] [--latency 0.5] [--token-delay 0.02]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_llm import start_stub_server
+
+def main():
+    parser = argparse.ArgumentParser(description="规则预标准化基准")
+    parser.add_argument("--patients-dir", default=os.path.join(ROOT_DIR, "data", "patients"))
+    parser.add_argument("--latency", type=float, default=0.5, help="桩LLM首个token前的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="桩LLM每个片段的间隔（秒）")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, token_delay=args.token_delay, echo_plan=True)
+    # 使用仓库中的动作库，LLM缓存写到临时目录
+    data_dir = tempfile.mkdtemp(prefix="bench_rules_")
+    shutil.copy(os.path.join(ROOT_DIR, "data", "action_library.json"), data_dir)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+
+    from patient_parser import parse_patient_file
+    from standardizer import request_standardization
+    from rule_standardizer import rule_standardizer
+
+    patients = {}
+    try:
+        for path in sorted(glob.glob(os.path.join(args.patients_dir, "*.txt"))):
+            with open(path, "r", encoding="utf-8") as f:
+                plan = parse_patient_file(f.read())["treatment_plan"]
+            if not plan.strip():
+                continue
+            prepared = rule_standardizer.prepare(plan)
+
+            start = time.perf_counter()
+            request_standardization(plan, [], bypass_cache=True)
+            full_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if prepared["unresolved"]:
+                request_standardization(prepared["remaining"], [], bypass_cache=True)
+            remaining_seconds = time.perf_counter() - start
+
+            _, report = rule_standardizer.finish(os.path.basename(path)[:-4], prepared, prepared["items"],
+                                                 remaining_seconds)
+            patients[os.path.basename(path)[:-4]] = {
+                "clauses": report["clauses"],
+                "resolved": report["resolved"],
+                "skipped": report["skipped"],
+                "fallback": report["fallback"],
+                "hit_rate": report["hit_rate"],
+                "rule_actions": report["rule_actions"],
+                "llm_called": report["llm_called"],
+                "rule_ms": report["rule_ms"],
+                "llm_full_ms": full_seconds * 1000,
+                "llm_remaining_ms": remaining_seconds * 1000,
+                "saved_ms": (full_seconds - remaining_seconds) * 1000,
+            }
+    finally:
+        server.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    stats = rule_standardizer.get_stats()
+    result = {
+        "benchmark": "rule_standardizer",
+        "params": {"latency": args.latency, "token_delay": args.token_delay, "patients": len(patients)},
+        "hit_rate": stats["hit_rate"],
+        "resolved": stats["resolved"],
+        "skipped": stats["skipped"],
+        "fallback": stats["fallback"],
+        "llm_skipped": stats["llm_skipped"],
+        "mean_saved_ms": statistics.mean(p["saved_ms"] for p in patients.values()) if patients else 0.0,
+        "patients": patients,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
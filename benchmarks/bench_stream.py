@@ -0,0 +1,110 @@
+"""流式生成接口基准：测量首个动作到达时间（TTFA）与总耗时
+
+在临时数据目录和本地桩LLM上运行 /api/patient/<id>/stream-actions，
+同时测量阻塞式 call_llm 的耗时作为对照（旧实现的首个动作时间下限）。
+--fanout 时另外测量按分句并行生成（桩服务按方案行数输出动作，输出长度随输入变化）。
+
+用法:
+    python benchmarks/bench_stream.py [--latency 1.0] [--token-delay 0.05] [--runs 5] [--fanout]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_llm import start_stub_server
+
+SAMPLE_PATIENT = os.path.join(ROOT_DIR, "data", "patients", "00001.txt")
+
+def prepare_data_dir() -> str:
+    """创建只包含一个样例患者的临时数据目录"""
+    data_dir = tempfile.mkdtemp(prefix="bench_stream_")
+    os.makedirs(os.path.join(data_dir, "patients"))
+    shutil.copy(SAMPLE_PATIENT, os.path.join(data_dir, "patients", "bench.txt"))
+    return data_dir
+
+def measure_stream(client, url):
+    """返回 (首个动作时间, 总耗时, 动作数)"""
+    start = time.perf_counter()
+    first_action = None
+    actions = 0
+    response = client.get(url, buffered=False)
+    for chunk in response.response:
+        text = chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+        for line in text.split("\n"):
+            if line.startswith("data: ") and json.loads(line[6:]).get("type") == "action":
+                actions += 1
+                if first_action is None:
+                    first_action = time.perf_counter() - start
+    response.close()
+    return first_action, time.perf_counter() - start, actions
+
+def summarize(values):
+    return {"mean": statistics.mean(values), "min": min(values), "max": max(values)}
+
+def main():
+    parser = argparse.ArgumentParser(description="流式生成接口基准")
+    parser.add_argument("--latency", type=float, default=1.0, help="桩LLM首个token前的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="桩LLM每个片段的间隔（秒）")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fanout", action="store_true", help="同时测量分句并行生成")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, token_delay=args.token_delay,
+                                         echo_plan=args.fanout)
+    data_dir = prepare_data_dir()
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+
+    import app
+    from standardizer import call_llm, build_standardize_prompt
+    from action_library import library_index
+
+    client = app.app.test_client()
+    url = "/api/patient/bench/stream-actions?bypass_cache=true"
+    stream_ttfa, stream_total, blocking_total = [], [], []
+    fanout_ttfa, fanout_total = [], []
+    actions = 0
+    try:
+        for _ in range(args.runs):
+            ttfa, total, actions = measure_stream(client, url)
+            stream_ttfa.append(ttfa)
+            stream_total.append(total)
+            if args.fanout:
+                ttfa, total, _ = measure_stream(client, url + "&fanout=true")
+                fanout_ttfa.append(ttfa)
+                fanout_total.append(total)
+
+            prompt = build_standardize_prompt("bench", library_index.all_actions())
+            start = time.perf_counter()
+            call_llm(prompt)
+            blocking_total.append(time.perf_counter() - start)
+    finally:
+        server.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    result = {
+        "benchmark": "stream_actions",
+        "params": {"latency": args.latency, "token_delay": args.token_delay, "runs": args.runs,
+                   "fanout": args.fanout},
+        "actions": actions,
+        "stream_time_to_first_action": summarize(stream_ttfa),
+        "stream_total": summarize(stream_total),
+        "blocking_llm_call": summarize(blocking_total),
+    }
+    if args.fanout:
+        result["fanout_time_to_first_action"] = summarize(fanout_ttfa)
+        result["fanout_total"] = summarize(fanout_total)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
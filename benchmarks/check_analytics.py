@@ -0,0 +1,75 @@
+"""统计分析增量更新检查：矩阵加载后保存标注，查询结果应立即反映这次保存
+
+在临时目录的合成语料上：
+1. 加载共现矩阵（与服务器预热后相同的状态）
+2. 通过 /api/save 为某患者新增一个关联到其问题的动作，top_actions 中该动作的计数应为 1
+3. 再次保存取消该关联，该动作应从 top_actions 中消失
+
+两次保存都在 ANALYTICS_SYNC_SECONDS 之内，只能通过 patient_index 的回调增量更新。
+结果以 JSON 输出，任一检查失败时以非零状态退出。
+
+用法:
+    python benchmarks/check_analytics.py
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+ACTION = "增量更新检查动作"
+
+def action_count(cooccurrence, problem: str) -> int:
+    result = cooccurrence.top_actions(problem, top=10000) or {"actions": []}
+    return next((item["count"] for item in result["actions"] if item["action"] == ACTION), 0)
+
+def main():
+    data_dir = tempfile.mkdtemp(prefix="check_analytics_")
+    # 应用模块在导入时读取数据目录
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+    try:
+        from corpus import generate_corpus
+        generate_corpus(data_dir, 200, seed=0)
+        import app
+        from analytics import cooccurrence, problem_key
+        from annotation_store import annotation_store
+        from patient_index import patient_index
+
+        client = app.app.test_client()
+        cooccurrence.refresh()
+        patient_id = next(pid for pid in patient_index.patient_ids() if annotation_store.load(pid))
+        problem = patient_index.get_parsed(patient_id)["problems"][0]
+        key = problem_key(problem)
+        before = action_count(cooccurrence, key)
+
+        def save(linked: bool):
+            data = annotation_store.load(patient_id)
+            solutions = [s for s in data["solutions"] if s["id"] != "action-check"]
+            data["solutions"] = solutions + [{"id": "action-check", "text": ACTION}]
+            data["annotations"]["action-check"] = [problem["id"]] if linked else []
+            response = client.post(f"/api/save/{patient_id}", json=data)
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+        save(True)
+        after_link = action_count(cooccurrence, key)
+        save(False)
+        after_unlink = action_count(cooccurrence, key)
+        stats = cooccurrence.get_stats()
+        results = {
+            "listener_registered": {"passed": cooccurrence.update in patient_index.listeners},
+            "link": {"passed": before == 0 and after_link == 1, "before": before, "after": after_link},
+            "unlink": {"passed": after_unlink == 0, "after": after_unlink},
+            "updates": {"passed": stats["updates"] == 2, "updates": stats["updates"]},
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    print(json.dumps({"benchmark": "analytics_updates", "results": results}, ensure_ascii=False, indent=2))
+    return 0 if all(result["passed"] for result in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
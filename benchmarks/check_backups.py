@@ -0,0 +1,91 @@
+"""编辑流程的备份检查：增量保存、新增和删除动作后，历史版本中应能找到编辑前的内容
+
+在临时目录的合成语料上，分别通过以下接口修改不同患者的标注，检查 list_versions 的版本数增加、
+且其中有一个版本与编辑前的动作列表相同：
+- patch: PATCH /api/patient/<id>/annotations
+- add: POST /api/action/add/<id>
+- delete: DELETE /api/action/delete/<id>/<动作ID>
+JSON 后端另外检查合并窗口：紧接着的第二次增量保存不再产生备份。
+SQLite 后端先把合成语料迁移为修订，列出的是差异修订。
+
+结果以 JSON 输出，任一检查失败时以非零状态退出。
+
+用法:
+    python benchmarks/check_backups.py [--backend sqlite]
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+def main():
+    parser = argparse.ArgumentParser(description="编辑流程的备份检查")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="check_backups_")
+    # 应用模块在导入时读取数据目录和存储后端
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+    os.environ["ANNOTATION_STORAGE"] = args.backend
+    try:
+        from corpus import generate_corpus
+        generate_corpus(data_dir, 50, seed=0)
+        import app
+        from storage import ANNOTATIONS_DIR
+        from annotation_store import annotation_store, migrate_json_to_sqlite
+        from backups import list_versions, load_version, backup_manager
+        from patient_index import patient_index
+
+        if args.backend == "sqlite":
+            migrate_json_to_sqlite(annotation_store, ANNOTATIONS_DIR)
+        client = app.app.test_client()
+        patient_ids = [pid for pid in patient_index.patient_ids()
+                       if (annotation_store.load(pid) or {}).get("solutions")]
+
+        def check(patient_id, edit):
+            before = annotation_store.load(patient_id)["solutions"]
+            count = len(list_versions(annotation_store, patient_id))
+            response = edit(patient_id, before)
+            versions = list_versions(annotation_store, patient_id)
+            kept = any((load_version(annotation_store, patient_id, version["id"]) or {}).get("solutions") == before
+                       for version in versions)
+            return {"passed": response.status_code == 200 and len(versions) > count and kept,
+                    "status": response.status_code, "versions_before": count, "versions_after": len(versions),
+                    "previous_content_kept": kept}
+
+        def patch(patient_id, solutions, text="备份检查动作"):
+            return client.patch(f"/api/patient/{patient_id}/annotations", json={"ops": [
+                {"op": "rename_action", "action_id": solutions[0]["id"], "text": text}]})
+
+        results = {
+            "patch": check(patient_ids[0], patch),
+            "add": check(patient_ids[1], lambda pid, solutions: client.post(
+                f"/api/action/add/{pid}", json={"text": "备份检查动作"})),
+            "delete": check(patient_ids[2], lambda pid, solutions: client.delete(
+                f"/api/action/delete/{pid}/{solutions[0]['id']}")),
+        }
+        if args.backend == "json":
+            count = len(list_versions(annotation_store, patient_ids[0]))
+            coalesced = backup_manager.stats["skipped_coalesced"]
+            response = patch(patient_ids[0], annotation_store.load(patient_ids[0])["solutions"], "再次修改")
+            results["coalesce"] = {
+                "passed": response.status_code == 200
+                          and len(list_versions(annotation_store, patient_ids[0])) == count
+                          and backup_manager.stats["skipped_coalesced"] == coalesced + 1,
+                "versions": count,
+            }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    print(json.dumps({"benchmark": "backups_on_edit", "backend": args.backend, "results": results},
+                     ensure_ascii=False, indent=2))
+    return 0 if all(result["passed"] for result in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
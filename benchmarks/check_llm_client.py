@@ -0,0 +1,162 @@
+"""LLM客户端行为检查：在本地桩服务上验证重试、超时、熔断与连接复用
+
+依次运行以下场景，输出每个场景的结果 JSON，任一场景不符合预期时以非零状态退出：
+- ok: 正常调用（阻塞与流式）
+- retry: 桩服务 50% 返回 500，重试后应成功
+- timeout: 桩服务延迟超过客户端超时，应抛出 LLMTimeoutError
+- breaker: 桩服务全部失败，连续失败后应快速抛出 LLMCircuitOpenError，冷却后放行试探请求
+- probe_cancel: 试探请求的流被提前关闭时放弃这次试探，下一个请求仍可试探
+- concurrency: 并发调用数不超过并发上限
+
+用法:
+    python benchmarks/check_llm_client.py
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_llm import start_stub_server, StubConfig
+from llm_client import LLMClient, CircuitBreaker, LLMTimeoutError, LLMCircuitOpenError, LLMServerError
+
+def make_client(base_url, **kwargs):
+    options = {"timeout": 2.0, "max_retries": 3, "backoff": 0.05, "max_concurrency": 4,
+               "breaker": CircuitBreaker(threshold=3, cooldown=1.0)}
+    options.update(kwargs)
+    return LLMClient(base_url=base_url, model="stub", **options)
+
+def check_ok(base_url):
+    client = make_client(base_url)
+    text = client.complete("test")
+    streamed = "".join(client.stream("test"))
+    return {"passed": text == streamed.strip() and bool(text), "stats": client.get_stats()}
+
+def check_retry(base_url):
+    StubConfig.fail_rate = 0.5
+    client = make_client(base_url, max_retries=8, breaker=CircuitBreaker(threshold=100))
+    try:
+        results = [client.complete("test") for _ in range(5)]
+    finally:
+        StubConfig.fail_rate = 0.0
+    stats = client.get_stats()
+    return {"passed": all(results), "stats": stats}
+
+def check_timeout(base_url):
+    StubConfig.latency = 1.0
+    client = make_client(base_url, timeout=0.3, max_retries=1)
+    start = time.perf_counter()
+    try:
+        client.complete("test")
+        raised = None
+    except Exception as e:
+        raised = type(e).__name__
+    finally:
+        StubConfig.latency = 0.0
+    elapsed = time.perf_counter() - start
+    return {"passed": raised == LLMTimeoutError.__name__ and elapsed < 1.5,
+            "raised": raised, "elapsed_s": elapsed}
+
+def check_breaker(base_url):
+    StubConfig.fail_rate = 1.0
+    client = make_client(base_url, max_retries=0)
+    errors = []
+    try:
+        for _ in range(5):
+            try:
+                client.complete("test")
+            except Exception as e:
+                errors.append(type(e).__name__)
+        requests_before = StubConfig.requests
+        start = time.perf_counter()
+        try:
+            client.complete("test")
+        except LLMCircuitOpenError:
+            pass
+        fast_fail_ms = (time.perf_counter() - start) * 1000
+        rejected_without_request = StubConfig.requests == requests_before
+
+        # 冷却后恢复服务，试探请求成功则关闭熔断
+        StubConfig.fail_rate = 0.0
+        time.sleep(1.1)
+        recovered = bool(client.complete("test")) and client.breaker.state == "closed"
+    finally:
+        StubConfig.fail_rate = 0.0
+    expected = [LLMServerError.__name__] * 3 + [LLMCircuitOpenError.__name__] * 2
+    return {"passed": errors == expected and rejected_without_request and recovered,
+            "errors": errors, "fast_fail_ms": fast_fail_ms, "recovered": recovered}
+
+def check_probe_cancel(base_url):
+    StubConfig.fail_rate = 1.0
+    client = make_client(base_url, max_retries=0)
+    try:
+        for _ in range(3):
+            try:
+                client.complete("test")
+            except LLMServerError:
+                pass
+        opened = client.breaker.state == "open"
+
+        # 冷却后的试探请求读到第一个片段即关闭（如客户端断开），不算成功也不算失败
+        StubConfig.fail_rate = 0.0
+        time.sleep(1.1)
+        stream = client.stream("test")
+        first = next(stream)
+        stream.close()
+        released = not client.breaker.probing and client.breaker.state == "half_open"
+        try:
+            recovered = bool(client.complete("test")) and client.breaker.state == "closed"
+        except LLMCircuitOpenError:
+            recovered = False
+    finally:
+        StubConfig.fail_rate = 0.0
+    return {"passed": opened and bool(first) and released and recovered,
+            "released": released, "recovered": recovered, "in_flight": client.get_stats()["in_flight"]}
+
+def check_concurrency(base_url):
+    StubConfig.latency = 0.2
+    client = make_client(base_url, max_concurrency=2)
+    active = [0, 0]  # 当前并发数, 最大并发数
+    lock = threading.Lock()
+    original = client._create
+
+    def tracked_create(prompt, stream):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        try:
+            return original(prompt, stream)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    client._create = tracked_create
+    threads = [threading.Thread(target=client.complete, args=("test",)) for _ in range(6)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        StubConfig.latency = 0.0
+    return {"passed": active[1] <= 2, "max_active": active[1]}
+
+def main():
+    server, base_url = start_stub_server(latency=0.0, token_delay=0.0)
+    checks = [check_ok, check_retry, check_timeout, check_breaker, check_probe_cancel, check_concurrency]
+    results = {}
+    try:
+        for check in checks:
+            results[check.__name__[len("check_"):]] = check(base_url)
+    finally:
+        server.shutdown()
+    print(json.dumps({"benchmark": "llm_client", "results": results}, ensure_ascii=False, indent=2))
+    return 0 if all(result["passed"] for result in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""合成患者语料生成器
+
+按真实病历格式（Patient<sep>… / 各类问题行 / TreatmentPlan<sep>…）生成 N 名患者，
+同时生成对应的标注文件和动作库，供基准测试使用。相同的参数和 --seed 生成相同的语料（时间均相对生成时刻）。
+
+- 问题行取自样例病历，另按模板生成带牙位和测量值的行，每名患者 15~35 行
+- 诊疗方案由矫治方式和 3~8 个矫治步骤组成，格式与样例病历相同
+- --annotated 比例的患者有人工标注（动作关联到问题），--auto 比例只有自动生成的动作，其余未标注；
+  标注文件的修改时间分散在过去 30 天内，最近编辑的患者可确定
+- 动作库包含标注中用到的动作，并补足到 --library 条
+
+用法:
+    python benchmarks/corpus.py --output /tmp/corpus --patients 10000 [--annotated 0.6] [--auto 0.2] [--library 1000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Dict, Any, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_analytics import sample_lines
+from bench_library import synthetic_actions
+
+APPLIANCES = ["隐形矫治", "固定矫治", "自锁托槽矫治", "隐形矫治、不拔牙矫治", "固定矫治、拔牙矫治"]
+STEPS = [
+    "上下唇倾排齐，解除拥挤及扭转", "后牙锁合先利用矫治器纠正，若无法完成则利用交互牵引纠正", "维持磨牙关系",
+    "智齿酌情", "正畸保持", "拔除4颗第一前磨牙", "强支抗内收前牙，改善突度", "压低上前牙，打开咬合",
+    "扩弓，改善牙弓宽度", "关闭间隙", "纠正中线", "推磨牙向远中", "片切，解除轻度拥挤", "直立下颌磨牙",
+    "调整尖牙关系至中性", "精细调整咬合",
+]
+TOOTH_PROBLEMS = ["缺失", "可见", "RCT后", "全冠修复", "阻生", "扭转", "龋坏"]
+CROWDING = ["轻度", "中度", "重度"]
+TEETH = [f"{q}{i}" for q in range(1, 5) for i in range(1, 9)]
+DAY = 86400
+
+def problem_line(lines: List[str], rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.15:
+        return f"Tooth<sep>{rng.choice(TEETH)}<sep>问题:{rng.choice(TOOTH_PROBLEMS)}"
+    if kind < 0.25:
+        jaw = rng.choice(["上", "下"])
+        return f"Dental<sep>{jaw}牙列{rng.choice(CROWDING)}拥挤<sep>拥挤度:{rng.randint(1, 20) / 2}mm"
+    return rng.choice(lines)
+
+def treatment_plan(rng: random.Random) -> str:
+    steps = rng.sample(STEPS, rng.randint(3, 8))
+    body = "\n".join(f"{i + 1}. {step}" for i, step in enumerate(steps))
+    return (f"TreatmentPlan<sep>{rng.choice(APPLIANCES)}<sep>id:1<sep>矫治目标:无<sep>矫治步骤:{body}"
+            f"<sep>矫治费用:{rng.randint(10, 60) * 1000}元")
+
+def patient_text(patient_id: str, lines: List[str], rng: random.Random) -> Tuple[str, int]:
+    """返回 (病历文本, 问题数)"""
+    problems = [problem_line(lines, rng) for _ in range(rng.randint(15, 35))]
+    text = "\n".join([f"Patient<sep>合成{patient_id}<sep>ID:{patient_id}"] + problems + [treatment_plan(rng)]) + "\n"
+    return text, len(problems)
+
+def annotation_for(patient_id: str, problem_count: int, actions: List[str], rng: random.Random,
+                   manual: bool, modified: float) -> Dict[str, Any]:
+    """人工标注：每个动作关联 1~3 个问题；自动生成：只有动作"""
+    texts = rng.sample(actions, min(len(actions), rng.randint(4, 10)))
+    solutions = [{"id": f"action-{i}", "text": text} for i, text in enumerate(texts)]
+    if not manual:
+        return {"patient_id": patient_id, "annotations": {}, "solutions": solutions,
+                "next_action_id": len(solutions), "auto_generated": True, "generated_time": modified}
+    links = {solution["id"]: [f"problem-{i}" for i in rng.sample(range(problem_count), min(problem_count, rng.randint(1, 3)))]
+             for solution in solutions}
+    return {"patient_id": patient_id, "annotations": links, "solutions": solutions,
+            "last_modified": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(modified)), "version": "1.0"}
+
+def generate_corpus(data_dir: str, patients: int, annotated: float = 0.6, auto: float = 0.2,
+                    library: int = 1000, seed: int = 0) -> Dict[str, Any]:
+    """在 data_dir 中生成语料，返回各类患者的数量和最近编辑的患者"""
+    rng = random.Random(seed)
+    lines = sample_lines()
+    actions = synthetic_actions(max(library, 50))
+    # 标注中常用的动作集中在动作库前部，与真实分布（少数动作占多数）接近
+    common = actions[:max(50, library // 10)]
+    patients_dir = os.path.join(data_dir, "patients")
+    annotations_dir = os.path.join(data_dir, "annotations")
+    os.makedirs(patients_dir, exist_ok=True)
+    os.makedirs(annotations_dir, exist_ok=True)
+
+    now = time.time()
+    counts = {"patients": patients, "annotated": 0, "auto_generated": 0, "unannotated": 0}
+    last_edited = (None, 0.0)
+    for i in range(patients):
+        patient_id = f"p{i:06d}"
+        text, problem_count = patient_text(patient_id, lines, rng)
+        with open(os.path.join(patients_dir, f"{patient_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+        kind = rng.random()
+        if kind >= annotated + auto:
+            counts["unannotated"] += 1
+            continue
+        manual = kind < annotated
+        counts["annotated" if manual else "auto_generated"] += 1
+        path = os.path.join(annotations_dir, f"{patient_id}.json")
+        mtime = now - rng.random() * 30 * DAY
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(annotation_for(patient_id, problem_count, common, rng, manual, mtime), f, ensure_ascii=False)
+        os.utime(path, (mtime, mtime))
+        if mtime > last_edited[1]:
+            last_edited = (patient_id, mtime)
+
+    with open(os.path.join(data_dir, "action_library.json"), "w", encoding="utf-8") as f:
+        json.dump(actions[:library], f, ensure_ascii=False)
+    counts["library"] = library
+    counts["last_edited"] = last_edited[0]
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成患者语料")
+    parser.add_argument("--output", "-o", required=True, help="数据目录（可作为 ANNOTATION_DATA_DIR）")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--annotated", type=float, default=0.6, help="人工标注的患者比例")
+    parser.add_argument("--auto", type=float, default=0.2, help="只有自动生成动作的患者比例")
+    parser.add_argument("--library", type=int, default=1000, help="动作库条数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate_corpus(args.output, args.patients, args.annotated, args.auto, args.library, args.seed)
+    print(json.dumps({**counts, "output": args.output, "elapsed_s": time.perf_counter() - start},
+                     ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
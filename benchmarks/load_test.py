@@ -0,0 +1,173 @@
+"""多进程服务器负载测试：模拟多名标注员同时工作
+
+在临时数据目录和本地桩LLM上以子进程启动 python app.py serve，K 个线程各模拟一名标注员，
+依次对自己的患者执行：获取患者数据、流式生成动作、添加一个动作；每轮还向同一个共享患者
+添加一个动作。结束后检查共享患者的动作数和动作库是否包含全部新增动作（跨进程无丢失写入），
+并以 JSON 输出各接口的 p50/p99 延迟。
+
+用法:
+    python benchmarks/load_test.py [--annotators 8] [--rounds 5] [--workers 4] [--threads 8] [--waitress]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+import urllib.request
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_llm import start_stub_server
+
+SAMPLE_PATIENT = os.path.join(ROOT_DIR, "data", "patients", "test_stream.txt")
+SHARED_PATIENT = "shared"
+
+def prepare_data_dir(patient_ids) -> str:
+    """创建包含样例患者的临时数据目录（诊疗方案各不相同）"""
+    data_dir = tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(os.path.join(data_dir, "patients"))
+    with open(SAMPLE_PATIENT, "r", encoding="utf-8") as f:
+        content = f.read().rstrip()
+    for i, patient_id in enumerate(patient_ids):
+        with open(os.path.join(data_dir, "patients", f"{patient_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{content}\n第{i}次复诊时酌情调整\n")
+    return data_dir
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def request(base_url: str, path: str, method: str = "GET", body=None, timeout: float = 120):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={"Content-Type": "application/json"} if data else {})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return response.read()
+
+def wait_ready(base_url: str, process, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("服务器启动失败")
+        try:
+            request(base_url, "/api/jobs/stats", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("等待服务器启动超时")
+
+def annotator(base_url: str, index: int, patient_ids, timings, errors, lock):
+    """一名标注员：逐个打开患者、等待生成完成、添加动作"""
+    def timed(name, path, method="GET", body=None):
+        start = time.perf_counter()
+        try:
+            result = request(base_url, path, method, body)
+        except Exception as e:
+            with lock:
+                errors[name] += 1
+            print(f"标注员{index} {name} 失败: {e}")
+            return None
+        with lock:
+            timings[name].append(time.perf_counter() - start)
+        return result
+
+    for round_index, patient_id in enumerate(patient_ids):
+        timed("patient", f"/api/patient/{patient_id}")
+        stream = timed("stream", f"/api/patient/{patient_id}/stream-actions")
+        if stream is not None and b'"complete"' not in stream:
+            with lock:
+                errors["stream_incomplete"] += 1
+        timed("add_action", f"/api/action/add/{patient_id}", "POST",
+              {"text": f"负载测试动作{index}-{round_index}"})
+        timed("add_shared", f"/api/action/add/{SHARED_PATIENT}", "POST",
+              {"text": f"共享患者动作{index}-{round_index}"})
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程服务器负载测试")
+    parser.add_argument("--annotators", type=int, default=8, help="同时工作的标注员数")
+    parser.add_argument("--rounds", type=int, default=5, help="每名标注员处理的患者数")
+    parser.add_argument("--workers", type=int, default=4, help="服务器进程数")
+    parser.add_argument("--threads", type=int, default=8, help="每个进程的线程数")
+    parser.add_argument("--waitress", action="store_true", help="使用 waitress 单进程服务器")
+    parser.add_argument("--latency", type=float, default=0.5, help="桩LLM首个token前的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="桩LLM每个片段的间隔（秒）")
+    args = parser.parse_args()
+
+    stub, llm_url = start_stub_server(latency=args.latency, token_delay=args.token_delay, echo_plan=True)
+    assignments = [[f"a{a:02d}_{r:03d}" for r in range(args.rounds)] for a in range(args.annotators)]
+    data_dir = prepare_data_dir([pid for ids in assignments for pid in ids] + [SHARED_PATIENT])
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, os.path.join(ROOT_DIR, "app.py"), "serve", "--port", str(port),
+               "--workers", str(args.workers), "--threads", str(args.threads)]
+    if args.waitress:
+        command.append("--waitress")
+    env = {**os.environ, "OPENAI_BASE_URL": llm_url, "ANNOTATION_DATA_DIR": data_dir}
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    try:
+        wait_ready(base_url, process)
+        start = time.perf_counter()
+        threads = [threading.Thread(target=annotator, args=(base_url, i, ids, timings, errors, lock))
+                   for i, ids in enumerate(assignments)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        # 跨进程写入检查：共享患者的动作和动作库都不应丢失
+        shared = json.loads(request(base_url, f"/api/patient/{SHARED_PATIENT}"))
+        expected = {f"共享患者动作{a}-{r}" for a in range(args.annotators) for r in range(args.rounds)}
+        shared_texts = {s["text"] for s in shared["solutions"]}
+        shared_ids = [s["id"] for s in shared["solutions"]]
+        with open(os.path.join(data_dir, "action_library.json"), "r", encoding="utf-8") as f:
+            library = set(json.load(f))
+        expected_library = expected | {f"负载测试动作{a}-{r}" for a in range(args.annotators)
+                                       for r in range(args.rounds)}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        stub.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    result = {
+        "benchmark": "load_test",
+        "params": vars(args),
+        "elapsed_s": elapsed,
+        "endpoints": {
+            name: {"count": len(values), "mean": statistics.mean(values),
+                   "p50": percentile(values, 0.5), "p99": percentile(values, 0.99)}
+            for name, values in sorted(timings.items())
+        },
+        "errors": dict(errors),
+        "consistency": {
+            "shared_missing": len(expected - shared_texts),
+            "shared_duplicate_ids": len(shared_ids) - len(set(shared_ids)),
+            "library_missing": len(expected_library - library),
+        },
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""基准测试套件：在合成语料上运行各项基准，结果写成 JSON 以便比较不同版本
+
+各项基准各自在子进程中运行（模块级的索引和缓存不会互相影响，冷启动耗时可测）：
+
+- parse：parse_patient_file 的吞吐量（患者/秒、MB/秒）
+- listing：--sizes 各规模下患者列表（全量 / 分页 / 按状态）和最近编辑患者接口的耗时，含首次请求（建索引）
+- save：开启备份时保存标注（/api/save）的耗时，同一患者反复保存时合并窗口内不再备份
+- library：--library-sizes 各规模动作库下添加动作（写回动作库）、相关动作检索的耗时和提示词大小
+- sse：本地桩LLM上流式生成的首个动作到达时间（TTFA）与总耗时
+- startup：--sizes 各规模下从导入应用到第一次患者列表返回的耗时、第一次保存的耗时，
+  依次为 lazy（第一个请求时建立索引）、background（后台扫描，完成后写入快照）、snapshot（从快照恢复）
+
+语料由 corpus.py 生成，同一规模的语料在各项基准之间复用。结果写入 --output
+（默认 benchmarks/results/<时间>-<提交>.json），--compare 给出与之前结果的差异。
+
+用法:
+    python benchmarks/run_suite.py [--sizes 1000 10000 100000] [--cases parse listing save library sse startup]
+    python benchmarks/run_suite.py --quick --compare benchmarks/results/old.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+CASES = ("parse", "listing", "save", "library", "sse", "startup")
+# startup 的各启动方式：(名称, ANNOTATION_WARMUP)，snapshot 使用 background 写入的快照
+STARTUP_MODES = (("lazy", "lazy"), ("background", "background"), ("snapshot", "background"))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+# 子进程输出中结果行的前缀（应用本身也会向标准输出打印日志）
+RESULT_MARKER = "SUITE_RESULT "
+
+def summary(values):
+    """耗时列表（秒）的统计，单位毫秒"""
+    values = sorted(values)
+    return {"count": len(values),
+            "mean_ms": statistics.mean(values) * 1000,
+            "p50_ms": values[len(values) // 2] * 1000,
+            "p99_ms": values[min(len(values) - 1, int(len(values) * 0.99))] * 1000}
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+# ---- 各项基准（在子进程中运行，ANNOTATION_DATA_DIR 指向语料目录）----
+
+def case_parse(data_dir: str, params):
+    from patient_parser import parse_patient_file
+    patients_dir = os.path.join(data_dir, "patients")
+    contents = []
+    for name in sorted(os.listdir(patients_dir)):
+        with open(os.path.join(patients_dir, name), "r", encoding="utf-8") as f:
+            contents.append(f.read())
+    size_mb = sum(len(content.encode("utf-8")) for content in contents) / 1024 / 1024
+    runs = []
+    for _ in range(params["repeat"]):
+        elapsed, _ = timed(lambda: [parse_patient_file(content) for content in contents])
+        runs.append(elapsed)
+    best = min(runs)
+    return {"patients": len(contents), "input_mb": size_mb, "best_s": best,
+            "patients_per_s": len(contents) / best, "mb_per_s": size_mb / best,
+            "us_per_patient": best / len(contents) * 1e6}
+
+def case_listing(data_dir: str, params):
+    import app
+    client = app.app.test_client()
+    requests = params["requests"]
+
+    def get(path):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+        return response.get_json()
+
+    cold_s, patients = timed(get, "/api/patients")
+    result = {"cold_list_ms": cold_s * 1000, "patients": len(patients["patients"])}
+    paths = {
+        "list_all": "/api/patients",
+        "page": "/api/patients?limit=100",
+        "page_annotated": "/api/patients?limit=100&status=annotated",
+        "page_deep": f"/api/patients?limit=100&start={patients['patients'][len(patients['patients']) // 2]}",
+        "last_edited": "/api/last-edited-patient",
+    }
+    for name, path in paths.items():
+        result[name] = summary([timed(get, path)[0] for _ in range(requests)])
+    last_edited = get("/api/last-edited-patient")["patient_id"]
+    result["last_edited_correct"] = last_edited == params.get("last_edited")
+    return result
+
+def case_save(data_dir: str, params):
+    import app
+    from annotation_store import annotation_store
+    from storage import BACKUP_DIR
+    client = app.app.test_client()
+    patient_ids = [name[:-5] for name in sorted(os.listdir(os.path.join(data_dir, "annotations")))]
+    patient_ids = patient_ids[:params["patients"]]
+    backups_before = len(os.listdir(BACKUP_DIR)) if os.path.isdir(BACKUP_DIR) else 0
+
+    def save(patient_id, index):
+        data = annotation_store.load(patient_id)
+        data["solutions"].append({"id": f"action-bench-{index}", "text": f"基准动作{index % 20}"})
+        response = client.post(f"/api/save/{patient_id}", json=data)
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    # 不同患者各保存一次；同一患者连续保存（合并窗口内跳过备份）
+    spread = [timed(save, patient_id, i)[0] for i, patient_id in enumerate(patient_ids)]
+    repeated = [timed(save, patient_ids[0], i)[0] for i in range(params["repeat_saves"])]
+    return {
+        "backend": os.environ.get("ANNOTATION_STORAGE", "json"),
+        "save_distinct_patients": summary(spread),
+        "save_same_patient": summary(repeated),
+        "backups_created": (len(os.listdir(BACKUP_DIR)) if os.path.isdir(BACKUP_DIR) else 0) - backups_before,
+    }
+
+def case_library(data_dir: str, params):
+    import app
+    from action_library import library_index
+    from standardizer import build_standardize_prompt
+    from bench_library import estimate_tokens
+    client = app.app.test_client()
+    patient_id = sorted(os.listdir(os.path.join(data_dir, "annotations")))[0][:-5]
+    plan = app.patient_index.get_parsed(patient_id)["treatment_plan"]
+
+    load_s, _ = timed(library_index.warm)
+    actions = library_index.all_actions()
+
+    def add(index):
+        response = client.post(f"/api/action/add/{patient_id}", json={"text": f"库增长动作{index}"})
+        assert response.status_code == 200
+
+    adds = [timed(add, i)[0] for i in range(params["requests"])]
+    relevant = [timed(library_index.relevant_actions, plan) for _ in range(params["requests"])]
+    return {
+        "library": len(actions),
+        "index_build_ms": load_s * 1000,
+        "add_action": summary(adds),
+        "relevant_lookup": summary([elapsed for elapsed, _ in relevant]),
+        "full_prompt_tokens": estimate_tokens(build_standardize_prompt(plan, library_index.all_actions())),
+        "pruned_prompt_tokens": estimate_tokens(build_standardize_prompt(plan, relevant[0][1])),
+    }
+
+def case_sse(data_dir: str, params):
+    from stub_llm import start_stub_server
+    from bench_stream import measure_stream
+    server, base_url = start_stub_server(latency=params["latency"], token_delay=params["token_delay"])
+    os.environ["OPENAI_BASE_URL"] = base_url
+    import app
+    client = app.app.test_client()
+    patient_ids = sorted(name[:-4] for name in os.listdir(os.path.join(data_dir, "patients")))
+    result = {}
+    try:
+        # 默认流程（规则预标准化 + LLM）与只用LLM，均跳过响应缓存
+        for name, query in (("default", "bypass_cache=true"), ("llm_only", "bypass_cache=true&rules=false")):
+            ttfa, total = [], []
+            for patient_id in patient_ids[:params["runs"]]:
+                first, elapsed, _ = measure_stream(client, f"/api/patient/{patient_id}/stream-actions?{query}")
+                if first is not None:
+                    ttfa.append(first)
+                total.append(elapsed)
+            result[name] = {"time_to_first_action": summary(ttfa) if ttfa else None, "total": summary(total)}
+    finally:
+        server.shutdown()
+    return result
+
+def case_startup(data_dir: str, params):
+    start = time.perf_counter()
+    import app
+    from warmup import warmup
+    from annotation_store import annotation_store
+    import_s = time.perf_counter() - start
+    client = app.app.test_client()
+    app.start_warmup()
+    if warmup.state != "idle":
+        warmup.ready.wait()
+    list_s, response = timed(client.get, "/api/patients")
+    assert response.status_code == 200
+    first_list_s = time.perf_counter() - start
+
+    # 第一次保存（新增动作写入动作库）
+    patient_id = sorted(os.listdir(os.path.join(data_dir, "annotations")))[0][:-5]
+    data = annotation_store.load(patient_id)
+    data["solutions"].append({"id": "action-startup", "text": "启动基准动作"})
+    save_s, response = timed(client.post, f"/api/save/{patient_id}", json=data)
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    # 等待就绪后的核对和快照写入完成，下一次运行才能使用快照
+    deadline = time.time() + 300
+    while warmup.state == "ready" and "save" not in warmup.timings and time.time() < deadline:
+        time.sleep(0.05)
+    return {
+        "import_ms": import_s * 1000,
+        "time_to_first_list_ms": first_list_s * 1000,
+        "first_list_ms": list_s * 1000,
+        "first_save_ms": save_s * 1000,
+        "patients": len(app.patient_index.patient_ids()),
+        "warmup": warmup.status(),
+    }
+
+CASE_FUNCTIONS = {"parse": case_parse, "listing": case_listing, "save": case_save,
+                  "library": case_library, "sse": case_sse, "startup": case_startup}
+
+# ---- 调度 ----
+
+def run_case(case: str, data_dir: str, params, env=None):
+    """在子进程中运行一项基准并取回结果"""
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", case, "--data-dir", data_dir,
+               "--params", json.dumps(params, ensure_ascii=False)]
+    env = {**os.environ, "ANNOTATION_DATA_DIR": data_dir, **(env or {})}
+    process = subprocess.run(command, env=env, capture_output=True, text=True, cwd=ROOT_DIR)
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return {"error": (process.stderr or process.stdout).strip().splitlines()[-5:]}
+
+def prepare_corpus(corpora, work_dir: str, patients: int, library: int, seed: int):
+    """生成（或复用）指定规模的语料，返回 (目录, 生成信息)"""
+    # 在此处导入：corpus 会间接导入应用模块，子进程中须先设置好环境变量
+    from corpus import generate_corpus
+    key = (patients, library)
+    if key not in corpora:
+        data_dir = os.path.join(work_dir, f"corpus_{patients}_{library}")
+        elapsed, info = timed(generate_corpus, data_dir, patients, library=library, seed=seed)
+        corpora[key] = (data_dir, {**info, "generate_s": elapsed})
+    return corpora[key]
+
+def fresh_copy(source: str, target: str) -> str:
+    """会修改数据的基准在语料副本上运行"""
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(source, target)
+    return target
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+def flatten(prefix: str, value, result):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(f"{prefix}.{key}" if prefix else str(key), item, result)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        result[prefix] = value
+    return result
+
+def compare(current, baseline):
+    """逐项比较耗时（_ms/_s）和吞吐量（per_s），change 为正表示变慢"""
+    old = flatten("", baseline["results"], {})
+    new = flatten("", current["results"], {})
+    changes = {}
+    for key in sorted(old.keys() & new.keys()):
+        if not old[key]:
+            continue
+        if key.endswith("per_s"):
+            change = old[key] / new[key] - 1 if new[key] else None
+        elif key.endswith("_ms") or key.endswith("_s"):
+            change = new[key] / old[key] - 1
+        else:
+            continue
+        changes[key] = {"baseline": old[key], "current": new[key], "change": change}
+    return {"baseline_commit": baseline["meta"].get("commit"), "metrics": changes}
+
+def main():
+    parser = argparse.ArgumentParser(description="基准测试套件")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="listing 的患者规模（save 使用最大规模）")
+    parser.add_argument("--library-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--parse-patients", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=50, help="每个接口的请求次数")
+    parser.add_argument("--saves", type=int, default=50, help="保存次数")
+    parser.add_argument("--sse-runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5, help="桩LLM首个token前的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="桩LLM每个片段的间隔（秒）")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json", help="save 使用的存储后端")
+    parser.add_argument("--quick", action="store_true", help="小规模快速运行（1k/10k，库 1k/10k）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", help="结果文件")
+    parser.add_argument("--compare", help="与之前的结果文件比较")
+    parser.add_argument("--run-case", choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--params", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        result = CASE_FUNCTIONS[args.run_case](args.data_dir, json.loads(args.params))
+        print(RESULT_MARKER + json.dumps(result, ensure_ascii=False))
+        return
+    if args.quick:
+        args.sizes = [size for size in args.sizes if size <= 10000] or [1000]
+        args.library_sizes = [size for size in args.library_sizes if size <= 10000] or [1000]
+
+    started = time.time()
+    work_dir = tempfile.mkdtemp(prefix="bench_suite_")
+    corpora = {}
+    results = {}
+    try:
+        if "parse" in args.cases:
+            data_dir, _ = prepare_corpus(corpora, work_dir, args.parse_patients, 1000, args.seed)
+            results["parse"] = run_case("parse", data_dir, {"repeat": 3})
+        if "listing" in args.cases:
+            results["listing"] = {}
+            for size in args.sizes:
+                data_dir, info = prepare_corpus(corpora, work_dir, size, 1000, args.seed)
+                results["listing"][str(size)] = run_case(
+                    "listing", data_dir, {"requests": args.requests, "last_edited": info["last_edited"]})
+        if "startup" in args.cases:
+            results["startup"] = {}
+            for size in args.sizes:
+                data_dir, _ = prepare_corpus(corpora, work_dir, size, 1000, args.seed)
+                copy = fresh_copy(data_dir, os.path.join(work_dir, "startup"))
+                results["startup"][str(size)] = {
+                    name: run_case("startup", copy, {}, {"ANNOTATION_WARMUP": mode}) for name, mode in STARTUP_MODES}
+        if "save" in args.cases:
+            size = max(args.sizes)
+            # 最后使用该语料的基准，直接在语料上修改
+            data_dir, _ = prepare_corpus(corpora, work_dir, size, 1000, args.seed)
+            results["save"] = {"patients": size, **run_case(
+                "save", data_dir, {"patients": args.saves, "repeat_saves": args.saves},
+                {"ANNOTATION_STORAGE": args.backend})}
+        if "library" in args.cases:
+            results["library"] = {}
+            for library in args.library_sizes:
+                data_dir, _ = prepare_corpus(corpora, work_dir, 200, library, args.seed)
+                copy = fresh_copy(data_dir, os.path.join(work_dir, "library"))
+                results["library"][str(library)] = run_case("library", copy, {"requests": args.requests})
+        if "sse" in args.cases:
+            data_dir, _ = prepare_corpus(corpora, work_dir, 200, 1000, args.seed)
+            copy = fresh_copy(data_dir, os.path.join(work_dir, "sse"))
+            results["sse"] = run_case("sse", copy, {"runs": args.sse_runs, "latency": args.latency,
+                                                     "token_delay": args.token_delay})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    # 语料生成耗时不属于比较的指标，记在 meta 中
+    corpus_seconds = {f"{patients}/{library}": info["generate_s"] for (patients, library), (_, info) in corpora.items()}
+
+    commit = git_commit()
+    report = {
+        "suite": "annotation_tool",
+        "meta": {
+            "commit": commit,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "elapsed_s": time.time() - started,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "corpus_generate_s": corpus_seconds,
+        },
+        "params": {key: value for key, value in vars(args).items()
+                   if key not in ("run_case", "data_dir", "params", "output", "compare")},
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["compare"] = compare(report, json.load(f))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(started))}-{commit}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"结果已写入 {output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
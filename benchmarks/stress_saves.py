@@ -0,0 +1,112 @@
+"""并发保存压力测试：检查并发添加动作、保存标注后没有丢失
+
+在临时数据目录中启动应用，多个线程同时：
+- 向同一批患者添加动作（/api/action/add，测试单个患者的读-改-写）
+- 保存整份标注（/api/save，测试动作库并发追加）
+结束后检查每个患者的标注和动作库中包含了全部写入的动作，并输出 JSON 结果。
+任何丢失都会以非零状态退出。
+
+用法:
+    python benchmarks/stress_saves.py [--threads 16] [--ops 50] [--patients 4] [--backend json|sqlite]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+SAMPLE_PATIENT = os.path.join(ROOT_DIR, "data", "patients", "00001.txt")
+
+def prepare_data_dir(patients: int) -> str:
+    """创建包含若干样例患者的临时数据目录"""
+    data_dir = tempfile.mkdtemp(prefix="stress_saves_")
+    os.makedirs(os.path.join(data_dir, "patients"))
+    for i in range(patients):
+        shutil.copy(SAMPLE_PATIENT, os.path.join(data_dir, "patients", f"p{i:03d}.txt"))
+    return data_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="并发保存压力测试")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=50, help="每个线程的操作次数")
+    parser.add_argument("--patients", type=int, default=4)
+    parser.add_argument("--backend", default="json", choices=["json", "sqlite"])
+    args = parser.parse_args()
+
+    data_dir = prepare_data_dir(args.patients)
+    os.environ["ANNOTATION_DATA_DIR"] = data_dir
+    os.environ["ANNOTATION_STORAGE"] = args.backend
+
+    import app
+    from annotation_store import annotation_store
+    from action_library import library_index
+    from storage import ACTION_LIBRARY_FILE, load_action_library
+
+    patient_ids = [f"p{i:03d}" for i in range(args.patients)]
+    added = {pid: [] for pid in patient_ids}
+    saved_actions = []
+    errors = []
+    record_lock = threading.Lock()
+
+    def worker(thread_id):
+        client = app.app.test_client()
+        for op in range(args.ops):
+            pid = patient_ids[(thread_id + op) % len(patient_ids)]
+            if op % 5 == 4:
+                # 整份保存写入另一个患者ID，只检查动作库是否收录
+                text = f"保存动作-{thread_id}-{op}"
+                response = client.post(f"/api/save/stress-save-{thread_id}", json={
+                    "annotations": {}, "solutions": [{"id": "action-0", "text": text}]})
+                if response.status_code == 200:
+                    with record_lock:
+                        saved_actions.append(text)
+            else:
+                text = f"添加动作-{thread_id}-{op}"
+                response = client.post(f"/api/action/add/{pid}", json={"text": text})
+                if response.status_code == 200:
+                    with record_lock:
+                        added[pid].append(text)
+            if response.status_code != 200:
+                with record_lock:
+                    errors.append(response.get_data(as_text=True))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    lost_annotations = 0
+    for pid, texts in added.items():
+        stored = {s["text"] for s in (annotation_store.load(pid) or {}).get("solutions", [])}
+        lost_annotations += sum(1 for text in texts if text not in stored)
+    library_on_disk = set(load_action_library(ACTION_LIBRARY_FILE))
+    expected_library = [t for texts in added.values() for t in texts] + saved_actions
+    lost_library = sum(1 for text in expected_library if text not in library_on_disk)
+
+    result = {
+        "benchmark": "stress_saves",
+        "params": vars(args),
+        "operations": args.threads * args.ops,
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "ops_per_s": args.threads * args.ops / elapsed,
+        "lost_annotation_actions": lost_annotations,
+        "lost_library_actions": lost_library,
+        "library": library_index.get_stats(),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return 1 if errors or lost_annotations or lost_library else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""本地 OpenAI 兼容桩服务，用于在不访问真实LLM的情况下测试与压测
+
+用法:
+    python benchmarks/stub_llm.py [--port 8001] [--latency 1.0] [--token-delay 0.05] [--fail-rate 0]
+
+然后以 OPENAI_BASE_URL=http://127.0.0.1:8001/v1 启动 app.py 或批量预生成。
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ACTIONS = [
+    "排齐上颌牙列",
+    "排齐下颌牙列",
+    "解除拥挤",
+    "纠正扭转牙",
+    "纠正后牙锁合",
+    "维持磨牙关系",
+    "拔除智齿",
+    "正畸保持",
+]
+
+class StubConfig:
+    latency = 1.0       # 首个token前的等待（秒）
+    token_delay = 0.05  # 流式输出每个片段的间隔（秒）
+    fail_rate = 0.0     # 随机返回500的比例
+    echo_plan = False   # 为提示词中诊疗方案的每一行输出一个动作（输出长度随输入变化）
+    actions = DEFAULT_ACTIONS
+    requests = 0
+    lock = threading.Lock()
+
+PLAN_MARKER = "请将以下治疗计划拆分为标准化的诊疗动作："
+
+def plan_actions(body):
+    """从提示词中取出诊疗方案，每行生成一个动作"""
+    prompt = body.get("messages", [{}])[-1].get("content", "")
+    plan = prompt.split(PLAN_MARKER)[-1]
+    return [f"执行{line.strip()[:20]}" for line in plan.split("\n") if line.strip()] or DEFAULT_ACTIONS
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            pass  # 客户端超时断开
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with StubConfig.lock:
+            StubConfig.requests += 1
+
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self.send_error(404)
+            return
+        if random.random() < StubConfig.fail_rate:
+            self.send_json(500, {"error": {"message": "stub failure", "type": "server_error"}})
+            return
+
+        time.sleep(StubConfig.latency)
+        actions = plan_actions(body) if StubConfig.echo_plan else StubConfig.actions
+        content = "\n".join(actions)
+        model = body.get("model", "stub")
+        if body.get("stream"):
+            self.stream_content(model, content)
+        else:
+            # 非流式响应也需等待完整生成时间（每个动作两个片段）
+            time.sleep(StubConfig.token_delay * 2 * len(actions))
+            self.send_json(200, {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_content(self, model, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        # 每个动作拆成两个片段发送，模拟 token 级输出
+        pieces = []
+        for line in content.split("\n"):
+            half = max(1, len(line) // 2)
+            pieces.extend([line[:half], line[half:] + "\n"])
+        for piece in pieces:
+            self.write_chunk(model, {"content": piece}, None)
+            time.sleep(StubConfig.token_delay)
+        self.write_chunk(model, {}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def write_chunk(self, model, delta, finish_reason):
+        chunk = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+def start_stub_server(port=0, latency=1.0, token_delay=0.05, fail_rate=0.0, echo_plan=False):
+    """在后台线程启动桩服务，返回 (server, base_url)"""
+    StubConfig.echo_plan = echo_plan
+    StubConfig.latency = latency
+    StubConfig.token_delay = token_delay
+    StubConfig.fail_rate = fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容桩服务")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.latency, args.token_delay, args.fail_rate)
+    print(f"桩服务已启动: OPENAI_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
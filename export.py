@@ -0,0 +1,251 @@
+"""标注批量导出（训练数据）
+
+把每个患者解析后的问题（parse_patient_file）与诊疗动作、关联合并为一条记录，
+写成 JSONL（每行一名患者）或列式 Parquet（需要 pyarrow）。
+
+- 患者按块分给多个进程读取和解析，主进程按顺序写出；同时在处理中的块数有上限，内存占用与患者总数无关
+- 增量导出：只导出标注修改时间晚于上次导出的患者，导出状态记在 data/exports/state.json
+
+用法:
+    python app.py export --output out.jsonl [--format jsonl|parquet] [--workers N] [--incremental [--name NAME]] [--since NS]
+
+HTTP: GET /api/export?format=jsonl&since=<ns>，响应头 X-Export-Cursor 为下次增量导出的 since。
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from storage import DATA_DIR, PATIENTS_DIR, write_json_atomic, file_lock
+from patient_parser import parse_patient_file
+from annotation_store import annotation_store
+
+# pyarrow 导入较慢，只有 Parquet 格式需要，首次使用时由 load_dependencies() 导入
+pa = pq = None
+
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+EXPORT_STATE_FILE = os.path.join(EXPORT_DIR, "state.json")
+# 每个进程一次处理的患者数（也是 Parquet 的行组大小）
+EXPORT_CHUNK_SIZE = getattr(config, "EXPORT_CHUNK_SIZE", 500)
+# 命令行默认进程数；HTTP 导出在服务器进程中进行，默认少用几个进程
+EXPORT_WORKERS = getattr(config, "EXPORT_WORKERS", os.cpu_count() or 1)
+EXPORT_HTTP_WORKERS = getattr(config, "EXPORT_HTTP_WORKERS", 2)
+FORMATS = ("jsonl", "parquet")
+MISSING_DEPENDENCY = "Parquet 导出需要 pyarrow，请安装: pip install pyarrow"
+
+def load_dependencies() -> bool:
+    """导入 pyarrow，未安装时返回 False"""
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:  # 可选依赖
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+def build_record(patient_id: str, parsed: Dict[str, Any], annotation_data: Dict[str, Any],
+                 mtime: int) -> Dict[str, Any]:
+    """一名患者的导出记录：问题、动作及每个动作关联的问题"""
+    links = annotation_data.get("annotations") or {}
+    return {
+        "patient_id": patient_id,
+        "revision": annotation_data.get("revision", 0),
+        "modified_ns": mtime,
+        "auto_generated": bool(annotation_data.get("auto_generated")),
+        "treatment_plan": parsed["treatment_plan"],
+        "problems": [{
+            "id": problem["id"],
+            "type": problem.get("type") or "",
+            "label": problem.get("label", ""),
+            "text": problem.get("text") or "",
+        } for problem in parsed["problems"]],
+        "solutions": [{
+            "id": solution["id"],
+            "text": solution.get("text", ""),
+            "problem_ids": list(links.get(solution["id"], [])),
+        } for solution in annotation_data.get("solutions", [])],
+    }
+
+def load_records(items: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """读取并合并一块患者（在工作进程中运行），病历或标注已不存在的跳过"""
+    records = []
+    for patient_id, mtime in items:
+        try:
+            with open(os.path.join(PATIENTS_DIR, f"{patient_id}.txt"), 'r', encoding='utf-8') as f:
+                parsed = parse_patient_file(f.read())
+            annotation_data = annotation_store.load(patient_id)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            logging.warning(f"导出时读取患者失败 {patient_id}: {e}")
+            continue
+        if annotation_data is not None:
+            records.append(build_record(patient_id, parsed, annotation_data, mtime))
+    return records
+
+def select_patients(since: Optional[int] = None) -> Tuple[List[Tuple[str, int]], int]:
+    """返回 ([(患者ID, 标注修改时间)], 游标)；游标为本次涉及的最大修改时间，下次以它作为 since"""
+    mtimes = annotation_store.scan()
+    cursor = max(mtimes.values(), default=since or 0)
+    items = sorted((pid, mtime) for pid, mtime in mtimes.items() if since is None or mtime > since)
+    return items, max(cursor, since or 0)
+
+def iter_records(items: List[Tuple[str, int]], workers: int = EXPORT_WORKERS,
+                 chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """按患者ID顺序逐块产生导出记录"""
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield load_records(chunk)
+        return
+    # spawn 启动工作进程：服务器进程中有其他线程持有锁时 fork 不安全
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = []
+        for chunk in chunks:
+            pending.append(executor.submit(load_records, chunk))
+            # 在处理中的块不超过进程数的两倍
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+# ---- 输出格式 ----
+
+def jsonl_lines(records: List[Dict[str, Any]]) -> str:
+    return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+def parquet_schema():
+    problem = pa.struct([("id", pa.string()), ("type", pa.string()), ("label", pa.string()), ("text", pa.string())])
+    solution = pa.struct([("id", pa.string()), ("text", pa.string()), ("problem_ids", pa.list_(pa.string()))])
+    return pa.schema([
+        ("patient_id", pa.string()),
+        ("revision", pa.int64()),
+        ("modified_ns", pa.int64()),
+        ("auto_generated", pa.bool_()),
+        ("treatment_plan", pa.string()),
+        ("problems", pa.list_(problem)),
+        ("solutions", pa.list_(solution)),
+    ])
+
+class _ChunkSink:
+    """ParquetWriter 的输出端：累积写入的字节，由调用方逐段取走"""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def parquet_chunks(batches: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """把记录块逐个写成 Parquet 行组，边写边产生文件字节"""
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for records in batches:
+        if records:
+            writer.write_table(pa.Table.from_pylist(records, schema=schema))
+            yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def stream_export(items: List[Tuple[str, int]], fmt: str = "jsonl",
+                  workers: int = EXPORT_WORKERS, stats: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """产生导出文件的字节流，stats 中累计导出的患者数"""
+    if fmt not in FORMATS:
+        raise ValueError(f"未知的导出格式: {fmt}")
+    if fmt == "parquet" and not load_dependencies():
+        raise RuntimeError(MISSING_DEPENDENCY)
+
+    def counted():
+        for records in iter_records(items, workers):
+            if stats is not None:
+                stats["patients"] = stats.get("patients", 0) + len(records)
+            yield records
+
+    if fmt == "parquet":
+        yield from parquet_chunks(counted())
+    else:
+        for records in counted():
+            yield jsonl_lines(records).encode("utf-8")
+
+# ---- 增量导出状态 ----
+
+def load_state() -> Dict[str, Any]:
+    try:
+        with open(EXPORT_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_state(name: str, entry: Dict[str, Any]):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with file_lock(EXPORT_STATE_FILE):
+        state = load_state()
+        state[name] = entry
+        write_json_atomic(EXPORT_STATE_FILE, state)
+
+def run_export(output: str, fmt: str = "jsonl", workers: int = EXPORT_WORKERS,
+               since: Optional[int] = None) -> Dict[str, Any]:
+    """导出到文件（先写临时文件，完成后替换），返回统计信息"""
+    start = time.time()
+    items, cursor = select_patients(since)
+    stats = {"patients": 0}
+    tmp_path = f"{output}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for data in stream_export(items, fmt, workers, stats):
+            f.write(data)
+    os.replace(tmp_path, output)
+    return {"output": output, "format": fmt, "since": since, "cursor": cursor,
+            "patients": stats["patients"], "elapsed": time.time() - start}
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(prog="python app.py export", description="导出标注为训练数据")
+    parser.add_argument("--output", "-o", required=True, help="输出文件")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="默认按扩展名判断（.parquet 为 Parquet）")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS, help="读取和解析的进程数")
+    parser.add_argument("--since", type=int, default=None, help="只导出标注修改时间(ns)晚于该值的患者")
+    parser.add_argument("--incremental", action="store_true", help="从上次同名导出的位置继续")
+    parser.add_argument("--name", default="default", help="增量导出状态的名称")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    if fmt == "parquet" and not load_dependencies():
+        print(MISSING_DEPENDENCY)
+        return 1
+    since = args.since
+    if args.incremental and since is None:
+        since = load_state().get(args.name, {}).get("cursor")
+
+    result = run_export(args.output, fmt, args.workers, since)
+    if args.incremental:
+        save_state(args.name, {"cursor": result["cursor"], "output": os.path.abspath(args.output),
+                               "patients": result["patients"], "exported_at": time.time()})
+    print(f"导出完成: {result['patients']} 名患者 -> {args.output} ({fmt}), "
+          f"耗时 {result['elapsed']:.1f}s, 下次增量起点 --since {result['cursor']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
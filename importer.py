@@ -0,0 +1,313 @@
+"""批量导入病历
+
+接受 zip / tar / tar.gz 归档、目录、单个或首尾相接的多患者文本文件（每名患者以
+Patient<sep>姓名<sep>ID:xxx 行开头），逐行流式拆分和解析，内存中只保留当前患者：
+- 逐行校验格式（patient_parser 报告缺少分隔符、未知问题类型等），有错误的患者默认不导入
+- 按患者ID去重：同一次导入中重复出现的只保留第一次；已存在且内容不同的病历默认跳过（--replace 覆盖）
+- 写入 data/patients/<ID>.txt 后分批登记到患者索引，不再由目录扫描重新解析
+
+用法:
+    python app.py import PATH [PATH ...] [--replace] [--allow-errors] [--dry-run] [--report errors.jsonl]
+
+PATH 为 - 时从标准输入读取。HTTP: POST /api/import（multipart 文件字段 file，或直接以请求体上传）。
+"""
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import hashlib
+import tarfile
+import zipfile
+import argparse
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Callable, BinaryIO
+
+import config
+from storage import PATIENTS_DIR, write_text_atomic
+from patient_parser import parse_patient_file, parse_patient_header, PATIENT_HEADER, SEP
+from patient_index import patient_index
+
+# 单名患者最多的行数，超过时视为格式错误（防止异常输入占满内存）
+IMPORT_MAX_RECORD_LINES = getattr(config, "IMPORT_MAX_RECORD_LINES", 5000)
+# 结果中保留的错误条数（其余只计数，完整列表可用 --report 写入文件）
+IMPORT_MAX_ERRORS = getattr(config, "IMPORT_MAX_ERRORS", 1000)
+# 每个病历写入后是否刷盘（关闭可加快大批量导入，中途断电需重新导入）
+IMPORT_FSYNC = getattr(config, "IMPORT_FSYNC", True)
+# 每导入多少名患者登记一次患者索引
+IMPORT_INDEX_BATCH = 1000
+PATIENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+# ---- 输入拆分 ----
+
+def _text_lines(stream: BinaryIO) -> Iterator[str]:
+    """按 UTF-8 逐行读取（去掉 BOM，无法解码的字节替换为 U+FFFD，由解析器报告）"""
+    for line in io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline=None):
+        yield line.rstrip("\n")
+
+class _RawReader(io.RawIOBase):
+    """把只有 read() 的流（如流式读取的 tar 成员）包装成 TextIOWrapper 可用的输入"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _head(stream) -> bytes:
+    if hasattr(stream, "peek"):
+        return stream.peek(512)[:512]
+    head = stream.read(512)
+    stream.seek(0)
+    return head
+
+def iter_sources(stream: BinaryIO, name: str) -> Iterator[tuple]:
+    """按内容识别格式，产生 (来源名称, 逐行迭代器)；zip 需要可随机读取的文件"""
+    if not hasattr(stream, "peek") and not stream.seekable():
+        stream = io.BufferedReader(stream)
+    head = _head(stream)
+    if head.startswith(b"PK\x03\x04"):
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if _is_patient_member(info.filename, info.is_dir()):
+                    with archive.open(info) as member:
+                        yield f"{name}:{info.filename}", _text_lines(member)
+        return
+    if head.startswith(b"\x1f\x8b"):
+        stream = io.BufferedReader(gzip.GzipFile(fileobj=stream))
+        head = stream.peek(512)[:512]
+    if head[257:262] == b"ustar":
+        with tarfile.open(fileobj=stream, mode="r|") as archive:
+            for member in archive:
+                if member.isfile() and _is_patient_member(member.name, False):
+                    member_stream = io.BufferedReader(_RawReader(archive.extractfile(member)))
+                    yield f"{name}:{member.name}", _text_lines(member_stream)
+        return
+    yield name, _text_lines(stream)
+
+def _is_patient_member(path: str, is_dir: bool) -> bool:
+    base = os.path.basename(path)
+    return not is_dir and base.endswith(".txt") and not base.startswith(".") and "__MACOSX" not in path
+
+def split_records(source: str, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """把一个来源拆分为患者记录 {source, start, lines, patient_id, error}
+
+    每遇到 Patient<sep> 行开始新患者；整个来源只有一名患者且首行没有ID时使用文件名作为ID。
+    """
+    def new_record(start: int) -> Dict[str, Any]:
+        return {"source": source, "start": start, "lines": [], "patient_id": None, "error": None,
+                "has_content": False}
+
+    previous = None
+    count = 0
+    record = new_record(1)
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip("\r")
+        if line.startswith(PATIENT_HEADER + SEP):
+            if record["has_content"]:
+                if previous is not None:
+                    yield previous
+                previous, count = record, count + 1
+                record = new_record(line_no)
+            if not record["has_content"]:
+                record["patient_id"] = parse_patient_header(line)
+        if len(record["lines"]) >= IMPORT_MAX_RECORD_LINES:
+            if record["error"] is None:
+                record["error"] = (line_no, f"单名患者超过 {IMPORT_MAX_RECORD_LINES} 行")
+            continue
+        record["lines"].append(line)
+        record["has_content"] = record["has_content"] or bool(line.strip())
+    if record["has_content"]:
+        count += 1
+    else:
+        record = None
+    if count == 1:
+        only = previous or record
+        if only["patient_id"] is None:
+            stem = os.path.splitext(os.path.basename(source.rsplit(":", 1)[-1]))[0]
+            only["patient_id"] = stem or None
+    for item in (previous, record):
+        if item is not None:
+            yield item
+
+# ---- 导入 ----
+
+class PatientImporter:
+    """逐条校验、去重并写入患者记录，统计结果"""
+
+    def __init__(self, replace: bool = False, allow_errors: bool = False, dry_run: bool = False,
+                 fsync: bool = IMPORT_FSYNC, patients_dir: str = PATIENTS_DIR, index=patient_index,
+                 on_error: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.replace = replace
+        self.allow_errors = allow_errors
+        self.dry_run = dry_run
+        self.fsync = fsync
+        self.patients_dir = patients_dir
+        self.index = index
+        self.on_error = on_error
+        self.seen: Dict[str, bytes] = {}  # 患者ID -> 内容摘要（本次导入中已出现的）
+        self.pending_index: List[tuple] = []
+        self.errors: List[Dict[str, Any]] = []
+        self.stats = {"records": 0, "created": 0, "updated": 0, "unchanged": 0, "duplicates": 0,
+                      "conflicts": 0, "rejected": 0, "errors": 0, "warnings": 0}
+        self.start_time = time.time()
+        os.makedirs(patients_dir, exist_ok=True)
+
+    def _report(self, record: Dict[str, Any], line: Optional[int], message: str,
+                content: str = "", level: str = "error"):
+        self.stats["errors" if level == "error" else "warnings"] += 1
+        item = {"level": level, "source": record["source"], "line": line,
+                "patient_id": record["patient_id"], "error": message, "content": content}
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(item)
+        if self.on_error is not None:
+            self.on_error(item)
+
+    def add(self, record: Dict[str, Any]) -> str:
+        """导入一名患者，返回结果: created/updated/unchanged/duplicate/conflict/rejected"""
+        self.stats["records"] += 1
+        result = self._add(record)
+        key = {"duplicate": "duplicates", "conflict": "conflicts"}.get(result, result)
+        self.stats[key] += 1
+        return result
+
+    def _add(self, record: Dict[str, Any]) -> str:
+        patient_id = record["patient_id"]
+        lines = record["lines"]
+        skip = 0
+        while not lines[skip].strip():
+            skip += 1  # 来源开头的空行
+        content = "\n".join(lines[skip:]).rstrip("\n") + "\n"
+        line_errors = []
+        parsed = parse_patient_file(content, line_errors, first_line=record["start"] + skip)
+
+        fatal = False
+        if record["error"] is not None:
+            self._report(record, record["error"][0], record["error"][1])
+            fatal = True
+        if patient_id is None:
+            self._report(record, record["start"], f"缺少患者ID（首行应为 {PATIENT_HEADER}{SEP}姓名{SEP}ID:xxx）")
+            fatal = True
+        elif not PATIENT_ID_PATTERN.match(patient_id):
+            self._report(record, record["start"], f"患者ID只能包含字母、数字、下划线和短横线: {patient_id}")
+            fatal = True
+        if not parsed["problems"]:
+            self._report(record, record["start"], "没有问题行")
+            fatal = True
+        for error in line_errors:
+            self._report(record, error["line"], error["error"], error["content"],
+                         level="warning" if self.allow_errors else "error")
+        if fatal or (line_errors and not self.allow_errors):
+            return "rejected"
+        if not parsed["treatment_plan"]:
+            self._report(record, record["start"], "没有诊疗方案", level="warning")
+
+        digest = hashlib.sha1(content.encode("utf-8")).digest()
+        if patient_id in self.seen:
+            if self.seen[patient_id] != digest:
+                self._report(record, record["start"], "同一患者ID在本次导入中出现多次且内容不同，保留第一次")
+            return "duplicate"
+        self.seen[patient_id] = digest
+
+        path = os.path.join(self.patients_dir, f"{patient_id}.txt")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                existing = f.read()
+        except FileNotFoundError:
+            existing = None
+        if existing is not None and existing == content:
+            return "unchanged"
+        if existing is not None and not self.replace:
+            self._report(record, record["start"], "病历已存在且内容不同，未覆盖（使用 replace 覆盖）")
+            return "conflict"
+        if not self.dry_run:
+            write_text_atomic(path, content, fsync=self.fsync)
+            self.pending_index.append((patient_id, os.stat(path).st_mtime_ns, len(parsed["problems"])))
+            if len(self.pending_index) >= IMPORT_INDEX_BATCH:
+                self._flush_index()
+        return "created" if existing is None else "updated"
+
+    def _flush_index(self):
+        if self.pending_index and self.index is not None:
+            self.index.register_patients(self.pending_index)
+        self.pending_index = []
+
+    def import_stream(self, stream: BinaryIO, name: str, progress: Optional[Callable[[], None]] = None):
+        """导入一个文件或归档"""
+        for source, lines in iter_sources(stream, name):
+            for record in split_records(source, lines):
+                self.add(record)
+                if progress is not None and self.stats["records"] % 10000 == 0:
+                    progress()
+
+    def import_path(self, path: str, progress: Optional[Callable[[], None]] = None):
+        """导入文件、目录（其中的 .txt 和归档文件）或标准输入（-）"""
+        if path == "-":
+            self.import_stream(sys.stdin.buffer, "<stdin>", progress)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file_name in sorted(files):
+                    if not file_name.startswith("."):
+                        with open(os.path.join(root, file_name), "rb") as f:
+                            self.import_stream(f, os.path.join(root, file_name), progress)
+        else:
+            with open(path, "rb") as f:
+                self.import_stream(f, path, progress)
+
+    def finish(self) -> Dict[str, Any]:
+        """登记剩余患者并返回统计结果"""
+        self._flush_index()
+        elapsed = time.time() - self.start_time
+        return {**self.stats, "elapsed": elapsed,
+                "records_per_second": self.stats["records"] / elapsed if elapsed > 0 else 0.0,
+                "dry_run": self.dry_run, "errors_truncated": self.stats["errors"] + self.stats["warnings"] > len(self.errors),
+                "error_list": self.errors}
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(prog="python app.py import", description="批量导入病历")
+    parser.add_argument("paths", nargs="+", help="文件、归档、目录，或 - 表示标准输入")
+    parser.add_argument("--replace", action="store_true", help="覆盖内容不同的已有病历")
+    parser.add_argument("--allow-errors", action="store_true", help="有格式问题的患者也导入（问题记为警告）")
+    parser.add_argument("--dry-run", action="store_true", help="只校验，不写入")
+    parser.add_argument("--report", default=None, help="把全部错误和警告写入 JSONL 文件")
+    parser.add_argument("--no-fsync", action="store_true", help="写入后不刷盘（更快）")
+    args = parser.parse_args(argv)
+
+    report = open(args.report, "w", encoding="utf-8") if args.report else None
+    try:
+        importer = PatientImporter(
+            replace=args.replace, allow_errors=args.allow_errors, dry_run=args.dry_run,
+            fsync=IMPORT_FSYNC and not args.no_fsync,
+            on_error=(lambda item: report.write(json.dumps(item, ensure_ascii=False) + "\n")) if report else None)
+
+        def progress():
+            stats = importer.stats
+            elapsed = time.time() - importer.start_time
+            print(f"已处理 {stats['records']} 名患者（新增 {stats['created']}，更新 {stats['updated']}，"
+                  f"拒绝 {stats['rejected']}），{stats['records'] / elapsed:.0f} 例/秒")
+
+        for path in args.paths:
+            importer.import_path(path, progress)
+        result = importer.finish()
+    finally:
+        if report is not None:
+            report.close()
+
+    for item in result["error_list"][:20]:
+        print(f"[{item['level']}] {item['source']}:{item['line']} {item['patient_id'] or ''} {item['error']}")
+    print(f"导入{'校验' if args.dry_run else ''}完成: {result['records']} 名患者，新增 {result['created']}，"
+          f"更新 {result['updated']}，未变化 {result['unchanged']}，重复 {result['duplicates']}，"
+          f"冲突 {result['conflicts']}，拒绝 {result['rejected']}；错误 {result['errors']}，"
+          f"警告 {result['warnings']}，耗时 {result['elapsed']:.1f}s")
+    return 1 if result["rejected"] or result["conflicts"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
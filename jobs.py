@@ -0,0 +1,467 @@
+"""后台生成任务
+
+流式生成和重新抽取不在请求线程中调用LLM：请求把生成任务提交到有界的后台线程池，
+再转发任务产生的事件（等待时定期发送心跳）。
+- 每个患者同一时间只有一个进行中的任务，重复提交（如打开了两个标签页、刷新页面）直接复用
+- 客户端断开后任务继续执行，完成后原子写入标注存储
+- 任务记录（状态和全部事件）保存在 data/jobs/ 中，页面刷新或请求落到其他进程时
+  可通过 /api/jobs/<id> 查询、长轮询或重新订阅事件
+- 执行中的任务定期续租；进程退出后租约过期的任务在下次访问时重新排队
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from llm_client import LLMError, LLMCircuitOpenError
+from storage import JOBS_DIR, build_auto_annotation, write_json_atomic, file_lock
+from annotation_store import annotation_store
+from action_library import library_index
+from patient_index import patient_index, STATUS_UNANNOTATED
+from standardizer import stream_standardization, stream_fanout_standardization
+from rule_standardizer import rule_standardizer
+from prefetch import prefetcher
+from analytics import cooccurrence
+
+# 同时执行的生成任务数
+JOB_WORKERS = getattr(config, "JOB_WORKERS", 4)
+# 结束的任务在内存中保留多久（秒），之后从任务记录读取
+JOB_KEEP_SECONDS = 300
+# 结束的任务记录保留多久（秒）
+JOB_RECORD_SECONDS = 24 * 3600
+# 转发事件时无新事件多久发送一次心跳（秒）
+JOB_HEARTBEAT_SECONDS = 15
+# 任务记录的写入间隔（秒），也是其他进程读取任务进度的轮询间隔
+JOB_PERSIST_INTERVAL = 0.5
+# 执行中的任务超过该时间未续租视为所在进程已退出（秒）
+JOB_LEASE_SECONDS = 30
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_INTERRUPTED = "interrupted"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+def _record_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+def _marker_path(patient_id: str) -> str:
+    """患者当前任务的标记文件"""
+    return os.path.join(JOBS_DIR, "active", f"{patient_id}.json")
+
+def _load_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def new_record(patient_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "patient_id": patient_id,
+        "status": STATUS_QUEUED,
+        "params": params,
+        "created": now,
+        "started": None,
+        "finished": None,
+        "heartbeat": now,
+        "owner": os.getpid(),
+        "events": [],
+        "actions": [],
+        "revision": None,
+        "error": None,
+        "retried_as": None,
+    }
+
+def describe(record: Dict[str, Any], after: Optional[int] = None) -> Dict[str, Any]:
+    """任务状态摘要，after 不为空时附带该序号之后的事件"""
+    summary = {key: value for key, value in record.items() if key not in ("events", "heartbeat", "owner")}
+    summary["event_count"] = len(record["events"])
+    if after is not None:
+        summary["events"] = record["events"][after:]
+    return summary
+
+class Job:
+    """本进程执行的任务：记录、事件通知和持久化"""
+
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record
+        self.id = record["id"]
+        self.patient_id = record["patient_id"]
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()  # 保证按顺序写入任务记录
+        self.dirty = True
+
+    @property
+    def done(self) -> bool:
+        return self.record["status"] not in ACTIVE_STATUSES
+
+    def set_status(self, status: str):
+        with self.condition:
+            self.record["status"] = status
+            if status == STATUS_RUNNING:
+                self.record["started"] = time.time()
+            elif status not in ACTIVE_STATUSES:
+                self.record["finished"] = time.time()
+            self.dirty = True
+            self.condition.notify_all()
+
+    def emit(self, event: Dict[str, Any]):
+        with self.condition:
+            record = self.record
+            record["events"].append(event)
+            if event["type"] == "action":
+                record["actions"].append(event["text"])
+            elif event["type"] == "complete":
+                record["actions"] = event["actions"]
+                record["revision"] = event.get("revision")
+            elif event["type"] == "error":
+                record["error"] = event.get("message")
+            self.dirty = True
+            self.condition.notify_all()
+
+    def persist(self):
+        """写入任务记录并续租"""
+        with self.write_lock:
+            with self.condition:
+                self.record["heartbeat"] = time.time()
+                snapshot = {**self.record, "events": list(self.record["events"]),
+                            "actions": list(self.record["actions"])}
+                self.dirty = False
+            write_json_atomic(_record_path(self.id), snapshot)
+
+    def wait_events(self, start: int, timeout: float) -> List[Dict[str, Any]]:
+        """返回第 start 个之后的事件，没有时最多等待 timeout 秒"""
+        with self.condition:
+            if len(self.record["events"]) <= start and not self.done:
+                self.condition.wait(timeout)
+            return self.record["events"][start:]
+
+class JobQueue:
+    """按患者去重的持久化后台任务队列"""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.executor = None
+        self.started = False
+        self.jobs: Dict[str, Job] = {}    # 本进程的任务
+        self.active: Dict[str, Job] = {}  # 患者ID -> 本进程未结束的任务
+        self.stats = {"submitted": 0, "deduplicated": 0, "completed": 0, "failed": 0, "recovered": 0}
+
+    def _start(self):
+        """首次使用时启动记录写入线程，并接管已退出进程遗留的任务"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            os.makedirs(os.path.join(JOBS_DIR, "active"), exist_ok=True)
+        threading.Thread(target=self._persist_loop, name="job-persist", daemon=True).start()
+        self.recover()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            return self.executor
+
+    def _persist_loop(self):
+        while True:
+            time.sleep(JOB_PERSIST_INTERVAL)
+            now = time.time()
+            with self.lock:
+                self._expire(now)
+                jobs = [job for job in self.jobs.values() if not job.done]
+            for job in jobs:
+                if job.dirty or now - job.record["heartbeat"] > JOB_LEASE_SECONDS / 3:
+                    try:
+                        job.persist()
+                    except OSError as e:
+                        logging.warning(f"写入任务记录失败: {job.id}: {e}")
+
+    def _expire(self, now: float):
+        for job_id, job in list(self.jobs.items()):
+            if job.done and now - job.record["finished"] > JOB_KEEP_SECONDS:
+                del self.jobs[job_id]
+
+    def _alive(self, record: Dict[str, Any]) -> bool:
+        """任务未结束且执行它的进程仍在续租"""
+        if record["status"] not in ACTIVE_STATUSES:
+            return False
+        with self.lock:
+            if record["id"] in self.jobs:
+                return True
+        return time.time() - record["heartbeat"] < JOB_LEASE_SECONDS
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务记录：本进程的任务读内存，其他进程的任务读文件"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            with job.condition:
+                return {**job.record, "events": list(job.record["events"])}
+        if not job_id.isalnum():
+            return None
+        return _load_json(_record_path(job_id))
+
+    def _enqueue(self, patient_id: str, params: Dict[str, Any]) -> Job:
+        """创建任务并交给线程池（调用方持有该患者的标记锁）"""
+        job = Job(new_record(patient_id, params))
+        with self.lock:
+            self.jobs[job.id] = job
+            self.active[patient_id] = job
+            self.stats["submitted"] += 1
+        job.persist()
+        write_json_atomic(_marker_path(patient_id), {"job_id": job.id})
+        self._get_executor().submit(self._run, job)
+        return job
+
+    def submit(self, patient_id: str, bypass_cache: bool = False, fanout: bool = False,
+               use_rules: bool = True) -> str:
+        """提交生成任务，返回任务ID；该患者已有进行中的任务（包括其他进程的）时返回该任务"""
+        self._start()
+        with self.lock:
+            job = self.active.get(patient_id)
+            if job is not None:
+                self.stats["deduplicated"] += 1
+                return job.id
+        with file_lock(_marker_path(patient_id)):
+            existing = self.active_job(patient_id)
+            if existing is not None:
+                with self.lock:
+                    self.stats["deduplicated"] += 1
+                return existing
+            params = {"bypass_cache": bypass_cache, "fanout": fanout, "use_rules": use_rules}
+            return self._enqueue(patient_id, params).id
+
+    def active_job(self, patient_id: str) -> Optional[str]:
+        """该患者进行中的任务ID"""
+        self._start()
+        with self.lock:
+            job = self.active.get(patient_id)
+            if job is not None:
+                return job.id
+        marker = _load_json(_marker_path(patient_id))
+        if marker is None:
+            return None
+        record = self.load(marker["job_id"])
+        if record is not None and self._alive(record):
+            return record["id"]
+        return None
+
+    def recover(self):
+        """租约过期的任务（所在进程已退出）标记为中断，以相同参数重新排队；清理过期的任务记录"""
+        for name in os.listdir(os.path.join(JOBS_DIR, "active")):
+            if not name.endswith(".json"):
+                continue
+            patient_id = name[:-5]
+            with file_lock(_marker_path(patient_id)):
+                marker = _load_json(_marker_path(patient_id))
+                record = self.load(marker["job_id"]) if marker else None
+                if record is None or record["status"] not in ACTIVE_STATUSES:
+                    try:
+                        os.remove(_marker_path(patient_id))
+                    except FileNotFoundError:
+                        pass
+                    continue
+                if self._alive(record):
+                    continue
+                job = self._enqueue(patient_id, record["params"])
+                record.update(status=STATUS_INTERRUPTED, finished=time.time(), error="任务所在进程已退出",
+                              retried_as=job.id)
+                write_json_atomic(_record_path(record["id"]), record)
+                with self.lock:
+                    self.stats["recovered"] += 1
+                logging.warning(f"重新排队中断的生成任务: {patient_id} ({record['id']} -> {job.id})")
+
+        now = time.time()
+        for name in os.listdir(JOBS_DIR):
+            path = os.path.join(JOBS_DIR, name)
+            try:
+                if name.endswith(".json") and now - os.path.getmtime(path) > JOB_RECORD_SECONDS:
+                    record = _load_json(path)
+                    if record is None or record["status"] not in ACTIVE_STATUSES:
+                        os.remove(path)
+            except FileNotFoundError:
+                pass  # 其他进程已清理
+
+    def _run(self, job: Job):
+        job.set_status(STATUS_RUNNING)
+        succeeded = False
+        try:
+            parsed = patient_index.get_parsed(job.patient_id)
+            if parsed is None or not parsed["treatment_plan"].strip():
+                job.emit({'type': 'error', 'message': '患者文件不存在' if parsed is None else '没有找到诊疗方案'})
+            else:
+                succeeded = run_generation(job.emit, job.patient_id, parsed["treatment_plan"],
+                                           job_id=job.id, **job.record["params"])
+        except Exception as e:
+            logging.error(f"生成任务失败: {job.patient_id}: {e}")
+            job.emit({'type': 'error', 'message': str(e)})
+        finally:
+            # 先解除该患者的进行中标记再通知订阅者，订阅者随后查询时不会再看到这个任务
+            with file_lock(_marker_path(job.patient_id)):
+                with self.lock:
+                    if self.active.get(job.patient_id) is job:
+                        del self.active[job.patient_id]
+                    self.stats["completed" if succeeded else "failed"] += 1
+                job.set_status(STATUS_COMPLETED if succeeded else STATUS_FAILED)
+                try:
+                    job.persist()
+                except OSError as e:
+                    logging.warning(f"写入任务记录失败: {job.id}: {e}")
+                marker = _load_json(_marker_path(job.patient_id))
+                if marker is not None and marker["job_id"] == job.id:
+                    os.remove(_marker_path(job.patient_id))
+
+    def wait(self, job_id: str, after: int = 0, timeout: float = 0) -> Optional[Dict[str, Any]]:
+        """长轮询：等到第 after 个之后有新事件、任务结束或超时，返回任务摘要及新事件"""
+        deadline = time.time() + timeout
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None and timeout > 0:
+            job.wait_events(after, timeout)
+        record = self.load(job_id)
+        while (job is None and record is not None and len(record["events"]) <= after
+               and self._alive(record) and time.time() < deadline):
+            time.sleep(JOB_PERSIST_INTERVAL)
+            record = self.load(job_id)
+        return describe(record, after) if record is not None else None
+
+    def follow(self, job_id: str, after: int = 0,
+               heartbeat: float = JOB_HEARTBEAT_SECONDS) -> Iterator[Optional[Tuple[int, Dict[str, Any]]]]:
+        """依次返回任务第 after 个之后的 (序号, 事件) 直到结束；等待超过 heartbeat 秒时返回 None（用于发送心跳）"""
+        position = after
+        last_sent = time.time()
+        while True:
+            with self.lock:
+                job = self.jobs.get(job_id)
+            if job is not None:
+                # 本进程的任务：等待事件通知
+                events = job.wait_events(position, heartbeat)
+                done = job.done and len(job.record["events"]) == position + len(events)
+                alive = True
+            else:
+                # 其他进程的任务：轮询任务记录
+                record = self.load(job_id)
+                if record is None:
+                    return
+                events = record["events"][position:]
+                done = record["status"] not in ACTIVE_STATUSES
+                alive = done or self._alive(record)
+            for event in events:
+                yield position, event
+                position += 1
+            if events:
+                last_sent = time.time()
+            if done:
+                return
+            if not alive:
+                yield position, {'type': 'error', 'message': '任务已中断，请重新生成', 'retryable': True}
+                return
+            if time.time() - last_sent >= heartbeat:
+                yield None
+                last_sent = time.time()
+            if job is None:
+                time.sleep(JOB_PERSIST_INTERVAL)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            statuses = [job.record["status"] for job in self.active.values()]
+            return {**self.stats, "active": len(self.active), "queued": statuses.count(STATUS_QUEUED),
+                    "running": statuses.count(STATUS_RUNNING), "kept": len(self.jobs), "workers": self.workers}
+
+# 全局共享的任务队列
+job_queue = JobQueue()
+
+def run_generation(emit, patient_id: str, treatment_plan: str, bypass_cache: bool = False,
+                   fanout: bool = False, use_rules: bool = True, job_id: Optional[str] = None) -> bool:
+    """生成并自动保存一个患者的诊疗动作，过程中通过 emit 发送 start/action/complete/error 事件"""
+    emit({'type': 'start', 'original_plan': treatment_plan, 'job_id': job_id})
+    items = []
+    sent = set()
+
+    def send(item):
+        """每个动作只发送一次，附带来源分句的偏移，前端按原文顺序插入
+
+        到达顺序与合并后的顺序不同，这里只给临时ID；保存后的ID在 complete 事件的 solutions 中，
+        前端按文本对应。
+        """
+        items.append(item)
+        if item['text'] in sent:
+            return
+        sent.add(item['text'])
+        emit({
+            'type': 'action',
+            'text': item['text'],
+            'id': f"stream-{len(sent) - 1}",
+            'offset': item['offset'],
+            'end': item['end']
+        })
+
+    try:
+        # 尚无标注的患者可能已在后台预生成（预取进行中时等待其完成）
+        prefetched = None
+        entry = patient_index.get_entry(patient_id)
+        if not bypass_cache and entry and entry['status'] == STATUS_UNANNOTATED:
+            prefetched = prefetcher.take(patient_id, treatment_plan, use_rules=use_rules, fanout=fanout)
+
+        if prefetched is not None:
+            for position, action in enumerate(prefetched['actions']):
+                send({'text': action, 'offset': 0, 'end': len(treatment_plan), 'position': position})
+            actions, rule_report = prefetched['actions'], prefetched['report']
+        else:
+            # 规则命中的动作立即发送
+            prepared = rule_standardizer.prepare(treatment_plan, enabled=use_rules)
+            for item in prepared['items']:
+                send(item)
+
+            llm_start = time.perf_counter()
+            remaining = prepared['remaining']
+            if prepared['unresolved'] and fanout:
+                # 各分句组完成即发送
+                for item in stream_fanout_standardization(remaining, library_index.relevant_actions,
+                                                          bypass_cache=bypass_cache,
+                                                          clauses=prepared['unresolved']):
+                    send(item)
+            elif prepared['unresolved']:
+                # 边接收LLM输出边解析，每完成一行立即发送（只带入与诊疗方案相关的动作库条目）
+                action_library = library_index.relevant_actions(remaining)
+                for position, action in enumerate(stream_standardization(remaining, action_library,
+                                                                         bypass_cache=bypass_cache)):
+                    send(rule_standardizer.remainder_item(prepared, action, position))
+            actions, rule_report = rule_standardizer.finish(patient_id, prepared, items,
+                                                            time.perf_counter() - llm_start)
+
+        # 持有该患者的锁自动保存生成的结果；重新生成会替换已有标注（包括人工修改），替换前备份
+        with annotation_store.lock(patient_id):
+            annotation_data = build_auto_annotation(patient_id, actions, annotation_store.load(patient_id))
+            revision = annotation_store.save(patient_id, annotation_data, source="auto")
+            patient_index.update_annotation(patient_id, annotation_data)
+            prefetcher.discard(patient_id)
+
+        # 更新动作库
+        library_index.add_actions(actions)
+
+        print(f"流式生成完成并自动保存: {patient_id}, {len(actions)} 个动作")
+        parsed = patient_index.get_parsed(patient_id)
+        suggestions = cooccurrence.suggest_links(parsed, annotation_data) if parsed else []
+        emit({'type': 'complete', 'actions': actions, 'solutions': annotation_data['solutions'],
+              'next_action_id': annotation_data['next_action_id'], 'auto_saved': True, 'revision': revision, 'rules': rule_report,
+              'prefetched': prefetched is not None, 'suggestions': suggestions})
+        return True
+
+    except LLMError as llm_error:
+        # 不再用默认动作冒充生成结果，交给前端提示并允许重试
+        print(f"LLM处理错误: {llm_error}")
+        emit({'type': 'error', 'message': str(llm_error), 'error_type': type(llm_error).__name__,
+              'retryable': llm_error.retryable or isinstance(llm_error, LLMCircuitOpenError)})
+        return False
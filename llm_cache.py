@@ -0,0 +1,156 @@
+"""LLM响应磁盘缓存
+
+以 (模型, 提示词模板版本, 动作库快照, 诊疗方案) 的哈希为键，将成功的LLM响应
+保存到 data/llm_cache/<key>.json，按条目数、总大小和存活时间淘汰（上限可在 config.py 中调整）。
+多进程部署时各进程共享缓存目录：索引中没有的键会再查一次磁盘，以便使用其他进程写入的条目。
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import List, Optional, Dict, Any
+from collections import OrderedDict
+
+import config
+from storage import DATA_DIR
+
+LLM_CACHE_DIR = os.path.join(DATA_DIR, "llm_cache")
+LLM_CACHE_MAX_ENTRIES = getattr(config, "LLM_CACHE_MAX_ENTRIES", 5000)
+LLM_CACHE_MAX_BYTES = getattr(config, "LLM_CACHE_MAX_BYTES", 200 * 1024 * 1024)  # 200MB
+LLM_CACHE_MAX_AGE = getattr(config, "LLM_CACHE_MAX_AGE", 30 * 24 * 3600)  # 30天
+
+def make_cache_key(model: str, prompt_version: str, action_library: List[str], treatment_plan: str) -> str:
+    """计算缓存键"""
+    library_hash = hashlib.sha256("\n".join(action_library).encode('utf-8')).hexdigest()
+    raw = json.dumps([model, prompt_version, library_hash, treatment_plan.strip()], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class LLMCache:
+    """线程安全的LLM响应缓存，内存中维护按访问时间排序的索引"""
+
+    def __init__(self, cache_dir: str = LLM_CACHE_DIR, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, max_age: float = LLM_CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.index = None  # OrderedDict: key -> (created, size)，按最近访问排序
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "bypassed": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        """首次使用时扫描缓存目录建立索引"""
+        if self.index is not None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        entries.sort()
+        self.index = OrderedDict((key, (mtime, size)) for mtime, key, size in entries)
+        self.total_bytes = sum(size for _, size in self.index.values())
+
+    def _remove(self, key: str):
+        _, size = self.index.pop(key)
+        self.total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.index and (len(self.index) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.index)))
+            self.stats["evictions"] += 1
+
+    def _adopt(self, key: str):
+        """其他进程写入的条目加入本进程的索引，不存在时返回 None"""
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        self.index[key] = (stat.st_mtime, stat.st_size)
+        self.total_bytes += stat.st_size
+        return self.index[key]
+
+    def get(self, key: str) -> Optional[str]:
+        """命中返回缓存的响应，否则返回 None"""
+        with self.lock:
+            self._load_index()
+            entry = self.index.get(key)
+            if entry is None:
+                entry = self._adopt(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if time.time() - entry[0] > self.max_age:
+                self._remove(key)
+                self.stats["evictions"] += 1
+                self.stats["misses"] += 1
+                return None
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    response = json.load(f)["response"]
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"LLM缓存条目损坏，已丢弃: {key}: {e}")
+                self._remove(key)
+                self.stats["misses"] += 1
+                return None
+            self.index.move_to_end(key)
+            self.stats["hits"] += 1
+            return response
+
+    def put(self, key: str, response: str):
+        """写入缓存并按容量淘汰"""
+        data = json.dumps({"created": time.time(), "response": response}, ensure_ascii=False)
+        with self.lock:
+            self._load_index()
+            if key in self.index:
+                self._remove(key)
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            size = len(data.encode('utf-8'))
+            self.index[key] = (time.time(), size)
+            self.total_bytes += size
+            self.stats["writes"] += 1
+            self._evict()
+
+    def record_bypass(self):
+        with self.lock:
+            self.stats["bypassed"] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self._load_index()
+            for key in list(self.index):
+                self._remove(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回命中统计和容量信息"""
+        with self.lock:
+            self._load_index()
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.index),
+                "bytes": self.total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "max_age": self.max_age,
+            }
+
+# 全局共享缓存实例
+llm_cache = LLMCache()
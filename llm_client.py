@@ -0,0 +1,337 @@
+"""共享的LLM客户端
+
+进程内只创建一个 OpenAI 客户端并复用其连接池，在此之上统一处理：
+- 超时（LLM_TIMEOUT）与带抖动的指数退避重试（LLM_MAX_RETRIES / LLM_RETRY_BACKOFF）
+- 并发上限（LLM_MAX_CONCURRENCY），超出的调用排队等待
+- 熔断：连续失败 LLM_BREAKER_THRESHOLD 次后 LLM_BREAKER_COOLDOWN 秒内直接失败，之后放行一次试探
+- 失败时抛出 LLMError 的子类，而不是返回提示文本
+- 调用耗时、首个片段延迟和 token 数记入 metrics（GET /metrics）
+
+openai 库导入较慢（约 0.7 秒），推迟到首次调用时导入，不拖慢应用启动。
+以上参数可在 config.py 中覆盖。可通过环境变量 OPENAI_BASE_URL 指向本地桩服务（benchmarks/stub_llm.py）测试。
+"""
+import os
+import time
+import random
+import logging
+import threading
+from typing import Dict, Any, Iterator, TYPE_CHECKING
+
+import config
+from metrics import span, LLM_REQUEST_SECONDS, LLM_FIRST_CHUNK_SECONDS, LLM_TOKENS, LLM_RESPONSE_CHARS
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", config.OPENAI_BASE_URL)
+MODEL = os.environ.get("OPENAI_MODEL", config.MODEL)
+
+LLM_TIMEOUT = getattr(config, "LLM_TIMEOUT", 60.0)
+LLM_MAX_RETRIES = getattr(config, "LLM_MAX_RETRIES", 2)
+LLM_RETRY_BACKOFF = getattr(config, "LLM_RETRY_BACKOFF", 1.0)
+LLM_MAX_CONCURRENCY = getattr(config, "LLM_MAX_CONCURRENCY", 8)
+LLM_BREAKER_THRESHOLD = getattr(config, "LLM_BREAKER_THRESHOLD", 5)
+LLM_BREAKER_COOLDOWN = getattr(config, "LLM_BREAKER_COOLDOWN", 30.0)
+
+# ---- 错误类型 ----
+
+class LLMError(Exception):
+    """LLM调用失败"""
+    retryable = False
+
+class LLMTimeoutError(LLMError):
+    """请求超时或排队等待超时"""
+    retryable = True
+
+class LLMConnectionError(LLMError):
+    """无法连接到LLM服务"""
+    retryable = True
+
+class LLMRateLimitError(LLMError):
+    """服务端限流（429）"""
+    retryable = True
+
+class LLMServerError(LLMError):
+    """服务端错误（5xx）"""
+    retryable = True
+
+class LLMRequestError(LLMError):
+    """请求本身有误（鉴权失败、参数错误等 4xx），重试无意义"""
+
+class LLMEmptyResponseError(LLMError):
+    """LLM返回空内容"""
+
+class LLMCircuitOpenError(LLMError):
+    """熔断中，暂不请求LLM服务"""
+
+def translate_error(error: Exception) -> LLMError:
+    """将 openai 库的异常转换为 LLMError"""
+    if isinstance(error, LLMError):
+        return error
+    import openai
+    if isinstance(error, openai.APITimeoutError):
+        return LLMTimeoutError(f"LLM请求超时: {error}")
+    if isinstance(error, openai.APIConnectionError):
+        return LLMConnectionError(f"无法连接LLM服务: {error}")
+    if isinstance(error, openai.RateLimitError):
+        return LLMRateLimitError(f"LLM服务限流: {error}")
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code >= 500:
+            return LLMServerError(f"LLM服务错误 {error.status_code}: {error}")
+        return LLMRequestError(f"LLM请求错误 {error.status_code}: {error}")
+    return LLMError(f"LLM调用错误: {error}")
+
+# ---- 熔断器 ----
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，冷却期过后只放行一个试探请求"""
+
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """不允许请求时抛出 LLMCircuitOpenError，返回本次请求是否为试探请求"""
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            remaining = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+            raise LLMCircuitOpenError(f"LLM服务暂不可用（熔断中，{remaining:.0f}秒后重试）")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    logging.warning(f"LLM连续失败 {self.failures} 次，熔断 {self.cooldown:.0f} 秒")
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release_probe(self):
+        """试探请求既未成功也未失败（如调用方提前关闭流）时放弃试探，之后的请求可再次试探"""
+        with self.lock:
+            self.probing = False
+
+# ---- 客户端 ----
+
+class LLMClient:
+    """线程安全、复用连接的LLM客户端"""
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, model: str = MODEL,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 backoff: float = LLM_RETRY_BACKOFF, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 breaker: CircuitBreaker = None):
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.breaker = breaker or CircuitBreaker()
+        self.client_lock = threading.Lock()
+        self.client = None
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0}
+        # 正在进行的调用数和排队等待并发名额的调用数
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _get_client(self) -> "OpenAI":
+        """首次使用时导入 openai 并创建，之后复用同一个客户端（及其连接池）"""
+        with self.client_lock:
+            if self.client is None:
+                from openai import OpenAI
+                self.client = OpenAI(api_key=config.OPENAI_API_KEY, base_url=self.base_url,
+                                     timeout=self.timeout, max_retries=0)
+            return self.client
+
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _acquire(self):
+        with self.stats_lock:
+            self.waiting += 1
+        acquired = False
+        try:
+            acquired = self.semaphore.acquire(timeout=self.timeout)
+        finally:
+            with self.stats_lock:
+                self.waiting -= 1
+                if acquired:
+                    self.in_flight += 1
+        if not acquired:
+            raise LLMTimeoutError("等待LLM并发名额超时")
+
+    def _release(self):
+        with self.stats_lock:
+            self.in_flight -= 1
+        self.semaphore.release()
+
+    def _attempts(self):
+        """带熔断检查和退避的重试循环，每次迭代产生 (尝试序号, 是否为熔断试探请求)"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                probe = self.breaker.allow()
+            except LLMCircuitOpenError:
+                self._count("rejected")
+                raise
+            if attempt > 0:
+                self._count("retries")
+            self._count("requests")
+            yield attempt, probe
+
+    def _failed(self, error: Exception, attempt: int) -> LLMError:
+        """记录失败；可以重试时等待退避时间并返回 None，否则返回要抛出的错误"""
+        error = translate_error(error)
+        self._count("failures")
+        self.breaker.record_failure()
+        if not error.retryable or attempt >= self.max_retries:
+            return error
+        delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+        logging.warning(f"LLM调用失败（第 {attempt + 1} 次）: {error}，{delay:.1f}s 后重试")
+        time.sleep(delay)
+        return None
+
+    def _create(self, prompt: str, stream: bool):
+        return self._get_client().chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+            stream=stream
+        )
+
+    def complete(self, prompt: str) -> str:
+        """阻塞调用，返回完整响应文本"""
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("llm_complete"):
+                result = self._complete(prompt)
+            outcome = "ok"
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, kind="complete", outcome=outcome)
+        LLM_RESPONSE_CHARS.inc(len(result), kind="complete")
+        return result
+
+    def _complete(self, prompt: str) -> str:
+        for attempt, probe in self._attempts():
+            self._acquire()
+            settled = False  # 已记为成功或失败
+            try:
+                response = self._create(prompt, stream=False)
+                self._count_usage(response, "complete")
+                result = response.choices[0].message.content if response.choices else None
+                if not result or not result.strip():
+                    raise LLMEmptyResponseError("LLM返回空内容")
+            except Exception as e:
+                settled = True
+                error = self._failed(e, attempt)
+                if error is not None:
+                    raise error from e
+                continue
+            else:
+                settled = True
+                self.breaker.record_success()
+            finally:
+                self._release()
+                if probe and not settled:
+                    self.breaker.release_probe()
+            return result.strip()
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """流式调用，逐段返回文本；只在收到首个片段之前重试，之后的中断直接抛出"""
+        start = time.perf_counter()
+        outcome = "error"
+        chars = 0
+        # 生成器在多次调用之间挂起，span 不留在调用方的上下文中，结束时手动记录
+        trace = span("llm_stream").__enter__()
+        trace.detach()
+        try:
+            for content in self._stream(prompt, start):
+                chars += len(content)
+                yield content
+            outcome = "ok"
+        except GeneratorExit:
+            # 调用方提前关闭（如客户端断开）
+            outcome = "cancelled"
+            raise
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, kind="stream", outcome=outcome)
+            LLM_RESPONSE_CHARS.inc(chars, kind="stream")
+            if hasattr(trace, "span_id"):
+                trace.finish(outcome=outcome, chars=chars)
+
+    def _stream(self, prompt: str, start: float) -> Iterator[str]:
+        for attempt, probe in self._attempts():
+            self._acquire()
+            received = False
+            settled = False  # 已记为成功或失败；调用方提前关闭（GeneratorExit）时两者都不算
+            try:
+                for chunk in self._create(prompt, stream=True):
+                    self._count_usage(chunk, "stream")
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        if not received:
+                            LLM_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - start)
+                        received = True
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                settled = True
+                if received:
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    raise translate_error(e) from e
+                error = self._failed(e, attempt)
+                if error is not None:
+                    raise error from e
+                continue
+            else:
+                settled = True
+                self.breaker.record_success()
+            finally:
+                self._release()
+                if probe and not settled:
+                    self.breaker.release_probe()
+            return
+
+    @staticmethod
+    def _count_usage(response, kind: str):
+        """服务端返回 usage 时累计 token 数（流式调用通常只在最后一个片段中带 usage）"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        for key in ("prompt_tokens", "completion_tokens"):
+            value = getattr(usage, key, None)
+            if value:
+                LLM_TOKENS.inc(value, kind=kind, type=key.split("_")[0])
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.stats_lock:
+            return {**self.stats, "in_flight": self.in_flight, "waiting": self.waiting,
+                    "breaker": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+# 全局共享的LLM客户端
+llm_client = LLMClient()
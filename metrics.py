@@ -0,0 +1,361 @@
+"""请求级指标与追踪
+
+进程内的计数器和直方图（线程安全，无外部依赖），由 GET /metrics 以 Prometheus 文本格式输出：
+- 各路由的请求耗时（http_request_seconds）
+- LLM调用耗时、首个片段延迟、token 数和响应字符数
+- 病历解析、JSON 读写和备份耗时
+- 各组件 get_stats() 中的数值（缓存命中、队列长度等），作为按进程区分的 gauge
+
+多进程部署时各进程每 METRICS_FLUSH_SECONDS 秒把自己的数值写入 data/metrics/<pid>.json，
+/metrics 合并仍在更新的进程快照：计数器和直方图求和，gauge 带 pid 标签。
+
+设置环境变量 ANNOTATION_TRACE=1（或 config.TRACE_ENABLED）后，每个请求及其中的计时区间
+记为追踪 span，以 JSON 行写入 TRACE_LOG_FILE。
+"""
+import os
+import json
+import time
+import uuid
+import bisect
+import functools
+import logging
+import threading
+import contextvars
+from contextlib import ContextDecorator
+from typing import List, Dict, Any, Optional, Callable
+
+import config
+
+METRICS_PREFIX = "annotation"
+# 进程快照的写入间隔，超过 3 倍间隔未更新的快照不再合并，超过 1 小时的删除
+METRICS_FLUSH_SECONDS = getattr(config, "METRICS_FLUSH_SECONDS", 5)
+METRICS_STALE_SECONDS = 3600
+TRACE_ENABLED = os.environ.get("ANNOTATION_TRACE", str(getattr(config, "TRACE_ENABLED", False))).lower() in (
+    "1", "true", "yes")
+TRACE_LOG_FILE = getattr(config, "TRACE_LOG_FILE", "trace.log")
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: Dict[str, "_Metric"] = {}
+_collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[tuple, Any] = {}
+        _registry[self.name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {json.dumps(key, ensure_ascii=False): json.loads(json.dumps(value))
+                    for key, value in self.values.items()}
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [各区间的计数（最后一个为 +Inf）, 总和, 次数]
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        """计时的上下文管理器/装饰器，在开启追踪的请求中同时记为一个 span"""
+        return _Timer(self, labels)
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+        self.span = None
+
+    def __call__(self, func):
+        """作为装饰器：每次调用独立计时（可能多线程同时调用）"""
+        histogram, labels = self.histogram, self.labels
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if TRACE_ENABLED and _current_span.get() is not None:
+                with _Timer(histogram, labels):
+                    return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+
+    def __enter__(self):
+        # 只在请求的追踪内记录 span，后台线程中的计时不单独成为追踪
+        if TRACE_ENABLED and _current_span.get() is not None:
+            name = self.histogram.name[len(METRICS_PREFIX) + 1:]
+            self.span = span(name[:-len("_seconds")] if name.endswith("_seconds") else name, **self.labels).__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+        return False
+
+# ---- 指标定义 ----
+
+HTTP_REQUEST_SECONDS = Histogram("http_request_seconds", "请求耗时（秒），流式响应计到响应结束",
+                                 ("method", "route", "status"))
+LLM_REQUEST_SECONDS = Histogram("llm_request_seconds", "一次LLM调用（含重试）的耗时（秒）", ("kind", "outcome"))
+LLM_FIRST_CHUNK_SECONDS = Histogram("llm_first_chunk_seconds", "流式调用收到首个片段的延迟（秒）")
+LLM_TOKENS = Counter("llm_tokens_total", "LLM服务返回的 token 数（服务端提供 usage 时）", ("kind", "type"))
+LLM_RESPONSE_CHARS = Counter("llm_response_chars_total", "LLM响应的字符数", ("kind",))
+PARSE_SECONDS = Histogram("parse_seconds", "解析一份病历的耗时（秒）",
+                          buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1))
+IO_SECONDS = Histogram("io_seconds", "标注读写和备份耗时（秒）", ("op",),
+                       buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+
+# ---- 组件状态 ----
+
+def register_collector(name: str, collect: Callable[[], Dict[str, Any]]):
+    """登记组件的 get_stats，其中的数值（含嵌套字典）在输出时作为 gauge"""
+    _collectors[name] = collect
+
+def _flatten(prefix: str, stats: Dict[str, Any], result: Dict[str, float]):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}".replace("-", "_").replace(".", "_")
+        if isinstance(value, bool):
+            result[name] = float(value)
+        elif isinstance(value, (int, float)):
+            result[name] = float(value)
+        elif isinstance(value, dict):
+            _flatten(name, value, result)
+
+def collect_gauges() -> Dict[str, float]:
+    gauges = {}
+    for name, collect in list(_collectors.items()):
+        try:
+            _flatten(f"{METRICS_PREFIX}_{name}", collect(), gauges)
+        except Exception as e:
+            logging.warning(f"收集 {name} 状态失败: {e}")
+    return gauges
+
+# ---- 多进程快照 ----
+
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+def _metrics_dir() -> str:
+    from storage import DATA_DIR
+    return os.path.join(DATA_DIR, "metrics")
+
+def snapshot() -> Dict[str, Any]:
+    """本进程的全部指标"""
+    return {
+        "pid": os.getpid(),
+        "time": time.time(),
+        "metrics": {name: metric.snapshot() for name, metric in list(_registry.items())},
+        "gauges": collect_gauges(),
+    }
+
+def _flush():
+    from storage import write_text_atomic
+    directory = _metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    write_text_atomic(os.path.join(directory, f"{os.getpid()}.json"),
+                      json.dumps(snapshot(), ensure_ascii=False), fsync=False)
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            _flush()
+        except Exception as e:
+            logging.warning(f"写入指标快照失败: {e}")
+
+def start_writer():
+    """开始定期写入本进程的快照（服务器进程处理请求时调用，每个进程只启动一次）"""
+    global _writer_pid
+    if _writer_pid == os.getpid():
+        return
+    with _writer_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name="metrics-writer", daemon=True).start()
+
+def _other_snapshots() -> List[Dict[str, Any]]:
+    """其他进程仍在更新的快照，顺便删除早已停止的进程的快照"""
+    directory = _metrics_dir()
+    snapshots = []
+    now = time.time()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        if not name.endswith(".json") or name == f"{os.getpid()}.json":
+            continue
+        path = os.path.join(directory, name)
+        try:
+            age = now - os.stat(path).st_mtime
+            if age > METRICS_STALE_SECONDS:
+                os.remove(path)
+                continue
+            if age > METRICS_FLUSH_SECONDS * 3:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+# ---- Prometheus 文本格式 ----
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def render() -> str:
+    """合并各进程的快照，输出 Prometheus 文本格式"""
+    snapshots = [snapshot()] + _other_snapshots()
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        merged: Dict[str, Any] = {}
+        for snap in snapshots:
+            for key, value in snap["metrics"].get(name, {}).items():
+                if metric.type == "counter":
+                    merged[key] = merged.get(key, 0) + value
+                elif key not in merged:
+                    merged[key] = [list(value[0]), value[1], value[2]]
+                else:
+                    entry = merged[key]
+                    entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                    entry[1] += value[1]
+                    entry[2] += value[2]
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for key, value in sorted(merged.items()):
+            label_values = json.loads(key)
+            if metric.type == "counter":
+                lines.append(f"{name}{_labels(metric.labelnames, label_values)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric.buckets) + ["+Inf"], value[0]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(metric.labelnames, label_values, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, label_values)} {_number(value[1])}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, label_values)} {value[2]}")
+
+    gauges: Dict[str, List[tuple]] = {}
+    for snap in snapshots:
+        for name, value in snap["gauges"].items():
+            gauges.setdefault(name, []).append((str(snap["pid"]), value))
+    for name, values in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        for pid, value in sorted(values):
+            lines.append(f'{name}{{pid="{pid}"}} {_number(value)}')
+    return "\n".join(lines) + "\n"
+
+# ---- 追踪 ----
+
+_current_span: "contextvars.ContextVar[Optional[span]]" = contextvars.ContextVar("trace_span", default=None)
+_trace_logger = None
+
+def _get_trace_logger() -> logging.Logger:
+    global _trace_logger
+    if _trace_logger is None:
+        logger = logging.getLogger("annotation.trace")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = logging.FileHandler(TRACE_LOG_FILE, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        _trace_logger = logger
+    return _trace_logger
+
+class span(ContextDecorator):
+    """追踪区间：嵌套在当前 span 之下，结束时写一行 JSON；未开启追踪时不做任何事"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, **attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self.token = None
+
+    def _recreate_cm(self):
+        return span(self.name, self.trace_id, **self.attrs)
+
+    def __enter__(self):
+        if not TRACE_ENABLED:
+            return self
+        parent = _current_span.get()
+        self.trace_id = self.trace_id or (parent.trace_id if parent else uuid.uuid4().hex)
+        self.parent_id = parent.span_id if parent and parent.trace_id == self.trace_id else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start = time.time()
+        self.start_perf = time.perf_counter()
+        self.token = _current_span.set(self)
+        return self
+
+    def detach(self):
+        """从当前上下文移除（span 由其他线程或稍后结束时先调用）"""
+        if self.token is not None:
+            try:
+                _current_span.reset(self.token)
+            except ValueError:
+                pass  # 在其他上下文中结束（如流式响应的生成器）
+            self.token = None
+
+    def __exit__(self, exc_type, exc, tb):
+        if not TRACE_ENABLED or not hasattr(self, "span_id"):
+            return False
+        self.detach()
+        self.finish(error=repr(exc) if exc is not None else None)
+        return False
+
+    def finish(self, error: Optional[str] = None, **attrs):
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": (time.perf_counter() - self.start_perf) * 1000,
+            "pid": os.getpid(),
+            "attrs": {**self.attrs, **attrs},
+        }
+        if error:
+            record["error"] = error
+        _get_trace_logger().info(json.dumps(record, ensure_ascii=False, default=str))
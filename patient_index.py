@@ -0,0 +1,442 @@
+"""患者索引与病历解析缓存
+
+在内存中维护每个患者的摘要（病历/标注修改时间、标注状态、问题数），
+列表和最近编辑接口直接读索引，不再每次扫描目录：
+- 病历目录的 mtime、标注存储的变更标记变化时才增量重新扫描
+- 本程序保存标注后调用 update_annotation 即时更新
+- 解析后的病历放在按 mtime 校验的 LRU 缓存中
+- 可保存为快照，下次启动时直接恢复，再在后台逐个核对修改时间（见 warmup.py）
+"""
+import os
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Any, Optional, Callable
+from collections import OrderedDict
+
+from patient_parser import parse_patient_file
+from storage import PATIENTS_DIR
+from annotation_store import annotation_store
+
+PARSED_CACHE_SIZE = 512
+PAGE_SIZE_MAX = 1000
+FACET_CACHE_SIZE = 64
+# 快照格式版本与条目字段（按行保存，比逐条保存字典小且加载快）
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FIELDS = ["id", "txt_mtime", "annotation_mtime", "problem_count", "status", "solution_count", "link_count"]
+
+# 标注状态
+STATUS_UNANNOTATED = "unannotated"
+STATUS_AUTO_GENERATED = "auto_generated"
+STATUS_ANNOTATED = "annotated"
+
+def annotation_summary(annotation_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """从标注数据提取状态摘要"""
+    if annotation_data is None:
+        return {"status": STATUS_UNANNOTATED, "solution_count": 0, "link_count": 0}
+    annotations = annotation_data.get("annotations", {}) or {}
+    link_count = sum(len(problem_ids) for problem_ids in annotations.values())
+    if annotation_data.get("auto_generated") and link_count == 0:
+        status = STATUS_AUTO_GENERATED
+    else:
+        status = STATUS_ANNOTATED
+    return {
+        "status": status,
+        "solution_count": len(annotation_data.get("solutions", []) or []),
+        "link_count": link_count,
+    }
+
+class PatientIndex:
+    """线程安全的患者索引"""
+
+    def __init__(self, patients_dir: str = PATIENTS_DIR, store=annotation_store,
+                 cache_size: int = PARSED_CACHE_SIZE):
+        self.patients_dir = patients_dir
+        self.store = store
+        self.cache_size = cache_size
+        self.lock = threading.RLock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.sorted_ids: Optional[List[str]] = None
+        self.dir_mtimes = {"patients": None, "annotations": None}
+        self.parsed_cache: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (mtime, parsed)
+        self.stats = {"parsed_hits": 0, "parsed_misses": 0, "rescans": 0, "local_writes": 0, "restored": 0}
+        self.version = 0  # 索引内容变化时递增，用于失效分面统计缓存
+        self.facet_cache: Dict[tuple, Dict[str, Any]] = {}
+        self.listeners: List[Callable[[str, Optional[Dict[str, Any]]], None]] = []
+
+    # ---- 内部工具 ----
+
+    def _patient_file(self, patient_id: str) -> str:
+        return os.path.join(self.patients_dir, f"{patient_id}.txt")
+
+    def _new_entry(self, patient_id: str) -> Dict[str, Any]:
+        return {
+            "id": patient_id,
+            "txt_mtime": None,
+            "annotation_mtime": None,
+            "problem_count": 0,
+            **annotation_summary(None),
+        }
+
+    def _dir_mtime(self, path: str):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _sync(self, local_write: bool = False):
+        """目录有变化时增量更新索引
+
+        local_write 为 True 时（本进程刚写入标注，由 update_annotation 直接更新条目），
+        变更标记只因本进程的写入而变化则只记下新标记，不重新扫描。
+        """
+        patients_mtime = self._dir_mtime(self.patients_dir)
+        if patients_mtime != self.dir_mtimes["patients"]:
+            self.dir_mtimes["patients"] = patients_mtime
+            self._rescan_patients()
+        annotations_token = self.store.change_token()
+        if annotations_token != self.dir_mtimes["annotations"]:
+            own = local_write and self.store.local_writes.follow(self.dir_mtimes["annotations"]) == annotations_token
+            self.dir_mtimes["annotations"] = annotations_token
+            if own:
+                self.stats["local_writes"] += 1
+            else:
+                self._rescan_annotations()
+
+    def _changed(self):
+        self.version += 1
+        self.facet_cache.clear()
+
+    def _scan_patients(self) -> Dict[str, int]:
+        """返回 {患者ID: 病历修改时间(ns)}"""
+        result = {}
+        if os.path.exists(self.patients_dir):
+            for item in os.scandir(self.patients_dir):
+                if item.name.endswith('.txt'):
+                    try:
+                        result[item.name[:-4]] = item.stat().st_mtime_ns
+                    except FileNotFoundError:
+                        pass
+        return result
+
+    def _rescan_patients(self, found: Optional[Dict[str, int]] = None):
+        self.stats["rescans"] += 1
+        self._changed()
+        if found is None:
+            found = self._scan_patients()
+        for patient_id in list(self.entries):
+            if patient_id not in found:
+                del self.entries[patient_id]
+                self.parsed_cache.pop(patient_id, None)
+        for patient_id, mtime in found.items():
+            entry = self.entries.get(patient_id)
+            if entry is None:
+                entry = self.entries[patient_id] = self._new_entry(patient_id)
+                # 新病历可能已有标注
+                if self.dir_mtimes["annotations"] is not None:
+                    annotation_mtime = self.store.mtime(patient_id)
+                    if annotation_mtime is not None:
+                        self._load_annotation(entry, annotation_mtime)
+            # 病历文件修改时间变化时重新统计问题数
+            if mtime != entry["txt_mtime"]:
+                parsed = self._parse(patient_id, mtime)
+                entry["txt_mtime"] = mtime
+                entry["problem_count"] = len(parsed["problems"]) if parsed else 0
+        self.sorted_ids = None
+
+    def _rescan_annotations(self, found: Optional[Dict[str, int]] = None):
+        self.stats["rescans"] += 1
+        self._changed()
+        if found is None:
+            found = self.store.scan()
+        for patient_id, entry in self.entries.items():
+            if patient_id not in found and entry["annotation_mtime"] is not None:
+                entry.update(annotation_mtime=None, **annotation_summary(None))
+        for patient_id, mtime in found.items():
+            entry = self.entries.get(patient_id)
+            if entry is None:
+                continue  # 没有对应病历的标注不计入索引
+            if mtime != entry["annotation_mtime"]:
+                self._load_annotation(entry, mtime)
+
+    def _load_annotation(self, entry: Dict[str, Any], mtime: int):
+        try:
+            annotation_data = self.store.load(entry["id"]) or {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取标注失败 {entry['id']}: {e}")
+            annotation_data = {}
+        entry.update(annotation_mtime=mtime, **annotation_summary(annotation_data))
+
+    def _parse(self, patient_id: str, mtime: int) -> Optional[Dict[str, Any]]:
+        """读取并解析病历，结果放入 LRU 缓存"""
+        try:
+            with open(self._patient_file(patient_id), 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        parsed = parse_patient_file(content)
+        self.parsed_cache[patient_id] = (mtime, parsed)
+        self.parsed_cache.move_to_end(patient_id)
+        while len(self.parsed_cache) > self.cache_size:
+            self.parsed_cache.popitem(last=False)
+        return parsed
+
+    # ---- 对外接口 ----
+
+    def patient_ids(self) -> List[str]:
+        """按ID排序的患者列表"""
+        with self.lock:
+            self._sync()
+            if self.sorted_ids is None:
+                self.sorted_ids = sorted(self.entries)
+            return self.sorted_ids
+
+    def get_entry(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """返回患者摘要的副本"""
+        with self.lock:
+            self._sync()
+            entry = self.entries.get(patient_id)
+            return dict(entry) if entry else None
+
+    def entries_in_order(self) -> List[Dict[str, Any]]:
+        """按ID排序返回所有患者摘要（只读）"""
+        with self.lock:
+            return [self.entries[pid] for pid in self.patient_ids()]
+
+    def last_edited(self) -> Optional[str]:
+        """最近修改过标注的患者ID"""
+        with self.lock:
+            self._sync()
+            latest = None
+            for entry in self.entries.values():
+                if entry["annotation_mtime"] is not None and (
+                        latest is None or entry["annotation_mtime"] > latest["annotation_mtime"]):
+                    latest = entry
+            return latest["id"] if latest else None
+
+    def get_parsed(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """获取解析后的病历（共享对象，调用方不要修改），文件不存在时返回 None"""
+        with self.lock:
+            try:
+                mtime = os.stat(self._patient_file(patient_id)).st_mtime_ns
+            except FileNotFoundError:
+                return None
+            cached = self.parsed_cache.get(patient_id)
+            if cached and cached[0] == mtime:
+                self.parsed_cache.move_to_end(patient_id)
+                self.stats["parsed_hits"] += 1
+                return cached[1]
+            self.stats["parsed_misses"] += 1
+            parsed = self._parse(patient_id, mtime)
+            entry = self.entries.get(patient_id)
+            if entry is not None and parsed is not None:
+                entry["txt_mtime"] = mtime
+                entry["problem_count"] = len(parsed["problems"])
+            return parsed
+
+    def register_patients(self, patients: List[tuple]):
+        """批量导入病历后登记 [(患者ID, 病历修改时间, 问题数)]
+
+        导入时已解析过，这里直接写入条目；之后目录变化触发的重新扫描发现修改时间一致，不再逐个解析。
+        """
+        with self.lock:
+            for patient_id, mtime, problem_count in patients:
+                entry = self.entries.get(patient_id)
+                if entry is None:
+                    entry = self.entries[patient_id] = self._new_entry(patient_id)
+                    if self.dir_mtimes["annotations"] is not None:
+                        annotation_mtime = self.store.mtime(patient_id)
+                        if annotation_mtime is not None:
+                            self._load_annotation(entry, annotation_mtime)
+                entry.update(txt_mtime=mtime, problem_count=problem_count)
+                self.parsed_cache.pop(patient_id, None)
+            self.sorted_ids = None
+            self._changed()
+
+    def add_listener(self, callback: Callable[[str, Optional[Dict[str, Any]]], None]):
+        """注册标注更新后的回调 callback(patient_id, annotation_data)，如统计分析的增量更新"""
+        self.listeners.append(callback)
+
+    def update_annotation(self, patient_id: str, annotation_data: Optional[Dict[str, Any]]):
+        """标注写入（或删除）后同步更新索引"""
+        with self.lock:
+            self._sync(local_write=True)
+            entry = self.entries.get(patient_id)
+            if entry is not None and annotation_data is None:
+                entry.update(annotation_mtime=None, **annotation_summary(None))
+            elif entry is not None:
+                mtime = self.store.mtime(patient_id)
+                entry.update(annotation_mtime=mtime, **annotation_summary(annotation_data))
+                self._changed()
+        for callback in self.listeners:
+            try:
+                callback(patient_id, annotation_data)
+            except Exception as e:
+                logging.warning(f"标注更新回调失败: {patient_id}: {e}")
+
+    def query(self, status: Optional[str] = None, has_links: Optional[bool] = None,
+              modified_since: Optional[float] = None, prefix: Optional[str] = None,
+              cursor: Optional[str] = None, start: Optional[str] = None, before: Optional[str] = None,
+              limit: int = 100) -> Dict[str, Any]:
+        """分页查询患者
+
+        cursor 为上一页最后一个ID（不含），start 为起始ID（含），before 返回该ID之前的一页。
+        modified_since 为秒级时间戳，按标注修改时间过滤。
+        """
+        limit = max(1, min(limit, PAGE_SIZE_MAX))
+        since_ns = int(modified_since * 1e9) if modified_since is not None else None
+
+        def in_scope(entry):
+            return since_ns is None or (entry["annotation_mtime"] is not None
+                                        and entry["annotation_mtime"] >= since_ns)
+
+        def matches(entry):
+            if status and entry["status"] != status:
+                return False
+            if has_links is not None and (entry["link_count"] > 0) != has_links:
+                return False
+            return in_scope(entry)
+
+        with self.lock:
+            ids = self.patient_ids()
+            lo, hi = 0, len(ids)
+            if prefix:
+                lo = bisect_left(ids, prefix)
+                hi = bisect_left(ids, prefix + "\U0010ffff", lo)
+
+            def scan(index, step):
+                """从 index 开始按 step 方向查找下一个匹配项"""
+                while lo <= index < hi:
+                    if matches(self.entries[ids[index]]):
+                        yield index
+                    index += step
+
+            if before is not None:
+                page = []
+                for index in scan(bisect_left(ids, before) - 1, -1):
+                    page.append(index)
+                    if len(page) >= limit:
+                        break
+                page.reverse()
+            else:
+                if cursor is not None:
+                    first = bisect_right(ids, cursor)
+                elif start is not None:
+                    first = bisect_left(ids, start)
+                else:
+                    first = lo
+                page = []
+                for index in scan(max(first, lo), 1):
+                    page.append(index)
+                    if len(page) >= limit:
+                        break
+
+            has_next = bool(page) and next(scan(page[-1] + 1, 1), None) is not None
+            has_prev = bool(page) and next(scan(page[0] - 1, -1), None) is not None
+            items = [self._public_entry(self.entries[ids[index]]) for index in page]
+
+            cells = self._facets(prefix, since_ns, lo, hi, in_scope)
+            facets = {STATUS_UNANNOTATED: 0, STATUS_AUTO_GENERATED: 0, STATUS_ANNOTATED: 0,
+                      "has_links": 0, "all": 0}
+            total = 0
+            for (cell_status, cell_links), count in cells.items():
+                facets[cell_status] += count
+                facets["all"] += count
+                if cell_links:
+                    facets["has_links"] += count
+                if (not status or cell_status == status) and (has_links is None or cell_links == has_links):
+                    total += count
+            return {
+                "patients": [item["id"] for item in items],
+                "items": items,
+                "next_cursor": items[-1]["id"] if has_next else None,
+                "prev_cursor": items[0]["id"] if has_prev else None,
+                "total": total,
+                "facets": facets,
+            }
+
+    def _facets(self, prefix, since_ns, lo, hi, in_scope) -> Dict[tuple, int]:
+        """统计 prefix/modified_since 范围内 (状态, 是否有链接) 的数量，按索引版本缓存"""
+        scope_key = (prefix, since_ns)
+        cells = self.facet_cache.get(scope_key)
+        if cells is None:
+            cells = {}
+            ids = self.sorted_ids
+            for index in range(lo, hi):
+                entry = self.entries[ids[index]]
+                if in_scope(entry):
+                    cell = (entry["status"], entry["link_count"] > 0)
+                    cells[cell] = cells.get(cell, 0) + 1
+            if len(self.facet_cache) >= FACET_CACHE_SIZE:
+                self.facet_cache.clear()
+            self.facet_cache[scope_key] = cells
+        return cells
+
+    @staticmethod
+    def _public_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+        annotation_mtime = entry["annotation_mtime"]
+        return {
+            "id": entry["id"],
+            "status": entry["status"],
+            "problem_count": entry["problem_count"],
+            "solution_count": entry["solution_count"],
+            "link_count": entry["link_count"],
+            "annotation_mtime": annotation_mtime / 1e9 if annotation_mtime is not None else None,
+        }
+
+    # ---- 快照 ----
+
+    def snapshot(self) -> Dict[str, Any]:
+        """索引的快照（条目与目录变更标记），用于下次启动时恢复"""
+        with self.lock:
+            return {
+                "version": SNAPSHOT_VERSION,
+                "patients_dir": os.path.abspath(self.patients_dir),
+                "store": self.store.name,
+                "dir_mtimes": dict(self.dir_mtimes),
+                "fields": SNAPSHOT_FIELDS,
+                "entries": [[entry[field] for field in SNAPSHOT_FIELDS] for entry in self.entries.values()],
+            }
+
+    def restore(self, snapshot: Dict[str, Any]) -> bool:
+        """从快照恢复尚未建立的索引，快照不属于当前数据目录或格式不符时返回 False
+
+        恢复后目录变更标记与快照一致时不再扫描目录；原地修改的文件由 verify() 补上。
+        """
+        if (snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("fields") != SNAPSHOT_FIELDS
+                or snapshot.get("patients_dir") != os.path.abspath(self.patients_dir)
+                or snapshot.get("store") != self.store.name):
+            return False
+        with self.lock:
+            if self.dir_mtimes["patients"] is not None:
+                return False  # 已经扫描过目录
+            self.entries = {row[0]: dict(zip(SNAPSHOT_FIELDS, row)) for row in snapshot["entries"]}
+            self.dir_mtimes = dict(snapshot["dir_mtimes"])
+            self.sorted_ids = None
+            self._changed()
+            self.stats["restored"] = len(self.entries)
+            return True
+
+    def verify(self):
+        """逐个核对病历和标注的修改时间，只重新读取有变化的文件
+
+        目录 mtime 只反映文件的增删；从快照恢复后用它找出停机期间被原地修改的文件。
+        扫描目录时不持有锁，不阻塞查询。
+        """
+        # 先取变更标记再扫描：扫描期间的变化会使标记过期，下次查询时重新扫描
+        patients_mtime = self._dir_mtime(self.patients_dir)
+        patients = self._scan_patients()
+        annotations_token = self.store.change_token()
+        annotations = self.store.scan()
+        with self.lock:
+            self.dir_mtimes["patients"] = patients_mtime
+            self._rescan_patients(patients)
+            self.dir_mtimes["annotations"] = annotations_token
+            self._rescan_annotations(annotations)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.stats, "patients": len(self.entries), "parsed_cached": len(self.parsed_cache)}
+
+# 全局共享的患者索引
+patient_index = PatientIndex()
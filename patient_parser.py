@@ -0,0 +1,84 @@
+from typing import List, Dict, Any, Optional
+
+from metrics import PARSE_SECONDS
+
+zh_en_dict = {
+    "Symptom":"主诉",
+    "Dental":"牙性",
+    "Tooth":"牙齿",
+    "Skeletal":"骨性",
+    "Softtissue":"软组织",
+    "Functional":"功能",
+    "Growth":"生长发育",
+    "UnhealthyHabits":"不良习惯",
+    "TreatmentPlan":"诊疗方案"
+}
+
+SEP = "<sep>"
+PATIENT_HEADER = "Patient"
+TREATMENT_PLAN_MARKER = "TreatmentPlan" + SEP
+
+def parse_patient_header(line: str) -> Optional[str]:
+    """从病历首行（Patient<sep>姓名<sep>ID:00001）取患者ID，没有时返回 None"""
+    for field in line.split(SEP)[1:]:
+        field = field.strip()
+        if field.upper().startswith("ID:") or field.startswith("ID："):
+            return field[3:].strip() or None
+    return None
+
+@PARSE_SECONDS.time()
+def parse_patient_file(content: str, errors: Optional[List[Dict[str, Any]]] = None,
+                       first_line: int = 1) -> Dict[str, Any]:
+    """解析病历文件内容
+
+    errors 不为 None 时逐行记录格式问题 {"line", "error", "content"}（行号从 first_line 起算）。
+    有问题的行仍按原方式计入问题列表，以免已有标注引用的问题ID错位。
+    """
+    def report(line_no: int, message: str, line: str):
+        if errors is not None:
+            errors.append({"line": line_no, "error": message, "content": line[:200]})
+
+    result = {
+        "problems": [],
+        "treatment_plan": ""
+    }
+
+    # 诊疗方案拆分（只取第一个诊疗方案段）
+    parts = content.split(TREATMENT_PLAN_MARKER)
+    infos = parts[0]
+    treatment_plan = parts[1] if len(parts) > 1 else ""
+    treatment_plan = '\n'.join(treatment_plan.split(SEP)).strip() if treatment_plan else ""
+    if len(parts) > 2:
+        second = content.find(TREATMENT_PLAN_MARKER, len(infos) + len(TREATMENT_PLAN_MARKER))
+        report(first_line + content.count('\n', 0, second), "出现多个诊疗方案段，只保留第一个",
+               content[second:].split('\n', 1)[0])
+
+    for line_no, line in enumerate(infos.split('\n'), first_line):
+        line = line.strip()
+        if not line:  continue
+
+        if line.startswith(PATIENT_HEADER): continue
+        if "\ufffd" in line:
+            report(line_no, "包含无法解码的字符", line)
+        fields = line.split(SEP)
+        problem_type = fields[0].strip()
+        problems = fields[1:]
+        current_section = zh_en_dict.get(problem_type, None)
+        if not problems:
+            report(line_no, f"缺少 {SEP} 分隔符", line)
+        elif current_section is None:
+            report(line_no, f"未知的问题类型: {problem_type}", line)
+        elif not problems[0].strip():
+            report(line_no, "问题名称为空", line)
+
+        result["problems"].append({
+            "id": f"problem-{len(result['problems'])}",
+            "text": ''.join(problems).strip(),
+            "type": current_section,
+            "label": problems[0].strip() if problems else ""  # 问题名称（不含测量值等附加字段）
+        })
+
+    # 处理诊疗方案
+    result["treatment_plan"] = treatment_plan
+
+    return result
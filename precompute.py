@@ -0,0 +1,181 @@
+"""批量预生成标准化诊疗动作
+
+遍历 data/patients/*.txt，为尚无标注的患者提前调用LLM生成
+auto_generated 标注，避免标注员打开新患者时等待。规则能确定的行不再调用LLM。
+
+用法:
+    python app.py precompute [--workers 4] [--rate 2] [--retries 3] [--limit N] [--force] [--no-cache] [--no-rules]
+
+可通过环境变量 OPENAI_BASE_URL 指向本地桩服务（benchmarks/stub_llm.py）进行测试。
+"""
+import time
+import random
+import logging
+import argparse
+import threading
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from standardizer import request_standardization, filter_action_lines
+from rule_standardizer import rule_standardizer
+from llm_client import LLMError, LLMCircuitOpenError
+from storage import build_auto_annotation
+from annotation_store import annotation_store
+from action_library import library_index
+from patient_index import patient_index, annotation_summary, STATUS_UNANNOTATED, STATUS_AUTO_GENERATED
+
+class RateLimiter:
+    """简单的线程安全限速器，保证两次请求间隔不小于 1/rate 秒"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+class PatientSkipped(Exception):
+    """生成期间该患者已有（人工）标注，不覆盖"""
+
+def find_pending_patients(force: bool = False) -> List[str]:
+    """返回尚未生成标注文件的患者ID，force 时包括自动生成后未经人工修改的患者"""
+    statuses = (STATUS_UNANNOTATED, STATUS_AUTO_GENERATED) if force else (STATUS_UNANNOTATED,)
+    return [entry["id"] for entry in patient_index.entries_in_order() if entry["status"] in statuses]
+
+def standardize_patient(patient_id: str, limiter: RateLimiter,
+                        retries: int = 3, backoff: float = 1.0,
+                        bypass_cache: bool = False, use_rules: bool = True,
+                        force: bool = False) -> Optional[List[str]]:
+    """为单个患者生成标准化动作并写入标注文件，没有诊疗方案时返回 None
+
+    保存前在该患者的锁内重新检查：调用LLM期间已有标注（标注员保存或流式生成）时抛出 PatientSkipped；
+    force 时只覆盖自动生成、未经人工修改的标注，覆盖前备份。
+    """
+    parsed_data = patient_index.get_parsed(patient_id)
+    if parsed_data is None:
+        raise FileNotFoundError(f"患者文件不存在: {patient_id}")
+
+    treatment_plan = parsed_data["treatment_plan"]
+    if not treatment_plan.strip():
+        return None
+
+    # 规则能确定的行直接得到动作，只把剩余部分交给LLM
+    prepared = rule_standardizer.prepare(treatment_plan, enabled=use_rules)
+    items = list(prepared["items"])
+    llm_seconds = 0.0
+    if prepared["unresolved"]:
+        remaining = prepared["remaining"]
+        action_library = library_index.relevant_actions(remaining)
+        for attempt in range(retries + 1):
+            limiter.wait()
+            try:
+                start = time.perf_counter()
+                response = request_standardization(remaining, action_library, bypass_cache=bypass_cache)
+                llm_seconds = time.perf_counter() - start
+                break
+            except LLMError as e:
+                # 单次调用内部已有重试；这里在熔断或持续失败时隔一段时间再整体重试
+                if attempt >= retries or not (e.retryable or isinstance(e, LLMCircuitOpenError)):
+                    raise
+                delay = backoff * (2 ** attempt) * (0.5 + random.random())
+                logging.warning(f"患者 {patient_id} 第 {attempt + 1} 次调用失败: {e}，{delay:.1f}s 后重试")
+                time.sleep(delay)
+        items += [rule_standardizer.remainder_item(prepared, action, position)
+                  for position, action in enumerate(filter_action_lines(response))]
+
+    actions, _ = rule_standardizer.finish(patient_id, prepared, items, llm_seconds)
+    with annotation_store.lock(patient_id):
+        existing = annotation_store.load(patient_id)
+        if existing is not None:
+            if not force:
+                raise PatientSkipped("生成期间已有标注")
+            if annotation_summary(existing)["status"] != STATUS_AUTO_GENERATED:
+                raise PatientSkipped("已有人工标注")
+        annotation_data = build_auto_annotation(patient_id, actions, existing)
+        annotation_store.save(patient_id, annotation_data, source="precompute")
+        patient_index.update_annotation(patient_id, annotation_data)
+    return actions
+
+def run_precompute(patient_ids: List[str], workers: int = 4, rate: float = 2.0,
+                   retries: int = 3, bypass_cache: bool = False, use_rules: bool = True,
+                   force: bool = False) -> Dict[str, Any]:
+    """使用有界线程池批量生成，返回统计信息"""
+    limiter = RateLimiter(rate)
+    stats = {"total": len(patient_ids), "done": 0, "skipped": 0, "failed": [], "actions": 0}
+    start_time = time.time()
+
+    logging.info(f"开始批量预生成: {len(patient_ids)} 个患者, {workers} 个线程, 限速 {rate} 次/秒")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(standardize_patient, pid, limiter, retries,
+                                   bypass_cache=bypass_cache, use_rules=use_rules, force=force): pid
+                   for pid in patient_ids}
+        for i, future in enumerate(as_completed(futures), 1):
+            patient_id = futures[future]
+            try:
+                actions = future.result()
+                if actions is None:
+                    stats["skipped"] += 1
+                    status = "无诊疗方案，跳过"
+                else:
+                    stats["done"] += 1
+                    stats["actions"] += len(actions)
+                    # 新动作并入动作库，供后续标注复用
+                    library_index.add_actions(actions)
+                    status = f"{len(actions)} 个动作"
+                    report = rule_standardizer.get_report(patient_id)
+                    if report and report["resolved"] + report["fallback"]:
+                        status += f", 规则命中 {report['hit_rate']:.0%}"
+                        if not report["llm_called"]:
+                            status += "（未调用LLM）"
+            except PatientSkipped as e:
+                stats["skipped"] += 1
+                status = f"{e}，跳过"
+            except Exception as e:
+                stats["failed"].append(patient_id)
+                status = f"失败: {e}"
+
+            elapsed = time.time() - start_time
+            logging.info(f"[{i}/{len(patient_ids)}] {patient_id} {status} ({i / elapsed:.2f} 例/秒)")
+
+    stats["elapsed"] = time.time() - start_time
+    stats["throughput"] = stats["done"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    stats["rules"] = {key: value for key, value in rule_standardizer.get_stats().items() if key != "recent"}
+    logging.info(f"批量预生成完成: 成功 {stats['done']}, 跳过 {stats['skipped']}, "
+                 f"失败 {len(stats['failed'])}, 耗时 {stats['elapsed']:.1f}s, "
+                 f"{stats['throughput']:.2f} 例/秒")
+    logging.info(f"规则命中率 {stats['rules']['hit_rate']:.1%}（治疗内容行: 规则 {stats['rules']['resolved']}, "
+                 f"交给LLM {stats['rules']['fallback']}; 略过 {stats['rules']['skipped']} 行）, "
+                 f"{stats['rules']['llm_skipped']} 个患者无需调用LLM, "
+                 f"估算节省LLM耗时 {stats['rules']['saved_seconds']:.1f}s")
+    return stats
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(prog="app.py precompute", description="批量预生成标准化诊疗动作")
+    parser.add_argument("--workers", type=int, default=4, help="并发线程数")
+    parser.add_argument("--rate", type=float, default=2.0, help="每秒最多LLM请求数，0表示不限速")
+    parser.add_argument("--retries", type=int, default=3, help="单个患者失败重试次数")
+    parser.add_argument("--limit", type=int, default=None, help="最多处理的患者数")
+    parser.add_argument("--force", action="store_true", help="重新生成自动生成的标注（人工修改过的标注不覆盖）")
+    parser.add_argument("--no-cache", action="store_true", help="跳过LLM响应缓存")
+    parser.add_argument("--no-rules", action="store_true", help="不使用规则预标准化，全部交给LLM")
+    args = parser.parse_args(argv)
+
+    patient_ids = find_pending_patients(force=args.force)
+    if args.limit is not None:
+        patient_ids = patient_ids[:args.limit]
+    if not patient_ids:
+        print("没有需要预生成的患者")
+        return 0
+
+    stats = run_precompute(patient_ids, workers=args.workers, rate=args.rate, retries=args.retries,
+                           bypass_cache=args.no_cache, use_rules=not args.no_rules, force=args.force)
+    return 1 if stats["failed"] else 0
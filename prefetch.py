@@ -0,0 +1,181 @@
+"""后台预取后续患者
+
+打开一个患者时，按标注员的列表顺序（相同的状态筛选）在后台预热其后的若干个患者：
+- 解析病历，填充 patient_index 的解析缓存
+- 尚无标注的患者提前生成标准化动作（规则 + LLM），结果暂存在内存中，
+  打开该患者时流式接口直接推送，不再等待LLM；生成尚未结束时等待这次预取而不是重新调用
+
+预生成按默认参数（config.RULE_STANDARDIZER，不分句并行）进行，参数不同的生成请求不使用预取结果。
+保存标注后丢弃该患者的预取结果。
+
+使用有界线程池，切换患者时取消尚未开始的预取。深度、并发可在 config.py 中调整。
+"""
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+import config
+from llm_client import LLM_TIMEOUT
+from patient_index import patient_index, STATUS_UNANNOTATED
+from rule_standardizer import rule_standardizer, RULE_STANDARDIZER
+
+# 每次预取当前患者之后的多少个患者，0 表示关闭
+PREFETCH_DEPTH = getattr(config, "PREFETCH_DEPTH", 3)
+# 预取线程数（同时进行的预生成LLM调用不超过该值）
+PREFETCH_WORKERS = getattr(config, "PREFETCH_WORKERS", 2)
+# 是否为尚无标注的患者提前生成动作；关闭时只解析病历
+PREFETCH_STANDARDIZE = getattr(config, "PREFETCH_STANDARDIZE", True)
+# 内存中最多暂存的预生成结果数
+PREFETCH_MAX_RESULTS = 64
+
+class Prefetcher:
+    """线程安全的患者预取器"""
+
+    def __init__(self, index=patient_index, depth: int = PREFETCH_DEPTH, workers: int = PREFETCH_WORKERS,
+                 standardize: bool = PREFETCH_STANDARDIZE, use_rules: bool = RULE_STANDARDIZER):
+        self.index = index
+        self.depth = depth
+        self.workers = workers
+        self.standardize = standardize
+        self.use_rules = use_rules
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = {}  # 患者ID -> Future
+        self.results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.stats = {"scheduled": 0, "cancelled": 0, "parsed": 0, "generated": 0, "errors": 0,
+                      "hits": 0, "joined": 0, "misses": 0, "stale": 0, "bypassed": 0,
+                      "discarded": 0, "evicted": 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+        return self.executor
+
+    def next_patients(self, patient_id: str, status: Optional[str] = None,
+                      has_links: Optional[bool] = None, depth: Optional[int] = None) -> List[str]:
+        """标注员列表中 patient_id 之后的若干个患者"""
+        depth = self.depth if depth is None else depth
+        if depth <= 0:
+            return []
+        return self.index.query(status=status, has_links=has_links, cursor=patient_id, limit=depth)["patients"]
+
+    def warm_after(self, patient_id: str, status: Optional[str] = None,
+                   has_links: Optional[bool] = None) -> List[str]:
+        """预取 patient_id 之后的患者，返回本次新提交的患者ID"""
+        return self.schedule(self.next_patients(patient_id, status=status, has_links=has_links))
+
+    def schedule(self, patient_ids: List[str]) -> List[str]:
+        """提交预取；不在本次列表中且尚未开始的旧预取会被取消"""
+        wanted = set(patient_ids)
+        submitted = []
+        with self.lock:
+            for pid, future in list(self.pending.items()):
+                if pid not in wanted and future.cancel():
+                    del self.pending[pid]
+                    self.stats["cancelled"] += 1
+            for pid in patient_ids:
+                if pid in self.pending or pid in self.results:
+                    continue
+                future = self._get_executor().submit(self._warm, pid)
+                self.pending[pid] = future
+                future.add_done_callback(lambda _, pid=pid, future=future: self._done(pid, future))
+                self.stats["scheduled"] += 1
+                submitted.append(pid)
+        return submitted
+
+    def _done(self, patient_id: str, future):
+        with self.lock:
+            if self.pending.get(patient_id) is future:
+                del self.pending[patient_id]
+
+    def _warm(self, patient_id: str):
+        """解析病历，必要时生成动作并暂存"""
+        try:
+            parsed = self.index.get_parsed(patient_id)
+            with self.lock:
+                self.stats["parsed"] += 1
+            entry = self.index.get_entry(patient_id)
+            if (parsed is None or not self.standardize or entry is None
+                    or entry["status"] != STATUS_UNANNOTATED or not parsed["treatment_plan"].strip()):
+                return None
+            plan = parsed["treatment_plan"]
+            actions, report = rule_standardizer.standardize(patient_id, plan, enabled=self.use_rules)
+            result = {"plan": plan, "actions": actions, "report": report, "created": time.time()}
+            with self.lock:
+                # 生成期间已保存了标注（保存后的 discard 在此之前或之后都不会留下旧结果）
+                entry = self.index.get_entry(patient_id)
+                if entry is None or entry["status"] != STATUS_UNANNOTATED:
+                    self.stats["discarded"] += 1
+                    return None
+                self.results[patient_id] = result
+                self.results.move_to_end(patient_id)
+                self.stats["generated"] += 1
+                while len(self.results) > PREFETCH_MAX_RESULTS:
+                    self.results.popitem(last=False)
+                    self.stats["evicted"] += 1
+            return result
+        except Exception as e:
+            with self.lock:
+                self.stats["errors"] += 1
+            logging.warning(f"预取患者 {patient_id} 失败: {e}")
+            return None
+
+    def take(self, patient_id: str, treatment_plan: str, use_rules: bool = RULE_STANDARDIZER,
+             fanout: bool = False) -> Optional[Dict[str, Any]]:
+        """取出该患者预生成的 {"actions", "report"}（只能取一次）
+
+        预取仍在进行时等待其完成；诊疗方案已变化、没有预取或生成参数与预取不同时返回 None。
+        """
+        if use_rules != self.use_rules or fanout:
+            # 结果与请求的参数不一致，不等待预取，按请求的参数重新生成
+            self.discard(patient_id)
+            with self.lock:
+                self.stats["bypassed"] += 1
+            return None
+        with self.lock:
+            result = self.results.pop(patient_id, None)
+            future = self.pending.get(patient_id) if result is None else None
+        if future is not None:
+            try:
+                future.result(timeout=LLM_TIMEOUT)
+            except (CancelledError, Exception):
+                pass
+            with self.lock:
+                result = self.results.pop(patient_id, None)
+                if result is not None:
+                    self.stats["joined"] += 1
+        with self.lock:
+            if result is None:
+                self.stats["misses"] += 1
+                return None
+            if result["plan"] != treatment_plan:
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return result
+
+    def discard(self, patient_id: str):
+        """丢弃该患者暂存的预生成结果（如已手动保存标注）"""
+        with self.lock:
+            if self.results.pop(patient_id, None) is not None:
+                self.stats["discarded"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """预取数量、命中率和当前状态"""
+        with self.lock:
+            requests = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / requests if requests else 0.0,
+                "pending": len(self.pending),
+                "stored": len(self.results),
+                "depth": self.depth,
+                "workers": self.workers,
+            }
+
+# 全局共享的预取器
+prefetcher = Prefetcher()
@@ -0,0 +1,278 @@
+"""基于规则的诊疗方案预标准化
+
+在调用LLM之前逐行匹配诊疗方案，能确定映射的行直接给出标准动作，只把剩余的行交给LLM：
+- 与动作库条目一致（归一化后比较：去掉序号、"矫治步骤:"等标签、括号内的说明、"适度""少量"等程度词）
+- 提示词中"转换规则"的示例编译成的查找表
+- 牙位展开："13、46、47全冠修复" → "13全冠修复"、"46全冠修复"、"47全冠修复"
+- "id""矫治费用"等非治疗内容直接略过
+一行中所有小句都能匹配时该行才算命中，否则整行交给LLM，保留上下文。
+"""
+import re
+import time
+import threading
+import unicodedata
+from typing import List, Dict, Any, Tuple, Optional
+from collections import OrderedDict
+
+import config
+from action_library import library_index, char_ngrams
+from standardizer import (standardize_actions_prompt, split_plan_clauses, merge_fanout_actions,
+                          request_standardization, filter_action_lines)
+
+# 是否默认启用规则预标准化，可被请求参数 rules 覆盖
+RULE_STANDARDIZER = getattr(config, "RULE_STANDARDIZER", True)
+# 只略过这些标签的行（费用、疗程等），其余标签去掉后照常匹配
+RULE_SKIP_LABELS = getattr(config, "RULE_SKIP_LABELS", ("id", "费用", "矫治费用", "疗程", "预计疗程", "矫治时间"))
+# 去掉后照常匹配的标签；只识别这两组标签，"10:30复诊"等冒号前的内容不当作标签
+RULE_CONTENT_LABELS = getattr(config, "RULE_CONTENT_LABELS", ("矫治目标", "矫治步骤", "矫治方案", "治疗方案", "治疗计划"))
+# 不影响标准动作的程度词
+DEGREE_WORDS = ("适度", "适当", "少量")
+# 除转换规则和动作库中出现的以外，可按牙位展开的处置
+TOOTH_PROCEDURES = ("全冠修复", "树脂修复", "根管治疗", "贴面修复")
+# 保留最近多少个患者的命中报告
+RULE_REPORT_SIZE = 200
+
+TOOTH = r"(?:[1-4][1-8]|[5-8][1-5])"
+TOOTH_LIST_PATTERN = re.compile(rf"^({TOOTH}(?:[、,和及与]{TOOTH})*)(\D.*)$")
+TOOTH_ACTION_PATTERN = re.compile(rf"^{TOOTH}(\D.+)$")
+LABEL_PATTERN = re.compile(
+    "^(" + "|".join(re.escape(label) for label in (*RULE_SKIP_LABELS, *RULE_CONTENT_LABELS)) + r")\s*:(.*)$",
+    re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"^(?:\d{1,2}|[一二三四五六七八九十]+)[.、)]\s*|^\(\d{1,2}\)\s*")
+REMARK_PATTERN = re.compile(r"\([^()]*\)")
+CLAUSE_SEPARATORS = re.compile(r"[,;。]")
+RULE_LINE_PATTERN = re.compile(r'^- "(.+?)" → (.+)$')
+
+def normalize_clause(text: str) -> str:
+    """归一化分句：统一全角半角，去掉序号、括号说明、程度词、空白和结尾标点"""
+    text = unicodedata.normalize("NFKC", text)
+    text = NUMBER_PATTERN.sub("", text.strip())
+    text = REMARK_PATTERN.sub("", text)
+    for word in DEGREE_WORDS:
+        text = text.replace(word, "")
+    return "".join(text.split()).strip(",;。.")
+
+def parse_conversion_rules(prompt: str) -> Dict[str, List[str]]:
+    """从提示词的"转换规则"中提取 {归一化的原文: [标准动作]}
+
+    目标中含有英文字母的规则（提示词中的笔误）不编译，交给LLM处理。
+    """
+    rules = {}
+    for line in prompt.split("\n"):
+        match = RULE_LINE_PATTERN.match(line.strip())
+        if not match:
+            continue
+        targets = re.findall(r'"([^"]+)"', match.group(2))
+        if not targets or any(re.search(r"[A-Za-z]", target) for target in targets):
+            continue
+        rules[normalize_clause(match.group(1))] = targets
+    return rules
+
+def hit_rate(resolved: int, fallback: int) -> float:
+    """治疗内容行中由规则确定的比例；略过的非治疗行（id、费用等）不计入"""
+    treatment = resolved + fallback
+    return resolved / treatment if treatment else 0.0
+
+class RuleStandardizer:
+    """线程安全的规则预标准化器，记录每个患者的命中率和节省的LLM耗时"""
+
+    def __init__(self, library=library_index, prompt: str = standardize_actions_prompt):
+        self.library = library
+        self.rules = parse_conversion_rules(prompt)
+        self.lock = threading.Lock()
+        self.library_version = None
+        self.library_map: Dict[str, str] = {}  # 归一化文本 -> 动作库中的动作
+        self.tooth_procedures = set(TOOTH_PROCEDURES)
+        self.reports: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.stats = {"patients": 0, "clauses": 0, "resolved": 0, "skipped": 0, "fallback": 0,
+                      "llm_skipped": 0, "rule_seconds": 0.0, "llm_seconds": 0.0,
+                      "llm_chars": 0, "saved_seconds": 0.0}
+
+    def _refresh_library(self):
+        """动作库变化后重建归一化查找表和可按牙位展开的处置"""
+        version = self.library.version()
+        with self.lock:
+            if version == self.library_version:
+                return
+        library_map = {}
+        procedures = set(TOOTH_PROCEDURES)
+        targets = [t for actions in self.rules.values() for t in actions]
+        for action in self.library.all_actions():
+            library_map.setdefault(normalize_clause(action), action)
+        for action in targets + list(library_map.values()):
+            match = TOOTH_ACTION_PATTERN.match(action)
+            if match:
+                procedures.add(match.group(1))
+        with self.lock:
+            self.library_map = library_map
+            self.tooth_procedures = procedures
+            self.library_version = version
+
+    def _match(self, clause: str) -> Optional[List[str]]:
+        """匹配单个归一化分句，无法确定时返回 None"""
+        if clause in self.library_map:
+            return [self.library_map[clause]]
+        if clause in self.rules:
+            return list(self.rules[clause])
+        match = TOOTH_LIST_PATTERN.match(clause)
+        if match and match.group(2) in self.tooth_procedures:
+            return [f"{tooth}{match.group(2)}" for tooth in re.findall(TOOTH, match.group(1))]
+        return None
+
+    def resolve_line(self, line: str) -> Optional[List[str]]:
+        """匹配诊疗方案中的一行，返回标准动作（非治疗内容返回空列表），无法确定时返回 None"""
+        text = unicodedata.normalize("NFKC", line).strip()
+        label = LABEL_PATTERN.match(text)
+        if label:
+            value = label.group(2).strip()
+            if label.group(1).lower() in RULE_SKIP_LABELS or value in ("", "无"):
+                return []
+            text = value
+        clause = normalize_clause(text)
+        if not clause:
+            return []
+        actions = self._match(clause)
+        if actions is not None:
+            return actions
+        parts = [part for part in CLAUSE_SEPARATORS.split(clause) if part]
+        if len(parts) < 2:
+            return None
+        actions = []
+        for part in parts:
+            matched = self._match(part)
+            if matched is None:
+                return None
+            actions.extend(matched)
+        return actions
+
+    def prepare(self, treatment_plan: str, enabled: bool = True) -> Dict[str, Any]:
+        """逐行匹配诊疗方案
+
+        返回 {"items": 规则得到的动作, "unresolved": [(偏移, 行)], "remaining": 交给LLM的文本, ...}，
+        items 与 stream_fanout_standardization 的结果格式相同，可一起用 merge_fanout_actions 合并。
+        "unresolved_grams" 是各未命中行的字符 n-gram，供 remainder_item 定位LLM生成的动作。
+        """
+        start = time.perf_counter()
+        clauses = split_plan_clauses(treatment_plan)
+        items, unresolved = [], []
+        skipped = 0
+        if enabled:
+            self._refresh_library()
+        for offset, line in clauses:
+            actions = self.resolve_line(line) if enabled else None
+            if actions is None:
+                unresolved.append((offset, line))
+                continue
+            if not actions:
+                skipped += 1
+            for position, action in enumerate(actions):
+                items.append({"text": action, "offset": offset, "end": offset + len(line),
+                              "position": position, "source": "rule"})
+
+        if len(unresolved) == len(clauses):
+            remaining = treatment_plan.strip()  # 没有命中时原样交给LLM，沿用已有的缓存
+        else:
+            remaining = "\n".join(line for _, line in unresolved)
+        return {
+            "items": items,
+            "unresolved": unresolved,
+            "unresolved_grams": [char_ngrams(normalize_clause(line)) for _, line in unresolved],
+            "remaining": remaining,
+            "clauses": len(clauses),
+            "resolved": len(clauses) - len(unresolved) - skipped,
+            "skipped": skipped,
+            "fallback": len(unresolved),
+            "resolved_chars": sum(len(line) for _, line in clauses) - sum(len(line) for _, line in unresolved),
+            "rule_seconds": time.perf_counter() - start,
+        }
+
+    def remainder_item(self, prepared: Dict[str, Any], text: str, position: int) -> Dict[str, Any]:
+        """整体交给LLM的剩余部分生成的动作，排在字面最接近的未命中行的位置
+
+        与所有未命中行都没有共同的 n-gram 时跟在上一个LLM动作所在的行（按输出顺序依次调用）。
+        """
+        grams = char_ngrams(normalize_clause(text))
+        overlaps = [len(grams & line_grams) for line_grams in prepared["unresolved_grams"]]
+        best = max(range(len(overlaps)), key=lambda i: (overlaps[i], -i))
+        if overlaps[best] == 0:
+            best = prepared.get("last_llm_line", 0)
+        prepared["last_llm_line"] = best
+        offset, line = prepared["unresolved"][best]
+        return {"text": text, "offset": offset, "end": offset + len(line),
+                "position": position, "source": "llm"}
+
+    def finish(self, patient_id: str, prepared: Dict[str, Any], items: List[Dict[str, Any]],
+               llm_seconds: float = 0.0) -> Tuple[List[str], Dict[str, Any]]:
+        """按原文顺序合并规则和LLM得到的全部动作 items 并去重，记录该患者的命中报告，返回 (动作, 报告)"""
+        actions = merge_fanout_actions(items)
+        llm_called = bool(prepared["unresolved"])
+        remaining_chars = len(prepared["remaining"]) if llm_called else 0
+        with self.lock:
+            self.stats["patients"] += 1
+            self.stats["clauses"] += prepared["clauses"]
+            self.stats["resolved"] += prepared["resolved"]
+            self.stats["skipped"] += prepared["skipped"]
+            self.stats["fallback"] += prepared["fallback"]
+            self.stats["rule_seconds"] += prepared["rule_seconds"]
+            if llm_called:
+                self.stats["llm_seconds"] += llm_seconds
+                self.stats["llm_chars"] += remaining_chars
+            else:
+                self.stats["llm_skipped"] += 1
+            # 按已观测到的每字符LLM耗时估算命中部分节省的时间
+            per_char = self.stats["llm_seconds"] / self.stats["llm_chars"] if self.stats["llm_chars"] else None
+            saved = per_char * prepared["resolved_chars"] if per_char is not None else None
+            if saved is not None:
+                self.stats["saved_seconds"] += saved
+            report = {
+                "clauses": prepared["clauses"],
+                "resolved": prepared["resolved"],
+                "skipped": prepared["skipped"],
+                "fallback": prepared["fallback"],
+                "hit_rate": hit_rate(prepared["resolved"], prepared["fallback"]),
+                "rule_actions": len(prepared["items"]),
+                "llm_called": llm_called,
+                "rule_ms": prepared["rule_seconds"] * 1000,
+                "llm_ms": llm_seconds * 1000 if llm_called else 0.0,
+                "estimated_saved_ms": saved * 1000 if saved is not None else None,
+            }
+            self.reports[patient_id] = report
+            self.reports.move_to_end(patient_id)
+            while len(self.reports) > RULE_REPORT_SIZE:
+                self.reports.popitem(last=False)
+        return actions, report
+
+    def standardize(self, patient_id: str, treatment_plan: str, bypass_cache: bool = False,
+                    enabled: bool = True) -> Tuple[List[str], Dict[str, Any]]:
+        """规则匹配后用一次LLM调用处理剩余部分，返回 (动作, 报告)，失败时抛出 LLMError"""
+        prepared = self.prepare(treatment_plan, enabled=enabled)
+        items = list(prepared["items"])
+        llm_seconds = 0.0
+        if prepared["unresolved"]:
+            remaining = prepared["remaining"]
+            start = time.perf_counter()
+            response = request_standardization(remaining, self.library.relevant_actions(remaining),
+                                               bypass_cache=bypass_cache)
+            llm_seconds = time.perf_counter() - start
+            items += [self.remainder_item(prepared, action, position)
+                      for position, action in enumerate(filter_action_lines(response))]
+        return self.finish(patient_id, prepared, items, llm_seconds)
+
+    def get_report(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """最近一次处理该患者时的命中报告"""
+        with self.lock:
+            report = self.reports.get(patient_id)
+            return dict(report) if report else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """总体命中率、节省的LLM调用和最近患者的报告"""
+        with self.lock:
+            return {
+                **self.stats,
+                "hit_rate": hit_rate(self.stats["resolved"], self.stats["fallback"]),
+                "rules": len(self.rules),
+                "recent": dict(self.reports),
+            }
+
+# 全局共享的规则预标准化器
+rule_standardizer = RuleStandardizer()
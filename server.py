@@ -0,0 +1,90 @@
+"""生产服务器
+
+开发服务器（app.run）只有一个进程，多名标注员同时使用时会互相阻塞。
+python app.py serve 启动多进程多线程的WSGI服务器：
+- Linux/macOS 使用 gunicorn（gthread 工作模式，每个进程若干线程，流式响应不占满进程）
+- Windows 或未安装 gunicorn 时使用 waitress（单进程多线程）
+
+各进程通过数据目录共享状态：标注与动作库写入使用跨进程文件锁，
+LLM缓存和患者索引按文件变化各自刷新。
+"""
+import os
+import sys
+import argparse
+
+import config
+
+# 默认监听地址、进程数和每个进程的线程数
+SERVER_HOST = getattr(config, "SERVER_HOST", "127.0.0.1")
+SERVER_PORT = getattr(config, "SERVER_PORT", 5000)
+SERVER_WORKERS = getattr(config, "SERVER_WORKERS", min(4, os.cpu_count() or 1))
+SERVER_THREADS = getattr(config, "SERVER_THREADS", 8)
+# 流式生成可能持续较久，超时需大于LLM调用的总耗时
+SERVER_TIMEOUT = getattr(config, "SERVER_TIMEOUT", 300)
+
+def load_app():
+    """在工作进程中导入应用（各进程各自初始化索引、线程池等），并在后台预热索引"""
+    from app import app, start_warmup
+    start_warmup()
+    return app
+
+def serve_gunicorn(host: str, port: int, workers: int, threads: int, timeout: int):
+    from gunicorn.app.base import BaseApplication
+
+    class AnnotationServer(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread",
+                "timeout": timeout,
+                "graceful_timeout": 30,
+                "accesslog": "-",
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()
+
+    AnnotationServer().run()
+
+def serve_waitress(host: str, port: int, threads: int):
+    from waitress import serve
+    serve(load_app(), host=host, port=port, threads=threads, channel_timeout=SERVER_TIMEOUT)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python app.py serve", description="启动生产服务器")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="进程数（仅 gunicorn）")
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS, help="每个进程的线程数")
+    parser.add_argument("--timeout", type=int, default=SERVER_TIMEOUT, help="请求超时（秒）")
+    parser.add_argument("--waitress", action="store_true", help="强制使用 waitress")
+    args = parser.parse_args(argv)
+
+    use_gunicorn = not args.waitress and sys.platform != "win32"
+    if use_gunicorn:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            use_gunicorn = False
+
+    if use_gunicorn:
+        print(f"使用 gunicorn 启动: http://{args.host}:{args.port} "
+              f"({args.workers} 个进程 x {args.threads} 个线程)")
+        serve_gunicorn(args.host, args.port, args.workers, args.threads, args.timeout)
+        return 0
+
+    try:
+        import waitress  # noqa: F401
+    except ImportError:
+        print("未找到可用的生产服务器，请安装: pip install gunicorn（Linux/macOS）或 pip install waitress")
+        return 1
+    print(f"使用 waitress 启动: http://{args.host}:{args.port} ({args.threads} 个线程)")
+    serve_waitress(args.host, args.port, args.threads)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
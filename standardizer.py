@@ -0,0 +1,285 @@
+import queue
+import asyncio
+import logging
+import threading
+from typing import List, Dict, Any, Tuple, Callable, Optional, Iterator
+
+import config
+from llm_cache import llm_cache, make_cache_key
+from llm_client import llm_client, MODEL, LLMEmptyResponseError
+
+def call_llm(prompt: str, test_mode: bool=False) -> str:
+    """调用LLM并返回响应，失败时抛出 LLMError"""
+    if test_mode:
+        logging.debug(f"测试模式，不调用LLM: {prompt}")
+        return "LLM response 1 \nLLM response 2"
+
+    return llm_client.complete(prompt)
+
+def call_llm_stream(prompt: str):
+    """流式调用LLM，逐段返回文本，失败时抛出 LLMError"""
+    yield from llm_client.stream(prompt)
+
+
+# 修改 standardize_actions_prompt 时递增，使旧的缓存响应失效
+PROMPT_VERSION = "1"
+
+standardize_actions_prompt = """
+你是一位专业的正畸医生助手，需要将口语化、描述性的正畸治疗计划拆分为标准化的诊疗动作。
+
+任务要求：
+1. 将输入的治疗计划文本拆分为具体的、可执行的诊疗动作
+2. 每个动作应该是原子化的，即一个动作只描述一个具体的治疗手段
+3. 使用标准的正畸医学术语
+4. 去除费用、时间、风险提示等非治疗动作的内容
+5. 每行输出一个诊疗动作，不要添加序号或其他格式
+6. 尽可能保存所有动词以及包含的医学术语，因为这些都属于重要的手段信息
+7. 方向前后也尽可能保留，位置信息和方向都属于重要的定位信息，比如"右移"、"左移"、"向后移动"等等
+8. 如果一小句中有多个动作，每个动作都要单独输出，不要合并
+9. 如果有多颗牙同时进行拆开，也要依次拆分
+10. "适度""尝试"等程度词不做保存，保证动作的标准化特性
+
+
+标准诊疗动作库：
+[这里是标准诊疗动作库]
+
+转换规则：
+- "上下唇倾排齐，解除拥挤及扭转" → "排齐上颌牙列"、"排齐下颌牙列"、"解除拥挤"、"纠正扭转牙"
+- "后牙锁合先利用矫治器纠正" → "纠正后牙锁合"
+- "维持磨牙关系" → "维持磨牙关系"
+- "上颌排齐整平后，拉17向近中，右侧直立27并拉向近中" → "排齐上颌牙列"、"整平上颌牙列"、"拉17向近中"、"右侧直立27"、"拉27向近中"
+- "下颌右侧推磨牙向后开辟间隙" → "下颌右侧推磨牙向后"、"开辟间隙"
+- "上颌前牙整体右移调整中线" → "前牙整体移动"、"纠正中线"
+- "智齿酌情" → "拔除智齿"
+- "正畸保持" → "正畸保持"
+- "下颌左侧直立磨牙" → "下颌左侧直立磨牙"
+- "必要时下前牙配合片切解决三角间隙" → "片切解决三角间隙"
+- "13、46、47全冠修复" → "13全冠修复"、"46全冠修复"、"47全冠修复"
+- "利用拔牙间隙排齐牙列，上前牙适度内收" → "排齐上颌牙列"、"排齐下颌牙列"、"内收上前牙"
+- "双颌扩弓，前牙原地排齐（考虑到患者鼻唇角较小），末端回弯。" → "双颌扩弓"、"排齐上颌牙列"、"末端回弯"
+- "左侧III类牵引配合推磨牙（考虑到下颌中线右偏），纠正左侧磨牙近中关系。" → "左侧III类牵引"、"推磨牙"、"纠正左侧磨牙近中关系"
+- "压低上前牙纠正深覆合（考虑到ahead牙位置较上唇较高）" → "压低ahead牙"、"纠正深覆合"
+- "斜行牵引纠正中线" → "斜行牵引"、"纠正中线"
+- "下颌推磨牙向后纠正磨牙关系，配合扩弓排齐牙列" → "下颌推磨牙向后"、"纠正磨牙关系"、"配合扩弓"、"排齐牙列"
+- "压低下前牙，尝试改善下颌角" → "压低下前牙"、"尝试改善下颌角"
+- "利用现有间隙内收上下牙列关闭现有间隙" → "内收上下牙列"、"关闭现有间隙"
+- "建立后牙稳定咬合关系及正常符合覆盖" → "建立后牙稳定咬合关系"
+- "上颌少量扩弓，改善宽度不调" → "上颌扩弓"、"改善宽度不调"
+- "下颌少量片切解除拥挤" → "下颌片切"、"解除拥挤"
+- "压低下前牙整平牙列打开咬合" → "压低下前牙"、"整平牙列"、"打开咬合"
+- "推双侧磨牙向远中" → "推双侧磨牙向远中"
+- "利用上述间隙排齐牙齿，压低并内收上下前牙" → "排齐牙齿"、"压低ahead牙"、"压低下前牙"、"内收ahead牙"、"内收下前牙"
+- "右侧适度推磨牙向后改善磨牙与尖牙关系" → "右侧推磨牙向后"、"改善磨牙关系"、"改善尖牙关系"
+- "交互牵引解除右侧后牙正锁合" → "交互牵引"、"解除右侧后牙正锁合"
+- "36酌情树脂或全冠修复" → "36全冠修复"、"36树脂修复"
+
+请将以下治疗计划拆分为标准化的诊疗动作：
+[这里是诊疗方案]
+"""
+
+def build_standardize_prompt(treatment_plan: str, action_library: List[str]) -> str:
+    """构建诊疗动作标准化提示词"""
+    action_library_text = "\n".join(action_library)
+    prompt = standardize_actions_prompt
+    prompt = prompt.replace("[这里是标准诊疗动作库]", action_library_text)
+    prompt = prompt.replace("[这里是诊疗方案]", treatment_plan)
+    return prompt
+
+def request_standardization(treatment_plan: str, action_library: List[str],
+                            bypass_cache: bool = False) -> str:
+    """获取诊疗方案的标准化LLM响应，优先读取缓存，失败时抛出异常"""
+    cache_key = make_cache_key(MODEL, PROMPT_VERSION, action_library, treatment_plan)
+    if bypass_cache:
+        llm_cache.record_bypass()
+    else:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    response = call_llm(build_standardize_prompt(treatment_plan, action_library))
+    llm_cache.put(cache_key, response)
+    return response
+
+def stream_standardization(treatment_plan: str, action_library: List[str],
+                           bypass_cache: bool = False):
+    """流式获取标准化诊疗动作，每完成一行立即返回一个动作，失败时抛出异常
+
+    缓存命中时直接逐行返回缓存内容；否则边接收边解析，结束后写入缓存。
+    """
+    cache_key = make_cache_key(MODEL, PROMPT_VERSION, action_library, treatment_plan)
+    if bypass_cache:
+        llm_cache.record_bypass()
+    else:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            yield from filter_action_lines(cached)
+            return
+
+    parser = ActionLineParser()
+    chunks = []
+    for chunk in call_llm_stream(build_standardize_prompt(treatment_plan, action_library)):
+        chunks.append(chunk)
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+    response = "".join(chunks).strip()
+    if not response:
+        raise LLMEmptyResponseError("LLM返回空内容")
+    llm_cache.put(cache_key, response)
+
+def is_action_line(line: str) -> bool:
+    """过滤掉空行、标题行、说明行等"""
+    return bool(line and
+                not line.startswith('**') and
+                not line.startswith('##') and
+                not line.startswith('-') and
+                not line.startswith('以下') and
+                not line.startswith('标准') and
+                not line.startswith('请') and
+                len(line) > 2 and
+                len(line) < 100)  # 合理的长度范围
+
+class ActionLineParser:
+    """增量行解析器：接收流式文本片段，每凑齐一整行就输出其中的诊疗动作"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """追加文本片段，返回新完成的动作行"""
+        self.buffer += text
+        if '\n' not in self.buffer:
+            return []
+        *lines, self.buffer = self.buffer.split('\n')
+        return [line.strip() for line in lines if is_action_line(line.strip())]
+
+    def close(self) -> List[str]:
+        """流结束时处理最后一行"""
+        line, self.buffer = self.buffer.strip(), ""
+        return [line] if is_action_line(line) else []
+
+def filter_action_lines(response: str) -> List[str]:
+    """从LLM响应中提取诊疗动作行"""
+    actions = []
+    for line in response.split('\n'):
+        line = line.strip()
+        if is_action_line(line):
+            actions.append(line)
+    return actions
+
+def dedupe_actions(actions: List[str]) -> List[str]:
+    """去重并保持顺序"""
+    seen = set()
+    result = []
+    for action in actions:
+        if action not in seen:
+            seen.add(action)
+            result.append(action)
+    return result
+
+# ---- 分句并行标准化 ----
+
+# 是否默认按分句并行调用LLM，可被请求参数 fanout 覆盖
+LLM_FANOUT = getattr(config, "LLM_FANOUT", False)
+# 同时进行的分句组请求数
+LLM_FANOUT_PARALLEL = getattr(config, "LLM_FANOUT_PARALLEL", 4)
+# 相邻的短分句合并成一组，每组不超过该字符数
+LLM_FANOUT_GROUP_CHARS = getattr(config, "LLM_FANOUT_GROUP_CHARS", 120)
+
+def split_plan_clauses(treatment_plan: str) -> List[Tuple[int, str]]:
+    """按行（即原始病历中的 <sep> 分句及步骤行）切分诊疗方案，返回 [(在方案中的偏移, 分句)]"""
+    clauses = []
+    offset = 0
+    for line in treatment_plan.split('\n'):
+        text = line.strip()
+        if text:
+            clauses.append((offset + len(line) - len(line.lstrip()), text))
+        offset += len(line) + 1
+    return clauses
+
+def group_clauses(clauses: List[Tuple[int, str]],
+                  max_chars: int = LLM_FANOUT_GROUP_CHARS) -> List[List[Tuple[int, str]]]:
+    """按原顺序把相邻分句合并成不超过 max_chars 的组"""
+    groups = []
+    size = 0
+    for clause in clauses:
+        if groups and size + len(clause[1]) <= max_chars:
+            groups[-1].append(clause)
+            size += len(clause[1])
+        else:
+            groups.append([clause])
+            size = len(clause[1])
+    return groups
+
+async def _standardize_groups(groups: List[List[Tuple[int, str]]], library_for: Callable[[str], List[str]],
+                              bypass_cache: bool, on_result: Callable[[int, List[str]], None],
+                              parallel: int):
+    """在 asyncio 中以有限并发标准化各组，每组完成时回调 on_result(组序号, 动作)"""
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def run(index: int, group: List[Tuple[int, str]]):
+        text = "\n".join(clause for _, clause in group)
+        async with semaphore:
+            # LLM客户端是同步的（共享连接池和熔断状态），放到线程中执行
+            response = await asyncio.to_thread(request_standardization, text, library_for(text), bypass_cache)
+        on_result(index, filter_action_lines(response))
+
+    results = await asyncio.gather(*(run(i, g) for i, g in enumerate(groups)), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        raise errors[0]
+
+def stream_fanout_standardization(treatment_plan: str, library_for: Callable[[str], List[str]],
+                                  bypass_cache: bool = False,
+                                  parallel: int = LLM_FANOUT_PARALLEL,
+                                  clauses: Optional[List[Tuple[int, str]]] = None) -> Iterator[Dict[str, Any]]:
+    """分句并行标准化，每组完成即返回该组的动作（按完成先后，不是原文顺序）
+
+    每个动作为 {"text", "offset", "end", "group", "position"}，offset/end 为来源分句组在方案中的范围。
+    用 merge_fanout_actions 按原文顺序合并去重。任一组失败时在其余组结束后抛出 LLMError。
+    clauses 不为空时只处理这些分句（如规则预标准化后剩下的分句），不再切分 treatment_plan。
+    """
+    groups = group_clauses(clauses if clauses is not None else split_plan_clauses(treatment_plan))
+    finished = queue.Queue()
+    done = object()
+
+    def worker():
+        try:
+            asyncio.run(_standardize_groups(groups, library_for, bypass_cache,
+                                            lambda index, actions: finished.put((index, actions)), parallel))
+            finished.put(done)
+        except Exception as e:
+            finished.put(e)
+
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        item = finished.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        index, actions = item
+        group = groups[index]
+        start = group[0][0]
+        end = group[-1][0] + len(group[-1][1])
+        for position, action in enumerate(actions):
+            yield {"text": action, "offset": start, "end": end, "group": index, "position": position}
+
+def merge_fanout_actions(items: List[Dict[str, Any]]) -> List[str]:
+    """按来源分句的原文顺序合并各组动作并去重"""
+    ordered = sorted(items, key=lambda item: (item["offset"], item["position"]))
+    return dedupe_actions([item["text"] for item in ordered])
+
+def standardize_actions_with_llm(treatment_plan: str, action_library: List[str],
+                                 bypass_cache: bool = False, fanout: bool = False,
+                                 library_for: Optional[Callable[[str], List[str]]] = None) -> List[str]:
+    """使用LLM标准化诊疗动作，失败时抛出 LLMError
+
+    fanout 为 True 时按分句并行调用，library_for(分句文本) 返回该组使用的动作库（默认都用 action_library）。
+    """
+    if fanout:
+        library_for = library_for or (lambda text: action_library)
+        return merge_fanout_actions(list(stream_fanout_standardization(
+            treatment_plan, library_for, bypass_cache=bypass_cache)))
+    response = request_standardization(treatment_plan, action_library, bypass_cache=bypass_cache)
+    return dedupe_actions(filter_action_lines(response))
@@ -3,13 +3,62 @@ let currentPatientId = null;
 let patientIds = [];
 let problemsData = [];
 let solutionsData = [];
+let solutionsById = new Map(); // 动作ID -> solutionsData 中的对象，修改 solutionsData 后调用 indexSolutions
 let annotationLinks = {}; // 结构: { solutionId: [problemId1, problemId2], ... }
+let problemLinks = new Map(); // 反向索引: 问题ID -> Set(动作ID)，通过 setLink 修改关联，整体替换 annotationLinks 后调用 indexLinks
 let selectedSolutionId = null;
+let linkSuggestions = []; // 根据历史标注推荐的关联: [{ action_id, problem_id, confidence, count, lift }, ...]
+
+// 患者列表分页：patientIds 只保存已加载的一段连续ID
+const PATIENT_PAGE_SIZE = 200;
+let patientFilter = '';
+let patientPrevCursor = null;
+let patientNextCursor = null;
+const PATIENT_PREV_OPTION = '__prev__';
+const PATIENT_NEXT_OPTION = '__next__';
+
+// 增量保存：本地修改记为操作，防抖后批量提交到服务器
+const OPS_DEBOUNCE_MS = 800;
+const OPS_MAX_CONFLICT_RETRIES = 3;
+const opQueue = {
+    patientId: null,
+    baseRevision: 0,
+    nextActionId: 0, // 新建动作的ID编号，由服务器的 next_action_id 初始化
+    ops: []
+};
+let opsTimer = null;
+let opsFlushPromise = null;
 
 // 缓存机制
 const patientCache = new Map();
 const CACHE_EXPIRY = 5 * 60 * 1000; // 5分钟缓存
 
+// 流式生成连接中断后重新订阅后台任务的最多次数
+const STREAM_MAX_RECONNECTS = 5;
+
+// 预取：打开患者后提前加载列表中后续几个患者的数据（服务器同时在后台预生成动作）
+const PREFETCH_DEPTH = 3;
+const prefetchRequests = new Map(); // 患者ID -> 进行中的预取请求
+const prefetchStats = { requested: 0, hits: 0, misses: 0 };
+
+// 流式动作的动画节奏（服务器收到即推送，前端负责错开显示）
+const STREAM_ANIMATION_INTERVAL = 150; // 毫秒
+let streamAnimationTimers = [];
+let nextStreamAnimationTime = 0;
+
+// 词块按ID复用：点击、编辑只更新受影响的词块，不整体重建列表
+const problemChips = new Map(); // 问题ID -> 已创建的问题词块
+let problemsById = new Map(); // 问题ID -> problemsData 中的对象，renderProblems 时重建
+const solutionChips = new Map(); // 动作ID -> 已创建的动作容器
+
+// 列表虚拟化：词块数超过阈值时分块渲染，只创建滚动区域附近的块
+const VIRTUAL_THRESHOLD = 300;
+const VIRTUAL_BLOCK_SIZE = 60;
+const VIRTUAL_BLOCK_HEIGHT = 240; // 尚未创建的块的占位高度（像素），创建后按实际高度
+const VIRTUAL_MARGIN = '400px'; // 视口上下提前创建的范围
+const virtualBlocks = new WeakMap(); // 块元素 -> { items, create, context, chips, shown }
+const virtualObservers = new Map(); // 滚动容器 -> IntersectionObserver
+
 // 优化双击事件处理
 let clickTimeout = null;
 let isDoubleClick = false;
@@ -25,11 +74,13 @@ const RETRY_CONFIG = {
 const elements = {
     patientInfo: document.getElementById('patient-info'),
     patientSelector: document.getElementById('patient-selector'),
+    patientFilter: document.getElementById('patient-filter'),
     prevButton: document.getElementById('prev-patient'),
     nextButton: document.getElementById('next-patient'),
     saveButton: document.getElementById('save-btn'),
     addActionBtn: document.getElementById('add-action-btn'),
     regenerateActionsBtn: document.getElementById('regenerate-actions-btn'),
+    acceptSuggestionsBtn: document.getElementById('accept-suggestions-btn'),
     useStreamCheckbox: document.getElementById('use-stream'),
     expandPlanBtn: document.getElementById('expand-plan-btn'),
     problemsContainer: document.getElementById('problems-container'),
@@ -72,10 +123,11 @@ function getCachedPatient(patientId) {
     return null;
 }
 
-function setCachedPatient(patientId, data) {
+function setCachedPatient(patientId, data, prefetched = false) {
     patientCache.set(patientId, {
         data: data,
-        timestamp: Date.now()
+        timestamp: Date.now(),
+        prefetched: prefetched // 由预取写入且尚未使用
     });
 }
 
@@ -89,8 +141,11 @@ async function init() {
         showLoading(true);
         await loadPatientList();
         if (patientIds.length > 0) {
-            // 获取最近编辑的患者ID
+            // 获取最近编辑的患者ID，不在第一页时从该患者开始加载列表
             const lastEditedPatient = await getLastEditedPatient();
+            if (lastEditedPatient && !patientIds.includes(lastEditedPatient)) {
+                await loadPatientList(lastEditedPatient);
+            }
             const patientToLoad = lastEditedPatient || patientIds[0];
             
             // 智能选择加载方式：如果是最近编辑的患者，使用常规加载；如果是新患者且开启流式，使用流式加载
@@ -121,32 +176,170 @@ async function getLastEditedPatient() {
     return null;
 }
 
-// 加载患者列表
-async function loadPatientList() {
+// 构建患者列表查询参数
+function buildPatientQuery(extra = {}) {
+    const params = new URLSearchParams({ limit: PATIENT_PAGE_SIZE });
+    if (patientFilter === 'has_links') {
+        params.set('has_links', 'true');
+    } else if (patientFilter) {
+        params.set('status', patientFilter);
+    }
+    Object.entries(extra).forEach(([key, value]) => params.set(key, value));
+    return `/api/patients?${params.toString()}`;
+}
+
+// 加载患者列表（第一页，或从指定患者开始的一页）
+async function loadPatientList(startId = null) {
     try {
-        const response = await fetchWithRetry('/api/patients');
+        const response = await fetchWithRetry(buildPatientQuery(startId ? { start: startId } : {}));
         const data = await response.json();
         
         patientIds = data.patients;
+        patientPrevCursor = data.prev_cursor;
+        patientNextCursor = data.next_cursor;
+        updatePatientFilter(data.facets);
         updatePatientSelector();
         updateNavigationButtons();
         
-        console.log(`成功加载 ${patientIds.length} 个患者`);
+        console.log(`成功加载 ${patientIds.length}/${data.total} 个患者`);
     } catch (error) {
         console.error('加载患者列表失败:', error);
         throw new Error('加载患者列表失败: ' + error.message);
     }
 }
 
-// 更新患者选择器
+// 加载后一页患者
+async function loadMorePatients() {
+    if (!patientNextCursor) return;
+    const response = await fetchWithRetry(buildPatientQuery({ cursor: patientNextCursor }));
+    const data = await response.json();
+    
+    patientIds = patientIds.concat(data.patients);
+    patientNextCursor = data.next_cursor;
+    updatePatientFilter(data.facets);
+    updatePatientSelector();
+    updateNavigationButtons();
+}
+
+// 加载前一页患者
+async function loadEarlierPatients() {
+    if (!patientPrevCursor) return;
+    const response = await fetchWithRetry(buildPatientQuery({ before: patientPrevCursor }));
+    const data = await response.json();
+    
+    patientIds = data.patients.concat(patientIds);
+    patientPrevCursor = data.prev_cursor;
+    updatePatientFilter(data.facets);
+    updatePatientSelector();
+    updateNavigationButtons();
+}
+
+// 更新筛选项上的数量
+function updatePatientFilter(facets) {
+    if (!elements.patientFilter || !facets) return;
+    const counts = {
+        '': facets.all,
+        unannotated: facets.unannotated,
+        auto_generated: facets.auto_generated,
+        annotated: facets.annotated,
+        has_links: facets.has_links
+    };
+    Array.from(elements.patientFilter.options).forEach(option => {
+        if (!option.dataset.label) {
+            option.dataset.label = option.textContent;
+        }
+        option.textContent = `${option.dataset.label} (${counts[option.value] ?? 0})`;
+    });
+}
+
+// 更新患者选择器（只包含已加载的分页）
 function updatePatientSelector() {
-    elements.patientSelector.innerHTML = '<option value="">选择患者...</option>';
-    patientIds.forEach(id => {
+    const fragment = document.createDocumentFragment();
+    const addOption = (value, text) => {
         const option = document.createElement('option');
-        option.value = id;
-        option.textContent = `患者 ${id}`;
-        elements.patientSelector.appendChild(option);
-    });
+        option.value = value;
+        option.textContent = text;
+        fragment.appendChild(option);
+    };
+    
+    addOption('', '选择患者...');
+    if (patientPrevCursor) {
+        addOption(PATIENT_PREV_OPTION, '↑ 加载更早的患者...');
+    }
+    patientIds.forEach(id => addOption(id, `患者 ${id}`));
+    if (patientNextCursor) {
+        addOption(PATIENT_NEXT_OPTION, '↓ 加载更多患者...');
+    }
+    
+    elements.patientSelector.innerHTML = '';
+    elements.patientSelector.appendChild(fragment);
+    elements.patientSelector.value = currentPatientId && patientIds.includes(currentPatientId) ? currentPatientId : '';
+}
+
+
+// 取得患者数据：优先使用缓存或进行中的预取，返回 { data, prefetched }
+async function fetchPatientData(patientId, forceRegenerate = false) {
+    if (!forceRegenerate) {
+        const cached = patientCache.get(patientId);
+        if (cached && Date.now() - cached.timestamp < CACHE_EXPIRY) {
+            const prefetched = cached.prefetched;
+            cached.prefetched = false;
+            console.log(`从缓存加载患者 ${patientId}`);
+            return { data: cached.data, prefetched };
+        }
+        const pending = prefetchRequests.get(patientId);
+        const data = pending ? await pending : null;
+        if (data) {
+            patientCache.get(patientId).prefetched = false;
+            return { data, prefetched: true };
+        }
+    }
+    
+    const url = forceRegenerate ? 
+        `/api/patient/${patientId}?force_regenerate=true` : 
+        `/api/patient/${patientId}`;
+    const response = await fetchWithRetry(url);
+    const data = await response.json();
+    
+    // 如果不是强制重新生成，缓存数据
+    if (!forceRegenerate) {
+        setCachedPatient(patientId, data);
+    }
+    return { data, prefetched: false };
+}
+
+// 预取列表中当前患者之后的几个患者（逐个请求，不影响当前操作）
+async function prefetchNextPatients() {
+    const currentIndex = patientIds.indexOf(currentPatientId);
+    if (currentIndex === -1) return;
+    
+    // 服务器按相同的筛选条件在后台解析并预生成后续患者的动作
+    const params = new URLSearchParams();
+    if (patientFilter === 'has_links') {
+        params.set('has_links', 'true');
+    } else if (patientFilter) {
+        params.set('status', patientFilter);
+    }
+    fetch(`/api/prefetch/${currentPatientId}?${params.toString()}`, { method: 'POST' }).catch(() => {});
+    
+    for (const patientId of patientIds.slice(currentIndex + 1, currentIndex + 1 + PREFETCH_DEPTH)) {
+        if (getCachedPatient(patientId) || prefetchRequests.has(patientId)) {
+            continue;
+        }
+        const request = fetch(`/api/patient/${patientId}`)
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                if (data) {
+                    setCachedPatient(patientId, data, true);
+                }
+                return data;
+            })
+            .catch(() => null)
+            .finally(() => prefetchRequests.delete(patientId));
+        prefetchRequests.set(patientId, request);
+        prefetchStats.requested++;
+        await request;
+    }
 }
 
 // 加载指定患者数据
@@ -154,26 +347,17 @@ async function loadPatient(patientId, useStream = false, forceRegenerate = false
     try {
         showLoading(true);
         
-        // 如果不是强制重新生成，检查缓存
+        // 首先检查患者是否有已保存的数据（预取命中时不再等待请求）
+        const { data, prefetched } = await fetchPatientData(patientId, forceRegenerate);
         if (!forceRegenerate) {
-            const cachedData = getCachedPatient(patientId);
-            if (cachedData) {
-                console.log(`从缓存加载患者 ${patientId}`);
-                await loadPatientDirectly(cachedData);
-                return;
-            }
+            prefetched ? prefetchStats.hits++ : prefetchStats.misses++;
         }
         
-        // 首先检查患者是否有已保存的数据
-        const url = forceRegenerate ? 
-            `/api/patient/${patientId}?force_regenerate=true` : 
-            `/api/patient/${patientId}`;
-        const response = await fetchWithRetry(url);
-        const data = await response.json();
-        
-        // 如果不是强制重新生成，缓存数据
-        if (!forceRegenerate) {
-            setCachedPatient(patientId, data);
+        // 服务器上该患者的生成任务仍在进行（如刷新了页面），重新订阅其进度
+        if (data.active_job && !forceRegenerate) {
+            console.log(`患者 ${patientId} 有进行中的生成任务 ${data.active_job}，继续接收`);
+            await loadPatientWithStream(patientId, data, data.active_job);
+            return;
         }
         
         // 如果有已保存的数据且不是强制重新生成，直接使用，不使用流式加载
@@ -187,7 +371,7 @@ async function loadPatient(patientId, useStream = false, forceRegenerate = false
         if (useStream) {
             const actionType = forceRegenerate ? '重新生成' : '生成';
             console.log(`患者 ${patientId} ${actionType}，使用流式生成`);
-            await loadPatientWithStream(patientId);
+            await loadPatientWithStream(patientId, data);
             return;
         }
         
@@ -201,6 +385,7 @@ async function loadPatient(patientId, useStream = false, forceRegenerate = false
         showMessage('加载患者数据失败: ' + error.message, 'error');
     } finally {
         showLoading(false);
+        prefetchNextPatients();
     }
 }
 
@@ -257,12 +442,18 @@ const ErrorLogger = {
 
 // 直接加载患者数据（用于有已保存数据的情况）
 async function loadPatientDirectly(data) {
+    await resetOpQueue(data.patient_id, data.revision, data.next_action_id);
+    
     // 更新全局状态
     currentPatientId = data.patient_id;
     problemsData = data.problems;
     solutionsData = data.solutions;
+    indexSolutions();
     annotationLinks = data.annotations || {};
-    selectedSolutionId = null;
+    indexLinks();
+    linkSuggestions = data.suggestions || [];
+    // 默认选择第一个动作
+    selectedSolutionId = solutionsData.length > 0 ? solutionsData[0].id : null;
     
     // 更新UI
     elements.patientInfo.textContent = `正畸标注工具 - 患者 ${data.patient_id}`;
@@ -272,36 +463,34 @@ async function loadPatientDirectly(data) {
     renderSolutions();
     renderOriginalPlan(data.original_treatment_plan || '');
     
-    // 默认选择第一个动作
-    if (solutionsData.length > 0) {
-        selectedSolutionId = solutionsData[0].id;
-        // 重新渲染以应用选择状态
-        renderSolutions();
-        renderProblems();
-    }
-    
     updateNavigationButtons();
     
     console.log('患者数据加载完成:', data);
 }
 
-// 流式加载患者数据
-async function loadPatientWithStream(patientId) {
+// 流式加载患者数据（data 为已取得的患者基本信息，jobId 为要继续接收的后台任务）
+async function loadPatientWithStream(patientId, data = null, jobId = null) {
     try {
-        // 先获取基本的患者信息（问题列表等）
-        const response = await fetch(`/api/patient/${patientId}`);
-        const data = await response.json();
-        
-        if (!response.ok) {
-            throw new Error(data.error || '获取患者数据失败');
+        if (!data) {
+            // 先获取基本的患者信息（问题列表等）
+            const response = await fetch(`/api/patient/${patientId}`);
+            data = await response.json();
+            
+            if (!response.ok) {
+                throw new Error(data.error || '获取患者数据失败');
+            }
         }
         
         // 更新基本信息
+        await resetOpQueue(patientId, data.revision, data.next_action_id);
         currentPatientId = patientId;
         problemsData = data.problems;
         annotationLinks = data.annotations || {};
+        indexLinks();
+        linkSuggestions = [];
         selectedSolutionId = null;
         solutionsData = []; // 清空，准备流式加载
+        indexSolutions();
         
         // 更新UI
         elements.patientInfo.textContent = `正畸标注工具 - 患者 ${patientId}`;
@@ -311,60 +500,115 @@ async function loadPatientWithStream(patientId) {
         renderOriginalPlan(data.original_treatment_plan || '');
         
         // 显示流式加载状态
+        cancelStreamAnimations();
         showStreamingActions();
         
-        // 开始流式获取诊疗动作
-        const eventSource = new EventSource(`/api/patient/${patientId}/stream-actions`);
+        // 开始流式获取诊疗动作（生成在服务器后台任务中进行，断线后从最后收到的事件继续）
+        let eventSource = null;
+        let lastEventId = null;
+        let reconnects = 0;
         
-        eventSource.onmessage = function(event) {
+        const openStream = (url) => {
+            eventSource = new EventSource(url);
+            eventSource.onmessage = handleStreamEvent;
+            eventSource.onerror = handleStreamError;
+        };
+        
+        const handleStreamEvent = function(event) {
             const data = JSON.parse(event.data);
+            if (event.lastEventId) {
+                lastEventId = event.lastEventId;
+            }
             
             switch(data.type) {
                 case 'start':
+                    if (data.job_id) {
+                        jobId = data.job_id;
+                    }
                     console.log('开始生成诊疗动作...');
                     break;
                 
                 case 'action':
                     // 添加新动作到列表
                     const newAction = {
-                        id: `action-${solutionsData.length}`,
+                        id: data.id,
                         text: data.text
                     };
-                    solutionsData.push(newAction);
+                    if (data.offset !== undefined) {
+                        // 分句并行生成时按完成先后到达，按来源分句在原文中的位置插入
+                        newAction.offset = data.offset;
+                        const before = solutionsData.findIndex(s => s.offset > data.offset);
+                        solutionsData.splice(before === -1 ? solutionsData.length : before, 0, newAction);
+                    } else {
+                        solutionsData.push(newAction);
+                    }
+                    solutionsById.set(newAction.id, newAction);
                     
-                    // 动态添加到UI
-                    addActionToUI(newAction, true); // true表示动画效果
+                    // 动态添加到UI，按固定节奏错开动画
+                    scheduleStreamAction(newAction);
                     break;
                 
                 case 'complete':
-                    // 完成时更新最终的动作列表
-                    solutionsData = data.actions.map((text, index) => ({
-                        id: `action-${index}`,
-                        text: text
-                    }));
-                    
-                    // 重新渲染完整列表
-                    renderSolutions();
-                    
-                    // 默认选择第一个动作
-                    if (solutionsData.length > 0) {
-                        selectedSolutionId = solutionsData[0].id;
-                        renderSolutions();
-                        renderProblems();
-                    }
-                    
-                    hideStreamingActions();
                     eventSource.close();
-                    
-                    // 显示自动保存消息
-                    if (data.auto_saved) {
-                        showMessage('诊疗动作生成完成并已自动保存', 'success');
+                    // 服务器已保存生成结果，缓存中的未标注数据作废
+                    patientCache.delete(patientId);
+                    if (data.prefetched) {
+                        console.log(`患者 ${patientId} 使用了后台预生成的动作`);
                     }
                     
-                    console.log('诊疗动作生成完成');
+                    // 等排队中的动画播放完再整体刷新
+                    whenStreamAnimationsDone(() => {
+                        // 期间已切换到其他患者则忽略
+                        if (currentPatientId !== patientId) {
+                            return;
+                        }
+                        
+                        // 服务器已自动保存，后续增量修改以新修订为基础
+                        if (data.revision !== undefined) {
+                            opQueue.baseRevision = data.revision;
+                        }
+                        
+                        // 完成时更新为已保存的动作列表；流式阶段的临时ID按文本改为保存后的ID，已显示的词块继续复用
+                        const streamedIds = new Map(solutionsData.map(solution => [solution.text, solution.id]));
+                        solutionsData = (data.solutions || data.actions.map((text, index) => ({
+                            id: `action-${index}`,
+                            text: text
+                        }))).map(solution => ({ id: solution.id, text: solution.text }));
+                        solutionsData.forEach(solution => {
+                            const streamedId = streamedIds.get(solution.text);
+                            const chipContainer = streamedId !== undefined && solutionChips.get(streamedId);
+                            if (streamedId !== solution.id && chipContainer) {
+                                solutionChips.delete(streamedId);
+                                solutionChips.set(solution.id, chipContainer);
+                                chipContainer.dataset.id = solution.id;
+                                chipContainer.firstChild.dataset.id = solution.id;
+                            }
+                        });
+                        indexSolutions();
+                        opQueue.nextActionId = data.next_action_id || solutionsData.length;
+                        linkSuggestions = data.suggestions || [];
+                        
+                        // 默认选择第一个动作
+                        if (solutionsData.length > 0) {
+                            selectedSolutionId = solutionsData[0].id;
+                        }
+                        
+                        // 按最终列表更新（已显示的词块按ID复用），问题列表只更新高亮
+                        hideStreamingActions();
+                        renderSolutions();
+                        refreshProblemChips();
+                        
+                        // 显示自动保存消息
+                        if (data.auto_saved) {
+                            showMessage('诊疗动作生成完成并已自动保存', 'success');
+                        }
+                        
+                        console.log('诊疗动作生成完成');
+                    });
                     break;
                 
                 case 'error':
+                    cancelStreamAnimations();
                     showMessage('生成诊疗动作时出错: ' + data.message, 'error');
                     hideStreamingActions();
                     eventSource.close();
@@ -372,13 +616,23 @@ async function loadPatientWithStream(patientId) {
             }
         };
         
-        eventSource.onerror = function(event) {
+        const handleStreamError = function(event) {
             console.error('EventSource 错误:', event);
+            eventSource.close();
+            // 任务仍在服务器上运行，切换到任务事件流从断点继续
+            if (jobId && reconnects < STREAM_MAX_RECONNECTS && currentPatientId === patientId) {
+                reconnects++;
+                const after = lastEventId === null ? 0 : Number(lastEventId) + 1;
+                setTimeout(() => openStream(`/api/jobs/${jobId}/events?after=${after}`), 1000 * reconnects);
+                return;
+            }
+            cancelStreamAnimations();
             showMessage('连接中断，请重试', 'error');
             hideStreamingActions();
-            eventSource.close();
         };
         
+        openStream(jobId ? `/api/jobs/${jobId}/events` : `/api/patient/${patientId}/stream-actions`);
+        
         updateNavigationButtons();
         
     } catch (error) {
@@ -390,6 +644,7 @@ async function loadPatientWithStream(patientId) {
 
 // 显示流式加载状态
 function showStreamingActions() {
+    clearChips(elements.solutionsContainer, solutionChips);
     elements.solutionsContainer.innerHTML = '<div class="streaming-message">正在智能分析诊疗方案...</div>';
     showLoading(false); // 隐藏普通的加载提示
 }
@@ -402,6 +657,35 @@ function hideStreamingActions() {
     }
 }
 
+// 按动画节奏排队显示流式动作
+function scheduleStreamAction(action) {
+    const now = performance.now();
+    const startAt = Math.max(now, nextStreamAnimationTime);
+    nextStreamAnimationTime = startAt + STREAM_ANIMATION_INTERVAL;
+    
+    const timer = setTimeout(() => {
+        streamAnimationTimers = streamAnimationTimers.filter(t => t !== timer);
+        addActionToUI(action, true); // true表示动画效果
+    }, startAt - now);
+    streamAnimationTimers.push(timer);
+}
+
+// 所有排队的动画开始后执行回调
+function whenStreamAnimationsDone(callback) {
+    const delay = Math.max(0, nextStreamAnimationTime - performance.now());
+    setTimeout(() => {
+        cancelStreamAnimations();
+        callback();
+    }, delay);
+}
+
+// 取消尚未播放的流式动画
+function cancelStreamAnimations() {
+    streamAnimationTimers.forEach(timer => clearTimeout(timer));
+    streamAnimationTimers = [];
+    nextStreamAnimationTime = 0;
+}
+
 // 动态添加动作到UI
 function addActionToUI(action, animated = false) {
     // 移除流式消息（如果存在）
@@ -412,13 +696,21 @@ function addActionToUI(action, animated = false) {
     
     const chip = createSolutionChip(action);
     
+    // 带来源偏移的动作插到偏移更大的动作之前
+    let nextChip = null;
+    if (action.offset !== undefined) {
+        chip.dataset.offset = action.offset;
+        nextChip = Array.from(elements.solutionsContainer.children)
+            .find(child => child.dataset.offset !== undefined && Number(child.dataset.offset) > action.offset) || null;
+    }
+    
     if (animated) {
         // 添加进入动画
         chip.style.opacity = '0';
         chip.style.transform = 'translateY(20px)';
         chip.classList.add('streaming-action');
         
-        elements.solutionsContainer.appendChild(chip);
+        elements.solutionsContainer.insertBefore(chip, nextChip);
         
         // 触发动画
         setTimeout(() => {
@@ -427,76 +719,68 @@ function addActionToUI(action, animated = false) {
             chip.style.transform = 'translateY(0)';
         }, 50);
     } else {
-        elements.solutionsContainer.appendChild(chip);
+        elements.solutionsContainer.insertBefore(chip, nextChip);
     }
 }
 
-// 创建解决方案芯片
+// 创建动作词块（事件由 setupChipEvents 在容器上统一处理），并按ID登记以便复用
 function createSolutionChip(solution) {
     const chipContainer = document.createElement('div');
-    chipContainer.className = 'chip-container-item';
+    chipContainer.className = 'solution-item';
     chipContainer.dataset.id = solution.id;
     
     const chip = document.createElement('div');
-    chip.className = 'chip solution-chip';
+    chip.className = 'chip solution';
     chip.dataset.id = solution.id;
     chip.textContent = solution.text;
+    chip.contentEditable = false;
     
-    // 添加选中状态
-    if (selectedSolutionId === solution.id) {
-        chip.classList.add('selected');
-    }
-    
-    // 添加关联状态
-    if (annotationLinks[solution.id] && annotationLinks[solution.id].length > 0) {
-        chip.classList.add('linked');
-    }
-    
-    // 如果是新动作，添加特殊样式
-    if (solution.isNew) {
-        chip.classList.add('new-action');
-    }
-    
-    // 添加点击事件
-    chip.addEventListener('click', (e) => {
-        if (clickTimeout) {
-            clearTimeout(clickTimeout);
-            clickTimeout = null;
-            isDoubleClick = true;
-            
-            // 双击事件：进入编辑模式
-            enableEditing(chip, solution.id);
-        } else {
-            clickTimeout = setTimeout(() => {
-                if (!isDoubleClick) {
-                    // 单击事件：选择动作
-                    selectSolution(solution.id);
-                }
-                isDoubleClick = false;
-                clickTimeout = null;
-            }, 250);
-        }
-    });
-    
-    // 添加删除按钮
+    // 创建删除按钮
     const deleteBtn = document.createElement('button');
     deleteBtn.className = 'delete-btn';
     deleteBtn.innerHTML = '×';
     deleteBtn.title = '删除动作';
-    deleteBtn.addEventListener('click', (e) => {
-        e.stopPropagation();
-        deleteAction(solution.id);
-    });
     
     chipContainer.appendChild(chip);
     chipContainer.appendChild(deleteBtn);
+    applySolutionChipState(chipContainer, solution);
+    solutionChips.set(solution.id, chipContainer);
     
     return chipContainer;
 }
 
-// 渲染问题列表（按类型分组）
+// 按当前状态设置动作词块的文本和样式（编辑中的词块不改文本）
+function applySolutionChipState(chipContainer, solution) {
+    const chip = chipContainer.firstChild;
+    if (chip.contentEditable !== 'true' && chip.textContent !== solution.text) {
+        chip.textContent = solution.text;
+    }
+    // 新建、选中的标记；编辑中的样式保留
+    let className = 'chip solution';
+    if (solution.isNew) className += ' new-action';
+    if (selectedSolutionId === solution.id) className += ' selected';
+    if (chip.classList.contains('editable')) className += ' editable';
+    if (chip.className !== className) {
+        chip.className = className;
+    }
+}
+
+// 更新指定动作的词块（未创建的词块在创建时按当前状态渲染）
+function updateSolutionChip(solutionId) {
+    const chipContainer = solutionChips.get(solutionId);
+    const solution = solutionsById.get(solutionId);
+    if (chipContainer && solution) {
+        applySolutionChipState(chipContainer, solution);
+    }
+}
+
+// 问题类型排序顺序
+const PROBLEM_TYPE_ORDER = ['主诉', '牙性', '牙齿', '骨性', '软组织', '功能', '生长发育', '不良习惯', '其他'];
+
+// 渲染问题列表（按类型分组）；只在切换患者时整体重建，关联变化由 refreshProblemChips 更新
 function renderProblems() {
-    elements.problemsContainer.innerHTML = '';
+    clearChips(elements.problemsContainer, problemChips);
+    problemsById = new Map(problemsData.map(problem => [problem.id, problem]));
     
     // 按类型分组
     const problemsByType = {};
@@ -508,11 +792,12 @@ function renderProblems() {
         problemsByType[type].push(problem);
     });
     
-    // 定义类型排序顺序
-    const typeOrder = ['主诉', '牙性', '牙齿', '骨性', '软组织', '功能', '生长发育', '不良习惯', '其他'];
+    // 问题很多时各类型分块渲染
+    const virtual = problemsData.length > VIRTUAL_THRESHOLD;
+    const suggested = selectedSuggestions();
     
     // 按顺序渲染每个类型
-    typeOrder.forEach(type => {
+    PROBLEM_TYPE_ORDER.forEach(type => {
         if (problemsByType[type]) {
             // 创建类型标题
             const typeHeader = document.createElement('div');
@@ -524,25 +809,198 @@ function renderProblems() {
             const typeContainer = document.createElement('div');
             typeContainer.className = 'problem-type-container';
             
-            problemsByType[type].forEach(problem => {
-                const chip = document.createElement('div');
-                chip.className = 'chip problem';
-                chip.dataset.id = problem.id;
-                chip.textContent = problem.text;
-                chip.title = `类型: ${type}`;
-                
-                // 检查是否与当前选中的方案有链接
-                if (selectedSolutionId && annotationLinks[selectedSolutionId]?.includes(problem.id)) {
-                    chip.classList.add('linked');
-                }
-                
-                chip.addEventListener('click', () => handleProblemClick(problem.id));
-                typeContainer.appendChild(chip);
-            });
+            if (virtual) {
+                // 块在滚动到附近时才创建，届时按当时的选中状态和建议渲染
+                renderVirtualBlocks(elements.problemsContainer, typeContainer, problemsByType[type],
+                    createProblemChip, problemChips, selectedSuggestions);
+            } else {
+                problemsByType[type].forEach(problem => typeContainer.appendChild(createProblemChip(problem, suggested)));
+            }
             
             elements.problemsContainer.appendChild(typeContainer);
         }
     });
+    
+    updateSuggestionsButton();
+}
+
+// 创建问题词块（点击由容器统一处理），suggested 为当前选中动作的关联建议
+function createProblemChip(problem, suggested = selectedSuggestions()) {
+    const chip = document.createElement('div');
+    chip.dataset.id = problem.id;
+    chip.textContent = problem.text;
+    applyProblemChipState(chip, problem, suggested);
+    problemChips.set(problem.id, chip);
+    return chip;
+}
+
+// 按当前选中的动作设置问题词块的关联、建议样式
+function applyProblemChipState(chip, problem, suggested) {
+    const linked = selectedSolutionId !== null && isLinked(selectedSolutionId, problem.id);
+    // 点击即采纳
+    const suggestion = linked ? null : suggested.get(problem.id);
+    const className = linked ? 'chip problem linked' : suggestion ? 'chip problem suggested' : 'chip problem';
+    if (chip.className !== className) {
+        chip.className = className;
+    }
+    let title = `类型: ${problem.type || '其他'}`;
+    if (suggestion) {
+        title += ` | 建议关联（置信度 ${Math.round(suggestion.confidence * 100)}%，${suggestion.count} 名患者）`;
+    }
+    if (chip.title !== title) {
+        chip.title = title;
+    }
+}
+
+// 更新问题词块的高亮：problemIds 为空时更新全部已创建的词块
+function refreshProblemChips(problemIds = null) {
+    const suggested = selectedSuggestions();
+    (problemIds || Array.from(problemChips.keys())).forEach(problemId => {
+        const chip = problemChips.get(problemId);
+        const problem = problemsById.get(problemId);
+        if (chip && problem) {
+            applyProblemChipState(chip, problem, suggested);
+        }
+    });
+    updateSuggestionsButton();
+}
+
+// 当前选中动作的关联建议：问题ID -> 建议
+function selectedSuggestions() {
+    if (selectedSolutionId === null) {
+        return new Map();
+    }
+    return new Map(pendingSuggestions()
+        .filter(s => s.action_id === selectedSolutionId)
+        .map(s => [s.problem_id, s]));
+}
+
+// 切换选中动作时需要更新的问题：两个动作已关联和建议关联的问题
+function problemsAffectedBySelection(solutionIds) {
+    const affected = new Set();
+    solutionIds.filter(id => id !== null).forEach(solutionId => {
+        (annotationLinks[solutionId] || []).forEach(problemId => affected.add(problemId));
+        linkSuggestions.forEach(s => {
+            if (s.action_id === solutionId) affected.add(s.problem_id);
+        });
+    });
+    return Array.from(affected);
+}
+
+// 清空容器中的词块及其登记
+function clearChips(container, chips) {
+    const observer = virtualObservers.get(container);
+    if (observer) {
+        observer.disconnect();
+    }
+    chips.clear();
+    container.innerHTML = '';
+}
+
+// 列表虚拟化：把 items 分块放入 parent，块进入滚动容器附近时才创建词块，远离后换回等高占位。
+// 创建块时调用一次 context()，结果作为 create 的第二个参数；不支持 IntersectionObserver 时全部创建
+function renderVirtualBlocks(scrollContainer, parent, items, create, chips, context = () => undefined) {
+    const observer = virtualObserver(scrollContainer);
+    for (let start = 0; start < items.length; start += VIRTUAL_BLOCK_SIZE) {
+        const block = document.createElement('div');
+        block.className = 'chip-block';
+        virtualBlocks.set(block, { items: items.slice(start, start + VIRTUAL_BLOCK_SIZE), create, context, chips, shown: false });
+        parent.appendChild(block);
+        if (observer) {
+            block.style.height = `${VIRTUAL_BLOCK_HEIGHT}px`;
+            observer.observe(block);
+        } else {
+            showVirtualBlock(block);
+        }
+    }
+}
+
+function virtualObserver(scrollContainer) {
+    if (typeof IntersectionObserver === 'undefined') {
+        return null;
+    }
+    if (!virtualObservers.has(scrollContainer)) {
+        virtualObservers.set(scrollContainer, new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) {
+                    showVirtualBlock(entry.target);
+                } else {
+                    hideVirtualBlock(entry.target);
+                }
+            });
+        }, { root: scrollContainer, rootMargin: `${VIRTUAL_MARGIN} 0px` }));
+    }
+    return virtualObservers.get(scrollContainer);
+}
+
+// 创建块中的词块（按当前状态渲染）
+function showVirtualBlock(block) {
+    const state = virtualBlocks.get(block);
+    if (!state || state.shown) {
+        return;
+    }
+    const fragment = document.createDocumentFragment();
+    const context = state.context();
+    state.items.forEach(item => fragment.appendChild(state.create(item, context)));
+    block.appendChild(fragment);
+    block.style.height = '';
+    state.shown = true;
+}
+
+// 移除块中的词块，保留其高度作为占位（正在编辑的块保留）
+function hideVirtualBlock(block) {
+    const state = virtualBlocks.get(block);
+    if (!state || !state.shown || block.contains(document.activeElement)) {
+        return;
+    }
+    block.style.height = `${block.offsetHeight}px`;
+    state.items.forEach(item => state.chips.delete(item.id));
+    block.innerHTML = '';
+    state.shown = false;
+}
+
+// 取得指定ID的词块，所在的块尚未创建时立即创建
+function materializeChip(container, chips, id) {
+    if (!chips.has(id)) {
+        const block = Array.from(container.querySelectorAll('.chip-block'))
+            .find(b => virtualBlocks.get(b)?.items.some(item => item.id === id));
+        if (block) {
+            showVirtualBlock(block);
+        }
+    }
+    return chips.get(id) || null;
+}
+
+// 尚未采纳的关联建议（动作已删除或已关联的除外）
+function pendingSuggestions() {
+    return linkSuggestions.filter(s =>
+        solutionsById.has(s.action_id) && !isLinked(s.action_id, s.problem_id));
+}
+
+// 更新"采纳建议"按钮（没有建议时隐藏）
+function updateSuggestionsButton() {
+    if (!elements.acceptSuggestionsBtn) {
+        return;
+    }
+    const count = pendingSuggestions().length;
+    elements.acceptSuggestionsBtn.style.display = count > 0 ? '' : 'none';
+    elements.acceptSuggestionsBtn.textContent = `✨ 采纳建议 (${count})`;
+}
+
+// 一键采纳全部关联建议
+function acceptAllSuggestions() {
+    const pending = pendingSuggestions();
+    if (pending.length === 0) {
+        return;
+    }
+    pending.forEach(s => {
+        setLink(s.action_id, s.problem_id, true);
+        queueLinkOp(s.action_id, s.problem_id, true);
+    });
+    linkSuggestions = [];
+    // 只有被建议的问题需要更新高亮
+    refreshProblemChips(Array.from(new Set(pending.map(s => s.problem_id))));
+    showMessage(`已采纳 ${pending.length} 条关联建议`, 'success');
 }
 
 // 渲染原始诊疗方案
@@ -673,120 +1131,48 @@ async function copyPlanToClipboard() {
     }
 }
 
-// 渲染方案列表
+// 渲染方案列表：按ID复用已有词块，只创建新增的、移除已删除的、移动顺序变化的
 function renderSolutions() {
-    elements.solutionsContainer.innerHTML = '';
+    const container = elements.solutionsContainer;
     
+    // 动作很多时分块渲染（增删时整体重建分块，点击选择仍只更新受影响的词块）
+    if (solutionsData.length > VIRTUAL_THRESHOLD) {
+        clearChips(container, solutionChips);
+        renderVirtualBlocks(container, container, solutionsData, createSolutionChip, solutionChips);
+        return;
+    }
+    if (container.querySelector('.chip-block')) {
+        clearChips(container, solutionChips);
+    }
+    
+    // 移除已删除动作的词块和其他元素（如流式提示）
+    const chipIds = new Map();
+    solutionChips.forEach((chipContainer, id) => chipIds.set(chipContainer, id));
+    Array.from(container.children).forEach(child => {
+        const id = chipIds.get(child);
+        if (id === undefined || !solutionsById.has(id)) {
+            child.remove();
+            if (id !== undefined) solutionChips.delete(id);
+        }
+    });
+    solutionChips.forEach((chipContainer, id) => {
+        if (chipContainer.parentNode !== container) solutionChips.delete(id);
+    });
+    
+    // 按顺序放置：位置不变的词块不移动
+    let cursor = container.firstChild;
     solutionsData.forEach(solution => {
-        // 创建动作容器
-        const chipContainer = document.createElement('div');
-        chipContainer.className = 'solution-item';
-        
-        const chip = document.createElement('div');
-        chip.className = 'chip solution';
-        chip.dataset.id = solution.id;
-        chip.textContent = solution.text;
-        chip.contentEditable = false;
-        
-        // 创建删除按钮
-        const deleteBtn = document.createElement('button');
-        deleteBtn.className = 'delete-btn';
-        deleteBtn.innerHTML = '×';
-        deleteBtn.title = '删除动作';
-        deleteBtn.addEventListener('click', (e) => {
-            e.stopPropagation();
-            if (confirm(`确定要删除动作"${solution.text}"吗？`)) {
-                deleteAction(solution.id);
-            }
-        });
-        
-        // 标记新建的动作
-        if (solution.isNew) {
-            chip.classList.add('new-action');
+        let chipContainer = solutionChips.get(solution.id);
+        if (chipContainer) {
+            applySolutionChipState(chipContainer, solution);
+        } else {
+            chipContainer = createSolutionChip(solution);
         }
-        
-        // 检查是否被选中
-        if (selectedSolutionId === solution.id) {
-            chip.classList.add('selected');
+        if (chipContainer === cursor) {
+            cursor = cursor.nextSibling;
+        } else {
+            container.insertBefore(chipContainer, cursor);
         }
-        
-        // 优化的点击和双击处理
-        chip.addEventListener('mousedown', (e) => {
-            e.preventDefault(); // 防止文本选择
-        });
-        
-        chip.addEventListener('click', (e) => {
-            e.stopPropagation();
-            
-            if (isDoubleClick) {
-                isDoubleClick = false;
-                return;
-            }
-            
-            // 单击事件延迟执行，如果是双击则取消
-            clickTimeout = setTimeout(() => {
-                if (!isDoubleClick) {
-                    handleSolutionClick(solution.id);
-                }
-            }, 250); // 250ms延迟
-        });
-        
-        chip.addEventListener('dblclick', (e) => {
-            e.preventDefault();
-            e.stopPropagation();
-            
-            isDoubleClick = true;
-            
-            // 清除单击超时
-            if (clickTimeout) {
-                clearTimeout(clickTimeout);
-                clickTimeout = null;
-            }
-            
-            // 启用编辑模式
-            enableEditing(chip, solution.id);
-            
-            // 重置双击标志
-            setTimeout(() => {
-                isDoubleClick = false;
-            }, 300);
-        });
-        
-        // 编辑完成事件
-        chip.addEventListener('blur', () => {
-            disableEditing(chip, solution.id);
-        });
-        
-        chip.addEventListener('keydown', (e) => {
-            if (e.key === 'Enter') {
-                e.preventDefault();
-                chip.blur();
-            }
-            // 添加删除功能：按Ctrl+Delete键删除动作
-            if ((e.ctrlKey || e.metaKey) && e.key === 'Delete') {
-                e.preventDefault();
-                deleteAction(solution.id);
-            }
-            // ESC键取消编辑
-            if (e.key === 'Escape') {
-                // 恢复原始文本
-                chip.textContent = solution.text;
-                chip.blur();
-            }
-        });
-        
-        // 右键菜单：删除动作
-        chip.addEventListener('contextmenu', (e) => {
-            e.preventDefault();
-            if (confirm(`确定要删除动作"${solution.text}"吗？`)) {
-                deleteAction(solution.id);
-            }
-        });
-        
-        // 组装容器
-        chipContainer.appendChild(chip);
-        chipContainer.appendChild(deleteBtn);
-        elements.solutionsContainer.appendChild(chipContainer);
     });
 }
 
@@ -796,30 +1182,25 @@ function handleProblemClick(problemId) {
         return; // 没有选中的方案，无法建立链接
     }
     
-    // 初始化当前方案的链接数组
-    if (!annotationLinks[selectedSolutionId]) {
-        annotationLinks[selectedSolutionId] = [];
-    }
-    
-    const links = annotationLinks[selectedSolutionId];
-    const linkIndex = links.indexOf(problemId);
-    
-    if (linkIndex > -1) {
+    if (isLinked(selectedSolutionId, problemId)) {
         // 已存在链接，移除它
-        links.splice(linkIndex, 1);
+        setLink(selectedSolutionId, problemId, false);
+        queueLinkOp(selectedSolutionId, problemId, false);
     } else {
         // 不存在链接，添加它
-        links.push(problemId);
+        setLink(selectedSolutionId, problemId, true);
+        queueLinkOp(selectedSolutionId, problemId, true);
     }
     
-    // 重新渲染问题以更新高亮状态
-    renderProblems();
+    // 只更新被点击问题的高亮状态
+    refreshProblemChips([problemId]);
     
     console.log('更新链接:', selectedSolutionId, '→', annotationLinks[selectedSolutionId]);
 }
 
 // 处理方案点击
 function handleSolutionClick(solutionId) {
+    const previousId = selectedSolutionId;
     if (selectedSolutionId === solutionId) {
         // 取消选择
         selectedSolutionId = null;
@@ -828,13 +1209,181 @@ function handleSolutionClick(solutionId) {
         selectedSolutionId = solutionId;
     }
     
-    // 重新渲染以更新高亮状态
-    renderProblems();
-    renderSolutions();
+    // 只更新前后两个动作及其关联、建议的问题
+    updateSolutionChip(previousId);
+    updateSolutionChip(selectedSolutionId);
+    refreshProblemChips(problemsAffectedBySelection([previousId, selectedSolutionId]));
     
     console.log('选中方案:', selectedSolutionId);
 }
 
+// 词块事件统一在两个列表容器上处理，新建、复用的词块无需各自绑定
+function setupChipEvents() {
+    elements.problemsContainer.addEventListener('click', (e) => {
+        const chip = e.target.closest('.chip.problem');
+        if (chip) {
+            handleProblemClick(chip.dataset.id);
+        }
+    });
+    
+    const container = elements.solutionsContainer;
+    const solutionChip = (e) => e.target.closest('.chip.solution');
+    // 删除前确认
+    const confirmDelete = (solutionId) => {
+        const solution = solutionsById.get(solutionId);
+        if (solution && confirm(`确定要删除动作"${solution.text}"吗？`)) {
+            deleteAction(solutionId);
+        }
+    };
+    
+    // 优化的点击和双击处理
+    container.addEventListener('mousedown', (e) => {
+        if (solutionChip(e)) {
+            e.preventDefault(); // 防止文本选择
+        }
+    });
+    
+    container.addEventListener('click', (e) => {
+        const deleteBtn = e.target.closest('.delete-btn');
+        if (deleteBtn) {
+            e.stopPropagation();
+            confirmDelete(deleteBtn.parentNode.dataset.id);
+            return;
+        }
+        const chip = solutionChip(e);
+        if (!chip) {
+            return;
+        }
+        e.stopPropagation();
+        
+        if (isDoubleClick) {
+            isDoubleClick = false;
+            return;
+        }
+        
+        // 单击事件延迟执行，如果是双击则取消
+        clickTimeout = setTimeout(() => {
+            if (!isDoubleClick) {
+                handleSolutionClick(chip.dataset.id);
+            }
+        }, 250); // 250ms延迟
+    });
+    
+    container.addEventListener('dblclick', (e) => {
+        const chip = solutionChip(e);
+        if (!chip) {
+            return;
+        }
+        e.preventDefault();
+        e.stopPropagation();
+        
+        isDoubleClick = true;
+        
+        // 清除单击超时
+        if (clickTimeout) {
+            clearTimeout(clickTimeout);
+            clickTimeout = null;
+        }
+        
+        // 启用编辑模式
+        enableEditing(chip, chip.dataset.id);
+        
+        // 重置双击标志
+        setTimeout(() => {
+            isDoubleClick = false;
+        }, 300);
+    });
+    
+    // 编辑完成事件（blur 不冒泡，使用 focusout）
+    container.addEventListener('focusout', (e) => {
+        const chip = solutionChip(e);
+        if (chip) {
+            disableEditing(chip, chip.dataset.id);
+        }
+    });
+    
+    container.addEventListener('keydown', (e) => {
+        const chip = solutionChip(e);
+        if (!chip) {
+            return;
+        }
+        if (e.key === 'Enter') {
+            e.preventDefault();
+            chip.blur();
+        }
+        // 添加删除功能：按Ctrl+Delete键删除动作
+        if ((e.ctrlKey || e.metaKey) && e.key === 'Delete') {
+            e.preventDefault();
+            deleteAction(chip.dataset.id);
+        }
+        // ESC键取消编辑
+        if (e.key === 'Escape') {
+            // 恢复原始文本
+            const solution = solutionsById.get(chip.dataset.id);
+            if (solution) {
+                chip.textContent = solution.text;
+            }
+            chip.blur();
+        }
+    });
+    
+    // 右键菜单：删除动作
+    container.addEventListener('contextmenu', (e) => {
+        const chip = solutionChip(e);
+        if (chip) {
+            e.preventDefault();
+            confirmDelete(chip.dataset.id);
+        }
+    });
+}
+
+// 重建问题 -> 动作的反向索引
+function indexLinks() {
+    problemLinks = new Map();
+    Object.entries(annotationLinks).forEach(([actionId, problemIds]) => {
+        problemIds.forEach(problemId => {
+            if (!problemLinks.has(problemId)) {
+                problemLinks.set(problemId, new Set());
+            }
+            problemLinks.get(problemId).add(actionId);
+        });
+    });
+}
+
+// 动作是否关联了问题
+function isLinked(actionId, problemId) {
+    const actionIds = problemLinks.get(problemId);
+    return actionIds !== undefined && actionIds.has(actionId);
+}
+
+// 添加或移除一条关联，同时维护反向索引
+function setLink(actionId, problemId, linked) {
+    if (isLinked(actionId, problemId) === linked) {
+        return;
+    }
+    if (linked) {
+        if (!annotationLinks[actionId]) {
+            annotationLinks[actionId] = [];
+        }
+        annotationLinks[actionId].push(problemId);
+        if (!problemLinks.has(problemId)) {
+            problemLinks.set(problemId, new Set());
+        }
+        problemLinks.get(problemId).add(actionId);
+    } else {
+        annotationLinks[actionId] = annotationLinks[actionId].filter(id => id !== problemId);
+        problemLinks.get(problemId).delete(actionId);
+    }
+}
+
+// 删除动作的全部关联，返回原来关联的问题ID
+function removeActionLinks(actionId) {
+    const problemIds = annotationLinks[actionId] || [];
+    problemIds.forEach(problemId => problemLinks.get(problemId)?.delete(actionId));
+    delete annotationLinks[actionId];
+    return problemIds;
+}
+
 // 启用编辑模式
 function enableEditing(chip, solutionId) {
     // 防止重复启用编辑模式
@@ -875,13 +1424,23 @@ function disableEditing(chip, solutionId) {
     
     // 更新数据
     const newText = chip.textContent.trim();
-    const solution = solutionsData.find(s => s.id === solutionId);
+    const solution = solutionsById.get(solutionId);
     if (solution) {
         if (newText === '' || newText === '新建动作') {
             // 如果文本为空，恢复原始文本
             chip.textContent = solution.text;
             showMessage('动作文本不能为空', 'error');
         } else {
+            // 新建动作在首次命名时才提交，避免占位文本进入动作库
+            if (solution.isNew) {
+                queueOp({ op: 'add_action', action_id: solutionId, text: newText });
+                // 命名前建立的关联随新增一起提交
+                (annotationLinks[solutionId] || []).forEach(problemId => {
+                    queueOp({ op: 'link', action_id: solutionId, problem_id: problemId });
+                });
+            } else if (newText !== solution.text) {
+                queueOp({ op: 'rename_action', action_id: solutionId, text: newText });
+            }
             solution.text = newText;
             solution.isNew = false; // 移除新建标记
             console.log('方案文本已更新:', solutionId, '→', newText);
@@ -892,7 +1451,7 @@ function disableEditing(chip, solutionId) {
 
 // 新建动作功能
 function addNewAction() {
-    const newActionId = `action-${solutionsData.length}`;
+    const newActionId = allocateActionId();
     const newAction = {
         id: newActionId,
         text: "新建动作",
@@ -900,11 +1459,14 @@ function addNewAction() {
     };
     
     solutionsData.push(newAction);
+    solutionsById.set(newActionId, newAction);
     renderSolutions();
     
-    // 自动进入编辑模式
-    const newChip = document.querySelector(`[data-id="${newActionId}"]`);
-    if (newChip) {
+    // 自动进入编辑模式（分块渲染时先创建所在的块）
+    const chipContainer = materializeChip(elements.solutionsContainer, solutionChips, newActionId);
+    if (chipContainer) {
+        const newChip = chipContainer.firstChild;
+        newChip.scrollIntoView({ block: 'nearest' });
         setTimeout(() => {
             enableEditing(newChip, newActionId);
         }, 100);
@@ -957,33 +1519,29 @@ async function deleteAction(actionId) {
     }
     
     try {
-        // 调用后端API删除动作
-        const response = await fetch(`/api/action/delete/${currentPatientId}/${actionId}`, {
-            method: 'DELETE'
-        });
-        
-        const data = await response.json();
-        
-        if (!response.ok) {
-            throw new Error(data.error || '删除动作失败');
-        }
-        
-        // 从本地数据中删除
-        const index = solutionsData.findIndex(s => s.id === actionId);
-        if (index > -1) {
+        // 从本地数据中删除，随下一批操作提交
+        const solution = solutionsById.get(actionId);
+        if (solution) {
+            if (!solution.isNew) {
+                queueOp({ op: 'delete_action', action_id: actionId });
+            }
+            
             // 删除相关标注链接
-            delete annotationLinks[actionId];
+            const linkedProblems = removeActionLinks(actionId);
             
             // 删除动作
-            solutionsData.splice(index, 1);
+            solutionsData.splice(solutionsData.indexOf(solution), 1);
+            solutionsById.delete(actionId);
             
-            // 如果删除的是当前选中的动作，清除选择
+            // 如果删除的是当前选中的动作，清除选择，并更新原来高亮的问题
+            let affectedProblems = [];
             if (selectedSolutionId === actionId) {
+                affectedProblems = problemsAffectedBySelection([actionId]).concat(linkedProblems);
                 selectedSolutionId = null;
             }
             
             renderSolutions();
-            renderProblems();
+            refreshProblemChips(affectedProblems);
             
             showMessage('动作删除成功', 'success');
             console.log('动作已删除:', actionId);
@@ -994,7 +1552,254 @@ async function deleteAction(actionId) {
     }
 }
 
-// 保存标注
+// 记录一个本地修改操作，防抖后批量提交
+function queueOp(op) {
+    if (!currentPatientId || opQueue.patientId !== currentPatientId) {
+        return;
+    }
+    opQueue.ops = compactOps([...opQueue.ops, op]);
+    clearTimeout(opsTimer);
+    opsTimer = setTimeout(() => {
+        flushOps().catch(error => console.error('增量保存失败:', error));
+    }, OPS_DEBOUNCE_MS);
+}
+
+// 记录关联变化；尚未命名提交的新建动作只改本地，命名时一并提交
+function queueLinkOp(actionId, problemId, linked) {
+    const solution = solutionsById.get(actionId);
+    if (solution && solution.isNew) {
+        return;
+    }
+    queueOp({ op: linked ? 'link' : 'unlink', action_id: actionId, problem_id: problemId });
+}
+
+// 合并同一对象上的重复操作（操作是幂等的，只保留最后一次）；
+// 删除动作时去掉同一批中该动作之前的操作，服务器拒绝已删除或不存在的动作上的关联
+function compactOps(ops) {
+    const result = [];
+    const lastIndex = new Map();
+    ops.forEach(op => {
+        let key = null;
+        if (op.op === 'link' || op.op === 'unlink') {
+            key = `link:${op.action_id}:${op.problem_id}`;
+        } else if (op.op === 'rename_action') {
+            // 改名合并进同一批中的新增操作
+            const added = result.find(o => o && o.op === 'add_action' && o.action_id === op.action_id);
+            if (added) {
+                added.text = op.text;
+                return;
+            }
+            key = `text:${op.action_id}`;
+        } else if (op.op === 'delete_action') {
+            let added = false;
+            result.forEach((o, index) => {
+                if (o && o.action_id === op.action_id) {
+                    added = added || o.op === 'add_action';
+                    result[index] = null;
+                }
+            });
+            // 同一批中新增又删除的动作无需提交
+            if (added) {
+                return;
+            }
+        } else if (op.op === 'reorder') {
+            key = 'reorder';
+        }
+        if (key !== null && lastIndex.has(key)) {
+            result[lastIndex.get(key)] = null;
+        }
+        if (key !== null) {
+            lastIndex.set(key, result.length);
+        }
+        result.push(op);
+    });
+    return result.filter(op => op !== null);
+}
+
+// 在本地数据上应用操作（与服务器 apply_annotation_ops 一致，用于冲突后重放）
+function applyOpLocally(op) {
+    const solution = solutionsById.get(op.action_id);
+    switch (op.op) {
+        case 'link':
+            setLink(op.action_id, op.problem_id, true);
+            break;
+        case 'unlink':
+            setLink(op.action_id, op.problem_id, false);
+            break;
+        case 'add_action':
+        case 'rename_action':
+            if (solution) {
+                solution.text = op.text;
+            } else if (op.op === 'add_action') {
+                const added = { id: op.action_id, text: op.text };
+                solutionsData.push(added);
+                solutionsById.set(added.id, added);
+            }
+            break;
+        case 'delete_action':
+            if (solution) {
+                solutionsData.splice(solutionsData.indexOf(solution), 1);
+                solutionsById.delete(op.action_id);
+            }
+            removeActionLinks(op.action_id);
+            break;
+        case 'reorder': {
+            const position = new Map(op.order.map((id, index) => [id, index]));
+            solutionsData.sort((a, b) => (position.get(a.id) ?? op.order.length) - (position.get(b.id) ?? op.order.length));
+            break;
+        }
+    }
+}
+
+// 切换患者前提交未保存的操作，并以新患者的修订号开始新队列
+async function resetOpQueue(patientId, revision, nextActionId) {
+    if (opQueue.patientId !== patientId) {
+        try {
+            await flushOps();
+        } catch (error) {
+            console.error('提交未保存的操作失败:', error);
+        }
+    }
+    clearTimeout(opsTimer);
+    opQueue.patientId = patientId;
+    opQueue.baseRevision = revision || 0;
+    opQueue.nextActionId = nextActionId || 0;
+    opQueue.ops = [];
+}
+
+// 重建动作ID索引
+function indexSolutions() {
+    solutionsById = new Map(solutionsData.map(solution => [solution.id, solution]));
+}
+
+// 分配新建动作的ID（编号单调递增，与服务器的 next_action_id 计数器一致）
+function allocateActionId(takenIds = solutionsById) {
+    let actionId;
+    do {
+        actionId = `action-${opQueue.nextActionId++}`;
+    } while (takenIds.has(actionId) || solutionsById.has(actionId));
+    return actionId;
+}
+
+// 把本地动作ID改为新ID（本地数据、选中状态和排队中的操作）
+function renameLocalActionId(oldId, newId, extraOps = []) {
+    [...extraOps, ...opQueue.ops].forEach(op => {
+        if (op.action_id === oldId) op.action_id = newId;
+        if (op.op === 'reorder') op.order = op.order.map(id => id === oldId ? newId : id);
+    });
+    if (opQueue.patientId !== currentPatientId) {
+        return;
+    }
+    const solution = solutionsById.get(oldId);
+    if (solution) {
+        solution.id = newId;
+        solutionsById.delete(oldId);
+        solutionsById.set(newId, solution);
+    }
+    if (annotationLinks[oldId]) {
+        const problemIds = removeActionLinks(oldId);
+        problemIds.forEach(problemId => setLink(newId, problemId, true));
+    }
+    if (selectedSolutionId === oldId) {
+        selectedSolutionId = newId;
+    }
+    // 词块改登记到新ID（正在编辑的词块不受影响）
+    const chipContainer = solutionChips.get(oldId);
+    if (chipContainer) {
+        solutionChips.delete(oldId);
+        solutionChips.set(newId, chipContainer);
+        chipContainer.dataset.id = newId;
+        chipContainer.firstChild.dataset.id = newId;
+    }
+}
+
+// 提交排队中的操作；同一时间只有一个请求在途
+async function flushOps() {
+    clearTimeout(opsTimer);
+    while (opsFlushPromise) {
+        await opsFlushPromise;
+    }
+    if (opQueue.ops.length === 0) {
+        return null;
+    }
+    opsFlushPromise = sendOps();
+    try {
+        return await opsFlushPromise;
+    } finally {
+        opsFlushPromise = null;
+    }
+}
+
+async function sendOps() {
+    const patientId = opQueue.patientId;
+    let ops = opQueue.ops;
+    opQueue.ops = [];
+    
+    try {
+        for (let attempt = 0; ; attempt++) {
+            const response = await fetch(`/api/patient/${patientId}/annotations`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ base_revision: opQueue.baseRevision, ops: ops })
+            });
+            const data = await response.json();
+            
+            if (response.status === 409 && attempt < OPS_MAX_CONFLICT_RETRIES) {
+                // 其他人已修改：以服务器最新数据为基础重放本批和之后的本地操作
+                console.log(`标注修订冲突，基于修订 ${data.revision} 重放 ${ops.length} 个操作`);
+                opQueue.baseRevision = data.revision;
+                opQueue.nextActionId = Math.max(opQueue.nextActionId, data.next_action_id || 0);
+                // 本地新建动作的ID已被他人占用时改用新ID
+                const serverIds = new Set((data.solutions || []).map(s => s.id));
+                ops.filter(op => op.op === 'add_action' && serverIds.has(op.action_id)).forEach(op => {
+                    renameLocalActionId(op.action_id, allocateActionId(serverIds), ops);
+                });
+                // 他人已删除的动作上的操作不再提交
+                const addedIds = new Set([...ops, ...opQueue.ops]
+                    .filter(op => op.op === 'add_action').map(op => op.action_id));
+                const stillExists = op => !op.action_id || op.op === 'delete_action'
+                    || serverIds.has(op.action_id) || addedIds.has(op.action_id);
+                ops = ops.filter(stillExists);
+                if (opQueue.patientId === patientId) {
+                    opQueue.ops = opQueue.ops.filter(stillExists);
+                }
+                if (patientId === currentPatientId) {
+                    annotationLinks = data.annotations || {};
+                    indexLinks();
+                    solutionsData = data.solutions || [];
+                    indexSolutions();
+                    [...ops, ...opQueue.ops].forEach(applyOpLocally);
+                    renderSolutions();
+                    refreshProblemChips();
+                }
+                continue;
+            }
+            if (!response.ok) {
+                throw new Error(data.error || `HTTP ${response.status}`);
+            }
+            
+            if (opQueue.patientId === patientId) {
+                opQueue.baseRevision = data.revision;
+                opQueue.nextActionId = Math.max(opQueue.nextActionId, data.next_action_id || 0);
+                // 服务器因冲突重新分配了ID
+                Object.entries(data.id_map || {}).forEach(([oldId, newId]) => renameLocalActionId(oldId, newId));
+            }
+            // 清除该患者的缓存，强制下次重新加载
+            patientCache.delete(patientId);
+            return data;
+        }
+    } catch (error) {
+        // 失败的操作放回队首，下次提交时重试
+        if (opQueue.patientId === patientId) {
+            opQueue.ops = compactOps([...ops, ...opQueue.ops]);
+        }
+        throw error;
+    }
+}
+
+// 保存标注（提交所有未保存的增量操作）
 async function saveAnnotations(silent = false) {
     if (!currentPatientId) {
         if (!silent) showMessage('没有选择患者', 'error');
@@ -1007,23 +1812,7 @@ async function saveAnnotations(silent = false) {
             PerformanceMonitor.start('保存标注');
         }
         
-        const payload = {
-            annotations: annotationLinks,
-            solutions: solutionsData
-        };
-        
-        const response = await fetchWithRetry(`/api/save/${currentPatientId}`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(payload)
-        });
-        
-        const data = await response.json();
-        
-        // 清除该患者的缓存，强制下次重新加载
-        patientCache.delete(currentPatientId);
+        const data = await flushOps();
         
         if (!silent) {
             showMessage('保存成功!', 'success');
@@ -1046,6 +1835,7 @@ async function saveAnnotations(silent = false) {
                 patientId: currentPatientId,
                 annotations: annotationLinks,
                 solutions: solutionsData,
+                pendingOps: opQueue.ops,
                 timestamp: Date.now()
             };
             localStorage.setItem(`backup_${currentPatientId}`, JSON.stringify(backup));
@@ -1063,7 +1853,12 @@ async function saveAnnotations(silent = false) {
 
 // 导航到上一个患者
 async function navigateToPreviousPatient() {
-    const currentIndex = patientIds.indexOf(currentPatientId);
+    let currentIndex = patientIds.indexOf(currentPatientId);
+    if (currentIndex === 0 && patientPrevCursor) {
+        // 已到已加载列表开头，先加载前一页
+        await loadEarlierPatients();
+        currentIndex = patientIds.indexOf(currentPatientId);
+    }
     if (currentIndex > 0) {
         // 自动保存当前患者
         await saveAnnotations(true); // 传入true表示静默保存
@@ -1074,7 +1869,12 @@ async function navigateToPreviousPatient() {
 
 // 导航到下一个患者
 async function navigateToNextPatient() {
-    const currentIndex = patientIds.indexOf(currentPatientId);
+    let currentIndex = patientIds.indexOf(currentPatientId);
+    if (currentIndex === patientIds.length - 1 && patientNextCursor) {
+        // 已到已加载列表末尾，先加载后一页
+        await loadMorePatients();
+    }
+    // 当前患者不在筛选结果中时（currentIndex 为 -1）跳到列表第一个
     if (currentIndex < patientIds.length - 1) {
         // 自动保存当前患者
         await saveAnnotations(true); // 传入true表示静默保存
@@ -1086,8 +1886,8 @@ async function navigateToNextPatient() {
 // 更新导航按钮状态
 function updateNavigationButtons() {
     const currentIndex = patientIds.indexOf(currentPatientId);
-    elements.prevButton.disabled = currentIndex <= 0;
-    elements.nextButton.disabled = currentIndex >= patientIds.length - 1;
+    elements.prevButton.disabled = currentIndex <= 0 && !(currentIndex === 0 && patientPrevCursor);
+    elements.nextButton.disabled = currentIndex >= patientIds.length - 1 && !patientNextCursor;
 }
 
 // 显示/隐藏加载状态
@@ -1113,12 +1913,42 @@ function showMessage(text, type = 'info') {
 
 // 事件监听器设置
 function setupEventListeners() {
+    // 问题、动作词块
+    setupChipEvents();
+    
     // 导航按钮
     elements.prevButton.addEventListener('click', navigateToPreviousPatient);
     elements.nextButton.addEventListener('click', navigateToNextPatient);
     
+    // 患者筛选
+    if (elements.patientFilter) {
+        elements.patientFilter.addEventListener('change', async (e) => {
+            patientFilter = e.target.value;
+            try {
+                await loadPatientList();
+            } catch (error) {
+                showMessage(error.message, 'error');
+            }
+        });
+    }
+    
     // 患者选择器
     elements.patientSelector.addEventListener('change', async (e) => {
+        // 分页加载项
+        if (e.target.value === PATIENT_PREV_OPTION || e.target.value === PATIENT_NEXT_OPTION) {
+            try {
+                if (e.target.value === PATIENT_PREV_OPTION) {
+                    await loadEarlierPatients();
+                } else {
+                    await loadMorePatients();
+                }
+            } catch (error) {
+                showMessage('加载患者列表失败: ' + error.message, 'error');
+                updatePatientSelector();
+            }
+            return;
+        }
+        
         if (e.target.value && e.target.value !== currentPatientId) {
             // 自动保存当前患者
             if (currentPatientId) {
@@ -1130,7 +1960,7 @@ function setupEventListeners() {
     });
     
     // 保存按钮
-    elements.saveButton.addEventListener('click', saveAnnotations);
+    elements.saveButton.addEventListener('click', () => saveAnnotations());
     
     // 新建动作按钮
     elements.addActionBtn.addEventListener('click', addNewAction);
@@ -1138,6 +1968,11 @@ function setupEventListeners() {
     // 重新抽取按钮
     elements.regenerateActionsBtn.addEventListener('click', regenerateActions);
     
+    // 一键采纳关联建议
+    if (elements.acceptSuggestionsBtn) {
+        elements.acceptSuggestionsBtn.addEventListener('click', acceptAllSuggestions);
+    }
+    
     // 模态框相关事件
     if (elements.expandPlanBtn) {
         elements.expandPlanBtn.addEventListener('click', showPlanModal);
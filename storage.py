@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import List, Dict, Any, Optional, Callable
+
+from metrics import IO_SECONDS
+
+# 配置数据目录（可通过环境变量指向其他目录，便于测试和性能基准）
+DATA_DIR = os.environ.get("ANNOTATION_DATA_DIR", "data")
+PATIENTS_DIR = os.path.join(DATA_DIR, "patients")
+ANNOTATIONS_DIR = os.path.join(DATA_DIR, "annotations")
+ACTION_LIBRARY_FILE = os.path.join(DATA_DIR, "action_library.json")
+BACKUP_DIR = os.path.join(DATA_DIR, "backups")
+# 后台生成任务记录
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+# 进程间锁文件目录（多进程部署时各进程共享数据目录）
+LOCK_DIR = os.path.join(DATA_DIR, ".locks")
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+def validate_patient_data(data):
+    """验证患者数据"""
+    required_fields = ['patient_id', 'annotations', 'solutions']
+    for field in required_fields:
+        if field not in data:
+            raise ValueError(f"缺少必要字段: {field}")
+
+    if not isinstance(data['solutions'], list):
+        raise ValueError("solutions 必须是列表")
+
+    if not isinstance(data['annotations'], dict):
+        raise ValueError("annotations 必须是字典")
+
+    return True
+
+def _acquire_process_lock(key: str):
+    """对 key 对应的锁文件加排他锁（阻塞），返回打开的锁文件"""
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest() + ".lock"
+    handle = open(os.path.join(LOCK_DIR, name), 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK 重试10次后仍失败会抛出，继续等待
+    except Exception:
+        handle.close()
+        raise
+    return handle
+
+def _release_process_lock(handle):
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        handle.close()
+
+class FileLock:
+    """同一文件的可重入锁：进程内为线程锁，最外层同时持有进程间的文件锁"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.handle = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.depth == 0:
+            try:
+                self.handle = _acquire_process_lock(self.key)
+            except Exception:
+                self.lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        try:
+            if self.depth == 0:
+                handle, self.handle = self.handle, None
+                _release_process_lock(handle)
+        finally:
+            self.lock.release()
+
+# 按文件路径共享的锁
+_file_locks: Dict[str, FileLock] = {}
+_file_locks_guard = threading.Lock()
+
+def file_lock(file_path: str) -> FileLock:
+    """返回该文件的可重入锁，读-改-写期间持有以免并发保存（包括其他进程）互相覆盖"""
+    key = os.path.abspath(file_path)
+    with _file_locks_guard:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = _file_locks[key] = FileLock(key)
+        return lock
+
+ACTION_ID_PREFIX = "action-"
+
+def action_id_number(action_id: Any) -> Optional[int]:
+    """解析 action-N 形式的动作ID，其他形式返回 None"""
+    if isinstance(action_id, str) and action_id.startswith(ACTION_ID_PREFIX):
+        suffix = action_id[len(ACTION_ID_PREFIX):]
+        if suffix.isdigit():
+            return int(suffix)
+    return None
+
+def next_action_number(annotation_data: Dict[str, Any]) -> int:
+    """下一个可用的动作编号；旧文件没有计数器时取现有最大编号加一"""
+    counter = annotation_data.get("next_action_id")
+    if isinstance(counter, int):
+        return counter
+    numbers = [action_id_number(s.get("id")) for s in annotation_data.get("solutions", [])]
+    return max((n for n in numbers if n is not None), default=-1) + 1
+
+def allocate_action_id(annotation_data: Dict[str, Any]) -> str:
+    """分配一个单调递增、不会与已有或已删除动作重复的ID"""
+    number = next_action_number(annotation_data)
+    annotation_data["next_action_id"] = number + 1
+    return f"{ACTION_ID_PREFIX}{number}"
+
+def reserve_action_id(annotation_data: Dict[str, Any], action_id: str):
+    """客户端按计数器分配的ID入库后推进计数器"""
+    number = action_id_number(action_id)
+    next_number = next_action_number(annotation_data)
+    annotation_data["next_action_id"] = max(next_number, number + 1) if number is not None else next_number
+
+def repair_action_ids(annotation_data: Dict[str, Any]) -> List[tuple]:
+    """为重复或缺失的动作ID重新分配ID并补上计数器，返回 [(原ID, 新ID)]
+
+    重复ID对应的链接无法区分归属，保留给第一个出现的动作。
+    """
+    seen = set()
+    renamed = []
+    annotation_data["next_action_id"] = next_action_number(annotation_data)
+    for solution in annotation_data.get("solutions", []):
+        action_id = solution.get("id")
+        if action_id and action_id not in seen:
+            seen.add(action_id)
+            continue
+        new_id = allocate_action_id(annotation_data)
+        renamed.append((action_id or "", new_id))
+        solution["id"] = new_id
+        seen.add(new_id)
+    return renamed
+
+ANNOTATION_OPS = ("link", "unlink", "add_action", "rename_action", "delete_action", "reorder")
+
+def apply_annotation_ops(annotation_data: Dict[str, Any], ops: List[Dict[str, Any]]):
+    """将增量操作依次应用到标注数据（原地修改）
+
+    支持的操作:
+    - {"op": "link" / "unlink", "action_id": ..., "problem_id": ...}
+    - {"op": "add_action", "action_id": ..., "text": ..., "index": 可选}
+    - {"op": "rename_action", "action_id": ..., "text": ...}
+    - {"op": "delete_action", "action_id": ...}
+    - {"op": "reorder", "order": [动作ID, ...]}
+
+    新增动作的ID已被他人占用时改分配新ID，同批后续操作自动改用新ID。
+    关联不存在（或已删除）的动作时抛出 ValueError。
+    返回 (新增或改名后的动作文本, {客户端ID: 实际ID})。
+    """
+    solutions = annotation_data.setdefault("solutions", [])
+    annotations = annotation_data.setdefault("annotations", {})
+    by_id = {s["id"]: s for s in solutions}
+    deleted = set()
+    texts = []
+    id_map = {}
+    for op in ops:
+        kind = op.get("op")
+        if kind not in ANNOTATION_OPS:
+            raise ValueError(f"未知的操作: {kind}")
+        action_id = id_map.get(op.get("action_id"), op.get("action_id"))
+        if kind in ("link", "unlink"):
+            problem_id = op.get("problem_id")
+            if not action_id or not problem_id:
+                raise ValueError(f"{kind} 缺少 action_id 或 problem_id")
+            if action_id not in by_id:
+                raise ValueError(f"动作不存在: {action_id}")
+            links = annotations.get(action_id, [])
+            if kind == "link" and problem_id not in links:
+                annotations[action_id] = links + [problem_id]
+            elif kind == "unlink" and problem_id in links:
+                links.remove(problem_id)
+                if not links:
+                    annotations.pop(action_id)
+        elif kind in ("add_action", "rename_action"):
+            text = (op.get("text") or "").strip()
+            if not action_id or not text:
+                raise ValueError(f"{kind} 缺少 action_id 或 text")
+            solution = by_id.get(action_id)
+            if kind == "add_action":
+                if solution is not None or action_id in deleted:
+                    new_id = allocate_action_id(annotation_data)
+                    id_map[action_id] = new_id
+                    action_id = new_id
+                else:
+                    reserve_action_id(annotation_data, action_id)
+                solution = by_id[action_id] = {"id": action_id, "text": text}
+                index = op.get("index")
+                solutions.insert(index if isinstance(index, int) else len(solutions), solution)
+            elif solution is None:
+                raise ValueError(f"动作不存在: {action_id}")
+            solution["text"] = text
+            texts.append(text)
+        elif kind == "delete_action":
+            if by_id.pop(action_id, None) is not None:
+                deleted.add(action_id)
+            annotations.pop(action_id, None)
+        else:
+            order = op.get("order")
+            if not isinstance(order, list):
+                raise ValueError("reorder 缺少 order 列表")
+            position = {action_id: i for i, action_id in enumerate(order)}
+            # 未列出的动作保持相对顺序排在最后
+            solutions.sort(key=lambda s: position.get(s["id"], len(order)))
+    if deleted:
+        # 删除统一在最后过滤一次，避免每个删除操作扫描整个列表
+        solutions[:] = [s for s in solutions if s["id"] in by_id]
+    return texts, id_map
+
+def _write_atomic(file_path: str, write: Callable, fsync: bool = True):
+    """先写临时文件（可选刷盘）再替换，避免中途退出留下半截文件"""
+    directory = os.path.dirname(file_path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            write(f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def write_json_atomic(file_path: str, data: Any):
+    """先写临时文件并刷盘再替换，避免中途退出留下半截文件"""
+    with file_lock(file_path), IO_SECONDS.time(op="json_dump"):
+        _write_atomic(file_path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+
+def write_text_atomic(file_path: str, content: str, fsync: bool = True):
+    """原子写入文本文件（不加锁，用于没有读-改-写的文件，如导入的病历）"""
+    _write_atomic(file_path, lambda f: f.write(content), fsync)
+
+def load_action_library(path: str = ACTION_LIBRARY_FILE) -> List[str]:
+    """加载诊疗动作库"""
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    else:
+        # 初始默认动作库
+        default_actions = [
+            "排齐牙列",
+            "解除拥挤",
+            "纠正中线",
+            "调整磨牙关系",
+            "内收前牙",
+            "压低前牙",
+            "片切",
+            "拔除智齿",
+            "正畸保持",
+            "纠正扭转牙",
+            "排齐上颌牙列",
+            "排齐下颌牙列"
+        ]
+        save_action_library(default_actions, path)
+        return default_actions
+
+def save_action_library(actions: List[str], path: str = ACTION_LIBRARY_FILE):
+    """保存诊疗动作库"""
+    write_json_atomic(path, actions)
+
+def build_auto_annotation(patient_id: str, actions: List[str],
+                          existing: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """构建LLM自动生成的标注数据；重新生成时从已有标注的计数器继续编号，不复用旧ID"""
+    start = next_action_number(existing) if existing else 0
+    solutions = [{"id": f"{ACTION_ID_PREFIX}{start + i}", "text": action} for i, action in enumerate(actions)]
+    return {
+        "patient_id": patient_id,
+        "annotations": {},
+        "solutions": solutions,
+        "next_action_id": start + len(solutions),
+        "auto_generated": True,
+        "generated_time": time.time()
+    }
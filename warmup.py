@@ -0,0 +1,152 @@
+"""启动预热
+
+默认（STARTUP_WARMUP = "background"）导入应用后立即在后台线程中建立患者索引和动作库，
+不等第一个请求来触发目录扫描和冷读取；GET /ready 在两者可用后返回 200，之前返回 503。
+
+INDEX_SNAPSHOT 开启时患者索引保存到 data/index/patient_index.json（预热完成后和进程退出时），
+下次启动直接恢复快照即就绪，耗时与语料规模基本无关；就绪后再在后台逐个核对修改时间，
+只重新读取停机期间变化的文件。快照属于其他数据目录或存储后端时忽略。
+
+STARTUP_WARMUP = "lazy" 时保持按需建立（第一个请求时扫描）。也可用环境变量 ANNOTATION_WARMUP 覆盖。
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+import config
+from storage import DATA_DIR, write_text_atomic
+from patient_index import patient_index
+from action_library import library_index
+
+STARTUP_WARMUP = os.environ.get("ANNOTATION_WARMUP", getattr(config, "STARTUP_WARMUP", "background"))
+INDEX_SNAPSHOT = getattr(config, "INDEX_SNAPSHOT", True)
+INDEX_SNAPSHOT_FILE = os.path.join(DATA_DIR, "index", "patient_index.json")
+
+class Warmup:
+    """在后台建立索引并记录就绪状态"""
+
+    def __init__(self, index=patient_index, library=library_index,
+                 snapshot_file: str = INDEX_SNAPSHOT_FILE, use_snapshot: bool = INDEX_SNAPSHOT):
+        self.index = index
+        self.library = library
+        self.snapshot_file = snapshot_file
+        self.use_snapshot = use_snapshot
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.state = "idle"  # idle / loading / ready / failed
+        self.source = None   # 患者索引来自 snapshot（快照）还是 scan（扫描目录）
+        self.error = None
+        self.started = None
+        self.timings: Dict[str, float] = {}
+        self.saved_version = None  # 已保存快照时的索引版本
+
+    def start(self):
+        """启动后台预热（只执行一次）"""
+        with self.lock:
+            if self.state != "idle":
+                return
+            self.state = "loading"
+            self.started = time.perf_counter()
+        if self.use_snapshot:
+            atexit.register(self.save_on_exit)
+        threading.Thread(target=self._run, name="startup-warmup", daemon=True).start()
+
+    def _timed(self, name: str, func):
+        start = time.perf_counter()
+        result = func()
+        self.timings[name] = time.perf_counter() - start
+        return result
+
+    def _run(self):
+        try:
+            snapshot = self._timed("restore", self._restore) if self.use_snapshot else None
+            restored = snapshot is not None
+            if not restored:
+                # 持有索引的锁扫描，期间到达的请求等待本次扫描而不是各自重复扫描
+                self._timed("scan", self.index.patient_ids)
+            self._timed("library", self.library.__len__)
+        except Exception as e:
+            logging.error(f"启动预热失败: {e}")
+            self.error = str(e)
+            self.state = "failed"
+            return
+        self.source = "snapshot" if restored else "scan"
+        self.state = "ready"
+        self.timings["ready"] = time.perf_counter() - self.started
+        self.ready.set()
+        logging.info(f"索引已就绪（{self.source}，{self.timings['ready'] * 1000:.0f} ms）")
+
+        # 就绪后的工作不影响服务：核对快照、建立动作库 n-gram 索引、保存新快照
+        try:
+            if restored:
+                self._timed("verify", self.index.verify)
+                if self.index.snapshot() == snapshot:
+                    self.saved_version = self.index.version  # 快照仍然准确，不必重写
+                snapshot = None
+            self._timed("library_ngrams", self.library.warm)
+            if self.use_snapshot:
+                self._timed("save", self.save_snapshot)
+        except Exception as e:
+            logging.warning(f"启动预热的后续步骤失败: {e}")
+
+    def _restore(self) -> Optional[Dict[str, Any]]:
+        """加载快照并恢复索引，返回快照；不存在、损坏或不适用时返回 None"""
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"索引快照无法读取，重新扫描: {e}")
+            return None
+        if not isinstance(snapshot, dict) or not self.index.restore(snapshot):
+            logging.info("索引快照不适用于当前数据目录，重新扫描")
+            return None
+        self.saved_version = self.index.version
+        return snapshot
+
+    def save_snapshot(self):
+        """索引有变化时写入快照"""
+        version = self.index.version
+        if version == self.saved_version:
+            return
+        snapshot = self.index.snapshot()
+        os.makedirs(os.path.dirname(self.snapshot_file), exist_ok=True)
+        write_text_atomic(self.snapshot_file, json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")),
+                          fsync=False)
+        self.saved_version = version
+
+    def save_on_exit(self):
+        """进程退出时保存快照（索引尚未建立完成时跳过）"""
+        if self.state != "ready":
+            return
+        try:
+            self.save_snapshot()
+        except Exception as e:
+            logging.warning(f"保存索引快照失败: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """就绪状态（/ready），不等待索引的锁"""
+        return {
+            "ready": self.is_ready(),
+            "state": self.state,
+            "mode": STARTUP_WARMUP,
+            "source": self.source,
+            "error": self.error,
+            "timings_ms": {name: round(seconds * 1000, 1) for name, seconds in list(self.timings.items())},
+        }
+
+    def is_ready(self) -> bool:
+        """按需建立索引（lazy）时总是就绪"""
+        return self.state == "ready" or (self.state == "idle" and STARTUP_WARMUP == "lazy")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"ready": self.is_ready(), "from_snapshot": self.source == "snapshot",
+                **{f"{name}_seconds": seconds for name, seconds in list(self.timings.items())}}
+
+# 全局共享的预热状态
+warmup = Warmup()